@@ -13,9 +13,11 @@ import HydrusSerialisable
 import HydrusSessions
 import itertools
 import json
+import mmap
 import os
 import random
 import requests
+import struct
 import threading
 import time
 import urllib
@@ -992,19 +994,63 @@ class ClientFilesManager( object ):
     
     def ImportFile( self, file_import_job ):
         
-        file_import_job.GenerateHashAndStatus()
+        file_import_job.Prepare()
         
-        hash = file_import_job.GetHash()
+        return self.ImportPreparedFile( file_import_job )
         
-        if file_import_job.IsNewToDB():
+    
+    def ImportPreparedFile( self, file_import_job ):
+        
+        ( ( import_status, hash, note ), ) = self.ImportPreparedFiles( ( file_import_job, ) )
+        
+        if import_status == CC.STATUS_FAILED:
             
-            file_import_job.GenerateInfo()
+            raise Exception( note )
+            
+        
+        return ( import_status, hash )
+        
+    
+    def ImportPreparedFiles( self, file_import_jobs ):
+        
+        # returns ( status, hash, note ) for each job, in order. a job that fails the import options is failed with the reason as its note
+        
+        results = [ None for file_import_job in file_import_jobs ]
+        
+        indices_and_jobs_to_write = []
+        
+        for ( i, file_import_job ) in enumerate( file_import_jobs ):
             
-            ( good_to_import, reason ) = file_import_job.IsGoodToImport()
+            hash = file_import_job.GetHash()
             
-            if good_to_import:
+            if file_import_job.IsNewToDB():
                 
-                with self._lock:
+                ( good_to_import, reason ) = file_import_job.IsGoodToImport()
+                
+                if good_to_import:
+                    
+                    indices_and_jobs_to_write.append( ( i, file_import_job ) )
+                    
+                else:
+                    
+                    results[ i ] = ( CC.STATUS_FAILED, hash, reason )
+                    
+                
+            else:
+                
+                file_import_job.PubsubContentUpdates()
+                
+                results[ i ] = ( file_import_job.GetPreImportStatus(), hash, '' )
+                
+            
+        
+        if len( indices_and_jobs_to_write ) > 0:
+            
+            with self._lock:
+                
+                for ( i, file_import_job ) in indices_and_jobs_to_write:
+                    
+                    hash = file_import_job.GetHash()
                     
                     ( temp_path, thumbnail ) = file_import_job.GetTempPathAndThumbnail()
                     
@@ -1017,22 +1063,58 @@ class ClientFilesManager( object ):
                         self.LocklessAddFullSizeThumbnail( hash, thumbnail )
                         
                     
-                    import_status = self._controller.WriteSynchronous( 'import_file', file_import_job )
-                    
                 
-            else:
+                jobs_to_write = [ file_import_job for ( i, file_import_job ) in indices_and_jobs_to_write ]
                 
-                raise Exception( reason )
+                if len( jobs_to_write ) == 1:
+                    
+                    import_statuses = [ self._controller.WriteSynchronous( 'import_file', jobs_to_write[0] ) ]
+                    
+                else:
+                    
+                    try:
+                        
+                        import_statuses = self._controller.WriteSynchronous( 'import_files', jobs_to_write )
+                        
+                    except:
+                        
+                        # one bad job rolls the whole batch back, so try them one at a time to let the good ones through
+                        
+                        import_statuses = []
+                        
+                        for file_import_job in jobs_to_write:
+                            
+                            try:
+                                
+                                import_statuses.append( self._controller.WriteSynchronous( 'import_file', file_import_job ) )
+                                
+                            except Exception as e:
+                                
+                                HydrusData.PrintException( e )
+                                
+                                import_statuses.append( ( CC.STATUS_FAILED, HydrusData.ToUnicode( e ) ) )
+                                
+                            
+                        
+                    
                 
             
-        else:
-            
-            file_import_job.PubsubContentUpdates()
-            
-            import_status = file_import_job.GetPreImportStatus()
+            for ( ( i, file_import_job ), import_status ) in zip( indices_and_jobs_to_write, import_statuses ):
+                
+                if isinstance( import_status, tuple ):
+                    
+                    ( import_status, note ) = import_status
+                    
+                else:
+                    
+                    note = ''
+                    
+                
+                results[ i ] = ( import_status, file_import_job.GetHash(), note )
+                
             
         
-        return ( import_status, hash )
+        return results
         
     
     def LocklessGetFilePath( self, hash, mime = None ):
@@ -1288,10 +1370,17 @@ class DataCache( object ):
         self._timeout = timeout
         
         self._keys_to_data = {}
+        self._keys_to_estimated_memory_footprints = {}
         self._keys_fifo = collections.OrderedDict()
         
+        # we remember each item's footprint as it goes in, so the running total can be kept up to date without ever summing the whole cache
+        
         self._total_estimated_memory_footprint = 0
         
+        self._num_hits = 0
+        self._num_misses = 0
+        self._num_evictions = 0
+        
         self._lock = threading.Lock()
         
         self._controller.sub( self, 'MaintainCache', 'memory_maintenance_pulse' )
@@ -1301,16 +1390,13 @@ class DataCache( object ):
         
         ( deletee_key, last_access_time ) = self._keys_fifo.popitem( last = False )
         
-        deletee_data = self._keys_to_data[ deletee_key ]
-        
         del self._keys_to_data[ deletee_key ]
         
-        self._RecalcMemoryUsage()
+        self._total_estimated_memory_footprint -= self._keys_to_estimated_memory_footprints[ deletee_key ]
         
-    
-    def _RecalcMemoryUsage( self ):
+        del self._keys_to_estimated_memory_footprints[ deletee_key ]
         
-        self._total_estimated_memory_footprint = sum( ( data.GetEstimatedMemoryFootprint() for data in self._keys_to_data.values() ) )
+        self._num_evictions += 1
         
     
     def _TouchKey( self, key ):
@@ -1329,6 +1415,7 @@ class DataCache( object ):
         with self._lock:
             
             self._keys_to_data = {}
+            self._keys_to_estimated_memory_footprints = {}
             self._keys_fifo = collections.OrderedDict()
             
             self._total_estimated_memory_footprint = 0
@@ -1341,18 +1428,21 @@ class DataCache( object ):
             
             if key not in self._keys_to_data:
                 
-                options = self._controller.GetOptions()
-                
-                while self._total_estimated_memory_footprint > self._cache_size:
-                    
-                    self._DeleteItem()
-                    
+                estimated_memory_footprint = data.GetEstimatedMemoryFootprint()
                 
                 self._keys_to_data[ key ] = data
+                self._keys_to_estimated_memory_footprints[ key ] = estimated_memory_footprint
+                
+                self._total_estimated_memory_footprint += estimated_memory_footprint
                 
                 self._TouchKey( key )
                 
-                self._RecalcMemoryUsage()
+                # now evict the least recently used until we fit, but never what we just added
+                
+                while self._total_estimated_memory_footprint > self._cache_size and len( self._keys_fifo ) > 1:
+                    
+                    self._DeleteItem()
+                    
                 
             
         
@@ -1363,9 +1453,13 @@ class DataCache( object ):
             
             if key not in self._keys_to_data:
                 
+                self._num_misses += 1
+                
                 raise Exception( 'Cache error! Looking for ' + HydrusData.ToUnicode( key ) + ', but it was missing.' )
                 
             
+            self._num_hits += 1
+            
             self._TouchKey( key )
             
             return self._keys_to_data[ key ]
@@ -1378,17 +1472,29 @@ class DataCache( object ):
             
             if key in self._keys_to_data:
                 
+                self._num_hits += 1
+                
                 self._TouchKey( key )
                 
                 return self._keys_to_data[ key ]
                 
             else:
                 
+                self._num_misses += 1
+                
                 return None
                 
             
         
     
+    def GetStats( self ):
+        
+        with self._lock:
+            
+            return ( len( self._keys_to_data ), self._total_estimated_memory_footprint, self._cache_size, self._num_hits, self._num_misses, self._num_evictions )
+            
+        
+    
     def HasData( self, key ):
         
         with self._lock:
@@ -1688,6 +1794,11 @@ class RenderedImageCache( object ):
         self._data_cache.Clear()
         
     
+    def GetDataCacheStats( self ):
+        
+        return self._data_cache.GetStats()
+        
+    
     def GetImageRenderer( self, media ):
         
         hash = media.GetHash()
@@ -1717,6 +1828,247 @@ class RenderedImageCache( object ):
         return self._data_cache.HasData( key )
         
     
+class ThumbnailDiskCache( object ):
+    
+    # an append-only pack file of rendered, lz4-compressed thumbnail buffers, so a cold client can skip decoding thumbnails it has shown before
+    # the file starts with the thumbnail dimensions it was made for, and each record is keyed by hash and the modified time of the thumbnail file it was rendered from
+    # when the file fills up, we just start it again
+    
+    MAGIC = 'hydthumb'
+    
+    HEADER_STRUCT = struct.Struct( '>8sHH' )
+    RECORD_STRUCT = struct.Struct( '>32sdHHBI' )
+    
+    def __init__( self, path, thumbnail_dimensions, max_size ):
+        
+        self._path = path
+        self._thumbnail_dimensions = tuple( thumbnail_dimensions )
+        self._max_size = max_size
+        
+        self._f = None
+        self._mmap = None
+        self._size = 0
+        
+        self._hashes_to_records = {}
+        
+        self._lock = threading.Lock()
+        
+        with self._lock:
+            
+            self._Open()
+            
+        
+    
+    def _Close( self ):
+        
+        if self._mmap is not None:
+            
+            self._mmap.close()
+            
+            self._mmap = None
+            
+        
+        if self._f is not None:
+            
+            self._f.close()
+            
+            self._f = None
+            
+        
+        self._hashes_to_records = {}
+        
+    
+    def _Open( self ):
+        
+        if os.path.exists( self._path ):
+            
+            self._f = open( self._path, 'r+b' )
+            
+            header = self._f.read( self.HEADER_STRUCT.size )
+            
+            if len( header ) < self.HEADER_STRUCT.size or self.HEADER_STRUCT.unpack( header ) != ( self.MAGIC, ) + self._thumbnail_dimensions:
+                
+                self._Reset()
+                
+                return
+                
+            
+            self._f.seek( 0, os.SEEK_END )
+            
+            self._size = self._f.tell()
+            
+            self._RemapFile()
+            
+            self._ReadIndex()
+            
+        else:
+            
+            self._Reset()
+            
+        
+    
+    def _ReadIndex( self ):
+        
+        position = self.HEADER_STRUCT.size
+        
+        while position + self.RECORD_STRUCT.size <= self._size:
+            
+            ( hash, source_timestamp, width, height, depth, data_length ) = self.RECORD_STRUCT.unpack_from( self._mmap, position )
+            
+            data_position = position + self.RECORD_STRUCT.size
+            
+            if data_position + data_length > self._size:
+                
+                break
+                
+            
+            # later records for the same hash replace earlier ones
+            
+            self._hashes_to_records[ hash ] = ( source_timestamp, ( width, height ), depth, data_position, data_length )
+            
+            position = data_position + data_length
+            
+        
+        if position < self._size:
+            
+            # a partial record, probably from a crash mid-write, so clip it off
+            
+            self._mmap.close()
+            
+            self._mmap = None
+            
+            self._f.truncate( position )
+            
+            self._size = position
+            
+            self._RemapFile()
+            
+        
+    
+    def _RemapFile( self ):
+        
+        if self._mmap is not None:
+            
+            self._mmap.close()
+            
+        
+        self._mmap = mmap.mmap( self._f.fileno(), self._size, access = mmap.ACCESS_READ )
+        
+    
+    def _Reset( self ):
+        
+        self._Close()
+        
+        self._f = open( self._path, 'w+b' )
+        
+        self._f.write( self.HEADER_STRUCT.pack( self.MAGIC, *self._thumbnail_dimensions ) )
+        
+        self._f.flush()
+        
+        self._size = self.HEADER_STRUCT.size
+        
+        self._RemapFile()
+        
+    
+    def AddHydrusBitmap( self, hash, source_timestamp, hydrus_bitmap ):
+        
+        with self._lock:
+            
+            if self._f is None:
+                
+                return
+                
+            
+            compressed_data = hydrus_bitmap.GetCompressedData()
+            
+            ( width, height ) = hydrus_bitmap.GetSize()
+            depth = hydrus_bitmap.GetDepth()
+            
+            record_header = self.RECORD_STRUCT.pack( hash, source_timestamp, width, height, depth, len( compressed_data ) )
+            
+            if self._size + len( record_header ) + len( compressed_data ) > self._max_size:
+                
+                self._Reset()
+                
+            
+            self._f.seek( self._size )
+            
+            self._f.write( record_header )
+            self._f.write( compressed_data )
+            
+            self._f.flush()
+            
+            data_position = self._size + len( record_header )
+            
+            self._size = data_position + len( compressed_data )
+            
+            self._hashes_to_records[ hash ] = ( source_timestamp, ( width, height ), depth, data_position, len( compressed_data ) )
+            
+        
+    
+    def Close( self ):
+        
+        with self._lock:
+            
+            self._Close()
+            
+        
+    
+    def GetHydrusBitmap( self, hash, source_timestamp ):
+        
+        with self._lock:
+            
+            if hash not in self._hashes_to_records:
+                
+                return None
+                
+            
+            ( record_source_timestamp, size, depth, data_position, data_length ) = self._hashes_to_records[ hash ]
+            
+            if record_source_timestamp != source_timestamp:
+                
+                # the thumbnail has been regenerated since we rendered it
+                
+                return None
+                
+            
+            if data_position + data_length > len( self._mmap ):
+                
+                self._RemapFile()
+                
+            
+            compressed_data = self._mmap[ data_position : data_position + data_length ]
+            
+            return ClientRendering.GenerateHydrusBitmapFromCompressedData( compressed_data, depth, size )
+            
+        
+    
+    def GetNumThumbnails( self ):
+        
+        with self._lock:
+            
+            return len( self._hashes_to_records )
+            
+        
+    
+    def Reset( self, thumbnail_dimensions ):
+        
+        with self._lock:
+            
+            self._thumbnail_dimensions = tuple( thumbnail_dimensions )
+            
+            self._Reset()
+            
+        
+    
+    def SetMaxSize( self, max_size ):
+        
+        with self._lock:
+            
+            self._max_size = max_size
+            
+        
+    
 class ThumbnailCache( object ):
     
     def __init__( self, controller ):
@@ -1732,17 +2084,33 @@ class ThumbnailCache( object ):
         self._lock = threading.Lock()
         
         self._waterfall_queue_quick = set()
+        self._waterfall_queue_visible = set()
         self._waterfall_queue_random = []
         
         self._waterfall_event = threading.Event()
         
+        self._num_waterfall_workers = 1
+        self._num_waterfall_workers_running = 0
+        
         self._special_thumbs = {}
         
+        self._disk_cache = None
+        
         self.Clear()
         
-        self._controller.CallToThreadLongRunning( self.DAEMONWaterfall )
+        with self._lock:
+            
+            self._RefreshDiskCache()
+            self._RefreshWaterfallWorkers()
+            
+        
+        self._controller.sub( self, 'NotifyThumbnailResize', 'thumbnail_resize' )
+        self._controller.sub( self, 'NotifyNewOptions', 'notify_new_options' )
+        
+    
+    def _GetDiskCachePath( self ):
         
-        self._controller.sub( self, 'Clear', 'thumbnail_resize' )
+        return os.path.join( self._controller.GetDBDir(), 'client_rendered_thumbnails.cache' )
         
     
     def _GetResizedHydrusBitmapFromHardDrive( self, display_media ):
@@ -1786,6 +2154,18 @@ class ThumbnailCache( object ):
             return self._special_thumbs[ 'hydrus' ]
             
         
+        disk_cache = self._disk_cache
+        
+        if disk_cache is not None:
+            
+            hydrus_bitmap = disk_cache.GetHydrusBitmap( hash, os.path.getmtime( path ) )
+            
+            if hydrus_bitmap is not None:
+                
+                return hydrus_bitmap
+                
+            
+        
         mime = display_media.GetMime()
         
         try:
@@ -1838,28 +2218,100 @@ class ThumbnailCache( object ):
             hydrus_bitmap = ClientRendering.GenerateHydrusBitmap( path, mime )
             
         
+        if disk_cache is not None:
+            
+            disk_cache.AddHydrusBitmap( hash, os.path.getmtime( path ), hydrus_bitmap )
+            
+        
         return hydrus_bitmap
         
     
     def _RecalcWaterfallQueueRandom( self ):
         
         # here we sort by the hash since this is both breddy random and more likely to access faster on a well defragged hard drive!
+        # anything on a visible page goes first though, so the user sees what they are looking at fill in before the pages either side
         
-        def sort_by_hash_key( ( page_key, media ) ):
+        def sort_by_visible_and_hash_key( result ):
             
-            return media.GetDisplayMedia().GetHash()
+            ( page_key, media ) = result
+            
+            return ( result not in self._waterfall_queue_visible, media.GetDisplayMedia().GetHash() )
             
         
         self._waterfall_queue_random = list( self._waterfall_queue_quick )
         
-        self._waterfall_queue_random.sort( key = sort_by_hash_key )
+        self._waterfall_queue_random.sort( key = sort_by_visible_and_hash_key )
+        
+    
+    def _RefreshDiskCache( self ):
+        
+        new_options = self._controller.GetNewOptions()
+        
+        disk_cache_mb = new_options.GetNoneableInteger( 'rendered_thumbnail_disk_cache_mb' )
+        
+        path = self._GetDiskCachePath()
+        
+        if disk_cache_mb is None:
+            
+            if self._disk_cache is not None:
+                
+                self._disk_cache.Close()
+                
+                self._disk_cache = None
+                
+            
+            if os.path.exists( path ):
+                
+                HydrusPaths.DeletePath( path )
+                
+            
+        elif self._disk_cache is None:
+            
+            options = self._controller.GetOptions()
+            
+            try:
+                
+                self._disk_cache = ThumbnailDiskCache( path, options[ 'thumbnail_dimensions' ], disk_cache_mb * 1048576 )
+                
+            except Exception as e:
+                
+                HydrusData.ShowText( 'The rendered thumbnail disk cache could not be loaded, so it will not be used this boot!' )
+                
+                HydrusData.ShowException( e )
+                
+            
+        else:
+            
+            self._disk_cache.SetMaxSize( disk_cache_mb * 1048576 )
+            
+        
+    
+    def _RefreshWaterfallWorkers( self ):
+        
+        new_options = self._controller.GetNewOptions()
+        
+        self._num_waterfall_workers = max( 1, new_options.GetInteger( 'thumbnail_waterfall_workers' ) )
+        
+        while self._num_waterfall_workers_running < self._num_waterfall_workers:
+            
+            self._num_waterfall_workers_running += 1
+            
+            self._controller.CallToThreadLongRunning( self.DAEMONWaterfall )
+            
+        
+        # any surplus workers will notice and bow out next time they check the queue
+        
+        self._waterfall_event.set()
         
     
     def CancelWaterfall( self, page_key, medias ):
         
         with self._lock:
             
-            self._waterfall_queue_quick.difference_update( ( ( page_key, media ) for media in medias ) )
+            results = [ ( page_key, media ) for media in medias ]
+            
+            self._waterfall_queue_quick.difference_update( results )
+            self._waterfall_queue_visible.difference_update( results )
             
             self._RecalcWaterfallQueueRandom()
             
@@ -1912,6 +2364,25 @@ class ThumbnailCache( object ):
             
         
     
+    def GetDataCacheStats( self ):
+        
+        return self._data_cache.GetStats()
+        
+    
+    def GetDiskCacheStats( self ):
+        
+        disk_cache = self._disk_cache
+        
+        if disk_cache is None:
+            
+            return None
+            
+        else:
+            
+            return disk_cache.GetNumThumbnails()
+            
+        
+    
     def GetThumbnail( self, media ):
         
         display_media = media.GetDisplayMedia()
@@ -1970,11 +2441,46 @@ class ThumbnailCache( object ):
             
         
     
-    def Waterfall( self, page_key, medias ):
+    def NotifyNewOptions( self ):
+        
+        with self._lock:
+            
+            self._RefreshDiskCache()
+            self._RefreshWaterfallWorkers()
+            
+        
+    
+    def NotifyThumbnailResize( self ):
+        
+        self.Clear()
+        
+        with self._lock:
+            
+            if self._disk_cache is not None:
+                
+                options = self._controller.GetOptions()
+                
+                self._disk_cache.Reset( options[ 'thumbnail_dimensions' ] )
+                
+            
+        
+    
+    def Waterfall( self, page_key, medias, visible = False ):
         
         with self._lock:
             
-            self._waterfall_queue_quick.update( ( ( page_key, media ) for media in medias ) )
+            results = [ ( page_key, media ) for media in medias ]
+            
+            self._waterfall_queue_quick.update( results )
+            
+            if visible:
+                
+                self._waterfall_queue_visible.update( results )
+                
+            else:
+                
+                self._waterfall_queue_visible.difference_update( results )
+                
             
             self._RecalcWaterfallQueueRandom()
             
@@ -1990,15 +2496,27 @@ class ThumbnailCache( object ):
             
             with self._lock:
                 
+                if self._num_waterfall_workers_running > self._num_waterfall_workers:
+                    
+                    self._num_waterfall_workers_running -= 1
+                    
+                    return
+                    
+                
                 do_wait = len( self._waterfall_queue_random ) == 0
                 
+                if do_wait:
+                    
+                    # only clear while holding the lock and looking at an empty queue, or another worker's wake-up could be lost
+                    
+                    self._waterfall_event.clear()
+                    
+                
             
             if do_wait:
                 
                 self._waterfall_event.wait( 1 )
                 
-                self._waterfall_event.clear()
-                
                 last_paused = HydrusData.GetNowPrecise()
                 
             
@@ -2019,6 +2537,7 @@ class ThumbnailCache( object ):
                     result = self._waterfall_queue_random.pop( 0 )
                     
                     self._waterfall_queue_quick.discard( result )
+                    self._waterfall_queue_visible.discard( result )
                     
                 
                 ( page_key, media ) = result
@@ -290,6 +290,18 @@ network_context_type_description_lookup[ NETWORK_CONTEXT_DOWNLOADER_QUERY ] = 'N
 network_context_type_description_lookup[ NETWORK_CONTEXT_SUBSCRIPTION ] = 'Network traffic going through this subscription.'
 network_context_type_description_lookup[ NETWORK_CONTEXT_THREAD_WATCHER_THREAD ] = 'Network traffic going through this single thread watch (you probably shouldn\'t be able to see this!)'
 
+NETWORK_JOB_PRIORITY_INTERACTIVE = 0
+NETWORK_JOB_PRIORITY_DOWNLOADER = 1
+NETWORK_JOB_PRIORITY_REPOSITORY = 2
+NETWORK_JOB_PRIORITY_SUBSCRIPTION = 3
+
+network_job_priority_string_lookup = {}
+
+network_job_priority_string_lookup[ NETWORK_JOB_PRIORITY_INTERACTIVE ] = 'interactive'
+network_job_priority_string_lookup[ NETWORK_JOB_PRIORITY_DOWNLOADER ] = 'downloader'
+network_job_priority_string_lookup[ NETWORK_JOB_PRIORITY_REPOSITORY ] = 'repository'
+network_job_priority_string_lookup[ NETWORK_JOB_PRIORITY_SUBSCRIPTION ] = 'subscription'
+
 PAGE_FILE_COUNT_DISPLAY_ALL = 0
 PAGE_FILE_COUNT_DISPLAY_NONE = 1
 PAGE_FILE_COUNT_DISPLAY_ONLY_IMPORTERS = 2
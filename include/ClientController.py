@@ -1248,6 +1248,16 @@ class Controller( HydrusController.HydrusController ):
         
         search_context.SetComplete()
         
+        if job_key.IsCancelled():
+            
+            return
+            
+        
+        if self.new_options.GetBoolean( 'update_search_pages_live' ) and search_context.GetSystemPredicates().GetLimit() is None:
+            
+            self.Write( 'register_live_search', page_key, job_key, search_context, query_hash_ids )
+            
+        
         self.pub( 'file_query_done', page_key, job_key, media_results )
         
     
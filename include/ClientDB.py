@@ -7,6 +7,7 @@ import ClientNetworkingDomain
 import ClientRatings
 import ClientSearch
 import ClientServices
+import ClientSimilarFiles
 import ClientThreading
 import collections
 import gc
@@ -30,11 +31,15 @@ import HydrusVideoHandling
 import ClientConstants as CC
 import os
 import psutil
+import Queue
 import random
 import re
 import sqlite3
+import sys
+import threading
 import time
 import traceback
+import weakref
 import wx
 
 YAML_DUMP_ID_SINGLE = 0
@@ -51,6 +56,10 @@ YAML_DUMP_ID_LOCAL_BOORU = 8
 MIN_CACHED_INTEGER = -99999999
 MAX_CACHED_INTEGER = 99999999
 
+NUM_REPOSITORY_UPDATES_TO_LOAD_AHEAD = 2
+
+REPOSITORY_CONTENT_CHUNK_TARGET_TIME = 0.5
+
 def CanCacheInteger( num ):
     
     return MIN_CACHED_INTEGER <= num and num <= MAX_CACHED_INTEGER
@@ -110,6 +119,84 @@ def GenerateSpecificMappingsCacheTableNames( file_service_id, tag_service_id ):
     
     return ( cache_files_table_name, cache_current_mappings_table_name, cache_deleted_mappings_table_name, cache_pending_mappings_table_name, ac_cache_table_name )
     
+def IterateLoadedRepositoryUpdates( hash_ids_and_paths ):
+    
+    # reading, decompressing and parsing an update takes about as long as processing it, so a worker thread loads the next few while the db thread does the sql
+    # yields ( hash_id, update ) in order. if a load fails, the error is raised here with the worker's traceback
+    
+    results = Queue.Queue( maxsize = NUM_REPOSITORY_UPDATES_TO_LOAD_AHEAD )
+    
+    stop_event = threading.Event()
+    
+    def THREADLoad():
+        
+        for ( hash_id, path ) in hash_ids_and_paths:
+            
+            try:
+                
+                with open( path, 'rb' ) as f:
+                    
+                    update_network_string = f.read()
+                    
+                
+                update = HydrusSerialisable.CreateFromNetworkString( update_network_string )
+                
+                result = ( hash_id, update, None )
+                
+            except Exception:
+                
+                result = ( hash_id, None, sys.exc_info() )
+                
+            
+            while True:
+                
+                if stop_event.is_set():
+                    
+                    return
+                    
+                
+                try:
+                    
+                    results.put( result, timeout = 1.0 )
+                    
+                    break
+                    
+                except Queue.Full:
+                    
+                    pass
+                    
+                
+            
+            if result[2] is not None:
+                
+                return
+                
+            
+        
+    
+    HG.client_controller.CallToThreadLongRunning( THREADLoad )
+    
+    try:
+        
+        for i in range( len( hash_ids_and_paths ) ):
+            
+            ( hash_id, update, exc_info ) = results.get()
+            
+            if exc_info is not None:
+                
+                ( exc_type, exc_value, exc_traceback ) = exc_info
+                
+                raise exc_type, exc_value, exc_traceback
+                
+            
+            yield ( hash_id, update )
+            
+        
+    finally:
+        
+        stop_event.set()
+        
+    
 def report_content_speed_to_job_key( job_key, rows_done, total_rows, precise_timestamp, num_rows, row_name ):
     
     it_took = HydrusData.GetNowPrecise() - precise_timestamp
@@ -121,6 +208,8 @@ def report_content_speed_to_job_key( job_key, rows_done, total_rows, precise_tim
     HG.client_controller.pub( 'splash_set_status_text', popup_message, print_to_log = False )
     job_key.SetVariable( 'popup_text_2', popup_message )
     
+    return it_took
+    
 def report_speed_to_job_key( job_key, precise_timestamp, num_rows, row_name ):
     
     it_took = HydrusData.GetNowPrecise() - precise_timestamp
@@ -132,6 +221,8 @@ def report_speed_to_job_key( job_key, precise_timestamp, num_rows, row_name ):
     HG.client_controller.pub( 'splash_set_status_text', popup_message, print_to_log = False )
     job_key.SetVariable( 'popup_text_2', popup_message )
     
+    return it_took
+    
 def report_speed_to_log( precise_timestamp, num_rows, row_name ):
     
     it_took = HydrusData.GetNowPrecise() - precise_timestamp
@@ -150,6 +241,19 @@ class DB( HydrusDB.HydrusDB ):
         
         self._initial_messages = []
         
+        self._phash_index = None
+        self._phash_substrings_exist = None
+        
+        self._live_searches = {}
+        self._live_search_dirty_hashes = set()
+        
+        self._media_result_cache = weakref.WeakValueDictionary()
+        
+        self._tag_archive_cache = {}
+        
+        self._repository_content_chunk_sizers = {}
+        self._repository_processing_totals = {}
+        
         HydrusDB.HydrusDB.__init__( self, controller, db_dir, db_name, no_wal = no_wal )
         
     
@@ -167,6 +271,8 @@ class DB( HydrusDB.HydrusDB ):
         # hash_id, size, mime, width, height, duration, num_frames, num_words
         self._c.executemany( insert_phrase + ' files_info VALUES ( ?, ?, ?, ?, ?, ?, ?, ? );', rows )
         
+        self._UncacheMediaResults( [ row[0] for row in rows ] )
+        
     
     def _AddFiles( self, service_id, rows ):
         
@@ -180,6 +286,8 @@ class DB( HydrusDB.HydrusDB ):
             
             valid_rows = [ ( hash_id, timestamp ) for ( hash_id, timestamp ) in rows if hash_id in valid_hash_ids ]
             
+            self._UncacheMediaResults( valid_hash_ids )
+            
             splayed_valid_hash_ids = HydrusData.SplayListForDB( valid_hash_ids )
             
             # insert the files
@@ -837,19 +945,36 @@ class DB( HydrusDB.HydrusDB ):
         self._c.execute( 'INSERT INTO shape_vptree ( phash_id, parent_id, radius, inner_id, inner_population, outer_id, outer_population ) VALUES ( ?, ?, ?, ?, ?, ?, ? );', ( phash_id, parent_id, radius, inner_id, inner_population, outer_id, outer_population ) )
         
     
+    def _CacheSimilarFilesAddPHashSubstrings( self, rows ):
+        
+        if self._CacheSimilarFilesPHashSubstringsExist():
+            
+            self._c.executemany( 'INSERT OR IGNORE INTO shape_perceptual_hash_substrings ( substring_index, substring, phash_id ) VALUES ( ?, ?, ? );', ( ( substring_index, substring, phash_id ) for ( phash_id, phash ) in rows for ( substring_index, substring ) in enumerate( ClientSimilarFiles.GetMIHSubstrings( phash ) ) ) )
+            
+        
+    
     def _CacheSimilarFilesAssociatePHashes( self, hash_id, phashes ):
         
         phash_ids = set()
+        phash_rows = []
         
         for phash in phashes:
             
             phash_id = self._CacheSimilarFilesGetPHashId( phash )
             
             phash_ids.add( phash_id )
+            phash_rows.append( ( phash_id, phash ) )
             
         
         self._c.executemany( 'INSERT OR IGNORE INTO shape_perceptual_hash_map ( phash_id, hash_id ) VALUES ( ?, ? );', ( ( phash_id, hash_id ) for phash_id in phash_ids ) )
         
+        phash_index = self._CacheSimilarFilesGetPHashIndex()
+        
+        if phash_index is not None:
+            
+            phash_index.AddPHashes( phash_rows )
+            
+        
         if self._GetRowCount() > 0:
             
             self._c.execute( 'REPLACE INTO shape_search_cache ( hash_id, searched_distance ) VALUES ( ?, ? );', ( hash_id, None ) )
@@ -858,6 +983,111 @@ class DB( HydrusDB.HydrusDB ):
         return phash_ids
         
     
+    def _CacheSimilarFilesBenchmarkSearch( self, num_files = 100 ):
+        
+        job_key = ClientThreading.JobKey()
+        
+        job_key.SetVariable( 'popup_title', 'similar files search benchmark' )
+        
+        self._controller.pub( 'message', job_key )
+        
+        hash_ids = self._STL( self._c.execute( 'SELECT DISTINCT hash_id FROM shape_perceptual_hash_map;' ) )
+        
+        if len( hash_ids ) > num_files:
+            
+            hash_ids = random.sample( hash_ids, num_files )
+            
+        
+        searches = []
+        
+        for hash_id in hash_ids:
+            
+            search_phashes = [ phash for ( phash, ) in self._c.execute( 'SELECT phash FROM shape_perceptual_hashes NATURAL JOIN shape_perceptual_hash_map WHERE hash_id = ?;', ( hash_id, ) ) ]
+            
+            searches.append( search_phashes )
+            
+        
+        if len( searches ) == 0:
+            
+            job_key.SetVariable( 'popup_text_1', 'No files have similar files data yet, so there is nothing to benchmark!' )
+            
+            job_key.Finish()
+            
+            return
+            
+        
+        # we want the multi-index substrings even if the user does not use them, so make them for the test and clear them afterwards
+        
+        substrings_already_existed = self._CacheSimilarFilesPHashSubstringsExist()
+        
+        if not substrings_already_existed:
+            
+            job_key.SetVariable( 'popup_text_1', 'generating multi-index hashing data' )
+            
+            self._CacheSimilarFilesGeneratePHashSubstrings()
+            
+        
+        job_key.SetVariable( 'popup_text_1', 'loading phashes into memory' )
+        
+        useful_rows = self._c.execute( 'SELECT phash_id, phash FROM shape_perceptual_hashes WHERE phash_id IN ( SELECT phash_id FROM shape_perceptual_hash_map );' ).fetchall()
+        
+        phash_index = ClientSimilarFiles.PHashIndex( useful_rows )
+        
+        # the tree and substrings may still hold some orphan phashes awaiting maintenance, so we only compare the useful results
+        
+        useful_phash_ids = { phash_id for ( phash_id, phash ) in useful_rows }
+        
+        search_methods = []
+        
+        search_methods.append( ( 'vp tree', self._CacheSimilarFilesSearchVPTree ) )
+        search_methods.append( ( 'multi-index hashing', self._CacheSimilarFilesSearchMIH ) )
+        search_methods.append( ( 'in memory', phash_index.Search ) )
+        
+        result_lines = [ 'searching ' + HydrusData.ConvertIntToPrettyString( len( searches ) ) + ' files among ' + HydrusData.ConvertIntToPrettyString( phash_index.GetNumPHashes() ) + ' phashes:' ]
+        
+        for max_hamming_distance in ( 0, 2, 4, 8, 10 ):
+            
+            job_key.SetVariable( 'popup_text_1', 'testing distance ' + str( max_hamming_distance ) )
+            
+            method_results = []
+            method_strings = []
+            
+            for ( name, search_method ) in search_methods:
+                
+                start_time = HydrusData.GetNowPrecise()
+                
+                results = [ search_method( search_phashes, max_hamming_distance ) for search_phashes in searches ]
+                
+                time_took = HydrusData.GetNowPrecise() - start_time
+                
+                method_results.append( [ similar_phash_ids.intersection( useful_phash_ids ) for similar_phash_ids in results ] )
+                method_strings.append( name + ' ' + HydrusData.ConvertTimeDeltaToPrettyString( time_took / len( searches ) ) )
+                
+            
+            num_results = sum( ( len( results ) for results in method_results[0] ) )
+            
+            line = 'distance ' + str( max_hamming_distance ) + ', ' + HydrusData.ConvertIntToPrettyString( num_results ) + ' results, per search: ' + ', '.join( method_strings )
+            
+            if not all( ( results == method_results[0] for results in method_results ) ):
+                
+                line += ' -- results did not match!'
+                
+            
+            result_lines.append( line )
+            
+        
+        if not substrings_already_existed:
+            
+            self._CacheSimilarFilesDropPHashSubstrings()
+            
+        
+        job_key.SetVariable( 'popup_text_1', os.linesep.join( result_lines ) )
+        
+        HydrusData.Print( os.linesep.join( result_lines ) )
+        
+        job_key.Finish()
+        
+    
     def _CacheSimilarFilesDeleteFile( self, hash_id ):
         
         phash_ids = { phash_id for ( phash_id, ) in self._c.execute( 'SELECT phash_id FROM shape_perceptual_hash_map WHERE hash_id = ?;', ( hash_id, ) ) }
@@ -868,6 +1098,14 @@ class DB( HydrusDB.HydrusDB ):
         self._c.execute( 'DELETE FROM shape_maintenance_phash_regen WHERE hash_id = ?;', ( hash_id, ) )
         
     
+    def _CacheSimilarFilesDeletePHashSubstrings( self, rows ):
+        
+        if self._CacheSimilarFilesPHashSubstringsExist():
+            
+            self._c.executemany( 'DELETE FROM shape_perceptual_hash_substrings WHERE substring_index = ? AND substring = ? AND phash_id = ?;', ( ( substring_index, substring, phash_id ) for ( phash_id, phash ) in rows for ( substring_index, substring ) in enumerate( ClientSimilarFiles.GetMIHSubstrings( phash ) ) ) )
+            
+        
+    
     def _CacheSimilarFilesDeleteUnknownDuplicatePairs( self ):
         
         hash_ids = set()
@@ -893,93 +1131,44 @@ class DB( HydrusDB.HydrusDB ):
         
         self._c.executemany( 'INSERT OR IGNORE INTO shape_maintenance_branch_regen ( phash_id ) VALUES ( ? );', ( ( phash_id, ) for phash_id in useless_phash_ids ) )
         
+        phash_index = self._CacheSimilarFilesGetPHashIndex()
+        
+        if phash_index is not None:
+            
+            phash_index.RemovePHashIds( useless_phash_ids )
+            
+        
     
-    def _CacheSimilarFilesGenerateBranch( self, job_key, parent_id, phash_id, phash, children ):
+    def _CacheSimilarFilesDropPHashSubstrings( self ):
         
-        process_queue = [ ( parent_id, phash_id, phash, children ) ]
+        self._c.execute( 'DROP TABLE external_caches.shape_perceptual_hash_substrings;' )
         
-        insert_rows = []
+        self._phash_substrings_exist = False
         
-        num_done = 0
-        num_to_do = len( children ) + 1
+    
+    def _CacheSimilarFilesGenerateBranch( self, job_key, parent_id, nodes ):
         
-        while len( process_queue ) > 0:
-            
-            job_key.SetVariable( 'popup_text_2', 'generating new branch -- ' + HydrusData.ConvertValueRangeToPrettyString( num_done, num_to_do ) )
-            
-            ( parent_id, phash_id, phash, children ) = process_queue.pop( 0 )
-            
-            if len( children ) == 0:
-                
-                inner_id = None
-                inner_population = 0
-                
-                outer_id = None
-                outer_population = 0
-                
-                radius = None
-                
-            else:
-                
-                children = [ ( HydrusData.Get64BitHammingDistance( phash, child_phash ), child_id, child_phash ) for ( child_id, child_phash ) in children ]
-                
-                children.sort()
-                
-                median_index = len( children ) / 2
-                
-                median_radius = children[ median_index ][0]
-                
-                inner_children = [ ( child_id, child_phash ) for ( distance, child_id, child_phash ) in children if distance < median_radius ]
-                radius_children = [ ( child_id, child_phash ) for ( distance, child_id, child_phash ) in children if distance == median_radius ]
-                outer_children = [ ( child_id, child_phash ) for ( distance, child_id, child_phash ) in children if distance > median_radius ]
-                
-                if len( inner_children ) <= len( outer_children ):
-                    
-                    radius = median_radius
-                    
-                    inner_children.extend( radius_children )
-                    
-                else:
-                    
-                    radius = median_radius - 1
-                    
-                    outer_children.extend( radius_children )
-                    
-                
-                inner_population = len( inner_children )
-                outer_population = len( outer_children )
-                
-                ( inner_id, inner_phash ) = self._CacheSimilarFilesPopBestRootNode( inner_children ) #HydrusData.MedianPop( inner_children )
-                
-                if len( outer_children ) == 0:
-                    
-                    outer_id = None
-                    
-                else:
-                    
-                    ( outer_id, outer_phash ) = self._CacheSimilarFilesPopBestRootNode( outer_children ) #HydrusData.MedianPop( outer_children )
-                    
-                
-            
-            insert_rows.append( ( phash_id, parent_id, radius, inner_id, inner_population, outer_id, outer_population ) )
-            
-            if inner_id is not None:
-                
-                process_queue.append( ( phash_id, inner_id, inner_phash, inner_children ) )
-                
-            
-            if outer_id is not None:
-                
-                process_queue.append( ( phash_id, outer_id, outer_phash, outer_children ) )
-                
-            
-            num_done += 1
-            
+        job_key.SetVariable( 'popup_text_2', 'generating new branch' )
+        
+        insert_rows = ClientSimilarFiles.GenerateVPTreeRows( nodes, parent_id = parent_id, job_key = job_key )
         
         job_key.SetVariable( 'popup_text_2', 'branch constructed, now committing' )
         
         self._c.executemany( 'INSERT INTO shape_vptree ( phash_id, parent_id, radius, inner_id, inner_population, outer_id, outer_population ) VALUES ( ?, ?, ?, ?, ?, ?, ? );', insert_rows )
         
+        ( root_id, parent_id, radius, inner_id, inner_population, outer_id, outer_population ) = insert_rows[0]
+        
+        return root_id
+        
+    
+    def _CacheSimilarFilesGeneratePHashSubstrings( self ):
+        
+        self._c.execute( 'CREATE TABLE IF NOT EXISTS external_caches.shape_perceptual_hash_substrings ( substring_index INTEGER, substring INTEGER, phash_id INTEGER, PRIMARY KEY ( substring_index, substring, phash_id ) ) WITHOUT ROWID;' )
+        
+        self._phash_substrings_exist = True
+        
+        self._CacheSimilarFilesAddPHashSubstrings( self._c.execute( 'SELECT phash_id, phash FROM shape_perceptual_hashes;' ).fetchall() )
+        
     
     def _CacheSimilarFilesGetDuplicateHashes( self, file_service_key, hash, duplicate_type ):
         
@@ -1140,10 +1329,21 @@ class DB( HydrusDB.HydrusDB ):
         return counter
         
     
-    def _CacheSimilarFilesGetHashIdsFromDuplicatePredicate( self, file_service_key, operator, num_relationships, dupe_type ):
+    def _CacheSimilarFilesGetHashIdsFromDuplicatePredicate( self, file_service_key, operator, num_relationships, dupe_type, hash_ids_table_name = None ):
         
         ( table_join, predicate_string ) = self._CacheSimilarFilesGetDuplicatePairsTableJoinInfo( file_service_key )
         
+        if hash_ids_table_name is None:
+            
+            smaller_predicate_string = predicate_string
+            larger_predicate_string = predicate_string
+            
+        else:
+            
+            smaller_predicate_string = predicate_string + ' AND smaller_hash_id IN ( SELECT hash_id FROM ' + hash_ids_table_name + ' )'
+            larger_predicate_string = predicate_string + ' AND larger_hash_id IN ( SELECT hash_id FROM ' + hash_ids_table_name + ' )'
+            
+        
         hash_ids_to_counts = collections.Counter()
         
         if dupe_type == HC.DUPLICATE_BETTER_OR_WORSE:
@@ -1167,8 +1367,8 @@ class DB( HydrusDB.HydrusDB ):
             larger_duplicate_predicate_string = 'duplicate_type = ' + str( dupe_type )
             
         
-        smaller_query = 'SELECT smaller_hash_id, COUNT( * ) FROM ' + table_join + ' WHERE ' + predicate_string + ' AND ' + smaller_duplicate_predicate_string + ' GROUP BY smaller_hash_id;'
-        larger_query = 'SELECT larger_hash_id, COUNT( * ) FROM ' + table_join + ' WHERE ' + predicate_string + ' AND ' + larger_duplicate_predicate_string + ' GROUP BY larger_hash_id;'
+        smaller_query = 'SELECT smaller_hash_id, COUNT( * ) FROM ' + table_join + ' WHERE ' + smaller_predicate_string + ' AND ' + smaller_duplicate_predicate_string + ' GROUP BY smaller_hash_id;'
+        larger_query = 'SELECT larger_hash_id, COUNT( * ) FROM ' + table_join + ' WHERE ' + larger_predicate_string + ' AND ' + larger_duplicate_predicate_string + ' GROUP BY larger_hash_id;'
         
         for ( hash_id, count ) in self._c.execute( smaller_query ):
             
@@ -1245,6 +1445,8 @@ class DB( HydrusDB.HydrusDB ):
             
             self._CacheSimilarFilesAddLeaf( phash_id, phash )
             
+            self._CacheSimilarFilesAddPHashSubstrings( [ ( phash_id, phash ) ] )
+            
         else:
             
             ( phash_id, ) = result
@@ -1253,6 +1455,22 @@ class DB( HydrusDB.HydrusDB ):
         return phash_id
         
     
+    def _CacheSimilarFilesGetPHashIndex( self ):
+        
+        new_options = HG.client_controller.GetNewOptions()
+        
+        if not new_options.GetBoolean( 'keep_similar_files_phash_index_in_memory' ):
+            
+            self._phash_index = None
+            
+        elif self._phash_index is None:
+            
+            self._CacheSimilarFilesLoadPHashIndex()
+            
+        
+        return self._phash_index
+        
+    
     def _CacheSimilarFilesGetUniqueDuplicatePairs( self, service_key, duplicate_type ):
         
         # we need to batch non-intersecting decisions here to keep it simple at the gui-level
@@ -1344,6 +1562,15 @@ class DB( HydrusDB.HydrusDB ):
         return pairs_of_hashes
         
     
+    def _CacheSimilarFilesLoadPHashIndex( self ):
+        
+        HG.client_controller.pub( 'splash_set_status_subtext', 'similar files index' )
+        
+        rows = self._c.execute( 'SELECT phash_id, phash FROM shape_perceptual_hashes WHERE phash_id IN ( SELECT phash_id FROM shape_perceptual_hash_map );' ).fetchall()
+        
+        self._phash_index = ClientSimilarFiles.PHashIndex( rows )
+        
+    
     def _CacheSimilarFilesMaintainDuplicatePairs( self, search_distance, job_key = None, stop_time = None, abandon_if_other_work_to_do = False ):
         
         if abandon_if_other_work_to_do:
@@ -1384,7 +1611,20 @@ class DB( HydrusDB.HydrusDB ):
             
             total_done_previously = total_num_hash_ids_in_cache - len( hash_ids )
             
-            for ( i, hash_id ) in enumerate( hash_ids ):
+            # the resident index can search a block of files in one go, whereas the vptree has to walk for each file
+            
+            if self._CacheSimilarFilesGetPHashIndex() is None:
+                
+                block_size = 1
+                
+            else:
+                
+                block_size = 256
+                
+            
+            for ( i, block_of_hash_ids ) in enumerate( HydrusData.SplitListIntoChunks( hash_ids, block_size ) ):
+                
+                num_done = i * block_size
                 
                 job_key.SetVariable( 'popup_title', 'similar files duplicate pair discovery' )
                 
@@ -1404,25 +1644,30 @@ class DB( HydrusDB.HydrusDB ):
                     return
                     
                 
-                if i % 25 == 0:
+                if block_size > 1 or num_done % 25 == 0:
                     
-                    text = 'searched ' + HydrusData.ConvertValueRangeToPrettyString( total_done_previously + i, total_num_hash_ids_in_cache ) + ' files'
+                    text = 'searched ' + HydrusData.ConvertValueRangeToPrettyString( total_done_previously + num_done, total_num_hash_ids_in_cache ) + ' files'
                     
                     job_key.SetVariable( 'popup_text_1', text )
-                    job_key.SetVariable( 'popup_gauge_1', ( total_done_previously + i, total_num_hash_ids_in_cache ) )
+                    job_key.SetVariable( 'popup_gauge_1', ( total_done_previously + num_done, total_num_hash_ids_in_cache ) )
                     
                     HG.client_controller.pub( 'splash_set_status_text', text )
                     
                 
-                duplicate_hash_ids = [ duplicate_hash_id for duplicate_hash_id in self._CacheSimilarFilesSearch( hash_id, search_distance ) if duplicate_hash_id != hash_id ]
+                hash_ids_to_similar_hash_ids = self._CacheSimilarFilesSearchMany( block_of_hash_ids, search_distance )
                 
-                # double-check the files exist in shape_search_cache, as I think stale branches are producing deleted file pairs here
-                
-                self._c.executemany( 'INSERT OR IGNORE INTO duplicate_pairs ( smaller_hash_id, larger_hash_id, duplicate_type ) VALUES ( ?, ?, ? );', ( ( min( hash_id, duplicate_hash_id ), max( hash_id, duplicate_hash_id ), HC.DUPLICATE_UNKNOWN ) for duplicate_hash_id in duplicate_hash_ids ) )
-                
-                pairs_found += self._GetRowCount()
+                for hash_id in block_of_hash_ids:
+                    
+                    duplicate_hash_ids = [ duplicate_hash_id for duplicate_hash_id in hash_ids_to_similar_hash_ids[ hash_id ] if duplicate_hash_id != hash_id ]
+                    
+                    # double-check the files exist in shape_search_cache, as I think stale branches are producing deleted file pairs here
+                    
+                    self._c.executemany( 'INSERT OR IGNORE INTO duplicate_pairs ( smaller_hash_id, larger_hash_id, duplicate_type ) VALUES ( ?, ?, ? );', ( ( min( hash_id, duplicate_hash_id ), max( hash_id, duplicate_hash_id ), HC.DUPLICATE_UNKNOWN ) for duplicate_hash_id in duplicate_hash_ids ) )
+                    
+                    pairs_found += self._GetRowCount()
+                    
                 
-                self._c.execute( 'UPDATE shape_search_cache SET searched_distance = ? WHERE hash_id = ?;', ( search_distance, hash_id ) )
+                self._c.executemany( 'UPDATE shape_search_cache SET searched_distance = ? WHERE hash_id = ?;', ( ( search_distance, hash_id ) for hash_id in block_of_hash_ids ) )
                 
             
         finally:
@@ -1573,6 +1818,8 @@ class DB( HydrusDB.HydrusDB ):
             pub_job_key = True
             
         
+        self._CacheSimilarFilesSyncPHashSubstrings()
+        
         try:
             
             job_key.SetVariable( 'popup_title', 'similar files metadata maintenance' )
@@ -1637,6 +1884,11 @@ class DB( HydrusDB.HydrusDB ):
         
         if new_options.GetBoolean( 'maintain_similar_files_duplicate_pairs_during_idle' ):
             
+            if new_options.GetBoolean( 'use_multi_index_hashing_for_similar_files' ) and not self._CacheSimilarFilesPHashSubstringsExist():
+                
+                return True
+                
+            
             ( count, ) = self._c.execute( 'SELECT COUNT( * ) FROM shape_maintenance_phash_regen;' ).fetchone()
             
             if count > 0:
@@ -1657,94 +1909,18 @@ class DB( HydrusDB.HydrusDB ):
         return False
         
     
-    def _CacheSimilarFilesPopBestRootNode( self, node_rows ):
-        
-        if len( node_rows ) == 1:
-            
-            root_row = node_rows.pop(0)
-            
-            return root_row
-            
+    def _CacheSimilarFilesPHashSubstringsExist( self ):
         
-        MAX_VIEWPOINTS = 256
-        MAX_SAMPLE = 64
+        # the substrings table is how a db records that it uses multi-index hashing. while it exists, it is kept in sync with shape_perceptual_hashes
         
-        if len( node_rows ) > MAX_VIEWPOINTS:
+        if self._phash_substrings_exist is None:
             
-            viewpoints = random.sample( node_rows, MAX_VIEWPOINTS )
+            result = self._c.execute( 'SELECT 1 FROM external_caches.sqlite_master WHERE name = ?;', ( 'shape_perceptual_hash_substrings', ) ).fetchone()
             
-        else:
-            
-            viewpoints = node_rows
+            self._phash_substrings_exist = result is not None
             
         
-        if len( node_rows ) > MAX_SAMPLE:
-            
-            sample = random.sample( node_rows, MAX_SAMPLE )
-            
-        else:
-            
-            sample = node_rows
-            
-        
-        final_scores = []
-        
-        for ( v_id, v_phash ) in viewpoints:
-            
-            views = [ HydrusData.Get64BitHammingDistance( v_phash, s_phash ) for ( s_id, s_phash ) in sample if v_id != s_id ]
-            
-            views.sort()
-            
-            # let's figure out the ratio of left_children to right_children, preferring 1:1, and convert it to a discrete integer score
-            
-            median_index = len( views ) / 2
-            
-            radius = views[ median_index ]
-            
-            num_left = float( len( [ 1 for view in views if view < radius ] ) )
-            num_radius = float( len( [ 1 for view in views if view == radius ] ) )
-            num_right = float( len( [ 1 for view in views if view > radius ] ) )
-            
-            if num_left <= num_right:
-                
-                num_left += num_radius
-                
-            else:
-                
-                num_right += num_radius
-                
-            
-            smaller = min( num_left, num_right )
-            larger = max( num_left, num_right )
-            
-            ratio = smaller / larger
-            
-            ratio_score = int( ratio * MAX_SAMPLE / 2 )
-            
-            # now let's calc the standard deviation--larger sd tends to mean less sphere overlap when searching
-            
-            mean_view = sum( views ) / float( len( views ) )
-            squared_diffs = [ ( view - mean_view  ) ** 2 for view in views ]
-            sd = ( sum( squared_diffs ) / len( squared_diffs ) ) ** 0.5
-            
-            final_scores.append( ( ratio_score, sd, v_id ) )
-            
-        
-        final_scores.sort()
-        
-        # we now have a list like [ ( 11, 4.0, [id] ), ( 15, 3.7, [id] ), ( 15, 4.3, [id] ) ]
-        
-        ( ratio_gumpf, sd_gumpf, root_id ) = final_scores.pop()
-        
-        for ( i, ( v_id, v_phash ) ) in enumerate( node_rows ):
-            
-            if v_id == root_id:
-                
-                root_row = node_rows.pop( i )
-                
-                return root_row
-                
-            
+        return self._phash_substrings_exist
         
     
     def _CacheSimilarFilesRegenerateBranch( self, job_key, phash_id ):
@@ -1781,15 +1957,17 @@ class DB( HydrusDB.HydrusDB ):
         
         self._c.executemany( 'DELETE FROM shape_perceptual_hashes WHERE phash_id = ?;', ( ( p_id, ) for p_id in orphan_phash_ids ) )
         
+        self._CacheSimilarFilesDeletePHashSubstrings( [ row for row in unbalanced_nodes if row[0] in orphan_phash_ids ] )
+        
         useful_nodes = [ row for row in unbalanced_nodes if row[0] in useful_phash_ids ]
         
         useful_population = len( useful_nodes )
         
-        # now create the new branch, starting by choosing a new root and updating the parent's left/right reference to that
+        # now create the new branch and update the parent's left/right reference to its new root
         
         if useful_population > 0:
             
-            ( new_phash_id, new_phash ) = self._CacheSimilarFilesPopBestRootNode( useful_nodes ) #HydrusData.RandomPop( useful_nodes )
+            new_phash_id = self._CacheSimilarFilesGenerateBranch( job_key, parent_id, useful_nodes )
             
         else:
             
@@ -1812,11 +1990,6 @@ class DB( HydrusDB.HydrusDB ):
             self._c.execute( query, ( new_phash_id, useful_population, parent_id ) )
             
         
-        if useful_population > 0:
-            
-            self._CacheSimilarFilesGenerateBranch( job_key, parent_id, new_phash_id, new_phash, useful_nodes )
-            
-        
     
     def _CacheSimilarFilesRegenerateTree( self ):
         
@@ -1832,13 +2005,25 @@ class DB( HydrusDB.HydrusDB ):
             
             self._c.execute( 'DELETE FROM shape_vptree;' )
             
+            # the new tree is balanced from the start, so any pending branch regen is moot. orphan phashes would only be cleared by a branch regen, so we drop them now
+            
+            self._c.execute( 'DELETE FROM shape_maintenance_branch_regen;' )
+            
+            self._c.execute( 'DELETE FROM shape_perceptual_hashes WHERE phash_id NOT IN ( SELECT phash_id FROM shape_perceptual_hash_map );' )
+            
+            if self._CacheSimilarFilesPHashSubstringsExist():
+                
+                self._c.execute( 'DELETE FROM shape_perceptual_hash_substrings WHERE phash_id NOT IN ( SELECT phash_id FROM shape_perceptual_hashes );' )
+                
+            
             all_nodes = self._c.execute( 'SELECT phash_id, phash FROM shape_perceptual_hashes;' ).fetchall()
             
             job_key.SetVariable( 'popup_text_1', HydrusData.ConvertIntToPrettyString( len( all_nodes ) ) + ' leaves found, now regenerating' )
             
-            ( root_id, root_phash ) = self._CacheSimilarFilesPopBestRootNode( all_nodes ) #HydrusData.RandomPop( all_nodes )
-            
-            self._CacheSimilarFilesGenerateBranch( job_key, None, root_id, root_phash, all_nodes )
+            if len( all_nodes ) > 0:
+                
+                self._CacheSimilarFilesGenerateBranch( job_key, None, all_nodes )
+                
             
         finally:
             
@@ -1869,106 +2054,214 @@ class DB( HydrusDB.HydrusDB ):
             
         else:
             
-            search_radius = max_hamming_distance
+            search_phashes = [ phash for ( phash, ) in self._c.execute( 'SELECT phash FROM shape_perceptual_hashes NATURAL JOIN shape_perceptual_hash_map WHERE hash_id = ?;', ( hash_id, ) ) ]
             
-            result = self._c.execute( 'SELECT phash_id FROM shape_vptree WHERE parent_id IS NULL;' ).fetchone()
+            phash_index = self._CacheSimilarFilesGetPHashIndex()
             
-            if result is None:
+            if phash_index is not None:
                 
-                return []
+                similar_phash_ids = phash_index.Search( search_phashes, max_hamming_distance )
+                
+            elif self._CacheSimilarFilesUseMIH():
+                
+                similar_phash_ids = self._CacheSimilarFilesSearchMIH( search_phashes, max_hamming_distance )
+                
+            else:
+                
+                similar_phash_ids = self._CacheSimilarFilesSearchVPTree( search_phashes, max_hamming_distance )
                 
             
-            ( root_node_phash_id, ) = result
+            select_statement = 'SELECT hash_id FROM shape_perceptual_hash_map WHERE phash_id IN %s;'
             
-            search_phashes = [ phash for ( phash, ) in self._c.execute( 'SELECT phash FROM shape_perceptual_hashes NATURAL JOIN shape_perceptual_hash_map WHERE hash_id = ?;', ( hash_id, ) ) ]
+            similar_hash_ids = [ hash_id for ( hash_id, ) in self._SelectFromList( select_statement, similar_phash_ids ) ]
             
-            if len( search_phashes ) == 0:
+        
+        return similar_hash_ids
+        
+    
+    def _CacheSimilarFilesSearchMIH( self, search_phashes, max_hamming_distance ):
+        
+        # any phash within range shares at least one near-identical substring with a search phash, so gather everything that does and then check it properly
+        
+        candidate_phash_ids = set()
+        
+        for search_phash in search_phashes:
+            
+            for ( substring_index, substrings ) in ClientSimilarFiles.GetMIHSearchSubstrings( search_phash, max_hamming_distance ):
                 
-                return []
+                candidate_phash_ids.update( self._STI( self._c.execute( 'SELECT phash_id FROM shape_perceptual_hash_substrings WHERE substring_index = ? AND substring IN ' + HydrusData.SplayListForDB( substrings ) + ';', ( substring_index, ) ) ) )
                 
             
-            next_potentials = { root_node_phash_id : tuple( search_phashes ) }
-            similar_phash_ids = set()
+        
+        if len( candidate_phash_ids ) == 0:
+            
+            return set()
+            
+        
+        select_statement = 'SELECT phash_id, phash FROM shape_perceptual_hashes WHERE phash_id IN %s;'
+        
+        candidates = self._SelectFromListFetchAll( select_statement, candidate_phash_ids )
+        
+        distances = HydrusData.Get64BitHammingDistances( search_phashes, [ phash for ( phash_id, phash ) in candidates ] )
+        
+        matches = ( distances <= max_hamming_distance ).any( axis = 0 ).tolist()
+        
+        similar_phash_ids = { phash_id for ( ( phash_id, phash ), match ) in zip( candidates, matches ) if match }
+        
+        if HG.db_report_mode:
+            
+            HydrusData.ShowText( 'Similar file search checked ' + HydrusData.ConvertIntToPrettyString( len( candidate_phash_ids ) ) + ' multi-index hashing candidates.' )
+            
+        
+        return similar_phash_ids
+        
+    
+    def _CacheSimilarFilesSearchMany( self, hash_ids, max_hamming_distance ):
+        
+        phash_index = self._CacheSimilarFilesGetPHashIndex()
+        
+        if phash_index is None:
+            
+            return { hash_id : self._CacheSimilarFilesSearch( hash_id, max_hamming_distance ) for hash_id in hash_ids }
+            
+        
+        hash_ids_to_search_phashes = collections.defaultdict( list )
+        
+        select_statement = 'SELECT hash_id, phash FROM shape_perceptual_hashes NATURAL JOIN shape_perceptual_hash_map WHERE hash_id IN %s;'
+        
+        for ( hash_id, phash ) in self._SelectFromList( select_statement, hash_ids ):
+            
+            hash_ids_to_search_phashes[ hash_id ].append( phash )
             
-            num_cycles = 0
+        
+        hash_ids_to_similar_phash_ids = phash_index.SearchMany( [ ( hash_id, hash_ids_to_search_phashes[ hash_id ] ) for hash_id in hash_ids ], max_hamming_distance )
+        
+        all_similar_phash_ids = set()
+        
+        for similar_phash_ids in hash_ids_to_similar_phash_ids.values():
             
-            while len( next_potentials ) > 0:
+            all_similar_phash_ids.update( similar_phash_ids )
+            
+        
+        select_statement = 'SELECT phash_id, hash_id FROM shape_perceptual_hash_map WHERE phash_id IN %s;'
+        
+        phash_ids_to_hash_ids = HydrusData.BuildKeyToListDict( self._SelectFromList( select_statement, all_similar_phash_ids ) )
+        
+        hash_ids_to_similar_hash_ids = {}
+        
+        for ( hash_id, similar_phash_ids ) in hash_ids_to_similar_phash_ids.items():
+            
+            similar_hash_ids = set()
+            
+            for phash_id in similar_phash_ids:
+                
+                similar_hash_ids.update( phash_ids_to_hash_ids[ phash_id ] )
                 
-                current_potentials = next_potentials
-                next_potentials = {}
+            
+            hash_ids_to_similar_hash_ids[ hash_id ] = similar_hash_ids
+            
+        
+        return hash_ids_to_similar_hash_ids
+        
+    
+    def _CacheSimilarFilesSearchVPTree( self, search_phashes, max_hamming_distance ):
+        
+        search_radius = max_hamming_distance
+        
+        result = self._c.execute( 'SELECT phash_id FROM shape_vptree WHERE parent_id IS NULL;' ).fetchone()
+        
+        if result is None or len( search_phashes ) == 0:
+            
+            return set()
+            
+        
+        ( root_node_phash_id, ) = result
+        
+        search_phashes_to_indices = { search_phash : i for ( i, search_phash ) in enumerate( search_phashes ) }
+        
+        next_potentials = { root_node_phash_id : tuple( search_phashes ) }
+        similar_phash_ids = set()
+        
+        num_cycles = 0
+        
+        while len( next_potentials ) > 0:
+            
+            current_potentials = next_potentials
+            next_potentials = {}
+            
+            num_cycles += 1
+            
+            select_statement = 'SELECT phash_id, phash, radius, inner_id, outer_id FROM shape_perceptual_hashes NATURAL JOIN shape_vptree WHERE phash_id IN %s;'
+            
+            nodes = self._SelectFromListFetchAll( select_statement, current_potentials.keys() )
+            
+            # get the distance from every search phash to every node at this level in one go
+            
+            level_distances = HydrusData.Get64BitHammingDistances( search_phashes, [ node_phash for ( node_phash_id, node_phash, node_radius, inner_phash_id, outer_phash_id ) in nodes ] ).tolist()
+            
+            for ( node_index, ( node_phash_id, node_phash, node_radius, inner_phash_id, outer_phash_id ) ) in enumerate( nodes ):
                 
-                num_cycles += 1
+                node_search_phashes = current_potentials[ node_phash_id ]
                 
-                select_statement = 'SELECT phash_id, phash, radius, inner_id, outer_id FROM shape_perceptual_hashes NATURAL JOIN shape_vptree WHERE phash_id IN %s;'
+                inner_search_phashes = []
+                outer_search_phashes = []
                 
-                for ( node_phash_id, node_phash, node_radius, inner_phash_id, outer_phash_id ) in self._SelectFromList( select_statement, current_potentials.keys() ):
+                for search_phash in node_search_phashes:
                     
-                    search_phashes = current_potentials[ node_phash_id ]
+                    # first check the node--is it similar?
                     
-                    inner_search_phashes = []
-                    outer_search_phashes = []
+                    node_hamming_distance = level_distances[ search_phashes_to_indices[ search_phash ] ][ node_index ]
                     
-                    for search_phash in search_phashes:
+                    if node_hamming_distance <= search_radius:
                         
-                        # first check the node--is it similar?
+                        similar_phash_ids.add( node_phash_id )
                         
-                        node_hamming_distance = HydrusData.Get64BitHammingDistance( search_phash, node_phash )
+                    
+                    # now how about its children?
+                    
+                    if node_radius is not None:
                         
-                        if node_hamming_distance <= search_radius:
-                            
-                            similar_phash_ids.add( node_phash_id )
-                            
+                        # we have two spheres--node and search--their centers separated by node_hamming_distance
+                        # we want to search inside/outside the node_sphere if the search_sphere intersects with those spaces
+                        # there are four possibles:
+                        # (----N----)-(--S--)    intersects with outer only - distance between N and S > their radii
+                        # (----N---(-)-S--)      intersects with both
+                        # (----N-(--S-)-)        intersects with both
+                        # (---(-N-S--)-)         intersects with inner only - distance between N and S + radius_S does not exceed radius_N
                         
-                        # now how about its children?
+                        spheres_disjoint = node_hamming_distance > ( node_radius + search_radius )
+                        search_sphere_subset_of_node_sphere = ( node_hamming_distance + search_radius ) <= node_radius
                         
-                        if node_radius is not None:
-                            
-                            # we have two spheres--node and search--their centers separated by node_hamming_distance
-                            # we want to search inside/outside the node_sphere if the search_sphere intersects with those spaces
-                            # there are four possibles:
-                            # (----N----)-(--S--)    intersects with outer only - distance between N and S > their radii
-                            # (----N---(-)-S--)      intersects with both
-                            # (----N-(--S-)-)        intersects with both
-                            # (---(-N-S--)-)         intersects with inner only - distance between N and S + radius_S does not exceed radius_N
+                        if not spheres_disjoint: # i.e. they intersect at some point
                             
-                            spheres_disjoint = node_hamming_distance > ( node_radius + search_radius )
-                            search_sphere_subset_of_node_sphere = ( node_hamming_distance + search_radius ) <= node_radius
+                            inner_search_phashes.append( search_phash )
                             
-                            if not spheres_disjoint: # i.e. they intersect at some point
-                                
-                                inner_search_phashes.append( search_phash )
-                                
+                        
+                        if not search_sphere_subset_of_node_sphere: # i.e. search sphere intersects with non-node sphere space at some point
                             
-                            if not search_sphere_subset_of_node_sphere: # i.e. search sphere intersects with non-node sphere space at some point
-                                
-                                outer_search_phashes.append( search_phash )
-                                
+                            outer_search_phashes.append( search_phash )
                             
                         
                     
-                    if inner_phash_id is not None and len( inner_search_phashes ) > 0:
-                        
-                        next_potentials[ inner_phash_id ] = tuple( inner_search_phashes )
-                        
+                
+                if inner_phash_id is not None and len( inner_search_phashes ) > 0:
                     
-                    if outer_phash_id is not None and len( outer_search_phashes ) > 0:
-                        
-                        next_potentials[ outer_phash_id ] = tuple( outer_search_phashes )
-                        
+                    next_potentials[ inner_phash_id ] = tuple( inner_search_phashes )
                     
                 
-            
-            if HG.db_report_mode:
-                
-                HydrusData.ShowText( 'Similar file search completed in ' + HydrusData.ConvertIntToPrettyString( num_cycles ) + ' cycles.' )
+                if outer_phash_id is not None and len( outer_search_phashes ) > 0:
+                    
+                    next_potentials[ outer_phash_id ] = tuple( outer_search_phashes )
+                    
                 
             
-            select_statement = 'SELECT hash_id FROM shape_perceptual_hash_map WHERE phash_id IN %s;'
+        
+        if HG.db_report_mode:
             
-            similar_hash_ids = [ hash_id for ( hash_id, ) in self._SelectFromList( select_statement, similar_phash_ids ) ]
+            HydrusData.ShowText( 'Similar file search completed in ' + HydrusData.ConvertIntToPrettyString( num_cycles ) + ' cycles.' )
             
         
-        return similar_hash_ids
+        return similar_phash_ids
         
     
     def _CacheSimilarFilesSetDuplicatePairStatus( self, pair_info ):
@@ -2123,6 +2416,26 @@ class DB( HydrusDB.HydrusDB ):
             
         
     
+    def _CacheSimilarFilesSyncPHashSubstrings( self ):
+        
+        new_options = HG.client_controller.GetNewOptions()
+        
+        use_mih = new_options.GetBoolean( 'use_multi_index_hashing_for_similar_files' )
+        
+        substrings_exist = self._CacheSimilarFilesPHashSubstringsExist()
+        
+        if use_mih and not substrings_exist:
+            
+            self._CacheSimilarFilesGeneratePHashSubstrings()
+            
+        elif substrings_exist and not use_mih:
+            
+            # no point keeping it in sync if we are not using it
+            
+            self._CacheSimilarFilesDropPHashSubstrings()
+            
+        
+    
     def _CacheSimilarFilesSyncSameQualityDuplicates( self, hash_id ):
         
         # exactly similar files should have exactly the same relationships with other files
@@ -2177,6 +2490,13 @@ class DB( HydrusDB.HydrusDB ):
             
         
     
+    def _CacheSimilarFilesUseMIH( self ):
+        
+        new_options = HG.client_controller.GetNewOptions()
+        
+        return new_options.GetBoolean( 'use_multi_index_hashing_for_similar_files' ) and self._CacheSimilarFilesPHashSubstringsExist()
+        
+    
     def _CacheSpecificMappingsAddFiles( self, file_service_id, tag_service_id, hash_ids ):
         
         ( cache_files_table_name, cache_current_mappings_table_name, cache_deleted_mappings_table_name, cache_pending_mappings_table_name, ac_cache_table_name ) = GenerateSpecificMappingsCacheTableNames( file_service_id, tag_service_id )
@@ -2676,6 +2996,13 @@ class DB( HydrusDB.HydrusDB ):
         self._subscriptions_cache = {}
         self._service_cache = {}
         
+        for ( mtime, hta, hash_type ) in self._tag_archive_cache.values():
+            
+            hta.Close()
+            
+        
+        self._tag_archive_cache = {}
+        
     
     def _CreateDB( self ):
         
@@ -2733,6 +3060,9 @@ class DB( HydrusDB.HydrusDB ):
         
         self._c.execute( 'CREATE TABLE remote_thumbnails ( service_id INTEGER, hash_id INTEGER, PRIMARY KEY( service_id, hash_id ) );' )
         
+        self._c.execute( 'CREATE TABLE repository_processing_history ( service_id INTEGER REFERENCES services ON DELETE CASCADE, timestamp INTEGER, row_name TEXT, num_rows INTEGER, time_took REAL );' )
+        self._CreateIndex( 'repository_processing_history', [ 'service_id', 'timestamp' ] )
+        
         self._c.execute( 'CREATE TABLE service_filenames ( service_id INTEGER REFERENCES services ON DELETE CASCADE, hash_id INTEGER, filename TEXT, PRIMARY KEY ( service_id, hash_id ) );' )
         self._c.execute( 'CREATE TABLE service_directories ( service_id INTEGER REFERENCES services ON DELETE CASCADE, directory_id INTEGER, num_files INTEGER, total_size INTEGER, note TEXT, PRIMARY KEY ( service_id, directory_id ) );' )
         self._c.execute( 'CREATE TABLE service_directory_file_map ( service_id INTEGER REFERENCES services ON DELETE CASCADE, directory_id INTEGER, hash_id INTEGER, PRIMARY KEY ( service_id, directory_id, hash_id ) );' )
@@ -2872,6 +3202,8 @@ class DB( HydrusDB.HydrusDB ):
     
     def _DeleteFiles( self, service_id, hash_ids ):
         
+        self._UncacheMediaResults( hash_ids )
+        
         service = self._GetService( service_id )
         
         service_type = service.GetServiceType()
@@ -3005,6 +3337,8 @@ class DB( HydrusDB.HydrusDB ):
     
     def _DeletePending( self, service_key ):
         
+        self._UncacheMediaResults()
+        
         service_id = self._GetServiceId( service_key )
         
         service = self._GetService( service_id )
@@ -3078,6 +3412,8 @@ class DB( HydrusDB.HydrusDB ):
     
     def _DeleteService( self, service_id ):
         
+        self._UncacheMediaResults()
+        
         service = self._GetService( service_id )
         
         service_key = service.GetServiceKey()
@@ -3327,6 +3663,170 @@ class DB( HydrusDB.HydrusDB ):
         return hashes_result
         
     
+    def _GenerateMediaResults( self, hash_ids ):
+        
+        with HydrusDB.TemporaryIntegerTable( self._c, hash_ids, 'hash_id' ) as temp_table_name:
+            
+            # get first detailed results
+            
+            hash_ids_to_hashes = dict( self._c.execute( 'SELECT hash_id, hash FROM ' + temp_table_name + ' NATURAL JOIN hashes;' ) )
+            
+            hash_ids_to_info = { hash_id : ClientMedia.FileInfoManager( hash_ids_to_hashes[ hash_id ], size, mime, width, height, duration, num_frames, num_words ) for ( hash_id, size, mime, width, height, duration, num_frames, num_words ) in self._c.execute( 'SELECT * FROM ' + temp_table_name + ' NATURAL JOIN files_info;' ) }
+            
+            hash_ids_to_current_file_service_ids_and_timestamps = HydrusData.BuildKeyToListDict( ( ( hash_id, ( service_id, timestamp ) ) for ( hash_id, service_id, timestamp ) in self._c.execute( 'SELECT hash_id, service_id, timestamp FROM ' + temp_table_name + ' NATURAL JOIN current_files;' ) ) )
+            
+            hash_ids_to_deleted_file_service_ids = HydrusData.BuildKeyToListDict( self._c.execute( 'SELECT hash_id, service_id FROM ' + temp_table_name + ' NATURAL JOIN deleted_files;' ) )
+            
+            hash_ids_to_pending_file_service_ids = HydrusData.BuildKeyToListDict( self._c.execute( 'SELECT hash_id, service_id FROM ' + temp_table_name + ' NATURAL JOIN file_transfers;' ) )
+            
+            hash_ids_to_petitioned_file_service_ids = HydrusData.BuildKeyToListDict( self._c.execute( 'SELECT hash_id, service_id FROM ' + temp_table_name + ' NATURAL JOIN file_petitions;' ) )
+            
+            hash_ids_to_urls = HydrusData.BuildKeyToSetDict( self._c.execute( 'SELECT hash_id, url FROM ' + temp_table_name + ' NATURAL JOIN urls;' ) )
+            
+            hash_ids_to_service_ids_and_filenames = HydrusData.BuildKeyToListDict( ( ( hash_id, ( service_id, filename ) ) for ( hash_id, service_id, filename ) in self._c.execute( 'SELECT hash_id, service_id, filename FROM ' + temp_table_name + ' NATURAL JOIN service_filenames;' ) ) )
+            
+            hash_ids_to_local_ratings = HydrusData.BuildKeyToListDict( ( ( hash_id, ( service_id, rating ) ) for ( service_id, hash_id, rating ) in self._c.execute( 'SELECT service_id, hash_id, rating FROM ' + temp_table_name + ' NATURAL JOIN local_ratings;' ) ) )
+            
+            #
+            
+            # Let's figure out if there is a common specific file service to this batch
+            
+            file_service_id_counter = collections.Counter()
+            
+            for file_service_ids_and_timestamps in hash_ids_to_current_file_service_ids_and_timestamps.values():
+                
+                for ( file_service_id, timestamp ) in file_service_ids_and_timestamps:
+                    
+                    file_service_id_counter[ file_service_id ] += 1
+                    
+                
+            
+            common_file_service_id = None
+            
+            for ( file_service_id, count ) in file_service_id_counter.items():
+                
+                if count == len( hash_ids ): # i.e. every hash has this file service
+                    
+                    ( file_service_type, ) = self._c.execute( 'SELECT service_type FROM services WHERE service_id = ?;', ( file_service_id, ) ).fetchone()
+                    
+                    if file_service_type in HC.AUTOCOMPLETE_CACHE_SPECIFIC_FILE_SERVICES:
+                        
+                        common_file_service_id = file_service_id
+                        
+                        break
+                        
+                    
+                
+            
+            #
+            
+            tag_data = []
+            
+            tag_service_ids = self._GetServiceIds( HC.TAG_SERVICES )
+            
+            for tag_service_id in tag_service_ids:
+                
+                ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateMappingsTableNames( tag_service_id )
+                
+                if common_file_service_id is None:
+                    
+                    tag_data.extend( ( hash_id, ( tag_service_id, HC.CONTENT_STATUS_CURRENT, tag_id ) ) for ( hash_id, tag_id ) in self._c.execute( 'SELECT hash_id, tag_id FROM ' + temp_table_name + ' NATURAL JOIN ' + current_mappings_table_name + ';' ) )
+                    tag_data.extend( ( hash_id, ( tag_service_id, HC.CONTENT_STATUS_DELETED, tag_id ) ) for ( hash_id, tag_id ) in self._c.execute( 'SELECT hash_id, tag_id FROM ' + temp_table_name + ' NATURAL JOIN ' + deleted_mappings_table_name + ';' ) )
+                    tag_data.extend( ( hash_id, ( tag_service_id, HC.CONTENT_STATUS_PENDING, tag_id ) ) for ( hash_id, tag_id ) in self._c.execute( 'SELECT hash_id, tag_id FROM ' + temp_table_name + ' NATURAL JOIN ' + pending_mappings_table_name + ';' ) )
+                    
+                else:
+                    
+                    ( cache_files_table_name, cache_current_mappings_table_name, cache_deleted_mappings_table_name, cache_pending_mappings_table_name, ac_cache_table_name ) = GenerateSpecificMappingsCacheTableNames( common_file_service_id, tag_service_id )
+                    
+                    tag_data.extend( ( hash_id, ( tag_service_id, HC.CONTENT_STATUS_CURRENT, tag_id ) ) for ( hash_id, tag_id ) in self._c.execute( 'SELECT hash_id, tag_id FROM ' + temp_table_name + ' NATURAL JOIN ' + cache_current_mappings_table_name + ';' ) )
+                    tag_data.extend( ( hash_id, ( tag_service_id, HC.CONTENT_STATUS_DELETED, tag_id ) ) for ( hash_id, tag_id ) in self._c.execute( 'SELECT hash_id, tag_id FROM ' + temp_table_name + ' NATURAL JOIN ' + cache_deleted_mappings_table_name + ';' ) )
+                    tag_data.extend( ( hash_id, ( tag_service_id, HC.CONTENT_STATUS_PENDING, tag_id ) ) for ( hash_id, tag_id ) in self._c.execute( 'SELECT hash_id, tag_id FROM ' + temp_table_name + ' NATURAL JOIN ' + cache_pending_mappings_table_name + ';' ) )
+                    
+                
+                tag_data.extend( ( hash_id, ( tag_service_id, HC.CONTENT_STATUS_PETITIONED, tag_id ) ) for ( hash_id, tag_id ) in self._c.execute( 'SELECT hash_id, tag_id FROM ' + temp_table_name + ' NATURAL JOIN ' + petitioned_mappings_table_name + ';' ) )
+                
+            
+        
+        seen_tag_ids = { tag_id for ( hash_id, ( tag_service_id, status, tag_id ) ) in tag_data }
+        
+        hash_ids_to_raw_tag_data = HydrusData.BuildKeyToListDict( tag_data )
+        
+        tag_ids_to_tags = self._GetTagIdsToTags( seen_tag_ids )
+        
+        # build it
+        
+        service_ids_to_service_keys = { service_id : service_key for ( service_id, service_key ) in self._c.execute( 'SELECT service_id, service_key FROM services;' ) }
+        
+        hash_ids_to_media_results = {}
+        
+        tag_censorship_manager = self._controller.GetManager( 'tag_censorship' )
+        
+        for hash_id in hash_ids:
+            
+            hash = hash_ids_to_hashes[ hash_id ]
+            
+            #
+            
+            # service_id, status, tag_id
+            raw_tag_data = hash_ids_to_raw_tag_data[ hash_id ]
+            
+            # service_id -> ( status, tag )
+            service_ids_to_tag_data = HydrusData.BuildKeyToListDict( ( ( tag_service_id, ( status, tag_ids_to_tags[ tag_id ] ) ) for ( tag_service_id, status, tag_id ) in raw_tag_data ) )
+            
+            service_keys_to_statuses_to_tags = collections.defaultdict( HydrusData.default_dict_set )
+            
+            service_keys_to_statuses_to_tags.update( { service_ids_to_service_keys[ service_id ] : HydrusData.BuildKeyToSetDict( tag_data ) for ( service_id, tag_data ) in service_ids_to_tag_data.items() } )
+            
+            service_keys_to_statuses_to_tags = tag_censorship_manager.FilterServiceKeysToStatusesToTags( service_keys_to_statuses_to_tags )
+            
+            tags_manager = ClientMedia.TagsManager( service_keys_to_statuses_to_tags )
+            
+            #
+            
+            current_file_service_keys = { service_ids_to_service_keys[ service_id ] for ( service_id, timestamp ) in hash_ids_to_current_file_service_ids_and_timestamps[ hash_id ] }
+            
+            deleted_file_service_keys = { service_ids_to_service_keys[ service_id ] for service_id in hash_ids_to_deleted_file_service_ids[ hash_id ] }
+            
+            pending_file_service_keys = { service_ids_to_service_keys[ service_id ] for service_id in hash_ids_to_pending_file_service_ids[ hash_id ] }
+            
+            petitioned_file_service_keys = { service_ids_to_service_keys[ service_id ] for service_id in hash_ids_to_petitioned_file_service_ids[ hash_id ] }
+            
+            inbox = hash_id in self._inbox_hash_ids
+            
+            urls = hash_ids_to_urls[ hash_id ]
+            
+            service_ids_to_filenames = HydrusData.BuildKeyToListDict( hash_ids_to_service_ids_and_filenames[ hash_id ] )
+            
+            service_keys_to_filenames = { service_ids_to_service_keys[ service_id ] : filenames for ( service_id, filenames ) in service_ids_to_filenames.items() }
+            
+            current_file_service_keys_to_timestamps = { service_ids_to_service_keys[ service_id ] : timestamp for ( service_id, timestamp ) in hash_ids_to_current_file_service_ids_and_timestamps[ hash_id ] }
+            
+            locations_manager = ClientMedia.LocationsManager( current_file_service_keys, deleted_file_service_keys, pending_file_service_keys, petitioned_file_service_keys, inbox, urls, service_keys_to_filenames, current_to_timestamps = current_file_service_keys_to_timestamps )
+            
+            #
+            
+            local_ratings = { service_ids_to_service_keys[ service_id ] : rating for ( service_id, rating ) in hash_ids_to_local_ratings[ hash_id ] }
+            
+            ratings_manager = ClientRatings.RatingsManager( local_ratings )
+            
+            #
+            
+            if hash_id in hash_ids_to_info:
+                
+                file_info_manager = hash_ids_to_info[ hash_id ]
+                
+            else:
+                
+                file_info_manager = ClientMedia.FileInfoManager( hash )
+                
+            
+            hash_ids_to_media_results[ hash_id ] = ClientMedia.MediaResult( file_info_manager, tags_manager, locations_manager, ratings_manager )
+            
+        
+        return hash_ids_to_media_results
+        
+    
+    
     def _GetAutocompleteCounts( self, tag_service_id, file_service_id, tag_ids, include_current, include_pending ):
         
         if tag_service_id == self._combined_tag_service_id:
@@ -3634,6 +4134,44 @@ class DB( HydrusDB.HydrusDB ):
         return names_to_analyze
         
     
+    def _GetCachedTagArchive( self, hta_path ):
+        
+        # opening a big archive is expensive, so we keep read-only handles open between imports and reopen only if the file has changed
+        
+        if hta_path in self._tag_archive_cache:
+            
+            ( mtime, hta, hash_type ) = self._tag_archive_cache[ hta_path ]
+            
+            if os.path.exists( hta_path ) and os.path.getmtime( hta_path ) == mtime:
+                
+                return ( hta, hash_type )
+                
+            
+            hta.Close()
+            
+            del self._tag_archive_cache[ hta_path ]
+            
+        
+        mtime = os.path.getmtime( hta_path )
+        
+        hta = HydrusTagArchive.HydrusTagArchive( hta_path, read_only = True )
+        
+        try:
+            
+            hash_type = hta.GetHashType()
+            
+        except:
+            
+            hta.Close()
+            
+            raise
+            
+        
+        self._tag_archive_cache[ hta_path ] = ( mtime, hta, hash_type )
+        
+        return ( hta, hash_type )
+        
+    
     def _GetClientFilesLocations( self ):
         
         result = { prefix : HydrusPaths.ConvertPortablePathToAbsPath( location ) for ( prefix, location ) in self._c.execute( 'SELECT prefix, location FROM client_files_locations;' ) }
@@ -3845,7 +4383,71 @@ class DB( HydrusDB.HydrusDB ):
         return hash_ids
         
     
-    def _GetHashIdsFromNamespace( self, file_service_key, tag_service_key, namespace, include_current_tags, include_pending_tags ):
+    def _GetHashIdsFromFilesInfoPredicates( self, file_service_key, files_info_predicates, hash_ids = None ):
+        
+        predicates = list( files_info_predicates )
+        
+        if file_service_key == CC.COMBINED_FILE_SERVICE_KEY:
+            
+            table_join = 'files_info'
+            
+        else:
+            
+            predicates.insert( 0, 'service_id = ' + str( self._GetServiceId( file_service_key ) ) )
+            
+            table_join = 'current_files NATURAL JOIN files_info'
+            
+        
+        if hash_ids is None:
+            
+            return self._STS( self._c.execute( 'SELECT hash_id FROM ' + table_join + ' WHERE ' + ' AND '.join( predicates ) + ';' ) )
+            
+        else:
+            
+            with HydrusDB.TemporaryIntegerTable( self._c, hash_ids, 'hash_id' ) as temp_table_name:
+                
+                return self._STS( self._c.execute( 'SELECT hash_id as h FROM ' + temp_table_name + ' WHERE EXISTS ( SELECT 1 FROM ' + table_join + ' WHERE hash_id = h AND ' + ' AND '.join( predicates ) + ' );' ) )
+                
+            
+        
+    
+    def _GetHashIdsFromMappingsPredicates( self, current_selects, pending_selects, include_current_tags, include_pending_tags, hash_ids_table_name = None ):
+        
+        # the selects are ( mappings_table_name, tags_predicate ) pairs
+        # if we are given a table of hash_ids, we only check those files. when that table is small and the tag is common, this touches far fewer rows
+        
+        selects = []
+        
+        if include_current_tags:
+            
+            selects.extend( current_selects )
+            
+        
+        if include_pending_tags:
+            
+            selects.extend( pending_selects )
+            
+        
+        hash_ids = set()
+        
+        for ( mappings_table_name, predicate ) in selects:
+            
+            if hash_ids_table_name is None:
+                
+                query = 'SELECT hash_id FROM ' + mappings_table_name + ' NATURAL JOIN tags WHERE ' + predicate + ';'
+                
+            else:
+                
+                query = 'SELECT hash_id as h FROM ' + hash_ids_table_name + ' WHERE EXISTS ( SELECT 1 FROM ' + mappings_table_name + ' NATURAL JOIN tags WHERE hash_id = h AND ' + predicate + ' );'
+                
+            
+            hash_ids.update( self._STI( self._c.execute( query ) ) )
+            
+        
+        return hash_ids
+        
+    
+    def _GetHashIdsFromNamespace( self, file_service_key, tag_service_key, namespace, include_current_tags, include_pending_tags, hash_ids_table_name = None ):
         
         if not self._NamespaceExists( namespace ):
             
@@ -3874,40 +4476,22 @@ class DB( HydrusDB.HydrusDB ):
                 
                 ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateMappingsTableNames( search_tag_service_id )
                 
-                current_selects.append( 'SELECT hash_id FROM ' + current_mappings_table_name + ' NATURAL JOIN tags WHERE namespace_id = ' + str( namespace_id ) + ';' )
-                pending_selects.append( 'SELECT hash_id FROM ' + pending_mappings_table_name + ' NATURAL JOIN tags WHERE namespace_id = ' + str( namespace_id ) + ';' )
+                current_selects.append( ( current_mappings_table_name, 'namespace_id = ' + str( namespace_id ) ) )
+                pending_selects.append( ( pending_mappings_table_name, 'namespace_id = ' + str( namespace_id ) ) )
                 
             else:
                 
                 ( cache_files_table_name, cache_current_mappings_table_name, cache_deleted_mappings_table_name, cache_pending_mappings_table_name, ac_cache_table_name ) = GenerateSpecificMappingsCacheTableNames( file_service_id, search_tag_service_id )
                 
-                current_selects.append( 'SELECT hash_id FROM ' + cache_current_mappings_table_name + ' NATURAL JOIN tags WHERE namespace_id = ' + str( namespace_id ) + ';' )
-                pending_selects.append( 'SELECT hash_id FROM ' + cache_pending_mappings_table_name + ' NATURAL JOIN tags WHERE namespace_id = ' + str( namespace_id ) + ';' )
-                
-            
-        
-        hash_ids = set()
-        
-        if include_current_tags:
-            
-            for current_select in current_selects:
-                
-                hash_ids.update( ( id for ( id, ) in self._c.execute( current_select ) ) )
-                
-            
-        
-        if include_pending_tags:
-            
-            for pending_select in pending_selects:
-                
-                hash_ids.update( ( id for ( id, ) in self._c.execute( pending_select ) ) )
+                current_selects.append( ( cache_current_mappings_table_name, 'namespace_id = ' + str( namespace_id ) ) )
+                pending_selects.append( ( cache_pending_mappings_table_name, 'namespace_id = ' + str( namespace_id ) ) )
                 
             
         
-        return hash_ids
+        return self._GetHashIdsFromMappingsPredicates( current_selects, pending_selects, include_current_tags, include_pending_tags, hash_ids_table_name = hash_ids_table_name )
         
     
-    def _GetHashIdsFromNamespaceIdsSubtagIds( self, file_service_key, tag_service_key, namespace_ids, subtag_ids, include_current_tags, include_pending_tags ):
+    def _GetHashIdsFromNamespaceIdsSubtagIds( self, file_service_key, tag_service_key, namespace_ids, subtag_ids, include_current_tags, include_pending_tags, hash_ids_table_name = None ):
         
         file_service_id = self._GetServiceId( file_service_key )
         
@@ -3929,43 +4513,30 @@ class DB( HydrusDB.HydrusDB ):
                 
                 ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateMappingsTableNames( search_tag_service_id )
                 
-                current_selects.append( 'SELECT hash_id FROM ' + current_mappings_table_name + ' NATURAL JOIN tags WHERE namespace_id IN ' + HydrusData.SplayListForDB( namespace_ids ) + ' AND subtag_id IN ' + HydrusData.SplayListForDB( subtag_ids ) + ';' )
-                pending_selects.append( 'SELECT hash_id FROM ' + pending_mappings_table_name + ' NATURAL JOIN tags WHERE namespace_id IN ' + HydrusData.SplayListForDB( namespace_ids ) + ' AND subtag_id IN ' + HydrusData.SplayListForDB( subtag_ids ) + ';' )
+                current_selects.append( ( current_mappings_table_name, 'namespace_id IN ' + HydrusData.SplayListForDB( namespace_ids ) + ' AND subtag_id IN ' + HydrusData.SplayListForDB( subtag_ids ) ) )
+                pending_selects.append( ( pending_mappings_table_name, 'namespace_id IN ' + HydrusData.SplayListForDB( namespace_ids ) + ' AND subtag_id IN ' + HydrusData.SplayListForDB( subtag_ids ) ) )
                 
             else:
                 
                 ( cache_files_table_name, cache_current_mappings_table_name, cache_deleted_mappings_table_name, cache_pending_mappings_table_name, ac_cache_table_name ) = GenerateSpecificMappingsCacheTableNames( file_service_id, search_tag_service_id )
                 
-                current_selects.append( 'SELECT hash_id FROM ' + cache_current_mappings_table_name + ' NATURAL JOIN tags WHERE namespace_id IN ' + HydrusData.SplayListForDB( namespace_ids ) + ' AND subtag_id IN ' + HydrusData.SplayListForDB( subtag_ids ) + ';' )
-                pending_selects.append( 'SELECT hash_id FROM ' + cache_pending_mappings_table_name + ' NATURAL JOIN tags WHERE namespace_id IN ' + HydrusData.SplayListForDB( namespace_ids ) + ' AND subtag_id IN ' + HydrusData.SplayListForDB( subtag_ids ) + ';' )
+                current_selects.append( ( cache_current_mappings_table_name, 'namespace_id IN ' + HydrusData.SplayListForDB( namespace_ids ) + ' AND subtag_id IN ' + HydrusData.SplayListForDB( subtag_ids ) ) )
+                pending_selects.append( ( cache_pending_mappings_table_name, 'namespace_id IN ' + HydrusData.SplayListForDB( namespace_ids ) + ' AND subtag_id IN ' + HydrusData.SplayListForDB( subtag_ids ) ) )
                 
             
         
-        hash_ids = set()
+        return self._GetHashIdsFromMappingsPredicates( current_selects, pending_selects, include_current_tags, include_pending_tags, hash_ids_table_name = hash_ids_table_name )
         
-        if include_current_tags:
-            
-            for current_select in current_selects:
-                
-                hash_ids.update( ( id for ( id, ) in self._c.execute( current_select ) ) )
-                
-            
+    
+    def _GetHashIdsFromQuery( self, search_context, hash_ids_to_check = None ):
         
-        if include_pending_tags:
+        # if hash_ids_to_check is set, we only want to know which of those files match, so every step can stay small
+        
+        if hash_ids_to_check is None:
             
-            for pending_select in pending_selects:
-                
-                hash_ids.update( ( id for ( id, ) in self._c.execute( pending_select ) ) )
-                
+            self._controller.ResetIdleTimer()
             
         
-        return hash_ids
-        
-    
-    def _GetHashIdsFromQuery( self, search_context ):
-        
-        self._controller.ResetIdleTimer()
-        
         system_predicates = search_context.GetSystemPredicates()
         
         file_service_key = search_context.GetFileServiceKey()
@@ -3988,8 +4559,54 @@ class DB( HydrusDB.HydrusDB ):
         wildcards_to_include = search_context.GetWildcardsToInclude()
         wildcards_to_exclude = search_context.GetWildcardsToExclude()
         
-        include_current_tags = search_context.IncludeCurrentTags()
-        include_pending_tags = search_context.IncludePendingTags()
+        include_current_tags = search_context.IncludeCurrentTags()
+        include_pending_tags = search_context.IncludePendingTags()
+        
+        # we time each stage so db report mode can say where a slow search spent its time
+        
+        report_rows = []
+        step_times = [ HydrusData.GetNowPrecise() ]
+        
+        def report_step( description, hash_ids ):
+            
+            now = HydrusData.GetNowPrecise()
+            
+            report_rows.append( ( description, now - step_times[ -1 ], len( hash_ids ) ) )
+            
+            step_times.append( now )
+            
+        
+        # once we have our first set of files, a check of just a few files only needs to ask sqlite about the ones still in it
+        
+        def get_hash_ids_from_table( table_join, predicate, args ):
+            
+            if hash_ids_to_check is None:
+                
+                return self._STS( self._c.execute( 'SELECT hash_id FROM ' + table_join + ' WHERE ' + predicate + ';', args ) )
+                
+            else:
+                
+                with HydrusDB.TemporaryIntegerTable( self._c, query_hash_ids, 'hash_id' ) as temp_table_name:
+                    
+                    return self._STS( self._c.execute( 'SELECT hash_id as h FROM ' + temp_table_name + ' WHERE EXISTS ( SELECT 1 FROM ' + table_join + ' WHERE hash_id = h AND ' + predicate + ' );', args ) )
+                    
+                
+            
+        
+        def get_hash_ids_from_func( func, *args ):
+            
+            if hash_ids_to_check is None:
+                
+                return func( *args )
+                
+            else:
+                
+                with HydrusDB.TemporaryIntegerTable( self._c, query_hash_ids, 'hash_id' ) as temp_table_name:
+                    
+                    return func( *args, hash_ids_table_name = temp_table_name )
+                    
+                
+            
         
         #
         
@@ -4028,6 +4645,11 @@ class DB( HydrusDB.HydrusDB ):
                     
                 
             
+            if hash_ids_to_check is not None:
+                
+                query_hash_ids.intersection_update( hash_ids_to_check )
+                
+            
             return query_hash_ids
             
         
@@ -4122,48 +4744,83 @@ class DB( HydrusDB.HydrusDB ):
         
         if len( tags_to_include ) > 0 or len( namespaces_to_include ) > 0 or len( wildcards_to_include ) > 0:
             
-            query_hash_ids = None
+            # we estimate how many files each tag has from the autocomplete counts and do the rarest first
+            # every predicate after that only has to check the files we already have, which we give to sqlite as a temp table
+            # namespaces and wildcards have no cheap estimate, so they go last
+            
+            include_jobs = []
             
-            if len( tags_to_include ) > 0:
+            for tag in tags_to_include:
                 
-                query_hash_ids = HydrusData.IntelligentMassIntersect( ( self._GetHashIdsFromTag( file_service_key, tag_service_key, tag, include_current_tags, include_pending_tags ) for tag in tags_to_include ) )
+                estimate = self._GetTagCountEstimate( file_service_key, tag_service_key, tag, include_current_tags, include_pending_tags )
+                
+                include_jobs.append( ( estimate, 'tag "' + tag + '"', self._GetHashIdsFromTag, tag ) )
                 
             
-            if len( namespaces_to_include ) > 0:
+            for namespace in namespaces_to_include:
+                
+                include_jobs.append( ( None, 'namespace "' + namespace + '"', self._GetHashIdsFromNamespace, namespace ) )
                 
-                namespace_query_hash_ids = HydrusData.IntelligentMassIntersect( ( self._GetHashIdsFromNamespace( file_service_key, tag_service_key, namespace, include_current_tags, include_pending_tags ) for namespace in namespaces_to_include ) )
+            
+            for wildcard in wildcards_to_include:
                 
-                if query_hash_ids is None: query_hash_ids = namespace_query_hash_ids
-                else: query_hash_ids.intersection_update( namespace_query_hash_ids )
+                include_jobs.append( ( None, 'wildcard "' + wildcard + '"', self._GetHashIdsFromWildcard, wildcard ) )
                 
             
-            if len( wildcards_to_include ) > 0:
+            include_jobs.sort( key = lambda ( estimate, description, func, search_term ): ( estimate is None, estimate ) )
+            
+            if hash_ids_to_check is None:
                 
-                wildcard_query_hash_ids = HydrusData.IntelligentMassIntersect( ( self._GetHashIdsFromWildcard( file_service_key, tag_service_key, wildcard, include_current_tags, include_pending_tags ) for wildcard in wildcards_to_include ) )
+                query_hash_ids = None
+                
+            else:
                 
-                if query_hash_ids is None: query_hash_ids = wildcard_query_hash_ids
-                else: query_hash_ids.intersection_update( wildcard_query_hash_ids )
+                query_hash_ids = set( hash_ids_to_check )
                 
             
-            if len( files_info_predicates ) > 0:
+            
+            for ( estimate, description, func, search_term ) in include_jobs:
                 
-                if file_service_key == CC.COMBINED_FILE_SERVICE_KEY:
+                if query_hash_ids is None:
+                    
+                    query_hash_ids = func( file_service_key, tag_service_key, search_term, include_current_tags, include_pending_tags )
+                    
+                elif len( query_hash_ids ) == 0:
                     
-                    query_hash_ids.intersection_update( self._STI( self._c.execute( 'SELECT hash_id FROM files_info WHERE ' + ' AND '.join( files_info_predicates ) + ';' ) ) )
+                    break
+                    
+                elif estimate is None or len( query_hash_ids ) < estimate:
+                    
+                    with HydrusDB.TemporaryIntegerTable( self._c, query_hash_ids, 'hash_id' ) as temp_table_name:
+                        
+                        query_hash_ids = func( file_service_key, tag_service_key, search_term, include_current_tags, include_pending_tags, hash_ids_table_name = temp_table_name )
+                        
                     
                 else:
                     
-                    files_info_predicates.insert( 0, 'service_id = ' + str( file_service_id ) )
+                    query_hash_ids.intersection_update( func( file_service_key, tag_service_key, search_term, include_current_tags, include_pending_tags ) )
+                    
+                
+                if estimate is not None:
                     
-                    query_hash_ids.intersection_update( self._STI( self._c.execute( 'SELECT hash_id FROM current_files NATURAL JOIN files_info WHERE ' + ' AND '.join( files_info_predicates ) + ';' ) ) )
+                    description += ' (estimated ' + HydrusData.ConvertIntToPrettyString( estimate ) + ')'
                     
                 
+                report_step( description, query_hash_ids )
+                
+            
+            if len( files_info_predicates ) > 0:
+                
+                query_hash_ids = self._GetHashIdsFromFilesInfoPredicates( file_service_key, files_info_predicates, hash_ids = query_hash_ids )
+                
+                report_step( 'file info', query_hash_ids )
+                
             
         else:
             
             if file_service_key == CC.COMBINED_FILE_SERVICE_KEY:
                 
-                query_hash_ids = self._GetHashIdsThatHaveTags( tag_service_key, include_current_tags, include_pending_tags )
+                query_hash_ids = self._GetHashIdsThatHaveTags( tag_service_key, include_current_tags, include_pending_tags, hash_ids_to_check )
                 
             else:
                 
@@ -4179,7 +4836,7 @@ class DB( HydrusDB.HydrusDB ):
                         
                     
                 
-                can_ratings_optimise = len( files_info_predicates ) == 0 and good_rating_pred is not None
+                can_ratings_optimise = len( files_info_predicates ) == 0 and good_rating_pred is not None and hash_ids_to_check is None
                 
                 if can_ratings_optimise:
                     
@@ -4224,19 +4881,21 @@ class DB( HydrusDB.HydrusDB ):
                     
                 else:
                     
-                    files_info_predicates.insert( 0, 'service_id = ' + str( file_service_id ) )
-                    
-                    query_hash_ids = self._STS( self._c.execute( 'SELECT hash_id FROM current_files NATURAL JOIN files_info WHERE ' + ' AND '.join( files_info_predicates ) + ';' ) )
+                    query_hash_ids = self._GetHashIdsFromFilesInfoPredicates( file_service_key, files_info_predicates, hash_ids = hash_ids_to_check )
                     
                 
             
+            report_step( 'file domain', query_hash_ids )
+            
         
         if file_service_key == CC.COMBINED_LOCAL_FILE_SERVICE_KEY:
             
-            repo_update_hash_ids = self._STS( self._c.execute( 'SELECT hash_id FROM current_files NATURAL JOIN files_info WHERE service_id = ?;', ( self._local_update_service_id, ) ) )
+            repo_update_hash_ids = get_hash_ids_from_table( 'current_files NATURAL JOIN files_info', 'service_id = ?', ( self._local_update_service_id, ) )
             
             query_hash_ids.difference_update( repo_update_hash_ids )
             
+            report_step( 'repository updates', query_hash_ids )
+            
         
         #
         
@@ -4250,6 +4909,8 @@ class DB( HydrusDB.HydrusDB ):
             
             query_hash_ids.intersection_update( similar_hash_ids )
             
+            report_step( 'similar to', query_hash_ids )
+            
         
         #
         
@@ -4257,21 +4918,26 @@ class DB( HydrusDB.HydrusDB ):
         
         for tag in tags_to_exclude:
             
-            exclude_query_hash_ids.update( self._GetHashIdsFromTag( file_service_key, tag_service_key, tag, include_current_tags, include_pending_tags ) )
+            exclude_query_hash_ids.update( get_hash_ids_from_func( self._GetHashIdsFromTag, file_service_key, tag_service_key, tag, include_current_tags, include_pending_tags ) )
             
         
         for namespace in namespaces_to_exclude:
             
-            exclude_query_hash_ids.update( self._GetHashIdsFromNamespace( file_service_key, tag_service_key, namespace, include_current_tags, include_pending_tags ) )
+            exclude_query_hash_ids.update( get_hash_ids_from_func( self._GetHashIdsFromNamespace, file_service_key, tag_service_key, namespace, include_current_tags, include_pending_tags ) )
             
         
         for wildcard in wildcards_to_exclude:
             
-            exclude_query_hash_ids.update( self._GetHashIdsFromWildcard( file_service_key, tag_service_key, wildcard, include_current_tags, include_pending_tags ) )
+            exclude_query_hash_ids.update( get_hash_ids_from_func( self._GetHashIdsFromWildcard, file_service_key, tag_service_key, wildcard, include_current_tags, include_pending_tags ) )
             
         
         query_hash_ids.difference_update( exclude_query_hash_ids )
         
+        if len( tags_to_exclude ) > 0 or len( namespaces_to_exclude ) > 0 or len( wildcards_to_exclude ) > 0:
+            
+            report_step( 'excluded tags', query_hash_ids )
+            
+        
         #
         
         ( file_services_to_include_current, file_services_to_include_pending, file_services_to_exclude_current, file_services_to_exclude_pending ) = system_predicates.GetFileServiceInfo()
@@ -4280,28 +4946,33 @@ class DB( HydrusDB.HydrusDB ):
             
             service_id = self._GetServiceId( service_key )
             
-            query_hash_ids.intersection_update( [ hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM current_files WHERE service_id = ?;', ( service_id, ) ) ] )
+            query_hash_ids.intersection_update( get_hash_ids_from_table( 'current_files', 'service_id = ?', ( service_id, ) ) )
             
         
         for service_key in file_services_to_include_pending:
             
             service_id = self._GetServiceId( service_key )
             
-            query_hash_ids.intersection_update( [ hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM file_transfers WHERE service_id = ?;', ( service_id, ) ) ] )
+            query_hash_ids.intersection_update( get_hash_ids_from_table( 'file_transfers', 'service_id = ?', ( service_id, ) ) )
             
         
         for service_key in file_services_to_exclude_current:
             
             service_id = self._GetServiceId( service_key )
             
-            query_hash_ids.difference_update( [ hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM current_files WHERE service_id = ?;', ( service_id, ) ) ] )
+            query_hash_ids.difference_update( get_hash_ids_from_table( 'current_files', 'service_id = ?', ( service_id, ) ) )
             
         
         for service_key in file_services_to_exclude_pending:
             
             service_id = self._GetServiceId( service_key )
             
-            query_hash_ids.difference_update( [ hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM file_transfers WHERE service_id = ?;', ( service_id, ) ) ] )
+            query_hash_ids.difference_update( get_hash_ids_from_table( 'file_transfers', 'service_id = ?', ( service_id, ) ) )
+            
+        
+        if len( file_services_to_include_current ) + len( file_services_to_include_pending ) + len( file_services_to_exclude_current ) + len( file_services_to_exclude_pending ) > 0:
+            
+            report_step( 'file services', query_hash_ids )
             
         
         for ( operator, value, service_key ) in system_predicates.GetRatingsPredicates():
@@ -4310,11 +4981,11 @@ class DB( HydrusDB.HydrusDB ):
             
             if value == 'rated':
                 
-                query_hash_ids.intersection_update( [ hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM local_ratings WHERE service_id = ?;', ( service_id, ) ) ] )
+                query_hash_ids.intersection_update( get_hash_ids_from_table( 'local_ratings', 'service_id = ?', ( service_id, ) ) )
                 
             elif value == 'not rated':
                 
-                query_hash_ids.difference_update( [ hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM local_ratings WHERE service_id = ?;', ( service_id, ) ) ] )
+                query_hash_ids.difference_update( get_hash_ids_from_table( 'local_ratings', 'service_id = ?', ( service_id, ) ) )
                 
             else:
                 
@@ -4342,9 +5013,11 @@ class DB( HydrusDB.HydrusDB ):
                     predicate = str( value * 0.995 ) + ' <= rating AND rating <= ' + str( value * 1.005 )
                     
                 
-                query_hash_ids.intersection_update( [ hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM local_ratings WHERE service_id = ? AND ' + predicate + ';', ( service_id, ) ) ] )
+                query_hash_ids.intersection_update( get_hash_ids_from_table( 'local_ratings', 'service_id = ? AND ' + predicate, ( service_id, ) ) )
                 
             
+            report_step( 'rating', query_hash_ids )
+            
         
         for ( operator, num_relationships, dupe_type ) in system_predicates.GetDuplicateRelationshipsPredicates():
             
@@ -4353,17 +5026,17 @@ class DB( HydrusDB.HydrusDB ):
             
             if only_do_zero:
                 
-                nonzero_hash_ids = self._CacheSimilarFilesGetHashIdsFromDuplicatePredicate( file_service_key, '>', 0, dupe_type )
+                nonzero_hash_ids = get_hash_ids_from_func( self._CacheSimilarFilesGetHashIdsFromDuplicatePredicate, file_service_key, '>', 0, dupe_type )
                 
                 query_hash_ids.difference_update( nonzero_hash_ids )
                 
             elif include_zero:
                 
-                nonzero_hash_ids = self._CacheSimilarFilesGetHashIdsFromDuplicatePredicate( file_service_key, '>', 0, dupe_type )
+                nonzero_hash_ids = get_hash_ids_from_func( self._CacheSimilarFilesGetHashIdsFromDuplicatePredicate, file_service_key, '>', 0, dupe_type )
                 
                 zero_hash_ids = query_hash_ids.difference( nonzero_hash_ids )
                 
-                accurate_except_zero_hash_ids = self._CacheSimilarFilesGetHashIdsFromDuplicatePredicate( file_service_key, operator, num_relationships, dupe_type )
+                accurate_except_zero_hash_ids = get_hash_ids_from_func( self._CacheSimilarFilesGetHashIdsFromDuplicatePredicate, file_service_key, operator, num_relationships, dupe_type )
                 
                 hash_ids = zero_hash_ids.union( accurate_except_zero_hash_ids )
                 
@@ -4371,9 +5044,11 @@ class DB( HydrusDB.HydrusDB ):
                 
             else:
                 
-                query_hash_ids.intersection_update( self._CacheSimilarFilesGetHashIdsFromDuplicatePredicate( file_service_key, operator, num_relationships, dupe_type ) )
+                query_hash_ids.intersection_update( get_hash_ids_from_func( self._CacheSimilarFilesGetHashIdsFromDuplicatePredicate, file_service_key, operator, num_relationships, dupe_type ) )
                 
             
+            report_step( 'duplicate relationships', query_hash_ids )
+            
         
         #
         
@@ -4391,7 +5066,7 @@ class DB( HydrusDB.HydrusDB ):
             
         elif must_be_local or must_not_be_local:
             
-            local_hash_ids = self._STL( self._c.execute( 'SELECT hash_id FROM current_files WHERE service_id = ?;', ( self._combined_local_file_service_id, ) ) )
+            local_hash_ids = get_hash_ids_from_table( 'current_files', 'service_id = ?', ( self._combined_local_file_service_id, ) )
             
             if must_be_local:
                 
@@ -4412,6 +5087,11 @@ class DB( HydrusDB.HydrusDB ):
             query_hash_ids.difference_update( self._inbox_hash_ids )
             
         
+        if must_be_local or must_not_be_local or must_be_inbox or must_be_archive:
+            
+            report_step( 'local/inbox', query_hash_ids )
+            
+        
         #
         
         num_tags_zero = False
@@ -4493,13 +5173,18 @@ class DB( HydrusDB.HydrusDB ):
             query_hash_ids.intersection_update( good_tag_count_hash_ids )
             
         
+        if num_tags_zero or num_tags_nonzero or len( tag_predicates ) > 0:
+            
+            report_step( 'number of tags', query_hash_ids )
+            
+        
         #
         
         if 'min_tag_as_number' in simple_preds:
             
             ( namespace, num ) = simple_preds[ 'min_tag_as_number' ]
             
-            good_hash_ids = self._GetHashIdsThatHaveTagAsNum( file_service_key, tag_service_key, namespace, num, '>', include_current_tags, include_pending_tags )
+            good_hash_ids = get_hash_ids_from_func( self._GetHashIdsThatHaveTagAsNum, file_service_key, tag_service_key, namespace, num, '>', include_current_tags, include_pending_tags )
             
             query_hash_ids.intersection_update( good_hash_ids )
             
@@ -4508,16 +5193,21 @@ class DB( HydrusDB.HydrusDB ):
             
             ( namespace, num ) = simple_preds[ 'max_tag_as_number' ]
             
-            good_hash_ids = self._GetHashIdsThatHaveTagAsNum( file_service_key, tag_service_key, namespace, num, '<', include_current_tags, include_pending_tags )
+            good_hash_ids = get_hash_ids_from_func( self._GetHashIdsThatHaveTagAsNum, file_service_key, tag_service_key, namespace, num, '<', include_current_tags, include_pending_tags )
             
             query_hash_ids.intersection_update( good_hash_ids )
             
         
+        if 'min_tag_as_number' in simple_preds or 'max_tag_as_number' in simple_preds:
+            
+            report_step( 'tag as number', query_hash_ids )
+            
+        
         #
         
         limit = system_predicates.GetLimit()
         
-        if limit is not None and limit <= len( query_hash_ids ):
+        if limit is not None and limit <= len( query_hash_ids ) and hash_ids_to_check is None:
             
             query_hash_ids = random.sample( query_hash_ids, limit )
             
@@ -4526,10 +5216,24 @@ class DB( HydrusDB.HydrusDB ):
             query_hash_ids = list( query_hash_ids )
             
         
+        if HG.db_report_mode and hash_ids_to_check is None:
+            
+            total_time = HydrusData.GetNowPrecise() - step_times[ 0 ]
+            
+            message = 'File search found ' + HydrusData.ConvertIntToPrettyString( len( query_hash_ids ) ) + ' files in ' + HydrusData.ConvertTimeDeltaToPrettyString( total_time ) + ':'
+            
+            for ( description, time_took, num_hash_ids ) in report_rows:
+                
+                message += os.linesep + description + ': ' + HydrusData.ConvertIntToPrettyString( num_hash_ids ) + ' files after ' + HydrusData.ConvertTimeDeltaToPrettyString( time_took )
+                
+            
+            HydrusData.ShowText( message )
+            
+        
         return query_hash_ids
         
     
-    def _GetHashIdsFromSubtagIds( self, file_service_key, tag_service_key, subtag_ids, include_current_tags, include_pending_tags ):
+    def _GetHashIdsFromSubtagIds( self, file_service_key, tag_service_key, subtag_ids, include_current_tags, include_pending_tags, hash_ids_table_name = None ):
         
         file_service_id = self._GetServiceId( file_service_key )
         
@@ -4551,40 +5255,22 @@ class DB( HydrusDB.HydrusDB ):
                 
                 ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateMappingsTableNames( search_tag_service_id )
                 
-                current_selects.append( 'SELECT hash_id FROM ' + current_mappings_table_name + ' NATURAL JOIN tags WHERE subtag_id IN ' + HydrusData.SplayListForDB( subtag_ids ) + ';' )
-                pending_selects.append( 'SELECT hash_id FROM ' + pending_mappings_table_name + ' NATURAL JOIN tags WHERE subtag_id IN ' + HydrusData.SplayListForDB( subtag_ids ) + ';' )
+                current_selects.append( ( current_mappings_table_name, 'subtag_id IN ' + HydrusData.SplayListForDB( subtag_ids ) ) )
+                pending_selects.append( ( pending_mappings_table_name, 'subtag_id IN ' + HydrusData.SplayListForDB( subtag_ids ) ) )
                 
             else:
                 
                 ( cache_files_table_name, cache_current_mappings_table_name, cache_deleted_mappings_table_name, cache_pending_mappings_table_name, ac_cache_table_name ) = GenerateSpecificMappingsCacheTableNames( file_service_id, search_tag_service_id )
                 
-                current_selects.append( 'SELECT hash_id FROM ' + cache_current_mappings_table_name + ' NATURAL JOIN tags WHERE subtag_id IN ' + HydrusData.SplayListForDB( subtag_ids ) + ';' )
-                pending_selects.append( 'SELECT hash_id FROM ' + cache_pending_mappings_table_name + ' NATURAL JOIN tags WHERE subtag_id IN ' + HydrusData.SplayListForDB( subtag_ids ) + ';' )
-                
-            
-        
-        hash_ids = set()
-        
-        if include_current_tags:
-            
-            for current_select in current_selects:
-                
-                hash_ids.update( ( id for ( id, ) in self._c.execute( current_select ) ) )
-                
-            
-        
-        if include_pending_tags:
-            
-            for pending_select in pending_selects:
-                
-                hash_ids.update( ( id for ( id, ) in self._c.execute( pending_select ) ) )
+                current_selects.append( ( cache_current_mappings_table_name, 'subtag_id IN ' + HydrusData.SplayListForDB( subtag_ids ) ) )
+                pending_selects.append( ( cache_pending_mappings_table_name, 'subtag_id IN ' + HydrusData.SplayListForDB( subtag_ids ) ) )
                 
             
         
-        return hash_ids
+        return self._GetHashIdsFromMappingsPredicates( current_selects, pending_selects, include_current_tags, include_pending_tags, hash_ids_table_name = hash_ids_table_name )
         
     
-    def _GetHashIdsFromTag( self, file_service_key, tag_service_key, tag, include_current_tags, include_pending_tags ):
+    def _GetHashIdsFromTag( self, file_service_key, tag_service_key, tag, include_current_tags, include_pending_tags, hash_ids_table_name = None ):
         
         siblings_manager = self._controller.GetManager( 'tag_siblings' )
         
@@ -4601,13 +5287,11 @@ class DB( HydrusDB.HydrusDB ):
             search_tag_service_ids = [ self._GetServiceId( tag_service_key ) ]
             
         
-        hash_ids = set()
+        current_selects = []
+        pending_selects = []
         
         for tag in tags:
             
-            current_selects = []
-            pending_selects = []
-            
             ( namespace, subtag ) = HydrusTags.SplitTag( tag )
             
             if namespace != '':
@@ -4626,15 +5310,15 @@ class DB( HydrusDB.HydrusDB ):
                         
                         ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateMappingsTableNames( search_tag_service_id )
                         
-                        current_selects.append( 'SELECT hash_id FROM ' + current_mappings_table_name + ' NATURAL JOIN tags WHERE namespace_id = ' + str( namespace_id ) + ' AND subtag_id = ' + str( subtag_id ) + ';' )
-                        pending_selects.append( 'SELECT hash_id FROM ' + pending_mappings_table_name + ' NATURAL JOIN tags WHERE namespace_id = ' + str( namespace_id ) + ' AND subtag_id = ' + str( subtag_id ) + ';' )
+                        current_selects.append( ( current_mappings_table_name, 'namespace_id = ' + str( namespace_id ) + ' AND subtag_id = ' + str( subtag_id ) ) )
+                        pending_selects.append( ( pending_mappings_table_name, 'namespace_id = ' + str( namespace_id ) + ' AND subtag_id = ' + str( subtag_id ) ) )
                         
                     else:
                         
                         ( cache_files_table_name, cache_current_mappings_table_name, cache_deleted_mappings_table_name, cache_pending_mappings_table_name, ac_cache_table_name ) = GenerateSpecificMappingsCacheTableNames( file_service_id, search_tag_service_id )
                         
-                        current_selects.append( 'SELECT hash_id FROM ' + cache_current_mappings_table_name + ' NATURAL JOIN tags WHERE namespace_id = ' + str( namespace_id ) + ' AND subtag_id = ' + str( subtag_id ) + ';' )
-                        pending_selects.append( 'SELECT hash_id FROM ' + cache_pending_mappings_table_name + ' NATURAL JOIN tags WHERE namespace_id = ' + str( namespace_id ) + ' AND subtag_id = ' + str( subtag_id ) + ';' )
+                        current_selects.append( ( cache_current_mappings_table_name, 'namespace_id = ' + str( namespace_id ) + ' AND subtag_id = ' + str( subtag_id ) ) )
+                        pending_selects.append( ( cache_pending_mappings_table_name, 'namespace_id = ' + str( namespace_id ) + ' AND subtag_id = ' + str( subtag_id ) ) )
                         
                     
                 
@@ -4653,40 +5337,24 @@ class DB( HydrusDB.HydrusDB ):
                         
                         ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateMappingsTableNames( search_tag_service_id )
                         
-                        current_selects.append( 'SELECT hash_id FROM ' + current_mappings_table_name + ' NATURAL JOIN tags WHERE subtag_id = ' + str( subtag_id ) + ';' )
-                        pending_selects.append( 'SELECT hash_id FROM ' + pending_mappings_table_name + ' NATURAL JOIN tags WHERE subtag_id = ' + str( subtag_id ) + ';' )
+                        current_selects.append( ( current_mappings_table_name, 'subtag_id = ' + str( subtag_id ) ) )
+                        pending_selects.append( ( pending_mappings_table_name, 'subtag_id = ' + str( subtag_id ) ) )
                         
                     else:
                         
                         ( cache_files_table_name, cache_current_mappings_table_name, cache_deleted_mappings_table_name, cache_pending_mappings_table_name, ac_cache_table_name ) = GenerateSpecificMappingsCacheTableNames( file_service_id, search_tag_service_id )
                         
-                        current_selects.append( 'SELECT hash_id FROM ' + cache_current_mappings_table_name + ' NATURAL JOIN tags WHERE subtag_id = ' + str( subtag_id ) + ';' )
-                        pending_selects.append( 'SELECT hash_id FROM ' + cache_pending_mappings_table_name + ' NATURAL JOIN tags WHERE subtag_id = ' + str( subtag_id ) + ';' )
+                        current_selects.append( ( cache_current_mappings_table_name, 'subtag_id = ' + str( subtag_id ) ) )
+                        pending_selects.append( ( cache_pending_mappings_table_name, 'subtag_id = ' + str( subtag_id ) ) )
                         
                     
                 
             
-            if include_current_tags:
-                
-                for current_select in current_selects:
-                    
-                    hash_ids.update( ( id for ( id, ) in self._c.execute( current_select ) ) )
-                    
-                
-            
-            if include_pending_tags:
-                
-                for pending_select in pending_selects:
-                    
-                    hash_ids.update( ( id for ( id, ) in self._c.execute( pending_select ) ) )
-                    
-                
-            
         
-        return hash_ids
+        return self._GetHashIdsFromMappingsPredicates( current_selects, pending_selects, include_current_tags, include_pending_tags, hash_ids_table_name = hash_ids_table_name )
         
     
-    def _GetHashIdsFromWildcard( self, file_service_key, tag_service_key, wildcard, include_current_tags, include_pending_tags ):
+    def _GetHashIdsFromWildcard( self, file_service_key, tag_service_key, wildcard, include_current_tags, include_pending_tags, hash_ids_table_name = None ):
         
         def GetNamespaceIdsFromWildcard( w ):
             
@@ -4742,11 +5410,11 @@ class DB( HydrusDB.HydrusDB ):
             
             possible_namespace_ids = GetNamespaceIdsFromWildcard( namespace_wildcard )
             
-            return self._GetHashIdsFromNamespaceIdsSubtagIds( file_service_key, tag_service_key, possible_namespace_ids, possible_subtag_ids, include_current_tags, include_pending_tags )
+            return self._GetHashIdsFromNamespaceIdsSubtagIds( file_service_key, tag_service_key, possible_namespace_ids, possible_subtag_ids, include_current_tags, include_pending_tags, hash_ids_table_name = hash_ids_table_name )
             
         else:
             
-            return self._GetHashIdsFromSubtagIds( file_service_key, tag_service_key, possible_subtag_ids, include_current_tags, include_pending_tags )
+            return self._GetHashIdsFromSubtagIds( file_service_key, tag_service_key, possible_subtag_ids, include_current_tags, include_pending_tags, hash_ids_table_name = hash_ids_table_name )
             
         
     
@@ -4873,13 +5541,13 @@ class DB( HydrusDB.HydrusDB ):
         return nonzero_tag_hash_ids
         
     
-    def _GetHashIdsThatHaveTagAsNum( self, file_service_key, tag_service_key, namespace, num, operator, include_current_tags, include_pending_tags ):
+    def _GetHashIdsThatHaveTagAsNum( self, file_service_key, tag_service_key, namespace, num, operator, include_current_tags, include_pending_tags, hash_ids_table_name = None ):
         
         possible_subtag_ids = self._STS( self._c.execute( 'SELECT subtag_id FROM integer_subtags WHERE integer_subtag ' + operator + ' ' + str( num ) + ';' ) )
         
         if namespace == '':
             
-            return self._GetHashIdsFromSubtagIds( file_service_key, tag_service_key, possible_subtag_ids, include_current_tags, include_pending_tags )
+            return self._GetHashIdsFromSubtagIds( file_service_key, tag_service_key, possible_subtag_ids, include_current_tags, include_pending_tags, hash_ids_table_name = hash_ids_table_name )
             
         else:
             
@@ -4887,7 +5555,7 @@ class DB( HydrusDB.HydrusDB ):
             
             possible_namespace_ids = { namespace_id }
             
-            return self._GetHashIdsFromNamespaceIdsSubtagIds( file_service_key, tag_service_key, possible_namespace_ids, possible_subtag_ids, include_current_tags, include_pending_tags )
+            return self._GetHashIdsFromNamespaceIdsSubtagIds( file_service_key, tag_service_key, possible_namespace_ids, possible_subtag_ids, include_current_tags, include_pending_tags, hash_ids_table_name = hash_ids_table_name )
             
         
     
@@ -5073,162 +5741,36 @@ class DB( HydrusDB.HydrusDB ):
     
     def _GetMediaResults( self, hash_ids ):
         
-        # get first detailed results
-        
-        hash_ids_to_hashes = self._GetHashIdsToHashes( hash_ids )
-        
-        hash_ids_to_info = { hash_id : ClientMedia.FileInfoManager( hash_ids_to_hashes[ hash_id ], size, mime, width, height, duration, num_frames, num_words ) for ( hash_id, size, mime, width, height, duration, num_frames, num_words ) in self._SelectFromList( 'SELECT * FROM files_info WHERE hash_id IN %s;', hash_ids ) }
-        
-        hash_ids_to_current_file_service_ids_and_timestamps = HydrusData.BuildKeyToListDict( ( ( hash_id, ( service_id, timestamp ) ) for ( hash_id, service_id, timestamp ) in self._SelectFromList( 'SELECT hash_id, service_id, timestamp FROM current_files WHERE hash_id IN %s;', hash_ids ) ) )
-        
-        hash_ids_to_deleted_file_service_ids = HydrusData.BuildKeyToListDict( self._SelectFromList( 'SELECT hash_id, service_id FROM deleted_files WHERE hash_id IN %s;', hash_ids ) )
-        
-        hash_ids_to_pending_file_service_ids = HydrusData.BuildKeyToListDict( self._SelectFromList( 'SELECT hash_id, service_id FROM file_transfers WHERE hash_id IN %s;', hash_ids ) )
-        
-        hash_ids_to_petitioned_file_service_ids = HydrusData.BuildKeyToListDict( self._SelectFromList( 'SELECT hash_id, service_id FROM file_petitions WHERE hash_id IN %s;', hash_ids ) )
-        
-        hash_ids_to_urls = HydrusData.BuildKeyToSetDict( self._SelectFromList( 'SELECT hash_id, url FROM urls WHERE hash_id IN %s;', hash_ids ) )
-        
-        hash_ids_to_service_ids_and_filenames = HydrusData.BuildKeyToListDict( ( ( hash_id, ( service_id, filename ) ) for ( hash_id, service_id, filename ) in self._SelectFromList( 'SELECT hash_id, service_id, filename FROM service_filenames WHERE hash_id IN %s;', hash_ids ) ) )
-        
-        hash_ids_to_local_ratings = HydrusData.BuildKeyToListDict( ( ( hash_id, ( service_id, rating ) ) for ( service_id, hash_id, rating ) in self._SelectFromList( 'SELECT service_id, hash_id, rating FROM local_ratings WHERE hash_id IN %s;', hash_ids ) ) )
-        
-        #
-        
-        # Let's figure out if there is a common specific file service to this batch
-        
-        file_service_id_counter = collections.Counter()
-        
-        for file_service_ids_and_timestamps in hash_ids_to_current_file_service_ids_and_timestamps.values():
-            
-            for ( file_service_id, timestamp ) in file_service_ids_and_timestamps:
-                
-                file_service_id_counter[ file_service_id ] += 1
-                
-            
-        
-        common_file_service_id = None
-        
-        for ( file_service_id, count ) in file_service_id_counter.items():
-            
-            if count == len( hash_ids ): # i.e. every hash has this file service
-                
-                ( file_service_type, ) = self._c.execute( 'SELECT service_type FROM services WHERE service_id = ?;', ( file_service_id, ) ).fetchone()
-                
-                if file_service_type in HC.AUTOCOMPLETE_CACHE_SPECIFIC_FILE_SERVICES:
-                    
-                    common_file_service_id = file_service_id
-                    
-                    break
-                    
-                
-            
-        
-        #
+        # anything a page or the media viewer is still holding on to can be handed straight back
         
-        tag_data = []
+        hash_ids_to_media_results = {}
         
-        tag_service_ids = self._GetServiceIds( HC.TAG_SERVICES )
+        uncached_hash_ids = set()
         
-        for tag_service_id in tag_service_ids:
+        for hash_id in hash_ids:
             
-            ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateMappingsTableNames( tag_service_id )
+            media_result = self._media_result_cache.get( hash_id, None )
             
-            if common_file_service_id is None:
+            if media_result is None:
                 
-                tag_data.extend( ( hash_id, ( tag_service_id, HC.CONTENT_STATUS_CURRENT, tag_id ) ) for ( hash_id, tag_id ) in self._SelectFromList( 'SELECT hash_id, tag_id FROM ' + current_mappings_table_name + ' WHERE hash_id IN %s;', hash_ids ) )
-                tag_data.extend( ( hash_id, ( tag_service_id, HC.CONTENT_STATUS_DELETED, tag_id ) ) for ( hash_id, tag_id ) in self._SelectFromList( 'SELECT hash_id, tag_id FROM ' + deleted_mappings_table_name + ' WHERE hash_id IN %s;', hash_ids ) )
-                tag_data.extend( ( hash_id, ( tag_service_id, HC.CONTENT_STATUS_PENDING, tag_id ) ) for ( hash_id, tag_id ) in self._SelectFromList( 'SELECT hash_id, tag_id FROM ' + pending_mappings_table_name + ' WHERE hash_id IN %s;', hash_ids ) )
+                uncached_hash_ids.add( hash_id )
                 
             else:
                 
-                ( cache_files_table_name, cache_current_mappings_table_name, cache_deleted_mappings_table_name, cache_pending_mappings_table_name, ac_cache_table_name ) = GenerateSpecificMappingsCacheTableNames( common_file_service_id, tag_service_id )
-                
-                tag_data.extend( ( hash_id, ( tag_service_id, HC.CONTENT_STATUS_CURRENT, tag_id ) ) for ( hash_id, tag_id ) in self._SelectFromList( 'SELECT hash_id, tag_id FROM ' + cache_current_mappings_table_name + ' WHERE hash_id IN %s;', hash_ids ) )
-                tag_data.extend( ( hash_id, ( tag_service_id, HC.CONTENT_STATUS_DELETED, tag_id ) ) for ( hash_id, tag_id ) in self._SelectFromList( 'SELECT hash_id, tag_id FROM ' + cache_deleted_mappings_table_name + ' WHERE hash_id IN %s;', hash_ids ) )
-                tag_data.extend( ( hash_id, ( tag_service_id, HC.CONTENT_STATUS_PENDING, tag_id ) ) for ( hash_id, tag_id ) in self._SelectFromList( 'SELECT hash_id, tag_id FROM ' + cache_pending_mappings_table_name + ' WHERE hash_id IN %s;', hash_ids ) )
+                hash_ids_to_media_results[ hash_id ] = media_result
                 
             
-            tag_data.extend( ( hash_id, ( tag_service_id, HC.CONTENT_STATUS_PETITIONED, tag_id ) ) for ( hash_id, tag_id ) in self._SelectFromList( 'SELECT hash_id, tag_id FROM ' + petitioned_mappings_table_name + ' WHERE hash_id IN %s;', hash_ids ) )
-            
-        
-        seen_tag_ids = { tag_id for ( hash_id, ( tag_service_id, status, tag_id ) ) in tag_data }
-        
-        hash_ids_to_raw_tag_data = HydrusData.BuildKeyToListDict( tag_data )
-        
-        tag_ids_to_tags = self._GetTagIdsToTags( seen_tag_ids )
-        
-        # build it
-        
-        service_ids_to_service_keys = { service_id : service_key for ( service_id, service_key ) in self._c.execute( 'SELECT service_id, service_key FROM services;' ) }
-        
-        media_results = []
-        
-        tag_censorship_manager = self._controller.GetManager( 'tag_censorship' )
         
-        for hash_id in hash_ids:
-            
-            hash = hash_ids_to_hashes[ hash_id ]
-            
-            #
-            
-            # service_id, status, tag_id
-            raw_tag_data = hash_ids_to_raw_tag_data[ hash_id ]
-            
-            # service_id -> ( status, tag )
-            service_ids_to_tag_data = HydrusData.BuildKeyToListDict( ( ( tag_service_id, ( status, tag_ids_to_tags[ tag_id ] ) ) for ( tag_service_id, status, tag_id ) in raw_tag_data ) )
-            
-            service_keys_to_statuses_to_tags = collections.defaultdict( HydrusData.default_dict_set )
-            
-            service_keys_to_statuses_to_tags.update( { service_ids_to_service_keys[ service_id ] : HydrusData.BuildKeyToSetDict( tag_data ) for ( service_id, tag_data ) in service_ids_to_tag_data.items() } )
-            
-            service_keys_to_statuses_to_tags = tag_censorship_manager.FilterServiceKeysToStatusesToTags( service_keys_to_statuses_to_tags )
-            
-            tags_manager = ClientMedia.TagsManager( service_keys_to_statuses_to_tags )
-            
-            #
-            
-            current_file_service_keys = { service_ids_to_service_keys[ service_id ] for ( service_id, timestamp ) in hash_ids_to_current_file_service_ids_and_timestamps[ hash_id ] }
-            
-            deleted_file_service_keys = { service_ids_to_service_keys[ service_id ] for service_id in hash_ids_to_deleted_file_service_ids[ hash_id ] }
-            
-            pending_file_service_keys = { service_ids_to_service_keys[ service_id ] for service_id in hash_ids_to_pending_file_service_ids[ hash_id ] }
-            
-            petitioned_file_service_keys = { service_ids_to_service_keys[ service_id ] for service_id in hash_ids_to_petitioned_file_service_ids[ hash_id ] }
-            
-            inbox = hash_id in self._inbox_hash_ids
-            
-            urls = hash_ids_to_urls[ hash_id ]
-            
-            service_ids_to_filenames = HydrusData.BuildKeyToListDict( hash_ids_to_service_ids_and_filenames[ hash_id ] )
-            
-            service_keys_to_filenames = { service_ids_to_service_keys[ service_id ] : filenames for ( service_id, filenames ) in service_ids_to_filenames.items() }
-            
-            current_file_service_keys_to_timestamps = { service_ids_to_service_keys[ service_id ] : timestamp for ( service_id, timestamp ) in hash_ids_to_current_file_service_ids_and_timestamps[ hash_id ] }
-            
-            locations_manager = ClientMedia.LocationsManager( current_file_service_keys, deleted_file_service_keys, pending_file_service_keys, petitioned_file_service_keys, inbox, urls, service_keys_to_filenames, current_to_timestamps = current_file_service_keys_to_timestamps )
-            
-            #
-            
-            local_ratings = { service_ids_to_service_keys[ service_id ] : rating for ( service_id, rating ) in hash_ids_to_local_ratings[ hash_id ] }
-            
-            ratings_manager = ClientRatings.RatingsManager( local_ratings )
+        if len( uncached_hash_ids ) > 0:
             
-            #
+            generated_hash_ids_to_media_results = self._GenerateMediaResults( uncached_hash_ids )
             
-            if hash_id in hash_ids_to_info:
-                
-                file_info_manager = hash_ids_to_info[ hash_id ]
-                
-            else:
-                
-                file_info_manager = ClientMedia.FileInfoManager( hash )
-                
+            self._media_result_cache.update( generated_hash_ids_to_media_results )
             
-            media_results.append( ClientMedia.MediaResult( file_info_manager, tags_manager, locations_manager, ratings_manager ) )
+            hash_ids_to_media_results.update( generated_hash_ids_to_media_results )
             
         
-        return media_results
+        return [ hash_ids_to_media_results[ hash_id ] for hash_id in hash_ids ]
         
     
     def _GetMediaResultsFromHashes( self, hashes ):
@@ -5644,6 +6186,39 @@ class DB( HydrusDB.HydrusDB ):
         return predicates
         
     
+    def _GetRepositoryContentChunkSizer( self, row_name, initial_chunk_size, max_chunk_size ):
+        
+        if row_name not in self._repository_content_chunk_sizers:
+            
+            # start from the speed we last saw, if we have one, so a new session doesn't have to ramp up from the defaults again
+            
+            result = self._c.execute( 'SELECT num_rows, time_took FROM repository_processing_history WHERE row_name = ? ORDER BY timestamp DESC LIMIT 1;', ( row_name, ) ).fetchone()
+            
+            if result is not None:
+                
+                ( num_rows, time_took ) = result
+                
+                if num_rows > 0 and time_took > 0:
+                    
+                    initial_chunk_size = int( ( num_rows / time_took ) * REPOSITORY_CONTENT_CHUNK_TARGET_TIME )
+                    
+                    initial_chunk_size = max( 1, min( initial_chunk_size, max_chunk_size ) )
+                    
+                
+            
+            self._repository_content_chunk_sizers[ row_name ] = HydrusData.AdaptiveChunkSizer( initial_chunk_size, REPOSITORY_CONTENT_CHUNK_TARGET_TIME, max_chunk_size = max_chunk_size )
+            
+        
+        return self._repository_content_chunk_sizers[ row_name ]
+        
+    
+    def _GetRepositoryProcessingHistory( self, service_key ):
+        
+        service_id = self._GetServiceId( service_key )
+        
+        return self._c.execute( 'SELECT timestamp, row_name, num_rows, time_took FROM repository_processing_history WHERE service_id = ? ORDER BY timestamp ASC;', ( service_id, ) ).fetchall()
+        
+    
     def _GetRepositoryProgress( self, service_key ):
         
         service_id = self._GetServiceId( service_key )
@@ -6046,29 +6621,93 @@ class DB( HydrusDB.HydrusDB ):
     
     def _GetTagCensorship( self, service_key = None ):
         
-        if service_key is None:
+        if service_key is None:
+            
+            result = []
+            
+            for ( service_id, blacklist, tags ) in self._c.execute( 'SELECT service_id, blacklist, tags FROM tag_censorship;' ).fetchall():
+                
+                service = self._GetService( service_id )
+                
+                service_key = service.GetServiceKey()
+                
+                result.append( ( service_key, blacklist, tags ) )
+                
+            
+        else:
+            
+            service_id = self._GetServiceId( service_key )
+            
+            result = self._c.execute( 'SELECT blacklist, tags FROM tag_censorship WHERE service_id = ?;', ( service_id, ) ).fetchone()
+            
+            if result is None: result = ( True, [] )
+            
+        
+        return result
+        
+    
+    def _GetTagCountEstimate( self, file_service_key, tag_service_key, tag, include_current_tags, include_pending_tags ):
+        
+        # this matches the tags _GetHashIdsFromTag will search, but reads the autocomplete counts rather than any mappings
+        # it can overcount, since a file can have more than one sibling or namespace, but it is good enough to order a search
+        
+        siblings_manager = self._controller.GetManager( 'tag_siblings' )
+        
+        tags = siblings_manager.GetAllSiblings( tag_service_key, tag )
+        
+        tag_ids = set()
+        
+        for tag in tags:
             
-            result = []
+            ( namespace, subtag ) = HydrusTags.SplitTag( tag )
             
-            for ( service_id, blacklist, tags ) in self._c.execute( 'SELECT service_id, blacklist, tags FROM tag_censorship;' ).fetchall():
+            if namespace != '':
                 
-                service = self._GetService( service_id )
+                if self._TagExists( tag ):
+                    
+                    tag_ids.add( self._GetTagId( tag ) )
+                    
                 
-                service_key = service.GetServiceKey()
+            else:
                 
-                result.append( ( service_key, blacklist, tags ) )
+                if self._SubtagExists( subtag ):
+                    
+                    subtag_id = self._GetSubtagId( subtag )
+                    
+                    tag_ids.update( self._STI( self._c.execute( 'SELECT tag_id FROM tags WHERE subtag_id = ?;', ( subtag_id, ) ) ) )
+                    
                 
             
+        
+        if len( tag_ids ) == 0:
+            
+            return 0
+            
+        
+        file_service_id = self._GetServiceId( file_service_key )
+        
+        if tag_service_key == CC.COMBINED_TAG_SERVICE_KEY:
+            
+            search_tag_service_ids = self._GetServiceIds( HC.TAG_SERVICES )
+            
         else:
             
-            service_id = self._GetServiceId( service_key )
+            search_tag_service_ids = [ self._GetServiceId( tag_service_key ) ]
             
-            result = self._c.execute( 'SELECT blacklist, tags FROM tag_censorship WHERE service_id = ?;', ( service_id, ) ).fetchone()
+        
+        estimate = 0
+        
+        for search_tag_service_id in search_tag_service_ids:
             
-            if result is None: result = ( True, [] )
+            ids_to_count = self._GetAutocompleteCounts( search_tag_service_id, file_service_id, tag_ids, include_current_tags, include_pending_tags )
+            
+            for ( current_min, current_max, pending_min, pending_max ) in ids_to_count.values():
+                
+                estimate += current_min + pending_min
+                
             
         
-        return result
+        return estimate
         
     
     def _GetTagId( self, tag ):
@@ -6376,54 +7015,110 @@ class DB( HydrusDB.HydrusDB ):
     
     def _ImportFile( self, file_import_job ):
         
-        hash = file_import_job.GetHash()
+        ( status, ) = self._ImportFiles( ( file_import_job, ) )
         
-        hash_id = self._GetHashId( hash )
+        return status
+        
+    
+    def _ImportFiles( self, file_import_jobs ):
         
-        ( status, status_hash, note ) = self._GetHashIdStatus( hash_id )
+        # a batch of prepared jobs in one transaction. the row inserts go in together and there is one content update pubsub for the lot
         
-        if status != CC.STATUS_REDUNDANT:
-            
-            ( size, mime, width, height, duration, num_frames, num_words ) = file_import_job.GetFileInfo()
+        hashes = [ file_import_job.GetHash() for file_import_job in file_import_jobs ]
+        
+        self._GetHashIds( hashes )
+        
+        timestamp = HydrusData.GetNow()
+        
+        statuses = []
+        
+        files_info_rows = []
+        local_hashes_rows = []
+        archive_hash_ids = []
+        inbox_hash_ids = []
+        content_updates = []
+        
+        imported_hash_ids = set()
+        
+        for file_import_job in file_import_jobs:
             
-            timestamp = HydrusData.GetNow()
+            hash = file_import_job.GetHash()
             
-            phashes = file_import_job.GetPHashes()
+            hash_id = self._GetHashId( hash )
             
-            if phashes is not None:
+            if hash_id in imported_hash_ids:
                 
-                self._CacheSimilarFilesAssociatePHashes( hash_id, phashes )
+                # the same file turned up twice in this batch
+                
+                status = CC.STATUS_REDUNDANT
+                
+            else:
+                
+                ( status, status_hash, note ) = self._GetHashIdStatus( hash_id )
                 
             
-            self._AddFilesInfo( [ ( hash_id, size, mime, width, height, duration, num_frames, num_words ) ], overwrite = True )
-            
-            self._AddFiles( self._local_file_service_id, [ ( hash_id, timestamp ) ] )
-            
-            file_info_manager = ClientMedia.FileInfoManager( hash, size, mime, width, height, duration, num_frames, num_words )
+            if status != CC.STATUS_REDUNDANT:
+                
+                ( size, mime, width, height, duration, num_frames, num_words ) = file_import_job.GetFileInfo()
+                
+                phashes = file_import_job.GetPHashes()
+                
+                if phashes is not None:
+                    
+                    self._CacheSimilarFilesAssociatePHashes( hash_id, phashes )
+                    
+                
+                files_info_rows.append( ( hash_id, size, mime, width, height, duration, num_frames, num_words ) )
+                
+                file_info_manager = ClientMedia.FileInfoManager( hash, size, mime, width, height, duration, num_frames, num_words )
+                
+                content_updates.append( HydrusData.ContentUpdate( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_ADD, ( file_info_manager, timestamp ) ) )
+                
+                ( md5, sha1, sha512 ) = file_import_job.GetExtraHashes()
+                
+                local_hashes_rows.append( ( hash_id, sqlite3.Binary( md5 ), sqlite3.Binary( sha1 ), sqlite3.Binary( sha512 ) ) )
+                
+                file_import_options = file_import_job.GetFileImportOptions()
+                
+                ( archive, exclude_deleted_files, min_size, min_resolution ) = file_import_options.ToTuple()
+                
+                if archive:
+                    
+                    archive_hash_ids.append( hash_id )
+                    
+                elif hash_id not in self._inbox_hash_ids:
+                    
+                    inbox_hash_ids.append( hash_id )
+                    
+                
+                imported_hash_ids.add( hash_id )
+                
+                status = CC.STATUS_SUCCESSFUL
+                
             
-            content_update = HydrusData.ContentUpdate( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_ADD, ( file_info_manager, timestamp ) )
+            statuses.append( status )
             
-            self.pub_content_updates_after_commit( { CC.LOCAL_FILE_SERVICE_KEY : [ content_update ] } )
+        
+        if len( files_info_rows ) > 0:
             
-            ( md5, sha1, sha512 ) = file_import_job.GetExtraHashes()
+            self._AddFilesInfo( files_info_rows, overwrite = True )
             
-            self._c.execute( 'INSERT OR IGNORE INTO local_hashes ( hash_id, md5, sha1, sha512 ) VALUES ( ?, ?, ?, ? );', ( hash_id, sqlite3.Binary( md5 ), sqlite3.Binary( sha1 ), sqlite3.Binary( sha512 ) ) )
+            self._AddFiles( self._local_file_service_id, [ ( hash_id, timestamp ) for hash_id in imported_hash_ids ] )
             
-            file_import_options = file_import_job.GetFileImportOptions()
+            self.pub_content_updates_after_commit( { CC.LOCAL_FILE_SERVICE_KEY : content_updates } )
             
-            ( archive, exclude_deleted_files, min_size, min_resolution ) = file_import_options.ToTuple()
+            self._c.executemany( 'INSERT OR IGNORE INTO local_hashes ( hash_id, md5, sha1, sha512 ) VALUES ( ?, ?, ?, ? );', local_hashes_rows )
             
-            if archive:
+            if len( archive_hash_ids ) > 0:
                 
-                self._ArchiveFiles( ( hash_id, ) )
+                self._ArchiveFiles( archive_hash_ids )
                 
-            else:
+            
+            if len( inbox_hash_ids ) > 0:
                 
-                self._InboxFiles( ( hash_id, ) )
+                self._InboxFiles( inbox_hash_ids )
                 
             
-            status = CC.STATUS_SUCCESSFUL
-            
         
         tag_services = self._GetServices( HC.TAG_SERVICES )
         
@@ -6441,7 +7136,7 @@ class DB( HydrusDB.HydrusDB ):
                 
                 try:
                     
-                    self._SyncHashesToTagArchive( [ hash ], hta_path, service_key, adding, namespaces )
+                    self._SyncHashesToTagArchive( hashes, hta_path, service_key, adding, namespaces )
                     
                 except:
                     
@@ -6450,7 +7145,7 @@ class DB( HydrusDB.HydrusDB ):
                 
             
         
-        return status
+        return statuses
         
     
     def _ImportUpdate( self, update_network_string, update_hash, mime ):
@@ -6529,6 +7224,16 @@ class DB( HydrusDB.HydrusDB ):
         
         self._inbox_hash_ids = self._STS( self._c.execute( 'SELECT hash_id FROM file_inbox;' ) )
         
+        self._phash_index = None
+        self._phash_substrings_exist = None
+        
+        new_options = self._GetJSONDump( HydrusSerialisable.SERIALISABLE_TYPE_CLIENT_OPTIONS )
+        
+        if new_options.GetBoolean( 'keep_similar_files_phash_index_in_memory' ):
+            
+            self._CacheSimilarFilesLoadPHashIndex()
+            
+        
     
     def _InitDiskCache( self ):
         
@@ -7423,11 +8128,19 @@ class DB( HydrusDB.HydrusDB ):
         MAPPINGS_CHUNK_SIZE = 1000
         NEW_TAG_PARENTS_CHUNK_SIZE = 5
         
+        # these are just where we start. each chunk sizer learns how many rows it can do in REPOSITORY_CONTENT_CHUNK_TARGET_TIME on this machine
+        
+        new_files_chunk_sizer = self._GetRepositoryContentChunkSizer( 'new files', FILES_CHUNK_SIZE, FILES_CHUNK_SIZE * 500 )
+        deleted_files_chunk_sizer = self._GetRepositoryContentChunkSizer( 'deleted files', FILES_CHUNK_SIZE, FILES_CHUNK_SIZE * 500 )
+        new_mappings_chunk_sizer = self._GetRepositoryContentChunkSizer( 'new mappings', MAPPINGS_CHUNK_SIZE, MAPPINGS_CHUNK_SIZE * 100 )
+        deleted_mappings_chunk_sizer = self._GetRepositoryContentChunkSizer( 'deleted mappings', MAPPINGS_CHUNK_SIZE, MAPPINGS_CHUNK_SIZE * 100 )
+        new_tag_parents_chunk_sizer = self._GetRepositoryContentChunkSizer( 'new tag parents', NEW_TAG_PARENTS_CHUNK_SIZE, NEW_TAG_PARENTS_CHUNK_SIZE * 20 )
+        
         total_rows = content_update.GetNumRows()
         
         rows_processed = 0
         
-        for chunk in HydrusData.SplitListIntoChunks( content_update.GetNewFiles(), FILES_CHUNK_SIZE ):
+        for chunk in HydrusData.SplitListIntoAdaptiveChunks( content_update.GetNewFiles(), new_files_chunk_sizer ):
             
             ( i_paused, should_quit ) = job_key.WaitIfNeeded()
             
@@ -7458,13 +8171,17 @@ class DB( HydrusDB.HydrusDB ):
             
             rows_processed += num_rows
             
-            report_content_speed_to_job_key( job_key, rows_processed, total_rows, precise_timestamp, num_rows, 'new files' )
+            it_took = report_content_speed_to_job_key( job_key, rows_processed, total_rows, precise_timestamp, num_rows, 'new files' )
             job_key.SetVariable( 'popup_gauge_2', ( rows_processed, total_rows ) )
             
+            new_files_chunk_sizer.ReportChunk( num_rows, it_took )
+            
+            self._ReportRepositoryProcessingSpeed( 'new files', num_rows, it_took )
+            
         
         #
         
-        for chunk in HydrusData.SplitListIntoChunks( content_update.GetDeletedFiles(), FILES_CHUNK_SIZE ):
+        for chunk in HydrusData.SplitListIntoAdaptiveChunks( content_update.GetDeletedFiles(), deleted_files_chunk_sizer ):
             
             ( i_paused, should_quit ) = job_key.WaitIfNeeded()
             
@@ -7485,13 +8202,17 @@ class DB( HydrusDB.HydrusDB ):
             
             rows_processed += num_rows
             
-            report_content_speed_to_job_key( job_key, rows_processed, total_rows, precise_timestamp, num_rows, 'deleted files' )
+            it_took = report_content_speed_to_job_key( job_key, rows_processed, total_rows, precise_timestamp, num_rows, 'deleted files' )
             job_key.SetVariable( 'popup_gauge_2', ( rows_processed, total_rows ) )
             
+            deleted_files_chunk_sizer.ReportChunk( num_rows, it_took )
+            
+            self._ReportRepositoryProcessingSpeed( 'deleted files', num_rows, it_took )
+            
         
         #
         
-        for chunk in HydrusData.SplitMappingListIntoChunks( content_update.GetNewMappings(), MAPPINGS_CHUNK_SIZE ):
+        for chunk in HydrusData.SplitMappingListIntoAdaptiveChunks( content_update.GetNewMappings(), new_mappings_chunk_sizer ):
             
             ( i_paused, should_quit ) = job_key.WaitIfNeeded()
             
@@ -7520,13 +8241,17 @@ class DB( HydrusDB.HydrusDB ):
             
             rows_processed += num_rows
             
-            report_content_speed_to_job_key( job_key, rows_processed, total_rows, precise_timestamp, num_rows, 'new mappings' )
+            it_took = report_content_speed_to_job_key( job_key, rows_processed, total_rows, precise_timestamp, num_rows, 'new mappings' )
             job_key.SetVariable( 'popup_gauge_2', ( rows_processed, total_rows ) )
             
+            new_mappings_chunk_sizer.ReportChunk( num_rows, it_took )
+            
+            self._ReportRepositoryProcessingSpeed( 'new mappings', num_rows, it_took )
+            
         
         #
         
-        for chunk in HydrusData.SplitMappingListIntoChunks( content_update.GetDeletedMappings(), MAPPINGS_CHUNK_SIZE ):
+        for chunk in HydrusData.SplitMappingListIntoAdaptiveChunks( content_update.GetDeletedMappings(), deleted_mappings_chunk_sizer ):
             
             ( i_paused, should_quit ) = job_key.WaitIfNeeded()
             
@@ -7555,13 +8280,17 @@ class DB( HydrusDB.HydrusDB ):
             
             rows_processed += num_rows
             
-            report_content_speed_to_job_key( job_key, rows_processed, total_rows, precise_timestamp, num_rows, 'deleted mappings' )
+            it_took = report_content_speed_to_job_key( job_key, rows_processed, total_rows, precise_timestamp, num_rows, 'deleted mappings' )
             job_key.SetVariable( 'popup_gauge_2', ( rows_processed, total_rows ) )
             
+            deleted_mappings_chunk_sizer.ReportChunk( num_rows, it_took )
+            
+            self._ReportRepositoryProcessingSpeed( 'deleted mappings', num_rows, it_took )
+            
         
         #
         
-        for chunk in HydrusData.SplitListIntoChunks( content_update.GetNewTagParents(), NEW_TAG_PARENTS_CHUNK_SIZE ):
+        for chunk in HydrusData.SplitListIntoAdaptiveChunks( content_update.GetNewTagParents(), new_tag_parents_chunk_sizer ):
             
             ( i_paused, should_quit ) = job_key.WaitIfNeeded()
             
@@ -7588,9 +8317,13 @@ class DB( HydrusDB.HydrusDB ):
             
             rows_processed += num_rows
             
-            report_content_speed_to_job_key( job_key, rows_processed, total_rows, precise_timestamp, num_rows, 'new tag parents' )
+            it_took = report_content_speed_to_job_key( job_key, rows_processed, total_rows, precise_timestamp, num_rows, 'new tag parents' )
             job_key.SetVariable( 'popup_gauge_2', ( rows_processed, total_rows ) )
             
+            new_tag_parents_chunk_sizer.ReportChunk( num_rows, it_took )
+            
+            self._ReportRepositoryProcessingSpeed( 'new tag parents', num_rows, it_took )
+            
         
         #
         
@@ -7623,9 +8356,11 @@ class DB( HydrusDB.HydrusDB ):
             
             rows_processed += num_rows
             
-            report_content_speed_to_job_key( job_key, rows_processed, total_rows, precise_timestamp, num_rows, 'deleted tag parents' )
+            it_took = report_content_speed_to_job_key( job_key, rows_processed, total_rows, precise_timestamp, num_rows, 'deleted tag parents' )
             job_key.SetVariable( 'popup_gauge_2', ( rows_processed, total_rows ) )
             
+            self._ReportRepositoryProcessingSpeed( 'deleted tag parents', num_rows, it_took )
+            
         
         #
         
@@ -7658,9 +8393,11 @@ class DB( HydrusDB.HydrusDB ):
             
             rows_processed += num_rows
             
-            report_content_speed_to_job_key( job_key, rows_processed, total_rows, precise_timestamp, num_rows, 'new tag siblings' )
+            it_took = report_content_speed_to_job_key( job_key, rows_processed, total_rows, precise_timestamp, num_rows, 'new tag siblings' )
             job_key.SetVariable( 'popup_gauge_2', ( rows_processed, total_rows ) )
             
+            self._ReportRepositoryProcessingSpeed( 'new tag siblings', num_rows, it_took )
+            
         
         #
         
@@ -7693,9 +8430,11 @@ class DB( HydrusDB.HydrusDB ):
             
             rows_processed += num_rows
             
-            report_content_speed_to_job_key( job_key, rows_processed, total_rows, precise_timestamp, num_rows, 'deleted tag siblings' )
+            it_took = report_content_speed_to_job_key( job_key, rows_processed, total_rows, precise_timestamp, num_rows, 'deleted tag siblings' )
             job_key.SetVariable( 'popup_gauge_2', ( rows_processed, total_rows ) )
             
+            self._ReportRepositoryProcessingSpeed( 'deleted tag siblings', num_rows, it_took )
+            
         
         return True
         
@@ -7805,9 +8544,13 @@ class DB( HydrusDB.HydrusDB ):
                     
                     total_definitions_rows = 0
                     
+                    hash_ids_and_paths = [ ( hash_id, client_files_manager.LocklessGetFilePath( self._GetHash( hash_id ), HC.APPLICATION_HYDRUS_UPDATE_DEFINITIONS ) ) for hash_id in definition_hash_ids ]
+                    
+                    loaded_definition_updates = IterateLoadedRepositoryUpdates( hash_ids_and_paths )
+                    
                     try:
                         
-                        for hash_id in definition_hash_ids:
+                        for ( hash_id, definition_update ) in loaded_definition_updates:
                             
                             ( i_paused, should_quit ) = job_key.WaitIfNeeded()
                             
@@ -7821,17 +8564,6 @@ class DB( HydrusDB.HydrusDB ):
                             job_key.SetVariable( 'popup_text_1', status )
                             job_key.SetVariable( 'popup_gauge_1', ( num_updates_done, num_updates_to_do ) )
                             
-                            update_hash = self._GetHash( hash_id )
-                            
-                            update_path = client_files_manager.LocklessGetFilePath( update_hash, HC.APPLICATION_HYDRUS_UPDATE_DEFINITIONS )
-                            
-                            with open( update_path, 'rb' ) as f:
-                                
-                                update_network_string = f.read()
-                                
-                            
-                            definition_update = HydrusSerialisable.CreateFromNetworkString( update_network_string )
-                            
                             precise_timestamp = HydrusData.GetNowPrecise()
                             
                             self._ProcessRepositoryDefinitionUpdate( service_id, definition_update )
@@ -7842,7 +8574,9 @@ class DB( HydrusDB.HydrusDB ):
                             
                             num_rows = definition_update.GetNumRows()
                             
-                            report_speed_to_job_key( job_key, precise_timestamp, num_rows, 'definitions' )
+                            it_took = report_speed_to_job_key( job_key, precise_timestamp, num_rows, 'definitions' )
+                            
+                            self._ReportRepositoryProcessingSpeed( 'definitions', num_rows, it_took )
                             
                             total_definitions_rows += num_rows
                             
@@ -7860,6 +8594,8 @@ class DB( HydrusDB.HydrusDB ):
                         
                     finally:
                         
+                        loaded_definition_updates.close()
+                        
                         report_speed_to_log( larger_precise_timestamp, total_definitions_rows, 'definitions' )
                         
                     
@@ -7874,9 +8610,13 @@ class DB( HydrusDB.HydrusDB ):
                     
                     total_content_rows = 0
                     
+                    hash_ids_and_paths = [ ( hash_id, client_files_manager.LocklessGetFilePath( self._GetHash( hash_id ), HC.APPLICATION_HYDRUS_UPDATE_DEFINITIONS ) ) for hash_id in content_hash_ids ]
+                    
+                    loaded_content_updates = IterateLoadedRepositoryUpdates( hash_ids_and_paths )
+                    
                     try:
                         
-                        for hash_id in content_hash_ids:
+                        for ( hash_id, content_update ) in loaded_content_updates:
                             
                             ( i_paused, should_quit ) = job_key.WaitIfNeeded()
                             
@@ -7890,17 +8630,6 @@ class DB( HydrusDB.HydrusDB ):
                             job_key.SetVariable( 'popup_text_1', status )
                             job_key.SetVariable( 'popup_gauge_1', ( num_updates_done, num_updates_to_do ) )
                             
-                            update_hash = self._GetHash( hash_id )
-                            
-                            update_path = client_files_manager.LocklessGetFilePath( update_hash, HC.APPLICATION_HYDRUS_UPDATE_DEFINITIONS )
-                            
-                            with open( update_path, 'rb' ) as f:
-                                
-                                update_network_string = f.read()
-                                
-                            
-                            content_update = HydrusSerialisable.CreateFromNetworkString( update_network_string )
-                            
                             did_whole_update = self._ProcessRepositoryContentUpdate( job_key, service_id, content_update )
                             
                             ( i_paused, should_quit ) = job_key.WaitIfNeeded()
@@ -7921,12 +8650,16 @@ class DB( HydrusDB.HydrusDB ):
                         
                     finally:
                         
+                        loaded_content_updates.close()
+                        
                         report_speed_to_log( precise_timestamp, total_content_rows, 'content rows' )
                         
                     
                 
             finally:
                 
+                self._SaveRepositoryProcessingSpeeds( service_id )
+                
                 self._AnalyzeStaleBigTables()
                 
                 job_key.SetVariable( 'popup_text_1', 'finished' )
@@ -7998,6 +8731,7 @@ class DB( HydrusDB.HydrusDB ):
         elif action == 'recent_tags': result = self._GetRecentTags( *args, **kwargs )
         elif action == 'remote_booru': result = self._GetYAMLDump( YAML_DUMP_ID_REMOTE_BOORU, *args, **kwargs )
         elif action == 'remote_boorus': result = self._GetYAMLDump( YAML_DUMP_ID_REMOTE_BOORU )
+        elif action == 'repository_processing_history': result = self._GetRepositoryProcessingHistory( *args, **kwargs )
         elif action == 'repository_progress': result = self._GetRepositoryProgress( *args, **kwargs )
         elif action == 'serialisable': result = self._GetJSONDump( *args, **kwargs )
         elif action == 'serialisable_simple': result = self._GetJSONSimple( *args, **kwargs )
@@ -8068,6 +8802,18 @@ class DB( HydrusDB.HydrusDB ):
             
         
     
+    def _RegisterLiveSearch( self, page_key, job_key, file_search_context, hash_ids ):
+        
+        # the page may have moved on to a new query or closed while this one was finishing up
+        
+        if job_key.IsCancelled():
+            
+            return
+            
+        
+        self._live_searches[ page_key ] = ( job_key, file_search_context, set( hash_ids ) )
+        
+    
     def _RelocateClientFiles( self, prefix, source, dest ):
         
         full_source = os.path.join( source, prefix )
@@ -8159,6 +8905,13 @@ class DB( HydrusDB.HydrusDB ):
             
         
     
+    def _ReportRepositoryProcessingSpeed( self, row_name, num_rows, time_took ):
+        
+        ( total_num_rows, total_time_took ) = self._repository_processing_totals.get( row_name, ( 0, 0.0 ) )
+        
+        self._repository_processing_totals[ row_name ] = ( total_num_rows + num_rows, total_time_took + time_took )
+        
+    
     def _ResetRepository( self, service ):
         
         self._Commit()
@@ -8204,6 +8957,25 @@ class DB( HydrusDB.HydrusDB ):
             
         
     
+    def _Rollback( self ):
+        
+        HydrusDB.HydrusDB._Rollback( self )
+        
+        # the resident similar files index may have been told about rows that no longer exist, so reload it next time it is needed
+        
+        self._phash_index = None
+        
+        # and we may have rolled back the creation or dropping of the multi-index hashing table
+        
+        self._phash_substrings_exist = None
+        
+        self._live_search_dirty_hashes = set()
+        
+        self._UncacheMediaResults()
+        
+        self._repository_processing_totals = {}
+        
+    
     def _SaveDirtyServices( self, dirty_services ):
         
         # if allowed to save objects
@@ -8225,6 +8997,15 @@ class DB( HydrusDB.HydrusDB ):
             
         
     
+    def _SaveRepositoryProcessingSpeeds( self, service_id ):
+        
+        now = HydrusData.GetNow()
+        
+        self._c.executemany( 'INSERT INTO repository_processing_history ( service_id, timestamp, row_name, num_rows, time_took ) VALUES ( ?, ?, ?, ?, ? );', ( ( service_id, now, row_name, num_rows, time_took ) for ( row_name, ( num_rows, time_took ) ) in self._repository_processing_totals.items() if num_rows > 0 ) )
+        
+        self._repository_processing_totals = {}
+        
+    
     def _SaveOptions( self, options ):
         
         ( old_options, ) = self._c.execute( 'SELECT options FROM options;' ).fetchone()
@@ -8289,6 +9070,16 @@ class DB( HydrusDB.HydrusDB ):
             
             self._c.execute( 'INSERT INTO json_dumps ( dump_type, version, dump ) VALUES ( ?, ?, ? );', ( dump_type, version, sqlite3.Binary( dump ) ) )
             
+            if dump_type == HydrusSerialisable.SERIALISABLE_TYPE_CLIENT_OPTIONS:
+                
+                # dropping the substrings is quick, but building them can take a long time, so that is left to similar files maintenance
+                
+                if not obj.GetBoolean( 'use_multi_index_hashing_for_similar_files' ) and self._CacheSimilarFilesPHashSubstringsExist():
+                    
+                    self._CacheSimilarFilesDropPHashSubstrings()
+                    
+                
+            
         
     
     def _SetJSONSimple( self, name, value ):
@@ -8326,6 +9117,8 @@ class DB( HydrusDB.HydrusDB ):
         
         self._c.execute( 'REPLACE INTO service_filenames ( service_id, hash_id, filename ) VALUES ( ?, ?, ? );', ( service_id, hash_id, filename ) )
         
+        self._UncacheMediaResults( ( hash_id, ) )
+        
     
     def _SetServiceDirectory( self, service_id, hash_ids, dirname, note ):
         
@@ -8364,6 +9157,8 @@ class DB( HydrusDB.HydrusDB ):
             self._c.execute( 'INSERT OR IGNORE INTO tag_censorship ( service_id, blacklist, tags ) VALUES ( ?, ?, ? );', ( service_id, blacklist, tags ) )
             
         
+        self._UncacheMediaResults()
+        
         self.pub_after_job( 'notify_new_tag_censorship' )
         
     
@@ -8416,28 +9211,33 @@ class DB( HydrusDB.HydrusDB ):
     
     def _SyncHashesToTagArchive( self, hashes, hta_path, tag_service_key, adding, namespaces ):
         
-        hta = HydrusTagArchive.HydrusTagArchive( hta_path )
+        ( hta, hash_type ) = self._GetCachedTagArchive( hta_path )
         
-        hash_type = hta.GetHashType()
+        if hash_type == HydrusTagArchive.HASH_TYPE_SHA256:
+            
+            archive_hashes_to_hashes = { hash : hash for hash in hashes }
+            
+        else:
+            
+            if hash_type == HydrusTagArchive.HASH_TYPE_MD5: h = 'md5'
+            elif hash_type == HydrusTagArchive.HASH_TYPE_SHA1: h = 'sha1'
+            elif hash_type == HydrusTagArchive.HASH_TYPE_SHA512: h = 'sha512'
+            
+            hash_ids_to_hashes = { self._GetHashId( hash ) : hash for hash in hashes }
+            
+            with HydrusDB.TemporaryIntegerTable( self._c, hash_ids_to_hashes.keys(), 'hash_id' ) as temp_table_name:
+                
+                archive_hashes_to_hashes = { archive_hash : hash_ids_to_hashes[ hash_id ] for ( hash_id, archive_hash ) in self._c.execute( 'SELECT hash_id, ' + h + ' FROM ' + temp_table_name + ' NATURAL JOIN local_hashes;' ) }
+                
+            
         
         content_updates = []
         
-        for hash in hashes:
+        for ( archive_hash, archive_tags ) in hta.GetMappingsForHashes( archive_hashes_to_hashes.keys() ).items():
             
-            if hash_type == HydrusTagArchive.HASH_TYPE_SHA256: archive_hash = hash
-            else:
-                
-                hash_id = self._GetHashId( hash )
-                
-                if hash_type == HydrusTagArchive.HASH_TYPE_MD5: h = 'md5'
-                elif hash_type == HydrusTagArchive.HASH_TYPE_SHA1: h = 'sha1'
-                elif hash_type == HydrusTagArchive.HASH_TYPE_SHA512: h = 'sha512'
-                
-                try: ( archive_hash, ) = self._c.execute( 'SELECT ' + h + ' FROM local_hashes WHERE hash_id = ?;', ( hash_id, ) ).fetchone()
-                except: return
-                
+            hash = archive_hashes_to_hashes[ archive_hash ]
             
-            tags = HydrusTags.CleanTags( hta.GetTags( archive_hash ) )
+            tags = HydrusTags.CleanTags( archive_tags )
             
             desired_tags = HydrusTags.FilterNamespaces( tags, namespaces )
             
@@ -8524,6 +9324,41 @@ class DB( HydrusDB.HydrusDB ):
             
         
     
+    def _UncacheMediaResults( self, hash_ids = None ):
+        
+        if len( self._media_result_cache ) == 0:
+            
+            return
+            
+        
+        if hash_ids is None:
+            
+            self._media_result_cache.clear()
+            
+        else:
+            
+            for hash_id in hash_ids:
+                
+                if hash_id in self._media_result_cache:
+                    
+                    del self._media_result_cache[ hash_id ]
+                    
+                
+            
+        
+    
+    def _UnregisterLiveSearch( self, page_key, job_key ):
+        
+        if page_key in self._live_searches:
+            
+            ( live_job_key, file_search_context, live_hash_ids ) = self._live_searches[ page_key ]
+            
+            if live_job_key == job_key:
+                
+                del self._live_searches[ page_key ]
+            
+        
+    
     def _UpdateDB( self, version ):
         
         self._controller.pub( 'splash_set_title_text', 'updating db to v' + str( version + 1 ) )
@@ -9998,11 +10833,74 @@ class DB( HydrusDB.HydrusDB ):
             self.pub_initial_message( message )
             
         
+        if version == 283:
+            
+            self._c.execute( 'CREATE TABLE repository_processing_history ( service_id INTEGER REFERENCES services ON DELETE CASCADE, timestamp INTEGER, row_name TEXT, num_rows INTEGER, time_took REAL );' )
+            self._CreateIndex( 'repository_processing_history', [ 'service_id', 'timestamp' ] )
+            
+        
         self._controller.pub( 'splash_set_title_text', 'updated db to v' + str( version + 1 ) )
         
         self._c.execute( 'UPDATE version SET version = ?;', ( version + 1, ) )
         
     
+    def _UpdateLiveSearches( self ):
+        
+        # rather than have pages run their whole search again, we check just the files that changed in this job against each live search and send the differences
+        
+        if len( self._live_search_dirty_hashes ) == 0:
+            
+            return
+            
+        
+        hashes = self._live_search_dirty_hashes
+        
+        self._live_search_dirty_hashes = set()
+        
+        if not self._controller.GetNewOptions().GetBoolean( 'update_search_pages_live' ):
+            
+            self._live_searches = {}
+            
+        
+        if len( self._live_searches ) == 0:
+            
+            return
+            
+        
+        hash_ids = set( self._GetHashIds( hashes ) )
+        
+        for ( page_key, ( job_key, file_search_context, live_hash_ids ) ) in self._live_searches.items():
+            
+            if job_key.IsCancelled():
+                
+                del self._live_searches[ page_key ]
+                
+                continue
+                
+            
+            matching_hash_ids = set( self._GetHashIdsFromQuery( file_search_context, hash_ids_to_check = hash_ids ) )
+            
+            hash_ids_to_add = matching_hash_ids.difference( live_hash_ids )
+            hash_ids_to_remove = live_hash_ids.intersection( hash_ids ).difference( matching_hash_ids )
+            
+            if len( hash_ids_to_add ) > 0:
+                
+                live_hash_ids.update( hash_ids_to_add )
+                
+                media_results = self._GetMediaResults( hash_ids_to_add )
+                
+                self.pub_after_job( 'add_media_results', page_key, media_results )
+                
+            
+            if len( hash_ids_to_remove ) > 0:
+                
+                live_hash_ids.difference_update( hash_ids_to_remove )
+                
+                self.pub_after_job( 'remove_media', page_key, self._GetHashes( hash_ids_to_remove ) )
+                
+            
+        
+    
     def _UpdateMappings( self, tag_service_id, mappings_ids = None, deleted_mappings_ids = None, pending_mappings_ids = None, pending_rescinded_mappings_ids = None, petitioned_mappings_ids = None, petitioned_rescinded_mappings_ids = None ):
         
         ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateMappingsTableNames( tag_service_id )
@@ -10040,6 +10938,11 @@ class DB( HydrusDB.HydrusDB ):
         tag_ids_to_search_for = tag_ids_being_added.union( tag_ids_being_removed )
         hash_ids_to_search_for = hash_ids_being_added.union( hash_ids_being_removed )
         
+        for ( tag_id, hash_ids ) in itertools.chain( all_adds, all_removes, petitioned_mappings_ids, petitioned_rescinded_mappings_ids ):
+            
+            self._UncacheMediaResults( hash_ids )
+            
+        
         self._c.execute( 'CREATE TABLE mem.temp_tag_ids ( tag_id INTEGER );' )
         self._c.execute( 'CREATE TABLE mem.temp_hash_ids ( hash_id INTEGER );' )
         
@@ -10562,6 +11465,7 @@ class DB( HydrusDB.HydrusDB ):
         if action == 'analyze': result = self._AnalyzeStaleBigTables( *args, **kwargs )
         elif action == 'associate_repository_update_hashes': result = self._AssociateRepositoryUpdateHashes( *args, **kwargs )
         elif action == 'backup': result = self._Backup( *args, **kwargs )
+        elif action == 'benchmark_similar_files_search': result = self._CacheSimilarFilesBenchmarkSearch( *args, **kwargs )
         elif action == 'content_updates': result = self._ProcessContentUpdates( *args, **kwargs )
         elif action == 'db_integrity': result = self._CheckDBIntegrity( *args, **kwargs )
         elif action == 'delete_hydrus_session_key': result = self._DeleteHydrusSessionKey( *args, **kwargs )
@@ -10579,6 +11483,7 @@ class DB( HydrusDB.HydrusDB ):
         elif action == 'hydrus_session': result = self._AddHydrusSession( *args, **kwargs )
         elif action == 'imageboard': result = self._SetYAMLDump( YAML_DUMP_ID_IMAGEBOARD, *args, **kwargs )
         elif action == 'import_file': result = self._ImportFile( *args, **kwargs )
+        elif action == 'import_files': result = self._ImportFiles( *args, **kwargs )
         elif action == 'import_update': result = self._ImportUpdate( *args, **kwargs )
         elif action == 'local_booru_share': result = self._SetYAMLDump( YAML_DUMP_ID_LOCAL_BOORU, *args, **kwargs )
         elif action == 'maintain_similar_files_duplicate_pairs': result = self._CacheSimilarFilesMaintainDuplicatePairs( *args, **kwargs )
@@ -10589,6 +11494,7 @@ class DB( HydrusDB.HydrusDB ):
         elif action == 'recheck_video_metadata': result = self._RecheckVideoMetadata( *args, **kwargs )
         elif action == 'regenerate_ac_cache': result = self._RegenerateACCache( *args, **kwargs )
         elif action == 'regenerate_similar_files': result = self._CacheSimilarFilesRegenerateTree( *args, **kwargs )
+        elif action == 'register_live_search': result = self._RegisterLiveSearch( *args, **kwargs )
         elif action == 'relocate_client_files': result = self._RelocateClientFiles( *args, **kwargs )
         elif action == 'remote_booru': result = self._SetYAMLDump( YAML_DUMP_ID_REMOTE_BOORU, *args, **kwargs )
         elif action == 'repair_client_files': result = self._RepairClientFiles( *args, **kwargs )
@@ -10601,16 +11507,42 @@ class DB( HydrusDB.HydrusDB ):
         elif action == 'set_password': result = self._SetPassword( *args, **kwargs )
         elif action == 'sync_hashes_to_tag_archive': result = self._SyncHashesToTagArchive( *args, **kwargs )
         elif action == 'tag_censorship': result = self._SetTagCensorship( *args, **kwargs )
+        elif action == 'unregister_live_search': result = self._UnregisterLiveSearch( *args, **kwargs )
         elif action == 'update_server_services': result = self._UpdateServerServices( *args, **kwargs )
         elif action == 'update_services': result = self._UpdateServices( *args, **kwargs )
         elif action == 'vacuum': result = self._Vacuum( *args, **kwargs )
         else: raise Exception( 'db received an unknown write command: ' + action )
         
+        self._UpdateLiveSearches()
+        
         return result
         
     
     def pub_content_updates_after_commit( self, service_keys_to_content_updates ):
         
+        if len( self._live_searches ) > 0 or len( self._media_result_cache ) > 0:
+            
+            hashes = set()
+            
+            for content_updates in service_keys_to_content_updates.values():
+                
+                for content_update in content_updates:
+                    
+                    hashes.update( content_update.GetHashes() )
+                    
+                
+            
+            if len( self._live_searches ) > 0:
+                
+                self._live_search_dirty_hashes.update( hashes )
+                
+            
+            if len( self._media_result_cache ) > 0:
+                
+                self._UncacheMediaResults( self._GetHashIds( hashes ) )
+                
+            
+        
         self.pub_after_job( 'content_updates_data', service_keys_to_content_updates )
         self.pub_after_job( 'content_updates_gui', service_keys_to_content_updates )
         
@@ -10622,6 +11554,8 @@ class DB( HydrusDB.HydrusDB ):
     
     def pub_service_updates_after_commit( self, service_keys_to_service_updates ):
         
+        self._UncacheMediaResults()
+        
         self.pub_after_job( 'service_updates_data', service_keys_to_service_updates )
         self.pub_after_job( 'service_updates_gui', service_keys_to_service_updates )
         
@@ -820,6 +820,8 @@ class ClientOptions( HydrusSerialisable.SerialisableBase ):
         self._dictionary[ 'booleans' ][ 'apply_all_siblings_to_all_services' ] = False
         self._dictionary[ 'booleans' ][ 'filter_inbox_and_archive_predicates' ] = False
         
+        self._dictionary[ 'booleans' ][ 'update_search_pages_live' ] = False
+        
         self._dictionary[ 'booleans' ][ 'do_not_import_decompression_bombs' ] = True
         
         self._dictionary[ 'booleans' ][ 'discord_dnd_fix' ] = False
@@ -846,6 +848,8 @@ class ClientOptions( HydrusSerialisable.SerialisableBase ):
         self._dictionary[ 'booleans' ][ 'use_system_ffmpeg' ] = False
         
         self._dictionary[ 'booleans' ][ 'maintain_similar_files_duplicate_pairs_during_idle' ] = False
+        self._dictionary[ 'booleans' ][ 'keep_similar_files_phash_index_in_memory' ] = False
+        self._dictionary[ 'booleans' ][ 'use_multi_index_hashing_for_similar_files' ] = False
         
         self._dictionary[ 'booleans' ][ 'show_namespaces' ] = True
         
@@ -919,8 +923,19 @@ class ClientOptions( HydrusSerialisable.SerialisableBase ):
         
         self._dictionary[ 'integers' ][ 'network_timeout' ] = 10
         
+        self._dictionary[ 'integers' ][ 'max_network_jobs' ] = 10
+        self._dictionary[ 'integers' ][ 'max_network_jobs_per_domain' ] = 3
+        
+        self._dictionary[ 'integers' ][ 'network_pool_connections' ] = 20
+        self._dictionary[ 'integers' ][ 'network_pool_maxsize' ] = 10
+        self._dictionary[ 'integers' ][ 'network_connection_retries' ] = 2
+        
         self._dictionary[ 'integers' ][ 'thumbnail_visibility_scroll_percent' ] = 75
         
+        self._dictionary[ 'integers' ][ 'thumbnail_waterfall_workers' ] = 4
+        
+        self._dictionary[ 'integers' ][ 'file_import_workers' ] = 4
+        
         self._dictionary[ 'integers' ][ 'last_session_save_period_minutes' ] = 5
         
         #
@@ -942,6 +957,8 @@ class ClientOptions( HydrusSerialisable.SerialisableBase ):
         self._dictionary[ 'noneable_integers' ][ 'disk_cache_maintenance_mb' ] = 256
         self._dictionary[ 'noneable_integers' ][ 'disk_cache_init_period' ] = 4
         
+        self._dictionary[ 'noneable_integers' ][ 'rendered_thumbnail_disk_cache_mb' ] = None
+        
         self._dictionary[ 'noneable_integers' ][ 'num_recent_tags' ] = 20
         
         self._dictionary[ 'noneable_integers' ][ 'maintenance_vacuum_period_days' ] = 30
@@ -785,6 +785,37 @@ class FrameGUI( ClientGUITopLevelWindows.FrameThatResizes ):
         HydrusData.Print( 'uncollectable garbage: ' + HydrusData.ToUnicode( gc.garbage ) )
         
     
+    def _DebugShowCacheStats( self ):
+        
+        for ( name, cache_name ) in ( ( 'image cache', 'images' ), ( 'thumbnail cache', 'thumbnail' ) ):
+            
+            ( num_items, total_estimated_memory_footprint, cache_size, num_hits, num_misses, num_evictions ) = self._controller.GetCache( cache_name ).GetDataCacheStats()
+            
+            num_requests = num_hits + num_misses
+            
+            if num_requests == 0:
+                
+                hit_rate = 'no requests yet'
+                
+            else:
+                
+                hit_rate = HydrusData.ConvertFloatToPercentage( float( num_hits ) / num_requests ) + ' hit rate'
+                
+            
+            message = name + ': ' + HydrusData.ConvertIntToPrettyString( num_items ) + ' items using ' + HydrusData.ConvertValueRangeToBytes( total_estimated_memory_footprint, cache_size ) + ', '
+            message += HydrusData.ConvertIntToPrettyString( num_hits ) + ' hits, ' + HydrusData.ConvertIntToPrettyString( num_misses ) + ' misses (' + hit_rate + '), ' + HydrusData.ConvertIntToPrettyString( num_evictions ) + ' evictions'
+            
+            HydrusData.ShowText( message )
+            
+        
+        num_disk_thumbnails = self._controller.GetCache( 'thumbnail' ).GetDiskCacheStats()
+        
+        if num_disk_thumbnails is not None:
+            
+            HydrusData.ShowText( 'thumbnail disk cache: ' + HydrusData.ConvertIntToPrettyString( num_disk_thumbnails ) + ' thumbnails' )
+            
+        
+    
     def _DeleteGUISession( self, name ):
         
         message = 'Delete session "' + name + '"?'
@@ -1493,9 +1524,11 @@ class FrameGUI( ClientGUITopLevelWindows.FrameThatResizes ):
             ClientGUIMenus.AppendMenuItem( self, debug, 'make a popup in five seconds', 'Throw a delayed popup at the message manager, giving you time to minimise or otherwise alter the client before it arrives.', wx.CallLater, 5000, HydrusData.ShowText, 'This is a delayed popup message.' )
             ClientGUIMenus.AppendMenuItem( self, debug, 'force a gui layout now', 'Tell the gui to relayout--useful to test some gui bootup layout issues.', self.Layout )
             ClientGUIMenus.AppendMenuItem( self, debug, 'print garbage', 'Print some information about the python garbage to the log.', self._DebugPrintGarbage )
+            ClientGUIMenus.AppendMenuItem( self, debug, 'show image cache stats', 'Show how full the image and thumbnail caches are and how often they are hit.', self._DebugShowCacheStats )
             ClientGUIMenus.AppendMenuItem( self, debug, 'clear image rendering cache', 'Tell the image rendering system to forget all current images. This will often free up a bunch of memory immediately.', self._controller.ClearCaches )
             ClientGUIMenus.AppendMenuItem( self, debug, 'clear db service info cache', 'Delete all cached service info like total number of mappings or files, in case it has become desynchronised. Some parts of the gui may be laggy immediately after this as these numbers are recalculated.', self._DeleteServiceInfo )
             ClientGUIMenus.AppendMenuItem( self, debug, 'load whole db in disk cache', 'Contiguously read as much of the db as will fit into memory. This will massively speed up any subsequent big job.', self._controller.CallToThread, self._controller.Read, 'load_into_disk_cache' )
+            ClientGUIMenus.AppendMenuItem( self, debug, 'benchmark similar files search', 'Time the similar files tree, multi-index hashing and in-memory searches against each other for a sample of your files at several search distances.', self._controller.Write, 'benchmark_similar_files_search' )
             ClientGUIMenus.AppendMenuItem( self, debug, 'run and initialise server for testing', 'This will try to boot the server in your install folder and initialise it. This is mostly here for testing purposes.', self._AutoServerSetup )
             ClientGUIMenus.AppendMenuItem( self, debug, 'save \'last session\' gui session', 'Make an immediate save of the \'last session\' gui session. Mostly for testing crashes, where last session is not saved correctly.', self._notebook.SaveGUISession, 'last session' )
             
@@ -3255,6 +3255,8 @@ class ManagementPanelQuery( ManagementPanel ):
         
         self._query_job_key.Cancel()
         
+        self._UnregisterLiveSearch()
+        
         self._query_job_key = ClientThreading.JobKey()
         
         if self._management_controller.GetVariable( 'search_enabled' ):
@@ -3315,6 +3317,14 @@ class ManagementPanelQuery( ManagementPanel ):
         sizer.AddF( tags_box, CC.FLAGS_EXPAND_BOTH_WAYS )
         
     
+    def _UnregisterLiveSearch( self ):
+        
+        if self._controller.GetNewOptions().GetBoolean( 'update_search_pages_live' ):
+            
+            self._controller.Write( 'unregister_live_search', self._page_key, self._query_job_key )
+            
+        
+    
     def AddMediaResultsFromQuery( self, query_job_key, media_results ):
         
         if query_job_key == self._query_job_key:
@@ -3337,6 +3347,8 @@ class ManagementPanelQuery( ManagementPanel ):
         
         self._query_job_key.Cancel()
         
+        self._UnregisterLiveSearch()
+        
     
     def GetPredicates( self ):
         
@@ -1864,6 +1864,8 @@ class MediaPanelThumbnails( MediaPanel ):
         
         thumbnail_cache = HG.client_controller.GetCache( 'thumbnail' )
         
+        page_is_visible = page_index in self._CalculateVisiblePageIndices()
+        
         for ( thumbnail_index, thumbnail ) in page_thumbnails:
             
             hash = thumbnail.GetDisplayMedia().GetHash()
@@ -1888,7 +1890,7 @@ class MediaPanelThumbnails( MediaPanel ):
                 
             
         
-        HG.client_controller.GetCache( 'thumbnail' ).Waterfall( self._page_key, thumbnails_to_render_later )
+        HG.client_controller.GetCache( 'thumbnail' ).Waterfall( self._page_key, thumbnails_to_render_later, visible = page_is_visible )
         
     
     def _ExportFiles( self ):
@@ -2195,7 +2197,27 @@ class MediaPanelThumbnails( MediaPanel ):
         
         if len( thumbnails_to_render_later ) > 0:
             
-            HG.client_controller.GetCache( 'thumbnail' ).Waterfall( self._page_key, thumbnails_to_render_later )
+            visible_page_indices = self._CalculateVisiblePageIndices()
+            
+            page_visible_thumbnails = []
+            offscreen_thumbnails = []
+            
+            for thumbnail in thumbnails_to_render_later:
+                
+                thumbnail_index = self._sorted_media.index( thumbnail )
+                
+                if self._GetPageIndexFromThumbnailIndex( thumbnail_index ) in visible_page_indices:
+                    
+                    page_visible_thumbnails.append( thumbnail )
+                    
+                else:
+                    
+                    offscreen_thumbnails.append( thumbnail )
+                    
+                
+            
+            thumbnail_cache.Waterfall( self._page_key, page_visible_thumbnails, visible = True )
+            thumbnail_cache.Waterfall( self._page_key, offscreen_thumbnails )
             
         
     
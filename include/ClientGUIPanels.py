@@ -714,6 +714,7 @@ class ReviewServicePanel( wx.Panel ):
             
             self._download_progress = ClientGUICommon.TextAndGauge( self )
             self._processing_progress = ClientGUICommon.TextAndGauge( self )
+            self._processing_speed_st = ClientGUICommon.BetterStaticText( self )
             
             self._sync_now_button = ClientGUICommon.BetterButton( self, 'process now', self._SyncNow )
             self._pause_play_button = ClientGUICommon.BetterButton( self, 'pause', self._PausePlay )
@@ -745,6 +746,7 @@ class ReviewServicePanel( wx.Panel ):
             self.AddF( self._metadata_st, CC.FLAGS_EXPAND_PERPENDICULAR )
             self.AddF( self._download_progress, CC.FLAGS_EXPAND_PERPENDICULAR )
             self.AddF( self._processing_progress, CC.FLAGS_EXPAND_PERPENDICULAR )
+            self.AddF( self._processing_speed_st, CC.FLAGS_EXPAND_PERPENDICULAR )
             self.AddF( hbox, CC.FLAGS_BUTTON_SIZER )
             
             HG.client_controller.sub( self, 'ServiceUpdated', 'service_updated' )
@@ -922,12 +924,13 @@ class ReviewServicePanel( wx.Panel ):
         
         def THREADFetchInfo( self ):
             
-            def wx_code( download_text, download_value, processing_text, processing_value, range ):
+            def wx_code( download_text, download_value, processing_text, processing_value, range, processing_speed_text ):
                 
                 if self:
                     
                     self._download_progress.SetValue( download_text, download_value, range )
                     self._processing_progress.SetValue( processing_text, processing_value, range )
+                    self._processing_speed_st.SetLabelText( processing_speed_text )
                     
                     if processing_value == download_value:
                         
@@ -978,7 +981,55 @@ class ReviewServicePanel( wx.Panel ):
             
             processing_text = 'processed ' + HydrusData.ConvertValueRangeToPrettyString( processing_value, range )
             
-            wx.CallAfter( wx_code, download_text, download_value, processing_text, processing_value, range )
+            processing_history = HG.client_controller.Read( 'repository_processing_history', self._service.GetServiceKey() )
+            
+            one_day_ago = HydrusData.GetNow() - 86400
+            
+            row_names_to_totals = {}
+            row_names_to_recent_totals = {}
+            
+            for ( timestamp, row_name, num_rows, time_took ) in processing_history:
+                
+                ( total_num_rows, total_time_took ) = row_names_to_totals.get( row_name, ( 0, 0.0 ) )
+                
+                row_names_to_totals[ row_name ] = ( total_num_rows + num_rows, total_time_took + time_took )
+                
+                if timestamp > one_day_ago:
+                    
+                    ( total_num_rows, total_time_took ) = row_names_to_recent_totals.get( row_name, ( 0, 0.0 ) )
+                    
+                    row_names_to_recent_totals[ row_name ] = ( total_num_rows + num_rows, total_time_took + time_took )
+                    
+                
+            
+            speed_lines = []
+            
+            for row_name in sorted( row_names_to_totals.keys() ):
+                
+                ( num_rows, time_took ) = row_names_to_totals[ row_name ]
+                
+                line = row_name + ': ' + HydrusData.ConvertIntToPrettyString( num_rows / max( time_took, 0.001 ) ) + ' rows/s overall'
+                
+                if row_name in row_names_to_recent_totals:
+                    
+                    ( num_rows, time_took ) = row_names_to_recent_totals[ row_name ]
+                    
+                    line += ', ' + HydrusData.ConvertIntToPrettyString( num_rows / max( time_took, 0.001 ) ) + ' rows/s in the last day'
+                    
+                
+                speed_lines.append( line )
+                
+            
+            if len( speed_lines ) == 0:
+                
+                processing_speed_text = 'no processing speeds recorded yet'
+                
+            else:
+                
+                processing_speed_text = 'processing speeds:' + os.linesep + os.linesep.join( speed_lines )
+                
+            
+            wx.CallAfter( wx_code, download_text, download_value, processing_text, processing_value, range, processing_speed_text )
             
         
     
@@ -1499,6 +1499,12 @@ class EditServersideService( ClientGUIScrolledPanels.EditPanel ):
             
             self._panels.append( self._ServiceRestrictedPanel( self, self._dictionary ) )
             
+            # older servers do not know about update formats
+            if self._service_type in HC.REPOSITORIES and 'update_format' in self._dictionary:
+                
+                self._panels.append( self._ServiceRepositoryPanel( self, self._dictionary ) )
+                
+            
             if self._service_type == HC.FILE_REPOSITORY:
                 
                 self._panels.append( self._ServiceFileRepositoryPanel( self, self._dictionary ) )
@@ -1627,6 +1633,46 @@ class EditServersideService( ClientGUIScrolledPanels.EditPanel ):
             
         
     
+    class _ServiceRepositoryPanel( ClientGUICommon.StaticBox ):
+        
+        def __init__( self, parent, dictionary ):
+            
+            ClientGUICommon.StaticBox.__init__( self, parent, 'repository' )
+            
+            self._update_format = ClientGUICommon.BetterChoice( self )
+            
+            for update_format in ( HC.UPDATE_FORMAT_JSON, HC.UPDATE_FORMAT_BINARY ):
+                
+                self._update_format.Append( HC.update_format_string_lookup[ update_format ], update_format )
+                
+            
+            #
+            
+            update_format = dictionary[ 'update_format' ]
+            
+            self._update_format.SelectClientData( update_format )
+            
+            #
+            
+            rows = []
+            
+            rows.append( ( 'format for new update files: ', self._update_format ) )
+            
+            gridbox = ClientGUICommon.WrapInGrid( self, rows )
+            
+            self.AddF( gridbox, CC.FLAGS_EXPAND_SIZER_PERPENDICULAR )
+            
+        
+        def GetValue( self ):
+            
+            dictionary_part = {}
+            
+            dictionary_part[ 'update_format' ] = self._update_format.GetChoice()
+            
+            return dictionary_part
+            
+        
+    
     class _ServiceFileRepositoryPanel( ClientGUICommon.StaticBox ):
         
         def __init__( self, parent, dictionary ):
@@ -1756,6 +1756,21 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             self._network_timeout = wx.SpinCtrl( self, min = 3, max = 300 )
             self._network_timeout.SetToolTipString( 'If a network connection experiences any uninterrupted inactivity for this duration, it will throw an error.' )
             
+            self._max_network_jobs = wx.SpinCtrl( self, min = 1, max = 100 )
+            self._max_network_jobs.SetToolTipString( 'The most network jobs that can be downloading at once. Others will wait in a queue, with interactive jobs ahead of downloaders, repositories and subscriptions.' )
+            
+            self._max_network_jobs_per_domain = wx.SpinCtrl( self, min = 1, max = 100 )
+            self._max_network_jobs_per_domain.SetToolTipString( 'The most network jobs that can be downloading from the same domain (e.g. anything under example.com) at once.' )
+            
+            self._network_pool_connections = wx.SpinCtrl( self, min = 1, max = 200 )
+            self._network_pool_connections.SetToolTipString( 'How many different hosts each session keeps a pool of open connections for.' )
+            
+            self._network_pool_maxsize = wx.SpinCtrl( self, min = 1, max = 200 )
+            self._network_pool_maxsize.SetToolTipString( 'How many open connections each of those pools keeps for reuse. Reusing a connection saves a new tls handshake.' )
+            
+            self._network_connection_retries = wx.SpinCtrl( self, min = 0, max = 10 )
+            self._network_connection_retries.SetToolTipString( 'How many times to quietly retry a connection that fails to open before the job deals with the error itself.' )
+            
             proxy_panel = ClientGUICommon.StaticBox( self, 'proxy settings' )
             
             self._proxy_type = ClientGUICommon.BetterChoice( proxy_panel )
@@ -1777,6 +1792,13 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             
             self._network_timeout.SetValue( self._new_options.GetInteger( 'network_timeout' ) )
             
+            self._max_network_jobs.SetValue( self._new_options.GetInteger( 'max_network_jobs' ) )
+            self._max_network_jobs_per_domain.SetValue( self._new_options.GetInteger( 'max_network_jobs_per_domain' ) )
+            
+            self._network_pool_connections.SetValue( self._new_options.GetInteger( 'network_pool_connections' ) )
+            self._network_pool_maxsize.SetValue( self._new_options.GetInteger( 'network_pool_maxsize' ) )
+            self._network_connection_retries.SetValue( self._new_options.GetInteger( 'network_connection_retries' ) )
+            
             self._proxy_type.Append( 'http', 'http' )
             self._proxy_type.Append( 'socks4', 'socks4' )
             self._proxy_type.Append( 'socks5', 'socks5' )
@@ -1835,6 +1857,11 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             
             rows.append( ( 'external ip/host override: ', self._external_host ) )
             rows.append( ( 'network timeout (seconds): ', self._network_timeout ) )
+            rows.append( ( 'max simultaneous network jobs: ', self._max_network_jobs ) )
+            rows.append( ( 'max simultaneous network jobs per domain: ', self._max_network_jobs_per_domain ) )
+            rows.append( ( 'hosts to keep connection pools for, per session: ', self._network_pool_connections ) )
+            rows.append( ( 'connections to keep open per host: ', self._network_pool_maxsize ) )
+            rows.append( ( 'connection retries: ', self._network_connection_retries ) )
             
             gridbox = ClientGUICommon.WrapInGrid( self, rows )
             
@@ -1877,6 +1904,13 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             
             self._new_options.SetInteger( 'network_timeout', self._network_timeout.GetValue() )
             
+            self._new_options.SetInteger( 'max_network_jobs', self._max_network_jobs.GetValue() )
+            self._new_options.SetInteger( 'max_network_jobs_per_domain', self._max_network_jobs_per_domain.GetValue() )
+            
+            self._new_options.SetInteger( 'network_pool_connections', self._network_pool_connections.GetValue() )
+            self._new_options.SetInteger( 'network_pool_maxsize', self._network_pool_maxsize.GetValue() )
+            self._new_options.SetInteger( 'network_connection_retries', self._network_connection_retries.GetValue() )
+            
         
     
     class _DownloadingPanel( wx.Panel ):
@@ -2162,6 +2196,11 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             
             self._filter_inbox_and_archive_predicates.SetValue( self._new_options.GetBoolean( 'filter_inbox_and_archive_predicates' ) )
             
+            self._update_search_pages_live = wx.CheckBox( self, label = 'add and remove files from search pages as files and tags change' )
+            self._update_search_pages_live.SetToolTipString( 'If checked, search pages will show new imports that match their search, and drop files that stop matching, without needing a refresh. Searches with a system:limit are not updated.' )
+            
+            self._update_search_pages_live.SetValue( self._new_options.GetBoolean( 'update_search_pages_live' ) )
+            
             self._file_system_predicate_age = ClientGUIPredicates.PanelPredicateSystemAge( self )
             self._file_system_predicate_duration = ClientGUIPredicates.PanelPredicateSystemDuration( self )
             self._file_system_predicate_height = ClientGUIPredicates.PanelPredicateSystemHeight( self )
@@ -2180,6 +2219,7 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             vbox = wx.BoxSizer( wx.VERTICAL )
             
             vbox.AddF( self._filter_inbox_and_archive_predicates, CC.FLAGS_VCENTER )
+            vbox.AddF( self._update_search_pages_live, CC.FLAGS_VCENTER )
             vbox.AddF( ( 20, 20 ), CC.FLAGS_EXPAND_PERPENDICULAR )
             vbox.AddF( self._file_system_predicate_age, CC.FLAGS_EXPAND_PERPENDICULAR )
             vbox.AddF( self._file_system_predicate_duration, CC.FLAGS_EXPAND_PERPENDICULAR )
@@ -2200,6 +2240,7 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
         def UpdateOptions( self ):
             
             self._new_options.SetBoolean( 'filter_inbox_and_archive_predicates', self._filter_inbox_and_archive_predicates.GetValue() )
+            self._new_options.SetBoolean( 'update_search_pages_live', self._update_search_pages_live.GetValue() )
             
             system_predicates = HC.options[ 'file_system_predicates' ]
             
@@ -3225,6 +3266,12 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             
             self._estimated_number_thumbnails = wx.StaticText( media_panel, label = '' )
             
+            self._rendered_thumbnail_disk_cache_mb = ClientGUICommon.NoneableSpinCtrl( media_panel, '', none_phrase = 'do not keep rendered thumbnails on disk', min = 16, max = 65536 )
+            self._rendered_thumbnail_disk_cache_mb.SetToolTipString( 'If set, the client saves thumbnails it has rendered to a file in your db directory, so it can skip decoding them again after a restart. This can make opening pages of thumbnails much faster after boot.' )
+            
+            self._thumbnail_waterfall_workers = wx.SpinCtrl( media_panel, min = 1, max = 32 )
+            self._thumbnail_waterfall_workers.SetToolTipString( 'How many threads to use to load and decode thumbnails as pages fill in. If you have several cores and a fast drive, raising this will get big pages of thumbnails on screen faster.' )
+            
             self._fullscreen_cache_size = wx.SpinCtrl( media_panel, min = 25, max = 8192 )
             self._fullscreen_cache_size.Bind( wx.EVT_SPINCTRL, self.EventFullscreensUpdate )
             
@@ -3264,6 +3311,15 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             
             self._forced_search_limit = ClientGUICommon.NoneableSpinCtrl( misc_panel, '', min = 1, max = 100000 )
             
+            self._keep_similar_files_phash_index_in_memory = wx.CheckBox( misc_panel )
+            self._keep_similar_files_phash_index_in_memory.SetToolTipString( 'If set, the client keeps a copy of all its similar files phashes in memory (about 20 bytes each), which makes duplicate searches much faster than walking the similar files tree on disk.' )
+            
+            self._use_multi_index_hashing_for_similar_files = wx.CheckBox( misc_panel )
+            self._use_multi_index_hashing_for_similar_files.SetToolTipString( 'If set, this database keeps some extra similar files search data on disk that is much faster than the similar files tree for small search distances, which is what duplicate searches usually use. When you first turn it on, it is generated the next time similar files maintenance runs. If the in-memory search data is on, that is used instead.' )
+            
+            self._file_import_workers = wx.SpinCtrl( misc_panel, min = 1, max = 32 )
+            self._file_import_workers.SetToolTipString( 'How many files hard drive imports and import folders hash and thumbnail at once. The database still adds them one at a time. If you have several cores, raising this will speed up big imports. If your files are on a slow spinning drive, lowering it may help.' )
+            
             #
             
             self._disk_cache_init_period.SetValue( self._new_options.GetNoneableInteger( 'disk_cache_init_period' ) )
@@ -3277,6 +3333,10 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             
             self._thumbnail_cache_size.SetValue( int( HC.options[ 'thumbnail_cache_size' ] / 1048576 ) )
             
+            self._rendered_thumbnail_disk_cache_mb.SetValue( self._new_options.GetNoneableInteger( 'rendered_thumbnail_disk_cache_mb' ) )
+            
+            self._thumbnail_waterfall_workers.SetValue( self._new_options.GetInteger( 'thumbnail_waterfall_workers' ) )
+            
             self._fullscreen_cache_size.SetValue( int( HC.options[ 'fullscreen_cache_size' ] / 1048576 ) )
             
             self._video_buffer_size_mb.SetValue( self._new_options.GetInteger( 'video_buffer_size_mb' ) )
@@ -3295,6 +3355,11 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             
             self._forced_search_limit.SetValue( self._new_options.GetNoneableInteger( 'forced_search_limit' ) )
             
+            self._keep_similar_files_phash_index_in_memory.SetValue( self._new_options.GetBoolean( 'keep_similar_files_phash_index_in_memory' ) )
+            self._use_multi_index_hashing_for_similar_files.SetValue( self._new_options.GetBoolean( 'use_multi_index_hashing_for_similar_files' ) )
+            
+            self._file_import_workers.SetValue( self._new_options.GetInteger( 'file_import_workers' ) )
+            
             #
             
             
@@ -3337,6 +3402,8 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             rows.append( ( 'Thumbnail width: ', self._thumbnail_width ) )
             rows.append( ( 'Thumbnail height: ', self._thumbnail_height ) )
             rows.append( ( 'MB memory reserved for thumbnail cache: ', thumbnails_sizer ) )
+            rows.append( ( 'MB disk reserved for rendered thumbnails: ', self._rendered_thumbnail_disk_cache_mb ) )
+            rows.append( ( 'Number of thumbnail loading threads: ', self._thumbnail_waterfall_workers ) )
             rows.append( ( 'MB memory reserved for media viewer cache: ', fullscreens_sizer ) )
             
             gridbox = ClientGUICommon.WrapInGrid( media_panel, rows )
@@ -3390,6 +3457,9 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             rows = []
             
             rows.append( ( 'Forced system:limit for all searches: ', self._forced_search_limit ) )
+            rows.append( ( 'Keep similar files search data in memory: ', self._keep_similar_files_phash_index_in_memory ) )
+            rows.append( ( 'Use multi-index hashing for similar files searches: ', self._use_multi_index_hashing_for_similar_files ) )
+            rows.append( ( 'Number of file import threads: ', self._file_import_workers ) )
             
             gridbox = ClientGUICommon.WrapInGrid( misc_panel, rows )
             
@@ -3475,12 +3545,22 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             HC.options[ 'thumbnail_dimensions' ] = new_thumbnail_dimensions
             
             HC.options[ 'thumbnail_cache_size' ] = self._thumbnail_cache_size.GetValue() * 1048576
+            
+            self._new_options.SetNoneableInteger( 'rendered_thumbnail_disk_cache_mb', self._rendered_thumbnail_disk_cache_mb.GetValue() )
+            
+            self._new_options.SetInteger( 'thumbnail_waterfall_workers', self._thumbnail_waterfall_workers.GetValue() )
+            
             HC.options[ 'fullscreen_cache_size' ] = self._fullscreen_cache_size.GetValue() * 1048576
             
             self._new_options.SetInteger( 'video_buffer_size_mb', self._video_buffer_size_mb.GetValue() )
             
             self._new_options.SetNoneableInteger( 'forced_search_limit', self._forced_search_limit.GetValue() )
             
+            self._new_options.SetBoolean( 'keep_similar_files_phash_index_in_memory', self._keep_similar_files_phash_index_in_memory.GetValue() )
+            self._new_options.SetBoolean( 'use_multi_index_hashing_for_similar_files', self._use_multi_index_hashing_for_similar_files.GetValue() )
+            
+            self._new_options.SetInteger( 'file_import_workers', self._file_import_workers.GetValue() )
+            
             HC.options[ 'num_autocomplete_chars' ] = self._num_autocomplete_chars.GetValue()
             
             HC.options[ 'fetch_ac_results_automatically' ] = self._fetch_ac_results_automatically.GetValue()
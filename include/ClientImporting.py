@@ -20,9 +20,11 @@ import HydrusSerialisable
 import HydrusTags
 import json
 import os
+import Queue
 import random
 import re
 import shutil
+import sys
 import threading
 import time
 import traceback
@@ -36,6 +38,126 @@ CHECKER_STATUS_404 = 2
 
 DID_FILE_WORK_MINIMUM_SLEEP_TIME = 0.1
 
+def PrepareFileImportJobs( paths, file_import_options, mimes = None ):
+    
+    # copies each path to temp and does the cpu-heavy part of the import--hash, file info, thumbnail, phashes--on a small pool of worker threads
+    # the caller is the committer: it gets lists of ( path, file_import_job, exc_info ), one for each path that is ready, and should do the actual import of that batch before asking for the next
+    # exc_info is the worker's sys.exc_info() if preparation failed, so the caller can re-raise it with the original traceback
+    # a job of None with no exc_info means the file's mime was not in mimes
+    # only a few paths are worked on at once, so we aren't copying a whole folder to temp before the first commit
+    # temp paths are cleaned up here once the caller has moved on, or if it stops early
+    
+    num_workers = max( 1, HG.client_controller.GetNewOptions().GetInteger( 'file_import_workers' ) )
+    
+    results = Queue.Queue()
+    
+    def THREADPrepare( path ):
+        
+        os_file_handle = None
+        temp_path = None
+        file_import_job = None
+        exc_info = None
+        
+        try:
+            
+            if not os.path.exists( path ):
+                
+                raise Exception( 'Source file does not exist!' )
+                
+            
+            if mimes is None or HydrusFileHandling.GetMime( path ) in mimes:
+                
+                ( os_file_handle, temp_path ) = HydrusPaths.GetTempPath()
+                
+                copied = HydrusPaths.MirrorFile( path, temp_path )
+                
+                if not copied:
+                    
+                    raise Exception( 'File failed to copy--see log for error.' )
+                    
+                
+                file_import_job = FileImportJob( temp_path, file_import_options )
+                
+                file_import_job.Prepare()
+                
+            
+        except Exception:
+            
+            file_import_job = None
+            exc_info = sys.exc_info()
+            
+        
+        results.put( ( path, os_file_handle, temp_path, file_import_job, exc_info ) )
+        
+    
+    paths = list( paths )
+    paths.reverse()
+    
+    num_in_flight = 0
+    
+    try:
+        
+        while True:
+            
+            while num_in_flight < num_workers and len( paths ) > 0:
+                
+                HG.client_controller.CallToThread( THREADPrepare, paths.pop() )
+                
+                num_in_flight += 1
+                
+            
+            if num_in_flight == 0:
+                
+                break
+                
+            
+            batch = [ results.get() ]
+            
+            while True:
+                
+                try:
+                    
+                    batch.append( results.get_nowait() )
+                    
+                except Queue.Empty:
+                    
+                    break
+                    
+                
+            
+            num_in_flight -= len( batch )
+            
+            try:
+                
+                yield [ ( path, file_import_job, exc_info ) for ( path, os_file_handle, temp_path, file_import_job, exc_info ) in batch ]
+                
+            finally:
+                
+                for ( path, os_file_handle, temp_path, file_import_job, exc_info ) in batch:
+                    
+                    if temp_path is not None:
+                        
+                        HydrusPaths.CleanUpTempPath( os_file_handle, temp_path )
+                        
+                    
+                
+            
+        
+    finally:
+        
+        while num_in_flight > 0:
+            
+            ( path, os_file_handle, temp_path, file_import_job, exc_info ) = results.get()
+            
+            num_in_flight -= 1
+            
+            if temp_path is not None:
+                
+                HydrusPaths.CleanUpTempPath( os_file_handle, temp_path )
+                
+            
+        
+    
 def THREADDownloadURL( job_key, url, url_string ):
     
     job_key.SetVariable( 'popup_title', url_string )
@@ -251,6 +373,7 @@ class FileImportJob( object ):
         self._thumbnail = None
         self._phashes = None
         self._extra_hashes = None
+        self._extra_hashes_callable = None
         
     
     def GetExtraHashes( self ):
@@ -364,7 +487,7 @@ class FileImportJob( object ):
         
         HydrusImageHandling.ConvertToPngIfBmp( self._temp_path )
         
-        self._hash = HydrusFileHandling.GetHashFromPath( self._temp_path )
+        ( self._hash, self._extra_hashes_callable ) = HydrusFileHandling.GetHashAndExtraHashesFromPath( self._temp_path )
         
         self._pre_import_status = HG.client_controller.Read( 'hash_status', self._hash )
         
@@ -397,7 +520,49 @@ class FileImportJob( object ):
             self._phashes = ClientImageHandling.GenerateShapePerceptualHashes( self._temp_path, mime )
             
         
-        self._extra_hashes = HydrusFileHandling.GetExtraHashesFromPath( self._temp_path )
+        if self._extra_hashes_callable is None:
+            
+            self._extra_hashes = HydrusFileHandling.GetExtraHashesFromPath( self._temp_path )
+            
+        else:
+            
+            # these were read alongside the sha256 in GenerateHashAndStatus
+            
+            self.WaitOnExtraHashes()
+            
+        
+    
+    def Prepare( self ):
+        
+        # everything that comes before the db write. it is all disk and cpu work, so several jobs can safely do this at once
+        
+        try:
+            
+            self.GenerateHashAndStatus()
+            
+            if self.IsNewToDB():
+                
+                self.GenerateInfo()
+                
+            
+        finally:
+            
+            # if we stopped early, the extra hashes worker is still out there
+            
+            self.WaitOnExtraHashes()
+            
+        
+    
+    def WaitOnExtraHashes( self ):
+        
+        if self._extra_hashes_callable is not None:
+            
+            extra_hashes_callable = self._extra_hashes_callable
+            
+            self._extra_hashes_callable = None
+            
+            self._extra_hashes = extra_hashes_callable()
+            
         
     
 class GalleryImport( HydrusSerialisable.SerialisableBase ):
@@ -1512,6 +1677,88 @@ class HDDImport( HydrusSerialisable.SerialisableBase ):
         self._new_files_event = threading.Event()
         
     
+    def _CommitFileImportJobs( self, page_key, paths_and_file_import_jobs ):
+        
+        client_files_manager = HG.client_controller.client_files_manager
+        
+        file_import_jobs = [ file_import_job for ( path, file_import_job ) in paths_and_file_import_jobs ]
+        
+        results = client_files_manager.ImportPreparedFiles( file_import_jobs )
+        
+        imported_hashes = []
+        
+        for ( ( path, file_import_job ), ( status, hash, note ) ) in zip( paths_and_file_import_jobs, results ):
+            
+            try:
+                
+                self._paths_cache.UpdateSeedStatus( path, status, note = note )
+                
+                if status in ( CC.STATUS_SUCCESSFUL, CC.STATUS_REDUNDANT ):
+                    
+                    with self._lock:
+                        
+                        if path in self._paths_to_tags:
+                            
+                            service_keys_to_tags = self._paths_to_tags[ path ]
+                            
+                        else:
+                            
+                            service_keys_to_tags = {}
+                            
+                        
+                    
+                    service_keys_to_content_updates = ClientData.ConvertServiceKeysToTagsToServiceKeysToContentUpdates( { hash }, service_keys_to_tags )
+                    
+                    if len( service_keys_to_content_updates ) > 0:
+                        
+                        HG.client_controller.WriteSynchronous( 'content_updates', service_keys_to_content_updates )
+                        
+                    
+                    imported_hashes.append( hash )
+                    
+                    if self._delete_after_success:
+                        
+                        try:
+                            
+                            ClientData.DeletePath( path )
+                            
+                        except Exception as e:
+                            
+                            HydrusData.ShowText( 'While attempting to delete ' + path + ', the following error occured:' )
+                            HydrusData.ShowException( e )
+                            
+                        
+                        txt_path = path + '.txt'
+                        
+                        if os.path.exists( txt_path ):
+                            
+                            try:
+                                
+                                ClientData.DeletePath( txt_path )
+                                
+                            except Exception as e:
+                                
+                                HydrusData.ShowText( 'While attempting to delete ' + txt_path + ', the following error occured:' )
+                                HydrusData.ShowException( e )
+                                
+                            
+                        
+                    
+                
+            except Exception as e:
+                
+                self._paths_cache.UpdateSeedStatus( path, CC.STATUS_FAILED, exception = e )
+                
+            
+        
+        if len( imported_hashes ) > 0:
+            
+            media_results = HG.client_controller.Read( 'media_results', imported_hashes )
+            
+            HG.client_controller.pub( 'add_media_results', page_key, media_results )
+            
+        
+    
     def _GetSerialisableInfo( self ):
         
         serialisable_url_cache = self._paths_cache.GetSerialisableTuple()
@@ -1532,122 +1779,84 @@ class HDDImport( HydrusSerialisable.SerialisableBase ):
     
     def _WorkOnFiles( self, page_key ):
         
-        path = self._paths_cache.GetNextSeed( CC.STATUS_UNKNOWN )
+        paths = self._paths_cache.GetSeeds( CC.STATUS_UNKNOWN )
         
-        if path is None:
+        if len( paths ) == 0:
             
             return False
             
         
         with self._lock:
             
-            if path in self._paths_to_tags:
-                
-                service_keys_to_tags = self._paths_to_tags[ path ]
-                
-            else:
-                
-                service_keys_to_tags = {}
-                
+            self._current_action = 'importing'
             
         
+        # the pool prepares the next few files while this thread commits whatever is ready in one db transaction
+        
+        prepared_file_import_jobs = PrepareFileImportJobs( paths, self._file_import_options )
+        
         try:
             
-            if not os.path.exists( path ):
-                
-                raise Exception( 'Source file does not exist!' )
-                
-            
-            with self._lock:
-                
-                self._current_action = 'preparing to import'
-                
-            
-            ( os_file_handle, temp_path ) = HydrusPaths.GetTempPath()
-            
-            try:
-                
-                copied = HydrusPaths.MirrorFile( path, temp_path )
-                
-                if not copied:
-                    
-                    raise Exception( 'File failed to copy--see log for error.' )
-                    
-                
-                with self._lock:
-                    
-                    self._current_action = 'importing'
-                    
-                
-                file_import_job = FileImportJob( temp_path, self._file_import_options )
-                
-                client_files_manager = HG.client_controller.client_files_manager
-                
-                ( status, hash ) = client_files_manager.ImportFile( file_import_job )
-                
-            finally:
-                
-                HydrusPaths.CleanUpTempPath( os_file_handle, temp_path )
-                
-            
-            self._paths_cache.UpdateSeedStatus( path, status )
-            
-            if status in ( CC.STATUS_SUCCESSFUL, CC.STATUS_REDUNDANT ):
+            for batch in prepared_file_import_jobs:
                 
-                service_keys_to_content_updates = ClientData.ConvertServiceKeysToTagsToServiceKeysToContentUpdates( { hash }, service_keys_to_tags )
+                paths_and_file_import_jobs = []
                 
-                if len( service_keys_to_content_updates ) > 0:
-                    
-                    HG.client_controller.WriteSynchronous( 'content_updates', service_keys_to_content_updates )
+                for ( path, file_import_job, exc_info ) in batch:
                     
-                
-                ( media_result, ) = HG.client_controller.Read( 'media_results', ( hash, ) )
-                
-                HG.client_controller.pub( 'add_media_results', page_key, ( media_result, ) )
-                
-                if self._delete_after_success:
+                    if exc_info is None:
+                        
+                        paths_and_file_import_jobs.append( ( path, file_import_job ) )
+                        
+                        continue
+                        
                     
                     try:
                         
-                        ClientData.DeletePath( path )
+                        ( exc_type, exc_value, exc_traceback ) = exc_info
+                        
+                        raise exc_type, exc_value, exc_traceback
+                        
+                    except HydrusExceptions.MimeException as e:
+                        
+                        status = CC.STATUS_UNINTERESTING_MIME
+                        
+                        self._paths_cache.UpdateSeedStatus( path, status )
                         
                     except Exception as e:
                         
-                        HydrusData.ShowText( 'While attempting to delete ' + path + ', the following error occured:' )
-                        HydrusData.ShowException( e )
+                        status = CC.STATUS_FAILED
+                        
+                        self._paths_cache.UpdateSeedStatus( path, status, exception = e )
                         
                     
-                    txt_path = path + '.txt'
+                
+                if len( paths_and_file_import_jobs ) > 0:
                     
-                    if os.path.exists( txt_path ):
+                    try:
                         
-                        try:
-                            
-                            ClientData.DeletePath( txt_path )
-                            
-                        except Exception as e:
+                        self._CommitFileImportJobs( page_key, paths_and_file_import_jobs )
+                        
+                    except Exception as e:
+                        
+                        for ( path, file_import_job ) in paths_and_file_import_jobs:
                             
-                            HydrusData.ShowText( 'While attempting to delete ' + txt_path + ', the following error occured:' )
-                            HydrusData.ShowException( e )
+                            self._paths_cache.UpdateSeedStatus( path, CC.STATUS_FAILED, exception = e )
                             
                         
                     
                 
-            
-        except HydrusExceptions.MimeException as e:
-            
-            status = CC.STATUS_UNINTERESTING_MIME
-            
-            self._paths_cache.UpdateSeedStatus( path, status )
-            
-        except Exception as e:
-            
-            status = CC.STATUS_FAILED
-            
-            self._paths_cache.UpdateSeedStatus( path, status, exception = e )
+                if self._paused or HG.view_shutdown or HG.client_controller.PageClosedButNotDestroyed( page_key ) or HG.client_controller.PageCompletelyDestroyed( page_key ):
+                    
+                    break
+                    
+                
+                HG.client_controller.WaitUntilViewFree()
+                
             
         finally:
             
+            prepared_file_import_jobs.close()
+            
             with self._lock:
                 
                 self._current_action = ''
@@ -2047,118 +2256,156 @@ class ImportFolder( HydrusSerialisable.SerialisableBaseNamed ):
                 
                 i = 0
                 
-                while True:
+                if HC.options[ 'pause_import_folders_sync' ] or HG.view_shutdown:
                     
-                    path = self._path_cache.GetNextSeed( CC.STATUS_UNKNOWN )
+                    paths = []
                     
-                    p1 = HC.options[ 'pause_import_folders_sync' ]
-                    p2 = HG.view_shutdown
+                else:
                     
-                    if path is None or p1 or p2:
-                        
-                        break
-                        
+                    paths = self._path_cache.GetSeeds( CC.STATUS_UNKNOWN )
                     
-                    try:
+                
+                # the pool prepares the next few files while this thread commits whatever is ready in one db transaction
+                
+                prepared_file_import_jobs = PrepareFileImportJobs( paths, self._file_import_options, mimes = self._mimes )
+                
+                try:
+                    
+                    for batch in prepared_file_import_jobs:
                         
-                        mime = HydrusFileHandling.GetMime( path )
+                        paths_and_file_import_jobs = []
                         
-                        if mime in self._mimes:
-                            
-                            ( os_file_handle, temp_path ) = HydrusPaths.GetTempPath()
+                        for ( path, file_import_job, exc_info ) in batch:
                             
                             try:
                                 
-                                copied = HydrusPaths.MirrorFile( path, temp_path )
+                                if exc_info is not None:
+                                    
+                                    ( exc_type, exc_value, exc_traceback ) = exc_info
+                                    
+                                    raise exc_type, exc_value, exc_traceback
+                                    
                                 
-                                if not copied:
+                                if file_import_job is None:
+                                    
+                                    self._path_cache.UpdateSeedStatus( path, CC.STATUS_UNINTERESTING_MIME )
+                                    
+                                else:
                                     
-                                    raise Exception( 'File failed to copy--see log for error.' )
+                                    paths_and_file_import_jobs.append( ( path, file_import_job ) )
                                     
                                 
-                                file_import_job = FileImportJob( temp_path, self._file_import_options )
+                            except Exception as e:
                                 
-                                client_files_manager = HG.client_controller.client_files_manager
+                                HydrusData.Print( 'A file failed to import from import folder ' + self._name + ':' )
                                 
-                                ( status, hash ) = client_files_manager.ImportFile( file_import_job )
+                                self._path_cache.UpdateSeedStatus( path, CC.STATUS_FAILED, exception = e )
                                 
-                            finally:
+                            
+                        
+                        client_files_manager = HG.client_controller.client_files_manager
+                        
+                        try:
+                            
+                            results = client_files_manager.ImportPreparedFiles( [ file_import_job for ( path, file_import_job ) in paths_and_file_import_jobs ] )
+                            
+                        except Exception as e:
+                            
+                            HydrusData.Print( 'A batch of files failed to import from import folder ' + self._name + ':' )
+                            
+                            for ( path, file_import_job ) in paths_and_file_import_jobs:
                                 
-                                HydrusPaths.CleanUpTempPath( os_file_handle, temp_path )
+                                self._path_cache.UpdateSeedStatus( path, CC.STATUS_FAILED, exception = e )
                                 
                             
-                            self._path_cache.UpdateSeedStatus( path, status )
+                            results = []
                             
-                            if status in ( CC.STATUS_SUCCESSFUL, CC.STATUS_REDUNDANT ):
-                                
-                                downloaded_tags = []
+                        
+                        for ( ( path, file_import_job ), ( status, hash, note ) ) in zip( paths_and_file_import_jobs, results ):
+                            
+                            try:
                                 
-                                service_keys_to_content_updates = self._tag_import_options.GetServiceKeysToContentUpdates( hash, downloaded_tags ) # explicit tags
+                                self._path_cache.UpdateSeedStatus( path, status, note = note )
                                 
-                                if len( service_keys_to_content_updates ) > 0:
+                                if status in ( CC.STATUS_SUCCESSFUL, CC.STATUS_REDUNDANT ):
                                     
-                                    HG.client_controller.WriteSynchronous( 'content_updates', service_keys_to_content_updates )
+                                    downloaded_tags = []
                                     
-                                
-                                service_keys_to_tags = {}
-                                
-                                for ( tag_service_key, filename_tagging_options ) in self._tag_service_keys_to_filename_tagging_options.items():
+                                    service_keys_to_content_updates = self._tag_import_options.GetServiceKeysToContentUpdates( hash, downloaded_tags ) # explicit tags
                                     
-                                    if not HG.client_controller.services_manager.ServiceExists( tag_service_key ):
+                                    if len( service_keys_to_content_updates ) > 0:
                                         
-                                        continue
+                                        HG.client_controller.WriteSynchronous( 'content_updates', service_keys_to_content_updates )
                                         
                                     
-                                    try:
+                                    service_keys_to_tags = {}
+                                    
+                                    for ( tag_service_key, filename_tagging_options ) in self._tag_service_keys_to_filename_tagging_options.items():
                                         
-                                        tags = filename_tagging_options.GetTags( tag_service_key, path )
+                                        if not HG.client_controller.services_manager.ServiceExists( tag_service_key ):
+                                            
+                                            continue
+                                            
                                         
-                                        if len( tags ) > 0:
+                                        try:
+                                            
+                                            tags = filename_tagging_options.GetTags( tag_service_key, path )
                                             
-                                            service_keys_to_tags[ tag_service_key ] = tags
+                                            if len( tags ) > 0:
+                                                
+                                                service_keys_to_tags[ tag_service_key ] = tags
+                                                
+                                            
+                                        except Exception as e:
+                                            
+                                            HydrusData.ShowText( 'Trying to parse filename tags in the import folder "' + self._name + '" threw an error!' )
+                                            
+                                            HydrusData.ShowException( e )
                                             
                                         
-                                    except Exception as e:
+                                    
+                                    if len( service_keys_to_tags ) > 0:
                                         
-                                        HydrusData.ShowText( 'Trying to parse filename tags in the import folder "' + self._name + '" threw an error!' )
+                                        service_keys_to_content_updates = ClientData.ConvertServiceKeysToTagsToServiceKeysToContentUpdates( { hash }, service_keys_to_tags )
                                         
-                                        HydrusData.ShowException( e )
+                                        HG.client_controller.WriteSynchronous( 'content_updates', service_keys_to_content_updates )
                                         
                                     
                                 
-                                if len( service_keys_to_tags ) > 0:
-                                    
-                                    service_keys_to_content_updates = ClientData.ConvertServiceKeysToTagsToServiceKeysToContentUpdates( { hash }, service_keys_to_tags )
+                                if status == CC.STATUS_SUCCESSFUL:
                                     
-                                    HG.client_controller.WriteSynchronous( 'content_updates', service_keys_to_content_updates )
+                                    successful_hashes.add( hash )
                                     
                                 
-                            
-                            if status == CC.STATUS_SUCCESSFUL:
+                            except Exception as e:
                                 
-                                successful_hashes.add( hash )
+                                HydrusData.Print( 'A file failed to import from import folder ' + self._name + ':' )
+                                
+                                self._path_cache.UpdateSeedStatus( path, CC.STATUS_FAILED, exception = e )
                                 
-                            
-                        else:
-                            
-                            self._path_cache.UpdateSeedStatus( path, CC.STATUS_UNINTERESTING_MIME )
                             
                         
-                    except Exception as e:
+                        i += len( batch )
                         
-                        error_text = traceback.format_exc()
+                        if i >= 10:
+                            
+                            self._ActionPaths()
+                            
+                            i = 0
+                            
                         
-                        HydrusData.Print( 'A file failed to import from import folder ' + self._name + ':' )
+                        p1 = HC.options[ 'pause_import_folders_sync' ]
+                        p2 = HG.view_shutdown
                         
-                        self._path_cache.UpdateSeedStatus( path, CC.STATUS_FAILED, exception = e )
+                        if p1 or p2:
+                            
+                            break
+                            
                         
                     
-                    i += 1
+                finally:
                     
-                    if i % 10 == 0:
-                        
-                        self._ActionPaths()
-                        
+                    prepared_file_import_jobs.close()
                     
                 
                 if len( successful_hashes ) > 0:
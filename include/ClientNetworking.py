@@ -11,6 +11,7 @@ import HydrusNetwork
 import HydrusNetworking
 import HydrusPaths
 import HydrusSerialisable
+import heapq
 import itertools
 import os
 import random
@@ -26,6 +27,10 @@ import yaml
 
 urllib3.disable_warnings( InsecureRequestWarning )
 
+# downloads report their data to the shared bandwidth trackers in batches, not every chunk
+BANDWIDTH_REPORT_THRESHOLD = 512 * 1024
+BANDWIDTH_REPORT_PERIOD = 0.25
+
 def CombineGETURLWithParameters( url, params_dict ):
     
     def make_safe( text ):
@@ -108,7 +113,7 @@ def ConvertStatusCodeAndDataIntoExceptionInfo( status_code, data, is_hydrus_serv
 class NetworkBandwidthManager( HydrusSerialisable.SerialisableBase ):
     
     SERIALISABLE_TYPE = HydrusSerialisable.SERIALISABLE_TYPE_NETWORK_BANDWIDTH_MANAGER
-    SERIALISABLE_VERSION = 1
+    SERIALISABLE_VERSION = 2
     
     def __init__( self ):
         
@@ -120,6 +125,8 @@ class NetworkBandwidthManager( HydrusSerialisable.SerialisableBase ):
         
         self._lock = threading.Lock()
         
+        self._bandwidth_changed_condition = threading.Condition()
+        
         self._network_contexts_to_bandwidth_trackers = collections.defaultdict( HydrusNetworking.BandwidthTracker )
         self._network_contexts_to_bandwidth_rules = collections.defaultdict( HydrusNetworking.BandwidthRules )
         
@@ -159,7 +166,8 @@ class NetworkBandwidthManager( HydrusSerialisable.SerialisableBase ):
     def _GetSerialisableInfo( self ):
         
         # note this discards ephemeral network contexts, which have page_key-specific identifiers and are temporary, not meant to be hung onto forever, and are generally invisible to the user
-        all_serialisable_trackers = [ ( network_context.GetSerialisableTuple(), tracker.GetSerialisableTuple() ) for ( network_context, tracker ) in self._network_contexts_to_bandwidth_trackers.items() if not network_context.IsEphemeral() ]
+        # the trackers never leave this client, so they can use their packed format
+        all_serialisable_trackers = [ ( network_context.GetSerialisableTuple(), tracker.DumpToBinaryString().encode( 'hex' ) ) for ( network_context, tracker ) in self._network_contexts_to_bandwidth_trackers.items() if not network_context.IsEphemeral() ]
         all_serialisable_rules = [ ( network_context.GetSerialisableTuple(), rules.GetSerialisableTuple() ) for ( network_context, rules ) in self._network_contexts_to_bandwidth_rules.items() ]
         
         return ( all_serialisable_trackers, all_serialisable_rules )
@@ -172,7 +180,7 @@ class NetworkBandwidthManager( HydrusSerialisable.SerialisableBase ):
         for ( serialisable_network_context, serialisable_tracker ) in all_serialisable_trackers:
             
             network_context = HydrusSerialisable.CreateFromSerialisableTuple( serialisable_network_context )
-            tracker = HydrusSerialisable.CreateFromSerialisableTuple( serialisable_tracker )
+            tracker = HydrusSerialisable.CreateFromBinaryString( serialisable_tracker.decode( 'hex' ) )
             
             self._network_contexts_to_bandwidth_trackers[ network_context ] = tracker
             
@@ -186,6 +194,19 @@ class NetworkBandwidthManager( HydrusSerialisable.SerialisableBase ):
             
         
     
+    def _NotifyBandwidthChanged( self ):
+        
+        with self._bandwidth_changed_condition:
+            
+            self._bandwidth_changed_condition.notify_all()
+            
+        
+        if self.engine is not None:
+            
+            self.engine.NotifyBandwidthChanged()
+            
+        
+    
     def _ReportRequestUsed( self, network_contexts ):
         
         for network_context in network_contexts:
@@ -201,6 +222,27 @@ class NetworkBandwidthManager( HydrusSerialisable.SerialisableBase ):
         self._dirty = True
         
     
+    def _UpdateSerialisableInfo( self, version, old_serialisable_info ):
+        
+        if version == 1:
+            
+            ( all_serialisable_trackers, all_serialisable_rules ) = old_serialisable_info
+            
+            new_serialisable_trackers = []
+            
+            for ( serialisable_network_context, serialisable_tracker ) in all_serialisable_trackers:
+                
+                tracker = HydrusSerialisable.CreateFromSerialisableTuple( serialisable_tracker )
+                
+                new_serialisable_trackers.append( ( serialisable_network_context, tracker.DumpToBinaryString().encode( 'hex' ) ) )
+                
+            
+            new_serialisable_info = ( new_serialisable_trackers, all_serialisable_rules )
+            
+            return ( 2, new_serialisable_info )
+            
+        
+    
     def CanContinueDownload( self, network_contexts ):
         
         with self._lock:
@@ -267,6 +309,8 @@ class NetworkBandwidthManager( HydrusSerialisable.SerialisableBase ):
             
             self._SetDirty()
             
+            self._NotifyBandwidthChanged()
+            
         
     
     def DeleteHistory( self, network_contexts ):
@@ -289,6 +333,8 @@ class NetworkBandwidthManager( HydrusSerialisable.SerialisableBase ):
             
             self._SetDirty()
             
+            self._NotifyBandwidthChanged()
+            
         
     
     def GetDefaultRules( self ):
@@ -432,6 +478,11 @@ class NetworkBandwidthManager( HydrusSerialisable.SerialisableBase ):
             
         
     
+    def NotifyBandwidthChanged( self ):
+        
+        self._NotifyBandwidthChanged()
+        
+    
     def ReportDataUsed( self, network_contexts, num_bytes ):
         
         with self._lock:
@@ -479,6 +530,8 @@ class NetworkBandwidthManager( HydrusSerialisable.SerialisableBase ):
             
             self._SetDirty()
             
+            self._NotifyBandwidthChanged()
+            
         
     
     def TryToStartRequest( self, network_contexts ):
@@ -506,6 +559,26 @@ class NetworkBandwidthManager( HydrusSerialisable.SerialisableBase ):
             
         
     
+    def WakeBandwidthWaiters( self ):
+        
+        # for when a waiting job needs to look at itself again but nothing about bandwidth has changed, so the engine does not need to hear about it
+        
+        with self._bandwidth_changed_condition:
+            
+            self._bandwidth_changed_condition.notify_all()
+            
+        
+    
+    def WaitForBandwidthChange( self, timeout ):
+        
+        # wakes early if rules or history change or a job is cancelled
+        
+        with self._bandwidth_changed_condition:
+            
+            self._bandwidth_changed_condition.wait( timeout )
+            
+        
+    
 HydrusSerialisable.SERIALISABLE_TYPES_TO_OBJECT_TYPES[ HydrusSerialisable.SERIALISABLE_TYPE_NETWORK_BANDWIDTH_MANAGER ] = NetworkBandwidthManager
 
 class NetworkContext( HydrusSerialisable.SerialisableBase ):
@@ -661,7 +734,12 @@ GLOBAL_NETWORK_CONTEXT = NetworkContext( CC.NETWORK_CONTEXT_GLOBAL )
 
 class NetworkEngine( object ):
     
-    MAX_JOBS = 10 # turn this into an option
+    JOB_STAGE_VALIDATION = 0
+    JOB_STAGE_BANDWIDTH = 1
+    JOB_STAGE_LOGIN = 2
+    
+    # everything that matters signals the loop, so this is only a backstop for noticing model shutdown
+    MAX_IDLE_WAIT = 5.0
     
     def __init__( self, controller, bandwidth_manager, session_manager, domain_manager, login_manager ):
         
@@ -680,15 +758,24 @@ class NetworkEngine( object ):
         self._lock = threading.Lock()
         
         self._new_work_to_do = threading.Event()
+        self._bandwidth_changed = threading.Event()
         
         self._jobs_awaiting_validity = []
         self._current_validation_process = None
         self._jobs_bandwidth_throttled = []
         self._jobs_login_throttled = []
         self._current_login_process = None
-        self._jobs_ready_to_start = []
+        self._priorities_to_jobs_ready_to_start = collections.defaultdict( collections.OrderedDict )
         self._jobs_downloading = []
         
+        # jobs that are asleep or waiting on something else sit here until their wake time, and are not looked at until then
+        self._waiting_jobs_heap = []
+        self._waiting_job_counter = itertools.count()
+        
+        self._domains_to_num_jobs_downloading = collections.Counter()
+        
+        self._priorities_to_queue_wait_stats = collections.defaultdict( lambda: [ 0, 0.0, 0.0 ] )
+        
         self._is_running = False
         self._is_shutdown = False
         self._local_shutdown = False
@@ -706,6 +793,16 @@ class NetworkEngine( object ):
         self._new_work_to_do.set()
         
     
+    def GetQueueWaitStats( self ):
+        
+        # how long jobs of each priority class have waited for a download slot
+        
+        with self._lock:
+            
+            return { priority : ( num_jobs, total_wait, max_wait ) for ( priority, ( num_jobs, total_wait, max_wait ) ) in self._priorities_to_queue_wait_stats.items() }
+            
+        
+    
     def IsRunning( self ):
         
         with self._lock:
@@ -851,7 +948,18 @@ class NetworkEngine( object ):
                 
             else:
                 
-                self._jobs_ready_to_start.append( job )
+                domains_to_jobs_ready_to_start = self._priorities_to_jobs_ready_to_start[ job.GetPriority() ]
+                
+                second_level_domain = job.GetSecondLevelDomain()
+                
+                if second_level_domain not in domains_to_jobs_ready_to_start:
+                    
+                    domains_to_jobs_ready_to_start[ second_level_domain ] = collections.deque()
+                    
+                
+                domains_to_jobs_ready_to_start[ second_level_domain ].append( ( job, HydrusData.GetNowPrecise() ) )
+                
+                job.SetStatus( u'waiting for download slot\u2026' )
                 
                 return False
                 
@@ -868,37 +976,182 @@ class NetworkEngine( object ):
                 
             
         
-        def ProcessReadyJob( job ):
+        def ProcessReadyJobs():
+            
+            # highest priority first, then first come first served within each domain, skipping any domain that is already full
+            # jobs queue per domain, so a thousand jobs waiting on one full domain cost one check, not a thousand
+            
+            new_options = HG.client_controller.GetNewOptions()
+            
+            max_jobs = new_options.GetInteger( 'max_network_jobs' )
+            max_jobs_per_domain = new_options.GetInteger( 'max_network_jobs_per_domain' )
+            
+            for priority in sorted( self._priorities_to_jobs_ready_to_start.keys() ):
+                
+                domains_to_jobs_ready_to_start = self._priorities_to_jobs_ready_to_start[ priority ]
+                
+                for ( second_level_domain, jobs_ready_to_start ) in domains_to_jobs_ready_to_start.items():
+                    
+                    while len( jobs_ready_to_start ) > 0:
+                        
+                        ( job, time_ready ) = jobs_ready_to_start[0]
+                        
+                        if job.IsDone():
+                            
+                            jobs_ready_to_start.popleft()
+                            
+                            continue
+                            
+                        
+                        if len( self._jobs_downloading ) >= max_jobs:
+                            
+                            return
+                            
+                        
+                        if self._domains_to_num_jobs_downloading[ second_level_domain ] >= max_jobs_per_domain:
+                            
+                            job.SetStatus( u'waiting for download slot on this domain\u2026' )
+                            
+                            break
+                            
+                        
+                        jobs_ready_to_start.popleft()
+                        
+                        queue_wait = HydrusData.GetNowPrecise() - time_ready
+                        
+                        queue_wait_stats = self._priorities_to_queue_wait_stats[ priority ]
+                        
+                        queue_wait_stats[0] += 1
+                        queue_wait_stats[1] += queue_wait
+                        queue_wait_stats[2] = max( queue_wait_stats[2], queue_wait )
+                        
+                        self.controller.CallToThread( job.Start )
+                        
+                        self._jobs_downloading.append( job )
+                        
+                        self._domains_to_num_jobs_downloading[ second_level_domain ] += 1
+                        
+                    
+                    if len( jobs_ready_to_start ) == 0:
+                        
+                        del domains_to_jobs_ready_to_start[ second_level_domain ]
+                        
+                    
+                
+                if len( domains_to_jobs_ready_to_start ) == 0:
+                    
+                    del self._priorities_to_jobs_ready_to_start[ priority ]
+                    
+                
+            
+        
+        def ProcessDownloadingJob( job ):
             
             if job.IsDone():
                 
+                second_level_domain = job.GetSecondLevelDomain()
+                
+                self._domains_to_num_jobs_downloading[ second_level_domain ] -= 1
+                
+                if self._domains_to_num_jobs_downloading[ second_level_domain ] == 0:
+                    
+                    del self._domains_to_num_jobs_downloading[ second_level_domain ]
+                    
+                
                 return False
                 
-            elif len( self._jobs_downloading ) < self.MAX_JOBS:
+            else:
                 
-                self.controller.CallToThread( job.Start )
+                return True
                 
-                self._jobs_downloading.append( job )
+            
+        
+        def ParkWaitingJob( job, stage ):
+            
+            if job.IsAsleep():
                 
-                return False
+                # IsAsleep is in whole seconds, so it is over once the second after the wake time begins
+                
+                wake_time = job.GetWakeTime() + 1
                 
             else:
                 
-                job.SetStatus( u'waiting for download slot\u2026' )
+                # waiting on bandwidth, a validation or a login, none of which can change before the next second
                 
-                return True
+                wake_time = int( time.time() ) + 1
                 
             
+            heapq.heappush( self._waiting_jobs_heap, ( wake_time, next( self._waiting_job_counter ), stage, job ) )
+            
         
-        def ProcessDownloadingJob( job ):
+        def ProcessStage( stage, jobs, process_job ):
+            
+            for job in jobs:
+                
+                if process_job( job ):
+                    
+                    ParkWaitingJob( job, stage )
+                    
+                
+            
+        
+        def WakeWaitingJob( stage, job ):
             
             if job.IsDone():
                 
-                return False
+                return
                 
-            else:
+            
+            if stage == self.JOB_STAGE_VALIDATION:
                 
-                return True
+                self._jobs_awaiting_validity.append( job )
+                
+            elif stage == self.JOB_STAGE_BANDWIDTH:
+                
+                self._jobs_bandwidth_throttled.append( job )
+                
+            elif stage == self.JOB_STAGE_LOGIN:
+                
+                self._jobs_login_throttled.append( job )
+                
+            
+        
+        def WakeWaitingJobs():
+            
+            if self._bandwidth_changed.is_set():
+                
+                self._bandwidth_changed.clear()
+                
+                # new rules or an override may have freed these early
+                
+                still_waiting = []
+                
+                for ( wake_time, job_number, stage, job ) in self._waiting_jobs_heap:
+                    
+                    if stage == self.JOB_STAGE_BANDWIDTH:
+                        
+                        job.Wake()
+                        
+                        WakeWaitingJob( stage, job )
+                        
+                    else:
+                        
+                        still_waiting.append( ( wake_time, job_number, stage, job ) )
+                        
+                    
+                
+                heapq.heapify( still_waiting )
+                
+                self._waiting_jobs_heap = still_waiting
+                
+            
+            now = time.time()
+            
+            while len( self._waiting_jobs_heap ) > 0 and self._waiting_jobs_heap[0][0] <= now:
+                
+                ( wake_time, job_number, stage, job ) = heapq.heappop( self._waiting_jobs_heap )
+                
+                WakeWaitingJob( stage, job )
                 
             
         
@@ -906,33 +1159,43 @@ class NetworkEngine( object ):
         
         while not ( self._local_shutdown or self.controller.ModelIsShutdown() ):
             
+            self._new_work_to_do.clear()
+            
             with self._lock:
                 
-                self._jobs_awaiting_validity = filter( ProcessValidationJob, self._jobs_awaiting_validity )
+                WakeWaitingJobs()
+                
+                ( jobs, self._jobs_awaiting_validity ) = ( self._jobs_awaiting_validity, [] )
+                
+                ProcessStage( self.JOB_STAGE_VALIDATION, jobs, ProcessValidationJob )
                 
                 ProcessCurrentValidationJob()
                 
-                self._jobs_bandwidth_throttled = filter( ProcessBandwidthJob, self._jobs_bandwidth_throttled )
+                ( jobs, self._jobs_bandwidth_throttled ) = ( self._jobs_bandwidth_throttled, [] )
                 
-                self._jobs_login_throttled = filter( ProcessLoginJob, self._jobs_login_throttled )
+                ProcessStage( self.JOB_STAGE_BANDWIDTH, jobs, ProcessBandwidthJob )
                 
-                ProcessCurrentLoginJob()
+                ( jobs, self._jobs_login_throttled ) = ( self._jobs_login_throttled, [] )
                 
-                self._jobs_ready_to_start = filter( ProcessReadyJob, self._jobs_ready_to_start )
+                ProcessStage( self.JOB_STAGE_LOGIN, jobs, ProcessLoginJob )
+                
+                ProcessCurrentLoginJob()
                 
                 self._jobs_downloading = filter( ProcessDownloadingJob, self._jobs_downloading )
                 
+                ProcessReadyJobs()
+                
+                if len( self._waiting_jobs_heap ) > 0:
+                    
+                    timeout = min( max( self._waiting_jobs_heap[0][0] - time.time(), 0.0 ), self.MAX_IDLE_WAIT )
+                    
+                else:
+                    
+                    timeout = self.MAX_IDLE_WAIT
+                    
+                
             
-            # we want to catch the rollover of the second for bandwidth jobs
-            
-            now_with_subsecond = time.time()
-            subsecond_part = now_with_subsecond % 1
-            
-            time_until_next_second = 1.0 - subsecond_part
-            
-            self._new_work_to_do.wait( time_until_next_second )
-            
-            self._new_work_to_do.clear()
+            self._new_work_to_do.wait( timeout )
             
         
         self._is_running = False
@@ -940,6 +1203,20 @@ class NetworkEngine( object ):
         self._is_shutdown = True
         
     
+    def NotifyBandwidthChanged( self ):
+        
+        # this is called from inside the bandwidth manager's lock, so it must not take ours
+        
+        self._bandwidth_changed.set()
+        
+        self._new_work_to_do.set()
+        
+    
+    def NotifyJobDone( self ):
+        
+        self._new_work_to_do.set()
+        
+    
     def Shutdown( self ):
         
         self._local_shutdown = True
@@ -950,6 +1227,7 @@ class NetworkEngine( object ):
 class NetworkJob( object ):
     
     IS_HYDRUS_SERVICE = False
+    PRIORITY = CC.NETWORK_JOB_PRIORITY_INTERACTIVE
     
     def __init__( self, method, url, body = None, referral_url = None, temp_path = None ):
         
@@ -1004,6 +1282,8 @@ class NetworkJob( object ):
         
         ( self._session_network_context, self._login_network_context ) = self._GenerateSpecificNetworkContexts()
         
+        self._second_level_domain = self._GenerateSecondLevelDomain()
+        
     
     def _CanReattemptRequest( self ):
         
@@ -1033,6 +1313,18 @@ class NetworkJob( object ):
         return network_contexts
         
     
+    def _GenerateSecondLevelDomain( self ):
+        
+        domain = ClientNetworkingDomain.ConvertURLIntoDomain( self._url )
+        
+        if len( ClientNetworkingDomain.ConvertDomainIntoAllApplicableDomains( domain ) ) == 0: # e.g. localhost
+            
+            return domain
+            
+        
+        return ClientNetworkingDomain.ConvertDomainIntoSecondLevelDomain( domain )
+        
+    
     def _GenerateSpecificNetworkContexts( self ):
         
         # we always store cookies in the larger session
@@ -1167,33 +1459,55 @@ class NetworkJob( object ):
                 
             
         
-        for chunk in response.iter_content( chunk_size = 65536 ):
+        num_bytes_unreported = 0
+        last_report_time = HydrusData.GetNowPrecise()
+        
+        try:
             
-            if self._IsCancelled():
+            for chunk in response.iter_content( chunk_size = 65536 ):
                 
-                return
+                if self._IsCancelled():
+                    
+                    return
+                    
                 
-            
-            stream_dest.write( chunk )
-            
-            chunk_length = len( chunk )
-            
-            with self._lock:
+                stream_dest.write( chunk )
                 
-                self._num_bytes_read += chunk_length
+                chunk_length = len( chunk )
                 
-                if max_allowed is not None and self._num_bytes_read > max_allowed:
+                with self._lock:
                     
-                    raise HydrusExceptions.NetworkException( 'The url ' + self._url + ' was too large!' )
+                    self._num_bytes_read += chunk_length
+                    
+                    if max_allowed is not None and self._num_bytes_read > max_allowed:
+                        
+                        raise HydrusExceptions.NetworkException( 'The url ' + self._url + ' was too large!' )
+                        
+                    
+                
+                num_bytes_unreported += chunk_length
+                
+                if num_bytes_unreported >= BANDWIDTH_REPORT_THRESHOLD or HydrusData.TimeHasPassedPrecise( last_report_time + BANDWIDTH_REPORT_PERIOD ):
+                    
+                    self._ReportDataUsed( num_bytes_unreported )
+                    
+                    num_bytes_unreported = 0
+                    last_report_time = HydrusData.GetNowPrecise()
+                    
+                    self._WaitOnOngoingBandwidth()
+                    
+                
+                if HG.view_shutdown:
+                    
+                    raise HydrusExceptions.ShutdownException()
                     
                 
             
-            self._ReportDataUsed( chunk_length )
-            self._WaitOnOngoingBandwidth()
+        finally:
             
-            if HG.view_shutdown:
+            if num_bytes_unreported > 0:
                 
-                raise HydrusExceptions.ShutdownException()
+                self._ReportDataUsed( num_bytes_unreported )
                 
             
         
@@ -1226,6 +1540,11 @@ class NetworkJob( object ):
         
         self._is_done_event.set()
         
+        if self.engine is not None:
+            
+            self.engine.NotifyJobDone()
+            
+        
     
     def _Sleep( self, seconds ):
         
@@ -1236,7 +1555,11 @@ class NetworkJob( object ):
         
         while not self._OngoingBandwidthOK() and not self._IsCancelled():
             
-            time.sleep( 0.1 )
+            # trackers count in whole seconds, so nothing can free up before the next one unless rules change
+            
+            timeout = max( 0.05, self._last_time_ongoing_bandwidth_failed + 1 - time.time() )
+            
+            self.engine.bandwidth_manager.WaitForBandwidthChange( timeout )
             
         
     
@@ -1313,6 +1636,13 @@ class NetworkJob( object ):
             self._SetCancelled()
             
         
+        # the engine already hears we are done, so only our own ongoing bandwidth wait needs waking
+        
+        if self.engine is not None:
+            
+            self.engine.bandwidth_manager.WakeBandwidthWaiters()
+            
+        
     
     def CanLogin( self ):
         
@@ -1410,6 +1740,24 @@ class NetworkJob( object ):
             
         
     
+    def GetPriority( self ):
+        
+        with self._lock:
+            
+            if self._for_login:
+                
+                return CC.NETWORK_JOB_PRIORITY_INTERACTIVE
+                
+            
+            return self.PRIORITY
+            
+        
+    
+    def GetSecondLevelDomain( self ):
+        
+        return self._second_level_domain
+        
+    
     def GetStatus( self ):
         
         with self._lock:
@@ -1426,6 +1774,14 @@ class NetworkJob( object ):
             
         
     
+    def GetWakeTime( self ):
+        
+        with self._lock:
+            
+            return self._wake_time
+            
+        
+    
     def HasError( self ):
         
         with self._lock:
@@ -1500,6 +1856,11 @@ class NetworkJob( object ):
             self._wake_time = 0
             
         
+        if self.engine is not None:
+            
+            self.engine.NotifyBandwidthChanged()
+            
+        
     
     def SetError( self, e, error ):
         
@@ -1714,8 +2075,18 @@ class NetworkJob( object ):
             
         
     
+    def Wake( self ):
+        
+        with self._lock:
+            
+            self._wake_time = 0
+            
+        
+    
 class NetworkJobDownloader( NetworkJob ):
     
+    PRIORITY = CC.NETWORK_JOB_PRIORITY_DOWNLOADER
+    
     def __init__( self, downloader_key, method, url, body = None, referral_url = None, temp_path = None ):
         
         self._downloader_key = downloader_key
@@ -1752,6 +2123,8 @@ class NetworkJobDownloaderQuery( NetworkJobDownloader ):
     
 class NetworkJobDownloaderQueryTemporary( NetworkJob ):
     
+    PRIORITY = CC.NETWORK_JOB_PRIORITY_DOWNLOADER
+    
     def __init__( self, downloader_page_key, method, url, body = None, referral_url = None, temp_path = None ):
         
         self._downloader_page_key = downloader_page_key
@@ -1770,6 +2143,8 @@ class NetworkJobDownloaderQueryTemporary( NetworkJob ):
     
 class NetworkJobSubscription( NetworkJobDownloader ):
     
+    PRIORITY = CC.NETWORK_JOB_PRIORITY_SUBSCRIPTION
+    
     def __init__( self, subscription_key, downloader_key, method, url, body = None, referral_url = None, temp_path = None ):
         
         self._subscription_key = subscription_key
@@ -1788,6 +2163,8 @@ class NetworkJobSubscription( NetworkJobDownloader ):
     
 class NetworkJobSubscriptionTemporary( NetworkJob ):
     
+    PRIORITY = CC.NETWORK_JOB_PRIORITY_SUBSCRIPTION
+    
     def __init__( self, subscription_key, method, url, body = None, referral_url = None, temp_path = None ):
         
         self._subscription_key = subscription_key
@@ -1807,6 +2184,7 @@ class NetworkJobSubscriptionTemporary( NetworkJob ):
 class NetworkJobHydrus( NetworkJob ):
     
     IS_HYDRUS_SERVICE = True
+    PRIORITY = CC.NETWORK_JOB_PRIORITY_REPOSITORY
     
     def __init__( self, service_key, method, url, body = None, referral_url = None, temp_path = None ):
         
@@ -1907,6 +2285,8 @@ class NetworkJobHydrus( NetworkJob ):
     
 class NetworkJobThreadWatcher( NetworkJob ):
     
+    PRIORITY = CC.NETWORK_JOB_PRIORITY_DOWNLOADER
+    
     def __init__( self, thread_key, method, url, body = None, referral_url = None, temp_path = None ):
         
         self._thread_key = thread_key
@@ -1944,6 +2324,8 @@ class NetworkSessionManager( HydrusSerialisable.SerialisableBase ):
         
         self._network_contexts_to_session_timeouts = {}
         
+        self._network_contexts_to_adapter_settings = {}
+        
     
     def _GenerateSession( self, network_context ):
         
@@ -1957,6 +2339,17 @@ class NetworkSessionManager( HydrusSerialisable.SerialisableBase ):
         return session
         
     
+    def _GetAdapterSettings( self ):
+        
+        new_options = HG.client_controller.GetNewOptions()
+        
+        pool_connections = new_options.GetInteger( 'network_pool_connections' )
+        pool_maxsize = new_options.GetInteger( 'network_pool_maxsize' )
+        connection_retries = new_options.GetInteger( 'network_connection_retries' )
+        
+        return ( pool_connections, pool_maxsize, connection_retries )
+        
+    
     def _GetSerialisableInfo( self ):
         
         serialisable_network_contexts_to_sessions = [ ( network_context.GetSerialisableTuple(), cPickle.dumps( session ) ) for ( network_context, session ) in self._network_contexts_to_sessions.items() ]
@@ -1979,6 +2372,30 @@ class NetworkSessionManager( HydrusSerialisable.SerialisableBase ):
             
         
     
+    def _MountAdapters( self, session, adapter_settings ):
+        
+        # the default adapters keep a small pool, so a big gallery import from one cdn churns connections and spends its time in tls handshakes
+        # only failures to connect are retried here. read errors are still raised straight away for the job to deal with
+        
+        ( pool_connections, pool_maxsize, connection_retries ) = adapter_settings
+        
+        for prefix in ( 'http://', 'https://' ):
+            
+            max_retries = urllib3.util.retry.Retry( total = connection_retries, connect = connection_retries, read = False, backoff_factor = 0.1 )
+            
+            adapter = requests.adapters.HTTPAdapter( pool_connections = pool_connections, pool_maxsize = pool_maxsize, max_retries = max_retries )
+            
+            # the old adapter's pool would otherwise hang on to its connections
+            
+            if prefix in session.adapters:
+                
+                session.adapters[ prefix ].close()
+                
+            
+            session.mount( prefix, adapter )
+            
+        
+    
     def _SetDirty( self ):
         
         self._dirty = True
@@ -1992,6 +2409,11 @@ class NetworkSessionManager( HydrusSerialisable.SerialisableBase ):
                 
                 del self._network_contexts_to_sessions[ network_context ]
                 
+                if network_context in self._network_contexts_to_adapter_settings:
+                    
+                    del self._network_contexts_to_adapter_settings[ network_context ]
+                    
+                
                 self._SetDirty()
                 
             
@@ -2016,6 +2438,17 @@ class NetworkSessionManager( HydrusSerialisable.SerialisableBase ):
             
             session = self._network_contexts_to_sessions[ network_context ]
             
+            # sessions loaded from the db come with whatever adapters they were pickled with, so this also catches them
+            
+            adapter_settings = self._GetAdapterSettings()
+            
+            if self._network_contexts_to_adapter_settings.get( network_context, None ) != adapter_settings:
+                
+                self._MountAdapters( session, adapter_settings )
+                
+                self._network_contexts_to_adapter_settings[ network_context ] = adapter_settings
+                
+            
             #
             
             if network_context not in self._network_contexts_to_session_timeouts:
@@ -2048,6 +2481,42 @@ class NetworkSessionManager( HydrusSerialisable.SerialisableBase ):
             
         
     
+    def GetConnectionPoolStats( self ):
+        
+        # ( scheme, host, port ) -> ( connections opened, requests that reused a connection, connections sitting idle )
+        
+        with self._lock:
+            
+            hosts_to_stats = collections.defaultdict( lambda: [ 0, 0, 0 ] )
+            
+            for session in self._network_contexts_to_sessions.values():
+                
+                for adapter in set( session.adapters.values() ):
+                    
+                    pools = adapter.poolmanager.pools
+                    
+                    for key in pools.keys():
+                        
+                        pool = pools.get( key, None )
+                        
+                        if pool is None or pool.pool is None:
+                            
+                            continue
+                            
+                        
+                        stats = hosts_to_stats[ ( pool.scheme, pool.host, pool.port ) ]
+                        
+                        stats[0] += pool.num_connections
+                        stats[1] += max( pool.num_requests - pool.num_connections, 0 )
+                        stats[2] += len( [ connection for connection in list( pool.pool.queue ) if connection is not None ] )
+                        
+                    
+                
+            
+            return { host : tuple( stats ) for ( host, stats ) in hosts_to_stats.items() }
+            
+        
+    
     def IsDirty( self ):
         
         with self._lock:
@@ -20,6 +20,19 @@ def GenerateHydrusBitmap( path, mime, compressed = True ):
     
     return GenerateHydrusBitmapFromNumPyImage( numpy_image, compressed = compressed )
     
+def GenerateHydrusBitmapFromCompressedData( compressed_data, depth, size ):
+    
+    if depth == 4:
+        
+        buffer_format = wx.BitmapBufferFormat_RGBA
+        
+    else:
+        
+        buffer_format = wx.BitmapBufferFormat_RGB
+        
+    
+    return HydrusBitmap( compressed_data, buffer_format, size, data_is_compressed = True )
+    
 def GenerateHydrusBitmapFromNumPyImage( numpy_image, compressed = True ):
     
     ( y, x, depth ) = numpy_image.shape
@@ -584,11 +597,11 @@ class RasterContainerVideo( RasterContainer ):
     
 class HydrusBitmap( object ):
     
-    def __init__( self, data, format, size, compressed = True ):
+    def __init__( self, data, format, size, compressed = True, data_is_compressed = False ):
         
         self._compressed = compressed
         
-        if self._compressed:
+        if self._compressed and not data_is_compressed:
             
             self._data = lz4.block.compress( data )
             
@@ -618,6 +631,18 @@ class HydrusBitmap( object ):
         wx_bmp.CopyFromBuffer( self._GetData(), self._format )
         
     
+    def GetCompressedData( self ):
+        
+        if self._compressed:
+            
+            return self._data
+            
+        else:
+            
+            return lz4.block.compress( self._data )
+            
+        
+    
     def GetDepth( self ):
         
         if self._format == wx.BitmapBufferFormat_RGB:
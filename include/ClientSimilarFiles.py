@@ -0,0 +1,365 @@
+import HydrusData
+import numpy
+import struct
+
+# comparing every search phash against every indexed phash makes a big intermediate array, so we do it in blocks of about this many cells
+MAX_COMPARISONS_PER_BLOCK = 4 * 1024 * 1024
+
+# multi-index hashing splits each 64-bit phash into four 16-bit substrings, each looked up in its own index
+MIH_NUM_SUBSTRINGS = 4
+MIH_SUBSTRING_STRUCT = '>4H'
+
+MIH_SUBSTRING_POPCOUNTS = HydrusData.BYTE_POPCOUNTS_LOOKUP[ numpy.arange( 2 ** 16 ) & 0xFF ] + HydrusData.BYTE_POPCOUNTS_LOOKUP[ numpy.arange( 2 ** 16 ) >> 8 ]
+
+class PHashIndex( object ):
+    
+    # a resident copy of the useful rows of shape_perceptual_hashes, so we can answer radius queries with one vectorised pass rather than walking the vptree
+    # phash_ids are kept sorted so we can find them with a binary search. removed rows are just flagged dead until there are enough of them to be worth compacting
+    
+    def __init__( self, rows = None ):
+        
+        self._phash_ids = numpy.zeros( 0, dtype = numpy.int64 )
+        self._phashes = numpy.zeros( 0, dtype = numpy.uint64 )
+        self._alive = numpy.zeros( 0, dtype = numpy.bool_ )
+        
+        self._num_dead = 0
+        
+        if rows is not None:
+            
+            self.AddPHashes( rows )
+            
+        
+    
+    def _Compact( self ):
+        
+        self._phash_ids = self._phash_ids[ self._alive ]
+        self._phashes = self._phashes[ self._alive ]
+        self._alive = numpy.ones( len( self._phash_ids ), dtype = numpy.bool_ )
+        
+        self._num_dead = 0
+        
+    
+    def _GetIndices( self, phash_ids ):
+        
+        # returns the positions of the given phash_ids, and a mask of which of them we actually have
+        
+        indices = numpy.searchsorted( self._phash_ids, phash_ids )
+        
+        in_bounds = indices < len( self._phash_ids )
+        
+        present = numpy.zeros( len( phash_ids ), dtype = numpy.bool_ )
+        
+        present[ in_bounds ] = self._phash_ids[ indices[ in_bounds ] ] == phash_ids[ in_bounds ]
+        
+        return ( indices, present )
+        
+    
+    def _SearchBlock( self, search_array, max_hamming_distance ):
+        
+        # returns ( search_index, phash_id ) pairs for every indexed phash within range of each search phash
+        
+        distances = HydrusData.Get64BitHammingDistances( search_array, self._phashes )
+        
+        matches = numpy.logical_and( distances <= max_hamming_distance, self._alive[ numpy.newaxis, : ] )
+        
+        ( search_indices, phash_indices ) = numpy.nonzero( matches )
+        
+        return zip( search_indices.tolist(), self._phash_ids[ phash_indices ].tolist() )
+        
+    
+    def AddPHashes( self, rows ):
+        
+        if len( rows ) == 0:
+            
+            return
+            
+        
+        ( phash_ids, phashes ) = zip( *rows )
+        
+        phash_ids = numpy.array( phash_ids, dtype = numpy.int64 )
+        phashes = HydrusData.Convert64BitHashesToArray( phashes )
+        
+        ( phash_ids, unique_indices ) = numpy.unique( phash_ids, return_index = True )
+        phashes = phashes[ unique_indices ]
+        
+        ( indices, present ) = self._GetIndices( phash_ids )
+        
+        # a phash_id always refers to the same phash, so anything we have already just needs to be revived
+        
+        revived_indices = indices[ present ]
+        
+        self._num_dead -= int( numpy.count_nonzero( numpy.logical_not( self._alive[ revived_indices ] ) ) )
+        
+        self._alive[ revived_indices ] = True
+        
+        new = numpy.logical_not( present )
+        
+        if numpy.any( new ):
+            
+            new_phash_ids = phash_ids[ new ]
+            
+            if len( self._phash_ids ) == 0 or new_phash_ids[0] > self._phash_ids[-1]:
+                
+                # new phash_ids are almost always fresh autoincrement ids, so the usual case is a quick append
+                
+                self._phash_ids = numpy.concatenate( ( self._phash_ids, new_phash_ids ) )
+                self._phashes = numpy.concatenate( ( self._phashes, phashes[ new ] ) )
+                self._alive = numpy.concatenate( ( self._alive, numpy.ones( len( new_phash_ids ), dtype = numpy.bool_ ) ) )
+                
+            else:
+                
+                insert_indices = indices[ new ]
+                
+                self._phash_ids = numpy.insert( self._phash_ids, insert_indices, new_phash_ids )
+                self._phashes = numpy.insert( self._phashes, insert_indices, phashes[ new ] )
+                self._alive = numpy.insert( self._alive, insert_indices, True )
+                
+            
+        
+    
+    def GetNumPHashes( self ):
+        
+        return len( self._phash_ids ) - self._num_dead
+        
+    
+    def RemovePHashIds( self, phash_ids ):
+        
+        if len( phash_ids ) == 0:
+            
+            return
+            
+        
+        phash_ids = numpy.array( list( phash_ids ), dtype = numpy.int64 )
+        
+        ( indices, present ) = self._GetIndices( phash_ids )
+        
+        removee_indices = indices[ present ]
+        
+        self._num_dead += int( numpy.count_nonzero( self._alive[ removee_indices ] ) )
+        
+        self._alive[ removee_indices ] = False
+        
+        if self._num_dead > 1024 and self._num_dead > len( self._phash_ids ) / 4:
+            
+            self._Compact()
+            
+        
+    
+    def Search( self, search_phashes, max_hamming_distance ):
+        
+        results = self.SearchMany( [ ( None, search_phashes ) ], max_hamming_distance )
+        
+        return results[ None ]
+        
+    
+    def SearchMany( self, keys_and_search_phashes, max_hamming_distance ):
+        
+        # takes [ ( key, search_phashes ) ] and returns { key : similar_phash_ids }
+        
+        results = { key : set() for ( key, search_phashes ) in keys_and_search_phashes }
+        
+        search_keys = []
+        search_phashes = []
+        
+        for ( key, phashes ) in keys_and_search_phashes:
+            
+            for phash in phashes:
+                
+                search_keys.append( key )
+                search_phashes.append( phash )
+                
+            
+        
+        if len( search_phashes ) == 0 or len( self._phash_ids ) == 0:
+            
+            return results
+            
+        
+        search_array = HydrusData.Convert64BitHashesToArray( search_phashes )
+        
+        block_size = max( 1, MAX_COMPARISONS_PER_BLOCK / len( self._phash_ids ) )
+        
+        for block_start in range( 0, len( search_array ), block_size ):
+            
+            for ( search_index, phash_id ) in self._SearchBlock( search_array[ block_start : block_start + block_size ], max_hamming_distance ):
+                
+                results[ search_keys[ block_start + search_index ] ].add( phash_id )
+                
+            
+        
+        return results
+        
+    
+def GenerateVPTreeRows( nodes, parent_id = None, job_key = None ):
+    
+    # builds a balanced vptree over [ ( phash_id, phash ) ] in one go and returns the shape_vptree rows for it, root first
+    # everything stays in numpy arrays, so each node costs one vectorised distance pass over its children rather than a pile of python pair comparisons
+    
+    if len( nodes ) == 0:
+        
+        return []
+        
+    
+    ( phash_ids, phashes ) = zip( *nodes )
+    
+    phash_ids = numpy.array( phash_ids, dtype = numpy.int64 )
+    phashes = HydrusData.Convert64BitHashesToArray( phashes )
+    
+    num_to_do = len( phash_ids )
+    
+    rows = []
+    
+    ( root_index, children_indices ) = PopBestVantagePoint( phash_ids, phashes, numpy.arange( num_to_do ) )
+    
+    process_queue = [ ( parent_id, root_index, children_indices ) ]
+    
+    while len( process_queue ) > 0:
+        
+        if job_key is not None and len( rows ) % 1000 == 0:
+            
+            job_key.SetVariable( 'popup_text_2', 'generating new branch -- ' + HydrusData.ConvertValueRangeToPrettyString( len( rows ), num_to_do ) )
+            
+        
+        ( parent_id, index, children_indices ) = process_queue.pop()
+        
+        phash_id = int( phash_ids[ index ] )
+        
+        if len( children_indices ) == 0:
+            
+            rows.append( ( phash_id, parent_id, None, None, 0, None, 0 ) )
+            
+            continue
+            
+        
+        distances = HydrusData.Get64BitHammingDistances( phashes[ index : index + 1 ], phashes[ children_indices ] )[0]
+        
+        median_index = len( distances ) / 2
+        
+        median_radius = int( numpy.partition( distances, median_index )[ median_index ] )
+        
+        num_inner = numpy.count_nonzero( distances < median_radius )
+        num_outer = numpy.count_nonzero( distances > median_radius )
+        
+        # the children at the median distance go on whichever side is smaller
+        
+        if num_inner <= num_outer:
+            
+            radius = median_radius
+            
+        else:
+            
+            radius = median_radius - 1
+            
+        
+        inner_indices = children_indices[ distances <= radius ]
+        outer_indices = children_indices[ distances > radius ]
+        
+        ( inner_index, inner_children_indices ) = PopBestVantagePoint( phash_ids, phashes, inner_indices )
+        
+        inner_id = int( phash_ids[ inner_index ] )
+        
+        process_queue.append( ( phash_id, inner_index, inner_children_indices ) )
+        
+        if len( outer_indices ) == 0:
+            
+            outer_id = None
+            
+        else:
+            
+            ( outer_index, outer_children_indices ) = PopBestVantagePoint( phash_ids, phashes, outer_indices )
+            
+            outer_id = int( phash_ids[ outer_index ] )
+            
+            process_queue.append( ( phash_id, outer_index, outer_children_indices ) )
+            
+        
+        rows.append( ( phash_id, parent_id, radius, inner_id, len( inner_indices ), outer_id, len( outer_indices ) ) )
+        
+    
+    return rows
+    
+def GetMIHSearchSubstrings( phash, max_hamming_distance ):
+    
+    # if two phashes are within max_hamming_distance, then by pigeonhole at least one pair of their substrings is within max_hamming_distance / MIH_NUM_SUBSTRINGS
+    # so returns [ ( substring_index, substrings ) ], listing every substring value close enough to the phash's own to be worth a lookup
+    
+    substring_radius = max_hamming_distance / MIH_NUM_SUBSTRINGS
+    
+    flip_masks = numpy.flatnonzero( MIH_SUBSTRING_POPCOUNTS <= substring_radius )
+    
+    return [ ( substring_index, numpy.bitwise_xor( flip_masks, substring ).tolist() ) for ( substring_index, substring ) in enumerate( GetMIHSubstrings( phash ) ) ]
+    
+def GetMIHSubstrings( phash ):
+    
+    return struct.unpack( MIH_SUBSTRING_STRUCT, phash )
+    
+def PopBestVantagePoint( phash_ids, phashes, indices ):
+    
+    # picks the member of indices that splits a sample of the others most evenly, preferring a larger spread of distances on a tie
+    # returns ( best_index, the_other_indices )
+    
+    MAX_VIEWPOINTS = 256
+    MAX_SAMPLE = 64
+    
+    num_indices = len( indices )
+    
+    if num_indices == 1:
+        
+        return ( indices[0], indices[ 1: ] )
+        
+    
+    if num_indices > MAX_VIEWPOINTS:
+        
+        viewpoint_positions = numpy.random.choice( num_indices, MAX_VIEWPOINTS, replace = False )
+        
+    else:
+        
+        viewpoint_positions = numpy.arange( num_indices )
+        
+    
+    if num_indices > MAX_SAMPLE:
+        
+        sample_positions = numpy.random.choice( num_indices, MAX_SAMPLE, replace = False )
+        
+    else:
+        
+        sample_positions = numpy.arange( num_indices )
+        
+    
+    # every viewpoint against every sample, with a viewpoint's distance to itself pushed past any real distance so it sorts to the end
+    
+    views = HydrusData.Get64BitHammingDistances( phashes[ indices[ viewpoint_positions ] ], phashes[ indices[ sample_positions ] ] ).astype( numpy.int32 )
+    
+    valid = viewpoint_positions[ :, numpy.newaxis ] != sample_positions[ numpy.newaxis, : ]
+    
+    views[ numpy.logical_not( valid ) ] = 65
+    
+    num_views = valid.sum( axis = 1 )
+    
+    radii = numpy.sort( views, axis = 1 )[ numpy.arange( len( viewpoint_positions ) ), num_views / 2 ]
+    
+    num_left = ( views < radii[ :, numpy.newaxis ] ).sum( axis = 1 )
+    num_radius = ( views == radii[ :, numpy.newaxis ] ).sum( axis = 1 )
+    num_right = num_views - num_left - num_radius
+    
+    left_gets_radius = num_left <= num_right
+    
+    num_left = numpy.where( left_gets_radius, num_left + num_radius, num_left )
+    num_right = numpy.where( left_gets_radius, num_right, num_right + num_radius )
+    
+    # the ratio of left to right, preferring 1:1, as a discrete integer score
+    
+    ratios = numpy.minimum( num_left, num_right ).astype( numpy.float64 ) / numpy.maximum( num_left, num_right )
+    
+    ratio_scores = ( ratios * MAX_SAMPLE / 2 ).astype( numpy.int32 )
+    
+    # larger sd tends to mean less sphere overlap when searching
+    
+    means = numpy.where( valid, views, 0 ).sum( axis = 1 ).astype( numpy.float64 ) / num_views
+    
+    sds = numpy.sqrt( numpy.where( valid, ( views - means[ :, numpy.newaxis ] ) ** 2, 0 ).sum( axis = 1 ) / num_views )
+    
+    best_position = viewpoint_positions[ numpy.lexsort( ( phash_ids[ indices[ viewpoint_positions ] ], sds, ratio_scores ) )[-1] ]
+    
+    return ( indices[ best_position ], numpy.delete( indices, best_position ) )
+    
@@ -49,7 +49,7 @@ options = {}
 # Misc
 
 NETWORK_VERSION = 18
-SOFTWARE_VERSION = 283
+SOFTWARE_VERSION = 284
 
 UNSCALED_THUMBNAIL_DIMENSIONS = ( 200, 200 )
 
@@ -380,6 +380,14 @@ SERVICE_INFO_NUM_VIEWABLE_FILES = 22
 SERVICE_UPDATE_DELETE_PENDING = 0
 SERVICE_UPDATE_RESET = 1
 
+UPDATE_FORMAT_JSON = 0
+UPDATE_FORMAT_BINARY = 1
+
+update_format_string_lookup = {}
+
+update_format_string_lookup[ UPDATE_FORMAT_JSON ] = 'json (all clients)'
+update_format_string_lookup[ UPDATE_FORMAT_BINARY ] = 'binary (v284+ clients, faster to process)'
+
 ADD = 0
 DELETE = 1
 EDIT = 2
@@ -7,6 +7,7 @@ import HydrusExceptions
 import HydrusGlobals as HG
 import HydrusSerialisable
 import locale
+import numpy
 import os
 import pstats
 import psutil
@@ -71,6 +72,12 @@ def CleanRunningFile( db_path, instance ):
         pass
         
     
+def Convert64BitHashesToArray( hashes ):
+    
+    # takes 8-byte strings, as we use for phashes, and returns a uint64 array ready for Get64BitHammingDistances
+    
+    return numpy.frombuffer( ''.join( hashes ), dtype = '>u8' ).astype( numpy.uint64 )
+    
 def ConvertFloatToPercentage( f ):
     
     return '%.1f' % ( f * 100 ) + '%'
@@ -678,6 +685,53 @@ def Get64BitHammingDistance( phash1, phash2 ):
     
     return n
     
+BYTE_POPCOUNTS_LOOKUP = numpy.array( [ bin( i ).count( '1' ) for i in range( 256 ) ], dtype = numpy.uint8 )
+
+def Get64BitHammingDistances( search_hashes, hashes ):
+    
+    # the many-vs-many version of Get64BitHammingDistance, for when per-pair python overhead adds up
+    # give it a single 8-byte string to get a vector of distances to each of hashes, or a list/array of them to get a matrix with one row per search hash
+    # hashes can be a list of 8-byte strings or an array from Convert64BitHashesToArray
+    
+    if isinstance( search_hashes, str ):
+        
+        search_array = Convert64BitHashesToArray( ( search_hashes, ) )
+        
+    elif isinstance( search_hashes, numpy.ndarray ):
+        
+        search_array = search_hashes
+        
+    else:
+        
+        search_array = Convert64BitHashesToArray( search_hashes )
+        
+    
+    if isinstance( hashes, numpy.ndarray ):
+        
+        array = hashes
+        
+    else:
+        
+        array = Convert64BitHashesToArray( hashes )
+        
+    
+    xor = numpy.bitwise_xor( search_array[ :, numpy.newaxis ], array[ numpy.newaxis, : ] )
+    
+    # count the bits through a lookup on each of the 8 bytes of each uint64
+    
+    xor_bytes = xor.view( numpy.uint8 ).reshape( xor.shape + ( 8, ) )
+    
+    distances = BYTE_POPCOUNTS_LOOKUP[ xor_bytes ].sum( axis = -1, dtype = numpy.uint8 )
+    
+    if isinstance( search_hashes, str ):
+        
+        return distances[0]
+        
+    else:
+        
+        return distances
+        
+    
 def GetEmptyDataDict():
     
     data = collections.defaultdict( default_dict_list )
@@ -1075,6 +1129,24 @@ def SplitIteratorIntoChunks( iterator, n ):
         yield chunk
         
 
+def SplitListIntoAdaptiveChunks( xs, chunk_sizer ):
+    
+    if isinstance( xs, set ):
+        
+        xs = list( xs )
+        
+    
+    i = 0
+    
+    while i < len( xs ):
+        
+        n = chunk_sizer.GetChunkSize()
+        
+        yield xs[ i : i + n ]
+        
+        i += n
+        
+    
 def SplitListIntoChunks( xs, n ):
     
     if isinstance( xs, set ):
@@ -1087,6 +1159,49 @@ def SplitListIntoChunks( xs, n ):
         yield xs[ i : i + n ]
         
     
+def SplitMappingListIntoAdaptiveChunks( xs, chunk_sizer ):
+    
+    chunk_weight = 0
+    chunk = []
+    
+    n = chunk_sizer.GetChunkSize()
+    
+    for ( tag_item, hash_items ) in xs:
+        
+        if isinstance( hash_items, set ):
+            
+            hash_items = list( hash_items )
+            
+        
+        i = 0
+        
+        while i < len( hash_items ):
+            
+            chunk_of_hash_items = hash_items[ i : i + n ]
+            
+            i += len( chunk_of_hash_items )
+            
+            chunk.append( ( tag_item, chunk_of_hash_items ) )
+            
+            chunk_weight += len( chunk_of_hash_items )
+            
+            if chunk_weight > n:
+                
+                yield chunk
+                
+                chunk_weight = 0
+                chunk = []
+                
+                n = chunk_sizer.GetChunkSize()
+                
+            
+        
+    
+    if len( chunk ) > 0:
+        
+        yield chunk
+        
+    
 def SplitMappingListIntoChunks( xs, n ):
     
     chunk_weight = 0
@@ -1524,6 +1639,46 @@ class AccountType( HydrusYAMLBase ):
     
 sqlite3.register_adapter( AccountType, yaml.safe_dump )
 
+class AdaptiveChunkSizer( object ):
+    
+    def __init__( self, initial_chunk_size, target_time, min_chunk_size = 1, max_chunk_size = None ):
+        
+        self._chunk_size = initial_chunk_size
+        self._target_time = target_time
+        self._min_chunk_size = min_chunk_size
+        self._max_chunk_size = max_chunk_size
+        
+    
+    def GetChunkSize( self ):
+        
+        return self._chunk_size
+        
+    
+    def ReportChunk( self, num_rows, time_took ):
+        
+        if num_rows == 0:
+            
+            return
+            
+        
+        rows_per_second = num_rows / max( time_took, 0.001 )
+        
+        ideal_chunk_size = int( rows_per_second * self._target_time )
+        
+        # one quick chunk may just have been all in the disk cache, so only grow gradually. if we overran, drop straight down
+        
+        chunk_size = min( ideal_chunk_size, self._chunk_size * 2 )
+        
+        chunk_size = max( chunk_size, self._min_chunk_size )
+        
+        if self._max_chunk_size is not None:
+            
+            chunk_size = min( chunk_size, self._max_chunk_size )
+            
+        
+        self._chunk_size = chunk_size
+        
+    
 class BigJobPauser( object ):
     
     def __init__( self, period = 10, wait_time = 0.1 ):
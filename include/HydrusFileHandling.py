@@ -14,6 +14,7 @@ import HydrusImageHandling
 import HydrusPaths
 import HydrusVideoHandling
 import os
+import Queue
 import tempfile
 import threading
 import traceback
@@ -238,6 +239,116 @@ def GetFileInfo( path, mime = None ):
     
     return ( size, mime, width, height, duration, num_frames, num_words )
     
+def GetHashAndExtraHashesFromPath( path ):
+    
+    # this reads the file once for all four hashes
+    # sha256 is done here and returned as soon as the read is done, so the 'already in db?' check can go ahead
+    # md5, sha1 and sha512 are fed the same blocks on a worker thread--hashlib releases the GIL on big updates, so the two sides really do run at the same time
+    # the second return value is a callable that joins that worker and then returns ( md5, sha1, sha512 )--call it even if you end up not needing them
+    
+    h_sha256 = hashlib.sha256()
+    h_md5 = hashlib.md5()
+    h_sha1 = hashlib.sha1()
+    h_sha512 = hashlib.sha512()
+    
+    block_size = 16 * HC.READ_BLOCK_SIZE
+    
+    if os.path.getsize( path ) <= block_size:
+        
+        with open( path, 'rb' ) as f:
+            
+            block = f.read()
+            
+        
+        for h in ( h_sha256, h_md5, h_sha1, h_sha512 ):
+            
+            h.update( block )
+            
+        
+        extra_hashes = ( h_md5.digest(), h_sha1.digest(), h_sha512.digest() )
+        
+        return ( h_sha256.digest(), lambda: extra_hashes )
+        
+    
+    block_queue = Queue.Queue( maxsize = 4 )
+    extra_hashes_errors = []
+    
+    def THREADExtraHashes():
+        
+        while True:
+            
+            block = block_queue.get()
+            
+            if block is None:
+                
+                break
+                
+            
+            if len( extra_hashes_errors ) > 0:
+                
+                # keep draining so the reader never blocks on a full queue
+                
+                continue
+                
+            
+            try:
+                
+                h_md5.update( block )
+                h_sha1.update( block )
+                h_sha512.update( block )
+                
+            except Exception as e:
+                
+                extra_hashes_errors.append( e )
+                
+            
+        
+    
+    thread = threading.Thread( target = THREADExtraHashes, name = 'extra hashes' )
+    
+    thread.daemon = True
+    
+    thread.start()
+    
+    try:
+        
+        with open( path, 'rb' ) as f:
+            
+            for block in HydrusPaths.ReadFileLikeAsBlocks( f, block_size = block_size ):
+                
+                block_queue.put( block )
+                
+                h_sha256.update( block )
+                
+            
+        
+    except:
+        
+        # don't leave the worker behind if the read fails
+        
+        block_queue.put( None )
+        
+        thread.join()
+        
+        raise
+        
+    
+    block_queue.put( None )
+    
+    def GetExtraHashes():
+        
+        thread.join()
+        
+        if len( extra_hashes_errors ) > 0:
+            
+            raise extra_hashes_errors[0]
+            
+        
+        return ( h_md5.digest(), h_sha1.digest(), h_sha512.digest() )
+        
+    
+    return ( h_sha256.digest(), GetExtraHashes )
+    
 def GetHashFromPath( path ):
     
     h = hashlib.sha256()
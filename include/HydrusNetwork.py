@@ -5,8 +5,15 @@ import HydrusExceptions
 import HydrusGlobals as HG
 import HydrusNetworking
 import HydrusSerialisable
+import numpy
+import struct
 import threading
 
+BINARY_COLUMN_HEADER_FORMAT = '<cI'
+BINARY_COLUMN_HEADER_LENGTH = struct.calcsize( BINARY_COLUMN_HEADER_FORMAT )
+
+BINARY_COLUMN_TYPECODES_TO_DTYPES = { 'i' : numpy.dtype( '<i4' ), 'q' : numpy.dtype( '<i8' ) }
+
 INT_PARAMS = { 'expires', 'num', 'since', 'content_type', 'action', 'status' }
 BYTE_PARAMS = { 'access_key', 'account_type_key', 'subject_account_key', 'hash', 'registration_key', 'subject_hash', 'subject_tag', 'share_key', 'update_hash' }
 
@@ -35,6 +42,7 @@ def GenerateDefaultServiceDictionary( service_type ):
             metadata.AppendUpdate( update_hashes, begin, end, next_update_due )
             
             dictionary[ 'metadata' ] = metadata
+            dictionary[ 'update_format' ] = HC.UPDATE_FORMAT_JSON
             
             if service_type == HC.FILE_REPOSITORY:
                 
@@ -318,6 +326,81 @@ def ParseGETArgs( requests_args ):
     
     return args
     
+def PackIntegerColumn( values ):
+    
+    # most columns are ids, and the -1s we use for None, which fit in four bytes. anything bigger gets eight
+    
+    if len( values ) > 0 and min( values ) >= -2 ** 31 and max( values ) < 2 ** 31:
+        
+        typecode = 'i'
+        
+    else:
+        
+        typecode = 'q'
+        
+    
+    column = numpy.array( values, dtype = BINARY_COLUMN_TYPECODES_TO_DTYPES[ typecode ] )
+    
+    return struct.pack( BINARY_COLUMN_HEADER_FORMAT, typecode, len( values ) ) + column.tostring()
+    
+def PackNullableIntegerColumn( values ):
+    
+    return PackIntegerColumn( [ -1 if value is None else value for value in values ] )
+    
+def PackStringColumn( values ):
+    
+    values = [ value.encode( 'utf-8' ) if isinstance( value, unicode ) else value for value in values ]
+    
+    return PackIntegerColumn( [ len( value ) for value in values ] ) + ''.join( values )
+    
+def UnpackIntegerColumn( binary_info, offset ):
+    
+    header_end = offset + BINARY_COLUMN_HEADER_LENGTH
+    
+    ( typecode, num_values ) = struct.unpack( BINARY_COLUMN_HEADER_FORMAT, binary_info[ offset : header_end ] )
+    
+    dtype = BINARY_COLUMN_TYPECODES_TO_DTYPES[ typecode ]
+    
+    column = numpy.frombuffer( binary_info, dtype = dtype, count = num_values, offset = header_end )
+    
+    # tolist gives us plain python ints, which sqlite can bind and which are much faster to iterate over than numpy scalars
+    
+    return ( column.tolist(), header_end + column.nbytes )
+    
+def UnpackNullableIntegerColumn( binary_info, offset ):
+    
+    ( values, offset ) = UnpackIntegerColumn( binary_info, offset )
+    
+    values = [ None if value == -1 else value for value in values ]
+    
+    return ( values, offset )
+    
+def UnpackStringColumn( binary_info, offset, decode = False ):
+    
+    ( lengths, offset ) = UnpackIntegerColumn( binary_info, offset )
+    
+    blob_length = sum( lengths )
+    
+    blob = binary_info[ offset : offset + blob_length ]
+    
+    values = []
+    
+    i = 0
+    
+    for length in lengths:
+        
+        values.append( blob[ i : i + length ] )
+        
+        i += length
+        
+    
+    if decode:
+        
+        values = [ value.decode( 'utf-8' ) for value in values ]
+        
+    
+    return ( values, offset + blob_length )
+    
 class Account( object ):
     
     def __init__( self, account_key, account_type, created, expires, banned_info = None, bandwidth_tracker = None ):
@@ -1202,6 +1285,10 @@ class ContentUpdate( HydrusSerialisable.SerialisableBase ):
     SERIALISABLE_TYPE = HydrusSerialisable.SERIALISABLE_TYPE_CONTENT_UPDATE
     SERIALISABLE_VERSION = 1
     
+    BINARY_VERSION = 1
+    
+    NUM_FILE_INFO_COLUMNS = 9
+    
     def __init__( self ):
         
         HydrusSerialisable.SerialisableBase.__init__( self )
@@ -1222,6 +1309,66 @@ class ContentUpdate( HydrusSerialisable.SerialisableBase ):
         return []
         
     
+    def _GetBinaryInfo( self ):
+        
+        sections = []
+        
+        for ( content_type, actions_to_datas ) in self._content_data.items():
+            
+            for ( action, data ) in actions_to_datas.items():
+                
+                if len( data ) > 0:
+                    
+                    sections.append( ( content_type, action, data ) )
+                    
+                
+            
+        
+        binary_info = [ struct.pack( '<I', len( sections ) ) ]
+        
+        for ( content_type, action, data ) in sections:
+            
+            binary_info.append( struct.pack( '<BB', content_type, action ) )
+            
+            if content_type == HC.CONTENT_TYPE_FILES:
+                
+                if action == HC.CONTENT_UPDATE_ADD:
+                    
+                    columns = zip( *data )
+                    
+                    binary_info.extend( ( PackNullableIntegerColumn( column ) for column in columns ) )
+                    
+                else:
+                    
+                    binary_info.append( PackIntegerColumn( data ) )
+                    
+                
+            elif content_type == HC.CONTENT_TYPE_MAPPINGS:
+                
+                tag_ids = [ tag_id for ( tag_id, hash_ids ) in data ]
+                counts = [ len( hash_ids ) for ( tag_id, hash_ids ) in data ]
+                flat_hash_ids = [ hash_id for ( tag_id, hash_ids ) in data for hash_id in hash_ids ]
+                
+                binary_info.append( PackIntegerColumn( tag_ids ) )
+                binary_info.append( PackIntegerColumn( counts ) )
+                binary_info.append( PackIntegerColumn( flat_hash_ids ) )
+                
+            elif content_type in ( HC.CONTENT_TYPE_TAG_PARENTS, HC.CONTENT_TYPE_TAG_SIBLINGS ):
+                
+                ( left_ids, right_ids ) = zip( *data )
+                
+                binary_info.append( PackIntegerColumn( left_ids ) )
+                binary_info.append( PackIntegerColumn( right_ids ) )
+                
+            else:
+                
+                raise NotImplementedError( 'Cannot write content type ' + str( content_type ) + ' to binary!' )
+                
+            
+        
+        return ''.join( binary_info )
+        
+    
     def _GetSerialisableInfo( self ):
         
         serialisable_info = []
@@ -1236,6 +1383,76 @@ class ContentUpdate( HydrusSerialisable.SerialisableBase ):
         return serialisable_info
         
     
+    def _InitialiseFromBinaryInfo( self, binary_info ):
+        
+        ( num_sections, ) = struct.unpack( '<I', binary_info[ 0 : 4 ] )
+        
+        offset = 4
+        
+        for i in range( num_sections ):
+            
+            ( content_type, action ) = struct.unpack( '<BB', binary_info[ offset : offset + 2 ] )
+            
+            offset += 2
+            
+            if content_type == HC.CONTENT_TYPE_FILES:
+                
+                if action == HC.CONTENT_UPDATE_ADD:
+                    
+                    columns = []
+                    
+                    for j in range( self.NUM_FILE_INFO_COLUMNS ):
+                        
+                        ( column, offset ) = UnpackNullableIntegerColumn( binary_info, offset )
+                        
+                        columns.append( column )
+                        
+                    
+                    data = zip( *columns )
+                    
+                else:
+                    
+                    ( data, offset ) = UnpackIntegerColumn( binary_info, offset )
+                    
+                
+            elif content_type == HC.CONTENT_TYPE_MAPPINGS:
+                
+                ( tag_ids, offset ) = UnpackIntegerColumn( binary_info, offset )
+                ( counts, offset ) = UnpackIntegerColumn( binary_info, offset )
+                ( flat_hash_ids, offset ) = UnpackIntegerColumn( binary_info, offset )
+                
+                data = []
+                
+                j = 0
+                
+                for ( tag_id, count ) in zip( tag_ids, counts ):
+                    
+                    data.append( ( tag_id, flat_hash_ids[ j : j + count ] ) )
+                    
+                    j += count
+                    
+                
+            elif content_type in ( HC.CONTENT_TYPE_TAG_PARENTS, HC.CONTENT_TYPE_TAG_SIBLINGS ):
+                
+                ( left_ids, offset ) = UnpackIntegerColumn( binary_info, offset )
+                ( right_ids, offset ) = UnpackIntegerColumn( binary_info, offset )
+                
+                data = zip( left_ids, right_ids )
+                
+            else:
+                
+                raise NotImplementedError( 'Cannot read content type ' + str( content_type ) + ' from binary!' )
+                
+            
+            if content_type not in self._content_data:
+                
+                self._content_data[ content_type ] = {}
+                
+            
+            self._content_data[ content_type ][ action ] = data
+            
+        
+    
     def _InitialiseFromSerialisableInfo( self, serialisable_info ):
         
         for ( content_type, serialisable_actions_to_datas ) in serialisable_info:
@@ -1511,6 +1728,8 @@ class DefinitionsUpdate( HydrusSerialisable.SerialisableBase ):
     SERIALISABLE_TYPE = HydrusSerialisable.SERIALISABLE_TYPE_DEFINITIONS_UPDATE
     SERIALISABLE_VERSION = 1
     
+    BINARY_VERSION = 1
+    
     def __init__( self ):
         
         HydrusSerialisable.SerialisableBase.__init__( self )
@@ -1519,6 +1738,22 @@ class DefinitionsUpdate( HydrusSerialisable.SerialisableBase ):
         self._tag_ids_to_tags = {}
         
     
+    def _GetBinaryInfo( self ):
+        
+        binary_info = []
+        
+        for ids_to_values in ( self._hash_ids_to_hashes, self._tag_ids_to_tags ):
+            
+            ids = ids_to_values.keys()
+            values = [ ids_to_values[ i ] for i in ids ]
+            
+            binary_info.append( PackIntegerColumn( ids ) )
+            binary_info.append( PackStringColumn( values ) )
+            
+        
+        return ''.join( binary_info )
+        
+    
     def _GetSerialisableInfo( self ):
         
         serialisable_info = []
@@ -1536,6 +1771,20 @@ class DefinitionsUpdate( HydrusSerialisable.SerialisableBase ):
         return serialisable_info
         
     
+    def _InitialiseFromBinaryInfo( self, binary_info ):
+        
+        offset = 0
+        
+        ( hash_ids, offset ) = UnpackIntegerColumn( binary_info, offset )
+        ( hashes, offset ) = UnpackStringColumn( binary_info, offset )
+        
+        ( tag_ids, offset ) = UnpackIntegerColumn( binary_info, offset )
+        ( tags, offset ) = UnpackStringColumn( binary_info, offset, decode = True )
+        
+        self._hash_ids_to_hashes = dict( zip( hash_ids, hashes ) )
+        self._tag_ids_to_tags = dict( zip( tag_ids, tags ) )
+        
+    
     def _InitialiseFromSerialisableInfo( self, serialisable_info ):
         
         for ( definition_type, definitions ) in serialisable_info:
@@ -2174,6 +2423,7 @@ class ServerServiceRepository( ServerServiceRestricted ):
         dictionary = ServerServiceRestricted._GetSerialisableDictionary( self )
         
         dictionary[ 'metadata' ] = self._metadata
+        dictionary[ 'update_format' ] = self._update_format
         
         return dictionary
         
@@ -2184,6 +2434,9 @@ class ServerServiceRepository( ServerServiceRestricted ):
         
         self._metadata = dictionary[ 'metadata' ]
         
+        # services edited by older clients and admins will not have this
+        self._update_format = dictionary.get( 'update_format', HC.UPDATE_FORMAT_JSON )
+        
     
     def GetMetadataSlice( self, from_update_index ):
         
@@ -2193,6 +2446,14 @@ class ServerServiceRepository( ServerServiceRestricted ):
             
         
     
+    def GetUpdateFormat( self ):
+        
+        with self._lock:
+            
+            return self._update_format
+            
+        
+    
     def HasUpdateHash( self, update_hash ):
         
         with self._lock:
@@ -2217,13 +2478,23 @@ class ServerServiceRepository( ServerServiceRestricted ):
                 with self._lock:
                     
                     service_key = self._service_key
+                    update_format = self._update_format
                     
                     begin = self._metadata.GetNextUpdateBegin()
                     
                 
                 end = begin + HC.UPDATE_DURATION
                 
-                update_hashes = HG.server_controller.WriteSynchronous( 'create_update', service_key, begin, end )
+                update_hashes = None
+                
+                # the db does this in bursts, so client requests can get in between
+                
+                while update_hashes is None:
+                    
+                    stop_time = HydrusData.GetNow() + 10
+                    
+                    update_hashes = HG.server_controller.WriteSynchronous( 'create_update', service_key, begin, end, update_format, stop_time )
+                    
                 
                 next_update_due = end + HC.UPDATE_DURATION + 1
                 
@@ -2370,8 +2641,14 @@ class UpdateBuilder( object ):
         self._current_update = None
         
     
-    def GetUpdates( self ):
+    def PopUpdates( self ):
+        
+        # hands over the finished updates so far and forgets them, so a caller streaming them out does not hold them all in memory
+        
+        updates = self._updates
+        
+        self._updates = []
         
-        return self._updates
+        return updates
         
     
@@ -7,9 +7,19 @@ import HydrusData
 import HydrusSerialisable
 import socket
 import ssl
+import struct
 import threading
 import time
 
+BANDWIDTH_MONTH_FORMAT = '<qqq'
+BANDWIDTH_MONTH_LENGTH = struct.calcsize( BANDWIDTH_MONTH_FORMAT )
+
+BANDWIDTH_RING_HEADER_FORMAT = '<qI'
+BANDWIDTH_RING_HEADER_LENGTH = struct.calcsize( BANDWIDTH_RING_HEADER_FORMAT )
+
+BANDWIDTH_RING_SLOT_FORMAT = '<Hq'
+BANDWIDTH_RING_SLOT_LENGTH = struct.calcsize( BANDWIDTH_RING_SLOT_FORMAT )
+
 def ConvertBandwidthRuleToString( rule ):
     
     ( bandwidth_type, time_delta, max_allowed ) = rule
@@ -277,11 +287,197 @@ class BandwidthRules( HydrusSerialisable.SerialisableBase ):
     
 HydrusSerialisable.SERIALISABLE_TYPES_TO_OBJECT_TYPES[ HydrusSerialisable.SERIALISABLE_TYPE_BANDWIDTH_RULES ] = BandwidthRules
 
+class BandwidthRingBuffer( object ):
+    
+    # a fixed number of fixed-width slots, each covering the timestamps that share a timestamp // width
+    # a running total of every slot still in range means a query over the whole buffer does not have to sum anything
+    
+    def __init__( self, width, num_slots ):
+        
+        self._width = width
+        self._num_slots = num_slots
+        
+        self._slot_ids = [ None ] * num_slots
+        self._values = [ 0 ] * num_slots
+        
+        self._latest_slot_id = None
+        self._total = 0
+        
+    
+    def _Advance( self, slot_id ):
+        
+        if self._latest_slot_id is None or slot_id - self._latest_slot_id >= self._num_slots:
+            
+            self._slot_ids = [ None ] * self._num_slots
+            self._values = [ 0 ] * self._num_slots
+            
+            self._total = 0
+            
+        else:
+            
+            for expired_slot_id in range( self._latest_slot_id + 1, slot_id + 1 ):
+                
+                index = expired_slot_id % self._num_slots
+                
+                if self._slot_ids[ index ] is not None:
+                    
+                    self._total -= self._values[ index ]
+                    
+                    self._slot_ids[ index ] = None
+                    self._values[ index ] = 0
+                    
+                
+            
+        
+        self._latest_slot_id = slot_id
+        
+    
+    def Add( self, timestamp, value ):
+        
+        slot_id = timestamp // self._width
+        
+        if self._latest_slot_id is None or slot_id > self._latest_slot_id:
+            
+            self._Advance( slot_id )
+            
+        elif slot_id <= self._latest_slot_id - self._num_slots:
+            
+            return
+            
+        
+        index = slot_id % self._num_slots
+        
+        self._slot_ids[ index ] = slot_id
+        self._values[ index ] += value
+        
+        self._total += value
+        
+    
+    def GetSlotTimestampsAndValues( self ):
+        
+        # newest first
+        
+        result = []
+        
+        if self._latest_slot_id is None:
+            
+            return result
+            
+        
+        for slot_id in range( self._latest_slot_id, self._latest_slot_id - self._num_slots, -1 ):
+            
+            index = slot_id % self._num_slots
+            
+            if self._slot_ids[ index ] == slot_id:
+                
+                result.append( ( slot_id * self._width, self._values[ index ] ) )
+                
+            
+        
+        return result
+        
+    
+    def GetUsageSince( self, since ):
+        
+        # every slot that starts at or after since
+        
+        if self._latest_slot_id is None:
+            
+            return 0
+            
+        
+        first_slot_id = - ( - since // self._width )
+        
+        if first_slot_id <= self._latest_slot_id - self._num_slots + 1:
+            
+            return self._total
+            
+        
+        usage = 0
+        
+        for slot_id in range( first_slot_id, self._latest_slot_id + 1 ):
+            
+            index = slot_id % self._num_slots
+            
+            if self._slot_ids[ index ] == slot_id:
+                
+                usage += self._values[ index ]
+                
+            
+        
+        return usage
+        
+    
+    def GetValue( self, timestamp ):
+        
+        slot_id = timestamp // self._width
+        
+        index = slot_id % self._num_slots
+        
+        if self._slot_ids[ index ] == slot_id:
+            
+            return self._values[ index ]
+            
+        else:
+            
+            return 0
+            
+        
+    
+    def PackToBinaryString( self ):
+        
+        slot_timestamps_and_values = self.GetSlotTimestampsAndValues()
+        
+        if self._latest_slot_id is None:
+            
+            latest_slot_id = 0
+            
+        else:
+            
+            latest_slot_id = self._latest_slot_id
+            
+        
+        rows = [ struct.pack( BANDWIDTH_RING_HEADER_FORMAT, latest_slot_id, len( slot_timestamps_and_values ) ) ]
+        
+        rows.extend( ( struct.pack( BANDWIDTH_RING_SLOT_FORMAT, latest_slot_id - timestamp // self._width, value ) for ( timestamp, value ) in slot_timestamps_and_values ) )
+        
+        return ''.join( rows )
+        
+    
+    def UnpackFromBinaryString( self, binary_info, offset ):
+        
+        ( latest_slot_id, num_rows ) = struct.unpack_from( BANDWIDTH_RING_HEADER_FORMAT, binary_info, offset )
+        
+        offset += BANDWIDTH_RING_HEADER_LENGTH
+        
+        rows = []
+        
+        for i in range( num_rows ):
+            
+            rows.append( struct.unpack_from( BANDWIDTH_RING_SLOT_FORMAT, binary_info, offset ) )
+            
+            offset += BANDWIDTH_RING_SLOT_LENGTH
+            
+        
+        # oldest first, so the buffer only ever advances
+        
+        for ( age, value ) in reversed( rows ):
+            
+            self.Add( ( latest_slot_id - age ) * self._width, value )
+            
+        
+        return offset
+        
+    
 class BandwidthTracker( HydrusSerialisable.SerialisableBase ):
     
     SERIALISABLE_TYPE = HydrusSerialisable.SERIALISABLE_TYPE_BANDWIDTH_TRACKER
     SERIALISABLE_VERSION = 1
     
+    # accounts carry trackers to clients, so the json format stays the old counter lists that every client understands
+    # the packed binary format is for local storage, like the client's bandwidth manager
+    BINARY_VERSION = 1
+    
     # I want to track and query using smaller periods even when the total time delta is larger than the next step up to increase granularity
     # for instance, querying minutes for 90 mins time delta is more smooth than watching a juddery sliding two hour window
     MAX_SECONDS_TIME_DELTA = 240
@@ -289,8 +485,6 @@ class BandwidthTracker( HydrusSerialisable.SerialisableBase ):
     MAX_HOURS_TIME_DELTA = 72 * 3600
     MAX_DAYS_TIME_DELTA = 31 * 86400
     
-    CACHE_MAINTENANCE_TIME_DELTA = 120
-    
     MIN_TIME_DELTA_FOR_USER = 10
     
     def __init__( self ):
@@ -299,48 +493,102 @@ class BandwidthTracker( HydrusSerialisable.SerialisableBase ):
         
         self._lock = threading.Lock()
         
-        self._next_cache_maintenance_timestamp = HydrusData.GetNow() + self.CACHE_MAINTENANCE_TIME_DELTA
+        self._InitialiseRings()
         
         self._months_bytes = collections.Counter()
-        self._days_bytes = collections.Counter()
-        self._hours_bytes = collections.Counter()
-        self._minutes_bytes = collections.Counter()
-        self._seconds_bytes = collections.Counter()
-        
         self._months_requests = collections.Counter()
-        self._days_requests = collections.Counter()
-        self._hours_requests = collections.Counter()
-        self._minutes_requests = collections.Counter()
-        self._seconds_requests = collections.Counter()
+        
+    
+    def _GetBinaryInfo( self ):
+        
+        month_times = sorted( set( self._months_bytes.keys() ).union( self._months_requests.keys() ) )
+        
+        rows = [ struct.pack( '<I', len( month_times ) ) ]
+        
+        rows.extend( ( struct.pack( BANDWIDTH_MONTH_FORMAT, month_time, self._months_bytes[ month_time ], self._months_requests[ month_time ] ) for month_time in month_times ) )
+        
+        rows.extend( ( ring.PackToBinaryString() for ring in self._GetRings() ) )
+        
+        return ''.join( rows )
         
     
     def _GetSerialisableInfo( self ):
         
-        dicts_flat = []
+        ( days_bytes, hours_bytes, minutes_bytes, seconds_bytes, days_requests, hours_requests, minutes_requests, seconds_requests ) = [ ring.GetSlotTimestampsAndValues() for ring in self._GetRings() ]
+        
+        dicts_flat = [ self._months_bytes.items(), days_bytes, hours_bytes, minutes_bytes, seconds_bytes, self._months_requests.items(), days_requests, hours_requests, minutes_requests, seconds_requests ]
+        
+        return dicts_flat
+        
+    
+    def _InitialiseFromBinaryInfo( self, binary_info ):
+        
+        self._InitialiseRings()
+        
+        self._months_bytes = collections.Counter()
+        self._months_requests = collections.Counter()
         
-        for d in ( self._months_bytes, self._days_bytes, self._hours_bytes, self._minutes_bytes, self._seconds_bytes, self._months_requests, self._days_requests, self._hours_requests, self._minutes_requests, self._seconds_requests ):
+        ( num_months, ) = struct.unpack_from( '<I', binary_info, 0 )
+        
+        offset = 4
+        
+        for i in range( num_months ):
             
-            dicts_flat.append( d.items() )
+            ( month_time, num_bytes, num_requests ) = struct.unpack_from( BANDWIDTH_MONTH_FORMAT, binary_info, offset )
+            
+            offset += BANDWIDTH_MONTH_LENGTH
+            
+            if num_bytes > 0:
+                
+                self._months_bytes[ month_time ] = num_bytes
+                
+            
+            if num_requests > 0:
+                
+                self._months_requests[ month_time ] = num_requests
+                
             
         
-        return dicts_flat
+        for ring in self._GetRings():
+            
+            offset = ring.UnpackFromBinaryString( binary_info, offset )
+            
         
     
     def _InitialiseFromSerialisableInfo( self, serialisable_info ):
         
-        counters = [ collections.Counter( dict( flat_dict ) ) for flat_dict in serialisable_info ]
+        # ten timestamp->value counters, which are folded into the rings here
+        
+        (
+            months_bytes, days_bytes, hours_bytes, minutes_bytes, seconds_bytes,
+            months_requests, days_requests, hours_requests, minutes_requests, seconds_requests
+        ) = [ sorted( flat_dict ) for flat_dict in serialisable_info ]
         
-        self._months_bytes = counters[ 0 ]
-        self._days_bytes = counters[ 1 ]
-        self._hours_bytes = counters[ 2 ]
-        self._minutes_bytes = counters[ 3 ]
-        self._seconds_bytes = counters[ 4 ]
+        self._InitialiseRings()
         
-        self._months_requests = counters[ 5 ]
-        self._days_requests = counters[ 6 ]
-        self._hours_requests = counters[ 7 ]
-        self._minutes_requests = counters[ 8 ]
-        self._seconds_requests = counters[ 9 ]
+        self._months_bytes = collections.Counter( dict( months_bytes ) )
+        self._months_requests = collections.Counter( dict( months_requests ) )
+        
+        for ( ring, timestamps_and_values ) in zip( self._GetRings(), ( days_bytes, hours_bytes, minutes_bytes, seconds_bytes, days_requests, hours_requests, minutes_requests, seconds_requests ) ):
+            
+            for ( timestamp, value ) in timestamps_and_values:
+                
+                ring.Add( timestamp, value )
+                
+            
+        
+    
+    def _InitialiseRings( self ):
+        
+        self._days_bytes = BandwidthRingBuffer( 86400, self.MAX_DAYS_TIME_DELTA // 86400 + 2 )
+        self._hours_bytes = BandwidthRingBuffer( 3600, self.MAX_HOURS_TIME_DELTA // 3600 + 2 )
+        self._minutes_bytes = BandwidthRingBuffer( 60, self.MAX_MINUTES_TIME_DELTA // 60 + 2 )
+        self._seconds_bytes = BandwidthRingBuffer( 1, self.MAX_SECONDS_TIME_DELTA + 2 )
+        
+        self._days_requests = BandwidthRingBuffer( 86400, self.MAX_DAYS_TIME_DELTA // 86400 + 2 )
+        self._hours_requests = BandwidthRingBuffer( 3600, self.MAX_HOURS_TIME_DELTA // 3600 + 2 )
+        self._minutes_requests = BandwidthRingBuffer( 60, self.MAX_MINUTES_TIME_DELTA // 60 + 2 )
+        self._seconds_requests = BandwidthRingBuffer( 1, self.MAX_SECONDS_TIME_DELTA + 2 )
         
     
     def _GetCurrentDateTime( self ):
@@ -348,29 +596,34 @@ class BandwidthTracker( HydrusSerialisable.SerialisableBase ):
         return datetime.datetime.utcfromtimestamp( HydrusData.GetNow() )
         
     
-    def _GetWindowAndCounter( self, bandwidth_type, time_delta ):
+    def _GetRings( self ):
+        
+        return ( self._days_bytes, self._hours_bytes, self._minutes_bytes, self._seconds_bytes, self._days_requests, self._hours_requests, self._minutes_requests, self._seconds_requests )
+        
+    
+    def _GetWindowAndRing( self, bandwidth_type, time_delta ):
         
         if bandwidth_type == HC.BANDWIDTH_TYPE_DATA:
             
             if time_delta < self.MAX_SECONDS_TIME_DELTA:
                 
                 window = 0
-                counter = self._seconds_bytes
+                ring = self._seconds_bytes
                 
             elif time_delta < self.MAX_MINUTES_TIME_DELTA:
                 
                 window = 60
-                counter = self._minutes_bytes
+                ring = self._minutes_bytes
                 
             elif time_delta < self.MAX_HOURS_TIME_DELTA:
                 
                 window = 3600
-                counter = self._hours_bytes
+                ring = self._hours_bytes
                 
             else:
                 
                 window = 86400
-                counter = self._days_bytes
+                ring = self._days_bytes
                 
             
         elif bandwidth_type == HC.BANDWIDTH_TYPE_REQUESTS:
@@ -378,26 +631,26 @@ class BandwidthTracker( HydrusSerialisable.SerialisableBase ):
             if time_delta < self.MAX_SECONDS_TIME_DELTA:
                 
                 window = 0
-                counter = self._seconds_requests
+                ring = self._seconds_requests
                 
             elif time_delta < self.MAX_MINUTES_TIME_DELTA:
                 
                 window = 60
-                counter = self._minutes_requests
+                ring = self._minutes_requests
                 
             elif time_delta < self.MAX_HOURS_TIME_DELTA:
                 
                 window = 3600
-                counter = self._hours_requests
+                ring = self._hours_requests
                 
             else:
                 
                 window = 86400
-                counter = self._days_requests
+                ring = self._days_requests
                 
             
         
-        return ( window, counter )
+        return ( window, ring )
         
     
     def _GetMonthTime( self, dt ):
@@ -429,7 +682,7 @@ class BandwidthTracker( HydrusSerialisable.SerialisableBase ):
                 
             
         
-        ( window, counter ) = self._GetWindowAndCounter( bandwidth_type, time_delta )
+        ( window, ring ) = self._GetWindowAndRing( bandwidth_type, time_delta )
         
         if time_delta == 1:
             
@@ -440,14 +693,7 @@ class BandwidthTracker( HydrusSerialisable.SerialisableBase ):
             
             now = HydrusData.GetNow()
             
-            if now in counter:
-                
-                return counter[ now ]
-                
-            else:
-                
-                return 0
-                
+            return ring.GetValue( now )
             
         else:
             
@@ -458,31 +704,10 @@ class BandwidthTracker( HydrusSerialisable.SerialisableBase ):
             
             since = HydrusData.GetNow() - search_time_delta
             
-            return sum( ( value for ( timestamp, value ) in counter.items() if timestamp >= since ) )
+            return ring.GetUsageSince( since )
             
         
     
-    def _GetTimes( self, dt ):
-        
-        # collapse each time portion to the latest timestamp it covers
-        
-        ( year, month, day, hour, minute ) = ( dt.year, dt.month, dt.day, dt.hour, dt.minute )
-        
-        month_dt = datetime.datetime( year, month, 1 )
-        day_dt = datetime.datetime( year, month, day )
-        hour_dt = datetime.datetime( year, month, day, hour )
-        minute_dt = datetime.datetime( year, month, day, hour, minute )
-        
-        month_time = calendar.timegm( month_dt.timetuple() )
-        day_time = calendar.timegm( day_dt.timetuple() )
-        hour_time = calendar.timegm( hour_dt.timetuple() )
-        minute_time = calendar.timegm( minute_dt.timetuple() )
-        
-        second_time = calendar.timegm( dt.timetuple() )
-        
-        return ( month_time, day_time, hour_time, minute_time, second_time )
-        
-    
     def _GetUsage( self, bandwidth_type, time_delta, for_user ):
         
         if for_user and time_delta is not None and bandwidth_type == HC.BANDWIDTH_TYPE_DATA and time_delta <= self.MIN_TIME_DELTA_FOR_USER:
@@ -494,8 +719,6 @@ class BandwidthTracker( HydrusSerialisable.SerialisableBase ):
             usage = self._GetRawUsage( bandwidth_type, time_delta )
             
         
-        self._MaintainCache()
-        
         return usage
         
     
@@ -503,15 +726,13 @@ class BandwidthTracker( HydrusSerialisable.SerialisableBase ):
         
         SEARCH_DELTA = self.MIN_TIME_DELTA_FOR_USER
         
-        counter = self._seconds_bytes
-        
         now = HydrusData.GetNow()
         
         since = now - SEARCH_DELTA
         
-        valid_keys = [ key for key in counter.keys() if key >= since ]
+        valid_timestamps_and_values = [ ( timestamp, value ) for ( timestamp, value ) in self._seconds_bytes.GetSlotTimestampsAndValues() if timestamp >= since ]
         
-        if len( valid_keys ) == 0:
+        if len( valid_timestamps_and_values ) == 0:
             
             return 0
             
@@ -519,48 +740,28 @@ class BandwidthTracker( HydrusSerialisable.SerialisableBase ):
         # If we want the average speed over past five secs but nothing has happened in sec 4 and 5, we don't want to count them
         # otherwise your 1MB/s counts as 200KB/s
         
-        earliest_timestamp = min( valid_keys )
+        earliest_timestamp = min( ( timestamp for ( timestamp, value ) in valid_timestamps_and_values ) )
         
         SAMPLE_DELTA = max( now - earliest_timestamp, 1 )
         
-        total_bytes = sum( ( counter[ key ] for key in valid_keys ) )
+        total_bytes = sum( ( value for ( timestamp, value ) in valid_timestamps_and_values ) )
         
         time_delta_average_per_sec = total_bytes / SAMPLE_DELTA
         
         return time_delta_average_per_sec * time_delta
         
     
-    def _MaintainCache( self ):
+    def _ReportUsed( self, months_counter, rings, value ):
         
-        if HydrusData.TimeHasPassed( self._next_cache_maintenance_timestamp ):
-            
-            now = HydrusData.GetNow()
-            
-            oldest_second = now - self.MAX_SECONDS_TIME_DELTA
-            oldest_minute = now - self.MAX_MINUTES_TIME_DELTA
-            oldest_hour = now - self.MAX_HOURS_TIME_DELTA
-            oldest_day = now - self.MAX_DAYS_TIME_DELTA
-            
-            def clear_counter( counter, timestamp ):
-                
-                bad_keys = [ key for key in counter.keys() if key < timestamp ]
-                
-                for bad_key in bad_keys:
-                    
-                    del counter[ bad_key ]
-                    
-                
-            
-            clear_counter( self._days_bytes, oldest_day )
-            clear_counter( self._days_requests, oldest_day )
-            clear_counter( self._hours_bytes, oldest_hour )
-            clear_counter( self._hours_requests, oldest_hour )
-            clear_counter( self._minutes_bytes, oldest_minute )
-            clear_counter( self._minutes_requests, oldest_minute )
-            clear_counter( self._seconds_bytes, oldest_second )
-            clear_counter( self._seconds_requests, oldest_second )
+        now = HydrusData.GetNow()
+        
+        month_time = self._GetMonthTime( self._GetCurrentDateTime() )
+        
+        months_counter[ month_time ] += value
+        
+        for ring in rings:
             
-            self._next_cache_maintenance_timestamp = HydrusData.GetNow() + self.CACHE_MAINTENANCE_TIME_DELTA
+            ring.Add( now, value )
             
         
     
@@ -632,18 +833,14 @@ class BandwidthTracker( HydrusSerialisable.SerialisableBase ):
                 # time_delta subtract that amount is the time we have to wait for usage to be less than max_allowed
                 # e.g. if in the past 24 hours there was a bunch of usage 16 hours ago clogging it up, we'll have to wait ~8 hours
                 
-                ( window, counter ) = self._GetWindowAndCounter( bandwidth_type, time_delta )
+                ( window, ring ) = self._GetWindowAndRing( bandwidth_type, time_delta )
                 
                 time_delta_in_which_bandwidth_counts = time_delta + window
                 
-                time_and_values = counter.items()
-                
-                time_and_values.sort( reverse = True )
-                
                 now = HydrusData.GetNow()
                 usage = 0
                 
-                for ( timestamp, value ) in time_and_values:
+                for ( timestamp, value ) in ring.GetSlotTimestampsAndValues():
                     
                     current_search_time_delta = now - timestamp
                     
@@ -669,21 +866,7 @@ class BandwidthTracker( HydrusSerialisable.SerialisableBase ):
         
         with self._lock:
             
-            dt = self._GetCurrentDateTime()
-            
-            ( month_time, day_time, hour_time, minute_time, second_time ) = self._GetTimes( dt )
-            
-            self._months_bytes[ month_time ] += num_bytes
-            
-            self._days_bytes[ day_time ] += num_bytes
-            
-            self._hours_bytes[ hour_time ] += num_bytes
-            
-            self._minutes_bytes[ minute_time ] += num_bytes
-            
-            self._seconds_bytes[ second_time ] += num_bytes
-            
-            self._MaintainCache()
+            self._ReportUsed( self._months_bytes, ( self._days_bytes, self._hours_bytes, self._minutes_bytes, self._seconds_bytes ), num_bytes )
             
         
     
@@ -691,21 +874,7 @@ class BandwidthTracker( HydrusSerialisable.SerialisableBase ):
         
         with self._lock:
             
-            dt = self._GetCurrentDateTime()
-            
-            ( month_time, day_time, hour_time, minute_time, second_time ) = self._GetTimes( dt )
-            
-            self._months_requests[ month_time ] += 1
-            
-            self._days_requests[ day_time ] += 1
-            
-            self._hours_requests[ hour_time ] += 1
-            
-            self._minutes_requests[ minute_time ] += 1
-            
-            self._seconds_requests[ second_time ] += 1
-            
-            self._MaintainCache()
+            self._ReportUsed( self._months_requests, ( self._days_requests, self._hours_requests, self._minutes_requests, self._seconds_requests ), 1 )
             
         
     
@@ -712,15 +712,15 @@ def PathsHaveSameSizeAndDate( path1, path2 ):
     
     return False
     
-def ReadFileLikeAsBlocks( f ):
+def ReadFileLikeAsBlocks( f, block_size = HC.READ_BLOCK_SIZE ):
     
-    next_block = f.read( HC.READ_BLOCK_SIZE )
+    next_block = f.read( block_size )
     
     while next_block != '':
         
         yield next_block
         
-        next_block = f.read( HC.READ_BLOCK_SIZE )
+        next_block = f.read( block_size )
         
     
 def RecyclePath( path ):
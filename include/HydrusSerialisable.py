@@ -1,5 +1,6 @@
 import json
 import lz4.block
+import struct
 import zlib
 
 SERIALISABLE_TYPE_BASE = 0
@@ -62,6 +63,25 @@ SERIALISABLE_TYPE_FILENAME_TAGGING_OPTIONS = 56
 
 SERIALISABLE_TYPES_TO_OBJECT_TYPES = {}
 
+# json strings always start with '[', so this can never be confused for one
+BINARY_MAGIC = 'hydrus binary\x00'
+BINARY_HEADER_FORMAT = '<HH'
+BINARY_HEADER_LENGTH = struct.calcsize( BINARY_HEADER_FORMAT )
+
+def CreateFromBinaryString( obj_string ):
+    
+    header_start = len( BINARY_MAGIC )
+    header_end = header_start + BINARY_HEADER_LENGTH
+    
+    ( serialisable_type, binary_version ) = struct.unpack( BINARY_HEADER_FORMAT, obj_string[ header_start : header_end ] )
+    
+    obj = SERIALISABLE_TYPES_TO_OBJECT_TYPES[ serialisable_type ]()
+    
+    obj.InitialiseFromBinaryInfo( binary_version, buffer( obj_string, header_end ) )
+    
+    return obj
+    
+
 def CreateFromNetworkString( network_string ):
     
     try:
@@ -77,6 +97,11 @@ def CreateFromNetworkString( network_string ):
     
 def CreateFromString( obj_string ):
     
+    if obj_string.startswith( BINARY_MAGIC ):
+        
+        return CreateFromBinaryString( obj_string )
+        
+    
     obj_tuple = json.loads( obj_string )
     
     return CreateFromSerialisableTuple( obj_tuple )
@@ -105,11 +130,23 @@ class SerialisableBase( object ):
     SERIALISABLE_TYPE = SERIALISABLE_TYPE_BASE
     SERIALISABLE_VERSION = 1
     
+    BINARY_VERSION = None
+    
+    def _GetBinaryInfo( self ):
+        
+        raise NotImplementedError()
+        
+    
     def _GetSerialisableInfo( self ):
         
         raise NotImplementedError()
         
     
+    def _InitialiseFromBinaryInfo( self, binary_info ):
+        
+        raise NotImplementedError()
+        
+    
     def _InitialiseFromSerialisableInfo( self, serialisable_info ):
         
         raise NotImplementedError()
@@ -120,9 +157,28 @@ class SerialisableBase( object ):
         return old_serialisable_info
         
     
-    def DumpToNetworkString( self ):
+    def DumpToBinaryString( self ):
+        
+        if self.BINARY_VERSION is None:
+            
+            raise NotImplementedError( 'This object does not have a binary format!' )
+            
         
-        obj_string = self.DumpToString()
+        header = struct.pack( BINARY_HEADER_FORMAT, self.SERIALISABLE_TYPE, self.BINARY_VERSION )
+        
+        return BINARY_MAGIC + header + self._GetBinaryInfo()
+        
+    
+    def DumpToNetworkString( self, binary = False ):
+        
+        if binary:
+            
+            obj_string = self.DumpToBinaryString()
+            
+        else:
+            
+            obj_string = self.DumpToString()
+            
         
         return zlib.compress( obj_string, 9 )
         
@@ -144,6 +200,16 @@ class SerialisableBase( object ):
         return ( self.SERIALISABLE_TYPE, self.SERIALISABLE_VERSION, self._GetSerialisableInfo() )
         
     
+    def InitialiseFromBinaryInfo( self, binary_version, binary_info ):
+        
+        if self.BINARY_VERSION is None or binary_version > self.BINARY_VERSION:
+            
+            raise Exception( 'Could not understand a binary object of type ' + str( self.SERIALISABLE_TYPE ) + ', version ' + str( binary_version ) + '! You may need to update your client.' )
+            
+        
+        self._InitialiseFromBinaryInfo( binary_info )
+        
+    
     def InitialiseFromSerialisableInfo( self, version, serialisable_info ):
         
         while version < self.SERIALISABLE_VERSION:
@@ -12,7 +12,7 @@ from twisted.internet import reactor, defer
 from twisted.internet.threads import deferToThread
 from twisted.web.server import NOT_DONE_YET
 from twisted.web.resource import Resource
-from twisted.web.static import File as FileResource, NoRangeStaticProducer
+from twisted.web.static import File as FileResource, NoRangeStaticProducer, SingleRangeStaticProducer
 import HydrusData
 import HydrusGlobals as HG
 
@@ -259,6 +259,80 @@ def ParseFileArguments( path ):
     
     return args
     
+def ParseRangeHeader( range_header, size ):
+    
+    # returns ( start, end ), inclusive, or None if we should ignore the header and send the whole file
+    # an unsatisfiable range comes back with start >= size
+    # we only do single ranges--the spec lets us answer anything fancier with the whole file
+    
+    range_header = range_header.strip()
+    
+    if not range_header.startswith( 'bytes=' ):
+        
+        return None
+        
+    
+    byte_range_spec = range_header[ 6 : ].strip()
+    
+    if ',' in byte_range_spec or '-' not in byte_range_spec:
+        
+        return None
+        
+    
+    ( first_byte_pos, last_byte_pos ) = [ pos.strip() for pos in byte_range_spec.split( '-', 1 ) ]
+    
+    try:
+        
+        if first_byte_pos == '':
+            
+            suffix_length = int( last_byte_pos )
+            
+            if suffix_length == 0:
+                
+                return ( size, size - 1 )
+                
+            
+            start = max( 0, size - suffix_length )
+            end = size - 1
+            
+        else:
+            
+            start = int( first_byte_pos )
+            
+            if last_byte_pos == '':
+                
+                end = size - 1
+                
+            else:
+                
+                last_byte = int( last_byte_pos )
+                
+                if last_byte < start:
+                    
+                    return None
+                    
+                
+                end = min( last_byte, size - 1 )
+                
+            
+            if start >= size:
+                
+                return ( size, size - 1 )
+                
+            
+        
+    except ValueError:
+        
+        return None
+        
+    
+    if start < 0:
+        
+        return None
+        
+    
+    return ( start, end )
+    
 hydrus_favicon = FileResource( os.path.join( HC.STATIC_DIR, 'hydrus.ico' ), defaultType = 'image/x-icon' )
 
 class HydrusDomain( object ):
@@ -317,6 +391,48 @@ class HydrusResource( Resource ):
         return request
         
     
+    def _checkIfRange( self, request, etag, last_modified ):
+        
+        # a client resuming a download tells us what version it has, and we only give it a range if that is still what we have
+        
+        if not request.requestHeaders.hasHeader( 'If-Range' ):
+            
+            return True
+            
+        
+        if_range = request.requestHeaders.getRawHeaders( 'If-Range' )[0].strip()
+        
+        return if_range in ( etag, last_modified )
+        
+    
+    def _checkIfNoneMatch( self, request, etag ):
+        
+        if not request.requestHeaders.hasHeader( 'If-None-Match' ):
+            
+            return False
+            
+        
+        for if_none_match in request.requestHeaders.getRawHeaders( 'If-None-Match' ):
+            
+            for client_etag in if_none_match.split( ',' ):
+                
+                client_etag = client_etag.strip()
+                
+                if client_etag.startswith( 'W/' ):
+                    
+                    client_etag = client_etag[2:]
+                    
+                
+                if client_etag in ( '*', etag ):
+                    
+                    return True
+                    
+                
+            
+        
+        return False
+        
+    
     def _checkUserAgent( self, request ):
         
         request.is_hydrus_user_agent = False
@@ -443,6 +559,11 @@ class HydrusResource( Resource ):
             request.addCookie( k, v, **kwargs )
             
         
+        if response_context.HasETag():
+            
+            request.setHeader( 'ETag', response_context.GetETag() )
+            
+        
         do_finish = True
         
         if response_context.HasPath():
@@ -451,31 +572,76 @@ class HydrusResource( Resource ):
             
             size = os.path.getsize( path )
             
+            last_modified = time.strftime( '%a, %d %b %Y %H:%M:%S GMT', time.gmtime( os.path.getmtime( path ) ) )
+            
             mime = response_context.GetMime()
             
             content_type = HC.mime_string_lookup[ mime ]
             
-            content_length = size
-            
             ( base, filename ) = os.path.split( path )
             
             content_disposition = 'inline; filename="' + filename + '"'
             
-            # can't be unicode!
-            request.setHeader( 'Content-Type', str( content_type ) )
-            request.setHeader( 'Content-Length', str( content_length ) )
-            request.setHeader( 'Content-Disposition', str( content_disposition ) )
-            
-            request.setHeader( 'Expires', time.strftime( '%a, %d %b %Y %H:%M:%S GMT', time.gmtime( time.time() + 86400 * 365 ) ) )
-            request.setHeader( 'Cache-Control', str( 86400 * 365 ) )
+            byte_range = None
             
-            fileObject = open( path, 'rb' )
-            
-            producer = NoRangeStaticProducer( request, fileObject )
+            if status_code == 200 and request.requestHeaders.hasHeader( 'Range' ) and self._checkIfRange( request, response_context.GetETag(), last_modified ):
+                
+                range_header = request.requestHeaders.getRawHeaders( 'Range' )[0]
+                
+                byte_range = ParseRangeHeader( range_header, size )
+                
             
-            producer.start()
+            request.setHeader( 'Accept-Ranges', 'bytes' )
+            request.setHeader( 'Last-Modified', last_modified )
             
-            do_finish = False
+            if byte_range is not None and byte_range[0] >= size:
+                
+                content_length = 0
+                
+                request.setResponseCode( 416 )
+                
+                request.setHeader( 'Content-Range', 'bytes */' + str( size ) )
+                request.setHeader( 'Content-Length', str( content_length ) )
+                
+            else:
+                
+                # can't be unicode!
+                request.setHeader( 'Content-Type', str( content_type ) )
+                request.setHeader( 'Content-Disposition', str( content_disposition ) )
+                
+                request.setHeader( 'Expires', time.strftime( '%a, %d %b %Y %H:%M:%S GMT', time.gmtime( time.time() + 86400 * 365 ) ) )
+                request.setHeader( 'Cache-Control', str( 86400 * 365 ) )
+                
+                fileObject = open( path, 'rb' )
+                
+                if byte_range is None:
+                    
+                    content_length = size
+                    
+                    producer = NoRangeStaticProducer( request, fileObject )
+                    
+                else:
+                    
+                    ( start, end ) = byte_range
+                    
+                    content_length = end - start + 1
+                    
+                    request.setResponseCode( 206 )
+                    
+                    request.setHeader( 'Content-Range', 'bytes ' + str( start ) + '-' + str( end ) + '/' + str( size ) )
+                    
+                    producer = SingleRangeStaticProducer( request, fileObject, start, content_length )
+                    
+                
+                request.setHeader( 'Content-Length', str( content_length ) )
+                
+                # twisted's default is 64KB, which means a lot of trips around the reactor for a big video
+                producer.bufferSize = HC.READ_BLOCK_SIZE
+                
+                producer.start()
+                
+                do_finish = False
+                
             
         elif response_context.HasBody():
             
@@ -493,6 +659,13 @@ class HydrusResource( Resource ):
             request.setHeader( 'Content-Length', str( content_length ) )
             request.setHeader( 'Content-Disposition', content_disposition )
             
+            if response_context.HasETag():
+                
+                # an etag'd body is a file we cached in memory, so it gets the same headers as if we had served it from disk
+                request.setHeader( 'Expires', time.strftime( '%a, %d %b %Y %H:%M:%S GMT', time.gmtime( time.time() + 86400 * 365 ) ) )
+                request.setHeader( 'Cache-Control', str( 86400 * 365 ) )
+                
+            
             request.write( HydrusData.ToByteString( body ) )
             
         else:
@@ -748,7 +921,7 @@ class HydrusResourceWelcome( HydrusResource ):
     
 class ResponseContext( object ):
     
-    def __init__( self, status_code, mime = HC.APPLICATION_JSON, body = None, path = None, cookies = None ):
+    def __init__( self, status_code, mime = HC.APPLICATION_JSON, body = None, path = None, cookies = None, etag = None ):
         
         if isinstance( body, HydrusSerialisable.SerialisableBase ):
             
@@ -765,6 +938,7 @@ class ResponseContext( object ):
         self._body = body
         self._path = path
         self._cookies = cookies
+        self._etag = etag
         
     
     def GetBody( self ):
@@ -774,6 +948,8 @@ class ResponseContext( object ):
     
     def GetCookies( self ): return self._cookies
     
+    def GetETag( self ): return self._etag
+    
     def GetLength( self ): return len( self._body )
     
     def GetMime( self ): return self._mime
@@ -784,5 +960,7 @@ class ResponseContext( object ):
     
     def HasBody( self ): return self._body is not None
     
+    def HasETag( self ): return self._etag is not None
+    
     def HasPath( self ): return self._path is not None
     
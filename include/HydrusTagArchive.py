@@ -45,17 +45,27 @@ HASH_TYPE_SHA512 = 3 # 64 bytes long
 # the tag import options widget when people sync with these archives.
 
 
+# If you only want to look things up, pass read_only = True. Then nothing you do can change the archive, and GetMappingsForHashes
+# will fetch the tags for lots of hashes at once much faster than calling GetTags for each.
+
+
 # And also feel free to contact me directly at hydrus.admin@gmail.com if you need help.
 
 class HydrusTagArchive( object ):
     
-    def __init__( self, path ):
+    def __init__( self, path, read_only = False ):
         
         self._path = path
+        self._read_only = read_only
         
         if not os.path.exists( self._path ): create_db = True
         else: create_db = False
         
+        if create_db and self._read_only:
+            
+            raise Exception( 'The tag archive at ' + self._path + ' does not exist!' )
+            
+        
         self._InitDBCursor()
         
         if create_db: self._InitDB()
@@ -91,6 +101,11 @@ class HydrusTagArchive( object ):
         
         self._c = self._db.cursor()
         
+        if self._read_only:
+            
+            self._c.execute( 'PRAGMA query_only = ON;' )
+            
+        
     
     def _GetHashId( self, hash, read_only = False ):
         
@@ -147,6 +162,12 @@ class HydrusTagArchive( object ):
         self._c.execute( 'BEGIN IMMEDIATE;' )
         
     
+    def Close( self ):
+        
+        self._c.close()
+        self._db.close()
+        
+    
     def CommitBigJob( self ):
         
         self._c.execute( 'COMMIT;' )
@@ -222,6 +243,11 @@ class HydrusTagArchive( object ):
             
             if hash_len in len_to_hash_type:
                 
+                if self._read_only:
+                    
+                    return len_to_hash_type[ hash_len ]
+                    
+                
                 self.SetHashType( len_to_hash_type[ hash_len ] )
                 
             else:
@@ -241,6 +267,36 @@ class HydrusTagArchive( object ):
     
     def GetMappings( self, hash ): return self.GetTags( hash )
     
+    def GetMappingsForHashes( self, hashes ):
+        
+        # hashes that are not in the archive are not in the result
+        
+        hashes_to_tags = {}
+        
+        hashes = list( hashes )
+        
+        for i in range( 0, len( hashes ), 256 ):
+            
+            chunk = hashes[ i : i + 256 ]
+            
+            select = 'SELECT hash, tag FROM hashes NATURAL JOIN mappings NATURAL JOIN tags WHERE hash IN ( ' + ', '.join( ( '?' for hash in chunk ) ) + ' );'
+            
+            for ( hash, tag ) in self._c.execute( select, [ sqlite3.Binary( hash ) for hash in chunk ] ):
+                
+                hash = str( hash )
+                
+                if hash not in hashes_to_tags:
+                    
+                    hashes_to_tags[ hash ] = set()
+                    
+                
+                hashes_to_tags[ hash ].add( tag )
+                
+            
+        
+        return hashes_to_tags
+        
+    
     def GetName( self ):
         
         filename = os.path.basename( self._path )
@@ -9,6 +9,7 @@ import HydrusThreading
 import os
 import ServerDaemons
 import ServerDB
+import ServerFiles
 import ServerServer
 import sys
 import time
@@ -274,6 +275,11 @@ class Controller( HydrusController.HydrusController ):
         HydrusData.CleanRunningFile( self.db_dir, 'server' )
         
     
+    def GetFileBlobCache( self ):
+        
+        return self._file_blob_cache
+        
+    
     def GetFilesDir( self ):
         
         return self.db.GetFilesDir()
@@ -295,6 +301,8 @@ class Controller( HydrusController.HydrusController ):
         
         self._server_session_manager = HydrusSessions.HydrusSessionManagerServer()
         
+        self._file_blob_cache = ServerFiles.FileBlobCache()
+        
         self._service_keys_to_connected_ports = {}
         
     
@@ -328,6 +328,19 @@ class DB( HydrusDB.HydrusDB ):
         HydrusData.Print( 'backing up: done!' )
         
     
+    def _CloseDBCursor( self ):
+        
+        # half-made updates hold temp tables on this cursor, so let them clean up while it is still open
+        # the db closes its cursor a couple of times while booting, before the caches exist
+        
+        if hasattr( self, '_repository_update_generations' ):
+            
+            self._RepositoryAbandonUpdateGenerations()
+            
+        
+        HydrusDB.HydrusDB._CloseDBCursor( self )
+        
+    
     def _CreateDB( self ):
         
         HydrusPaths.MakeSureDirectoryExists( self._files_dir )
@@ -1044,6 +1057,8 @@ class DB( HydrusDB.HydrusDB ):
         self._over_monthly_data = False
         self._services_over_monthly_data = set()
         
+        self._repository_update_generations = {}
+        
     
     def _InitExternalDatabases( self ):
         
@@ -1279,6 +1294,28 @@ class DB( HydrusDB.HydrusDB ):
             
         
     
+    def _RepositoryAbandonUpdateGenerations( self, service_id = None ):
+        
+        if service_id is None:
+            
+            service_ids = list( self._repository_update_generations.keys() )
+            
+        else:
+            
+            service_ids = [ service_id ]
+            
+        
+        for service_id in service_ids:
+            
+            if service_id in self._repository_update_generations:
+                
+                ( generation_key, updates, update_hashes, total_definition_rows, total_content_rows ) = self._repository_update_generations.pop( service_id )
+                
+                updates.close()
+                
+            
+        
+    
     def _RepositoryAddFile( self, service_id, account_id, file_dict, overwrite_deleted ):
         
         master_hash_id = self._AddFile( file_dict )
@@ -1530,24 +1567,37 @@ class DB( HydrusDB.HydrusDB ):
         self._c.execute( 'CREATE TABLE ' + update_table_name + ' ( master_hash_id INTEGER PRIMARY KEY );' )
         
     
-    def _RepositoryCreateUpdate( self, service_key, begin, end ):
-        
-        service_id = self._GetServiceId( service_key )
+    def _RepositoryCreateUpdate( self, service_key, begin, end, update_format = HC.UPDATE_FORMAT_JSON, stop_time = None ):
         
-        ( name, ) = self._c.execute( 'SELECT name FROM services WHERE service_id = ?;', ( service_id, ) ).fetchone()
+        # returns None if stop_time came before we were done, in which case call again with the same period to carry on
         
-        HydrusData.Print( 'Creating update for ' + repr( name ) + ' from ' + HydrusData.ConvertTimestampToPrettyTime( begin ) + ' to ' + HydrusData.ConvertTimestampToPrettyTime( end ) )
-        
-        updates = self._RepositoryGenerateUpdates( service_id, begin, end )
+        service_id = self._GetServiceId( service_key )
         
-        update_hashes = []
+        generation_key = ( begin, end, update_format )
         
-        total_definition_rows = 0
-        total_content_rows = 0
+        if service_id in self._repository_update_generations and self._repository_update_generations[ service_id ][0] == generation_key:
+            
+            ( generation_key, updates, update_hashes, total_definition_rows, total_content_rows ) = self._repository_update_generations.pop( service_id )
+            
+        else:
+            
+            self._RepositoryAbandonUpdateGenerations( service_id )
+            
+            ( name, ) = self._c.execute( 'SELECT name FROM services WHERE service_id = ?;', ( service_id, ) ).fetchone()
+            
+            HydrusData.Print( 'Creating update for ' + repr( name ) + ' from ' + HydrusData.ConvertTimestampToPrettyTime( begin ) + ' to ' + HydrusData.ConvertTimestampToPrettyTime( end ) )
+            
+            updates = self._RepositoryGenerateUpdates( service_id, begin, end )
+            
+            update_hashes = []
+            
+            total_definition_rows = 0
+            total_content_rows = 0
+            
         
-        if len( updates ) > 0:
+        for update in updates:
             
-            for update in updates:
+            if update is not None:
                 
                 num_rows = update.GetNumRows()
                 
@@ -1560,7 +1610,7 @@ class DB( HydrusDB.HydrusDB ):
                     total_content_rows += num_rows
                     
                 
-                update_bytes = update.DumpToNetworkString()
+                update_bytes = update.DumpToNetworkString( binary = update_format == HC.UPDATE_FORMAT_BINARY )
                 
                 update_hash = hashlib.sha256( update_bytes ).digest()
                 
@@ -1573,6 +1623,19 @@ class DB( HydrusDB.HydrusDB ):
                 
                 update_hashes.append( update_hash )
                 
+                del update
+                del update_bytes
+                
+            
+            if stop_time is not None and HydrusData.TimeHasPassed( stop_time ):
+                
+                self._repository_update_generations[ service_id ] = ( generation_key, updates, update_hashes, total_definition_rows, total_content_rows )
+                
+                return None
+                
+            
+        
+        if len( update_hashes ) > 0:
             
             ( update_table_name ) = GenerateRepositoryUpdateTableName( service_id )
             
@@ -1581,7 +1644,7 @@ class DB( HydrusDB.HydrusDB ):
             self._c.executemany( 'INSERT OR IGNORE INTO ' + update_table_name + ' ( master_hash_id ) VALUES ( ? );', ( ( master_hash_id, ) for master_hash_id in master_hash_ids ) )
             
         
-        HydrusData.Print( 'Update OK. ' + HydrusData.ConvertIntToPrettyString( total_definition_rows ) + ' definition rows and ' + HydrusData.ConvertIntToPrettyString( total_content_rows ) + ' content rows in ' + HydrusData.ConvertIntToPrettyString( len( updates ) ) + ' update files.' )
+        HydrusData.Print( 'Update OK. ' + HydrusData.ConvertIntToPrettyString( total_definition_rows ) + ' definition rows and ' + HydrusData.ConvertIntToPrettyString( total_content_rows ) + ' content rows in ' + HydrusData.ConvertIntToPrettyString( len( update_hashes ) ) + ' update files.' )
         
         return update_hashes
         
@@ -1735,134 +1798,178 @@ class DB( HydrusDB.HydrusDB ):
         
         service_id = self._GetServiceId( service_key )
         
-        updates = self._RepositoryGenerateUpdates( service_id, begin, end )
+        updates = [ update for update in self._RepositoryGenerateUpdates( service_id, begin, end ) if update is not None ]
         
         return updates
         
     
     def _RepositoryGenerateUpdates( self, service_id, begin, end ):
         
+        # this yields each update as soon as it fills up, and None after every page of rows
+        # no cursor is left open across a yield, so the caller can stop at any of them, do other db work, and carry on later
+        
         MAX_DEFINITIONS_ROWS = 50000
         MAX_CONTENT_ROWS = 250000
         
         MAX_CONTENT_CHUNK = 25000
         
-        updates = []
-        
         definitions_update_builder = HydrusNetwork.UpdateBuilder( HydrusNetwork.DefinitionsUpdate, MAX_DEFINITIONS_ROWS )
         content_update_builder = HydrusNetwork.UpdateBuilder( HydrusNetwork.ContentUpdate, MAX_CONTENT_ROWS )
         
         ( service_hash_ids_table_name, service_tag_ids_table_name ) = GenerateRepositoryMasterMapTableNames( service_id )
         
-        for ( service_hash_id, hash ) in self._c.execute( 'SELECT service_hash_id, hash FROM ' + service_hash_ids_table_name + ' NATURAL JOIN hashes WHERE hash_id_timestamp BETWEEN ? AND ?;', ( begin, end ) ):
+        for page in self._RepositoryIterateRowPages( service_hash_ids_table_name, 'hash_id_timestamp', begin, end, ( 'service_hash_id', ), 'SELECT service_hash_id, hash FROM %s NATURAL CROSS JOIN ' + service_hash_ids_table_name + ' NATURAL JOIN hashes' ):
             
-            row = ( HC.DEFINITIONS_TYPE_HASHES, service_hash_id, hash )
-            
-            definitions_update_builder.AddRow( row )
-            
-        
-        for ( service_tag_id, tag ) in self._c.execute( 'SELECT service_tag_id, tag FROM ' + service_tag_ids_table_name + ' NATURAL JOIN tags WHERE tag_id_timestamp BETWEEN ? AND ?;', ( begin, end ) ):
+            for ( service_hash_id, hash ) in page:
+                
+                definitions_update_builder.AddRow( ( HC.DEFINITIONS_TYPE_HASHES, service_hash_id, hash ) )
+                
             
-            row = ( HC.DEFINITIONS_TYPE_TAGS, service_tag_id, tag )
+            for update in definitions_update_builder.PopUpdates():
+                
+                yield update
+                
             
-            definitions_update_builder.AddRow( row )
+            yield None
             
         
-        definitions_update_builder.Finish()
-        
-        updates.extend( definitions_update_builder.GetUpdates() )
-        
-        #
-        
-        ( current_files_table_name, deleted_files_table_name, pending_files_table_name, petitioned_files_table_name, ip_addresses_table_name ) = GenerateRepositoryFilesTableNames( service_id )
-        
-        table_join = self._RepositoryGetFilesInfoFilesTableJoin( service_id, HC.CONTENT_STATUS_CURRENT )
-        
-        for ( service_hash_id, size, mime, timestamp, width, height, duration, num_frames, num_words ) in self._c.execute( 'SELECT service_hash_id, size, mime, file_timestamp, width, height, duration, num_frames, num_words FROM ' + table_join + ' WHERE file_timestamp BETWEEN ? AND ?;', ( begin, end ) ):
+        for page in self._RepositoryIterateRowPages( service_tag_ids_table_name, 'tag_id_timestamp', begin, end, ( 'service_tag_id', ), 'SELECT service_tag_id, tag FROM %s NATURAL CROSS JOIN ' + service_tag_ids_table_name + ' NATURAL JOIN tags' ):
+            
+            for ( service_tag_id, tag ) in page:
+                
+                definitions_update_builder.AddRow( ( HC.DEFINITIONS_TYPE_TAGS, service_tag_id, tag ) )
+                
             
-            file_row = ( service_hash_id, size, mime, timestamp, width, height, duration, num_frames, num_words )
+            for update in definitions_update_builder.PopUpdates():
+                
+                yield update
+                
             
-            content_update_builder.AddRow( ( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_ADD, file_row ) )
+            yield None
             
         
-        service_hash_ids = [ service_hash_id for ( service_hash_id, ) in self._c.execute( 'SELECT service_hash_id FROM ' + deleted_files_table_name + ' WHERE file_timestamp BETWEEN ? AND ?;', ( begin, end ) ) ]
+        definitions_update_builder.Finish()
         
-        for service_hash_id in service_hash_ids:
+        for update in definitions_update_builder.PopUpdates():
             
-            content_update_builder.AddRow( ( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_DELETE, service_hash_id ) )
+            yield update
             
         
         #
         
-        ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateRepositoryMappingsTableNames( service_id )
-        
-        service_tag_ids_to_service_hash_ids = HydrusData.BuildKeyToListDict( self._c.execute( 'SELECT service_tag_id, service_hash_id FROM ' + current_mappings_table_name + ' WHERE mapping_timestamp BETWEEN ? AND ?;', ( begin, end ) ) )
+        ( current_files_table_name, deleted_files_table_name, pending_files_table_name, petitioned_files_table_name, ip_addresses_table_name ) = GenerateRepositoryFilesTableNames( service_id )
         
-        for ( service_tag_id, service_hash_ids ) in service_tag_ids_to_service_hash_ids.items():
+        for page in self._RepositoryIterateRowPages( current_files_table_name, 'file_timestamp', begin, end, ( 'service_hash_id', ), 'SELECT service_hash_id, size, mime, file_timestamp, width, height, duration, num_frames, num_words FROM %s NATURAL CROSS JOIN ' + current_files_table_name + ' NATURAL JOIN ' + service_hash_ids_table_name + ' NATURAL JOIN files_info' ):
             
-            for block_of_service_hash_ids in HydrusData.SplitListIntoChunks( service_hash_ids, MAX_CONTENT_CHUNK ):
+            for file_row in page:
+                
+                content_update_builder.AddRow( ( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_ADD, file_row ) )
                 
-                row_weight = len( block_of_service_hash_ids )
+            
+            for update in content_update_builder.PopUpdates():
                 
-                content_update_builder.AddRow( ( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( service_tag_id, block_of_service_hash_ids ) ), row_weight )
+                yield update
                 
             
+            yield None
+            
         
-        service_tag_ids_to_service_hash_ids = HydrusData.BuildKeyToListDict( self._c.execute( 'SELECT service_tag_id, service_hash_id FROM ' + deleted_mappings_table_name + ' WHERE mapping_timestamp BETWEEN ? AND ?;', ( begin, end ) ) )
-        
-        for ( service_tag_id, service_hash_ids ) in service_tag_ids_to_service_hash_ids.items():
+        for page in self._RepositoryIterateRowPages( deleted_files_table_name, 'file_timestamp', begin, end, ( 'service_hash_id', ) ):
             
-            for block_of_service_hash_ids in HydrusData.SplitListIntoChunks( service_hash_ids, MAX_CONTENT_CHUNK ):
+            for ( service_hash_id, ) in page:
                 
-                row_weight = len( block_of_service_hash_ids )
+                content_update_builder.AddRow( ( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_DELETE, service_hash_id ) )
                 
-                content_update_builder.AddRow( ( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_DELETE, ( service_tag_id, block_of_service_hash_ids ) ), row_weight )
+            
+            for update in content_update_builder.PopUpdates():
+                
+                yield update
                 
             
+            yield None
+            
         
         #
         
-        ( current_tag_parents_table_name, deleted_tag_parents_table_name, pending_tag_parents_table_name, petitioned_tag_parents_table_name ) = GenerateRepositoryTagParentsTableNames( service_id )
-        
-        pairs = self._c.execute( 'SELECT child_service_tag_id, parent_service_tag_id FROM ' + current_tag_parents_table_name + ' WHERE parent_timestamp BETWEEN ? AND ?;', ( begin, end ) ).fetchall()
+        ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateRepositoryMappingsTableNames( service_id )
         
-        for pair in pairs:
+        for ( mappings_table_name, action ) in ( ( current_mappings_table_name, HC.CONTENT_UPDATE_ADD ), ( deleted_mappings_table_name, HC.CONTENT_UPDATE_DELETE ) ):
             
-            content_update_builder.AddRow( ( HC.CONTENT_TYPE_TAG_PARENTS, HC.CONTENT_UPDATE_ADD, pair ) )
+            # rows come in tag order, so we can gather each tag's hashes as we go rather than building a dict of the whole period
             
-        
-        pairs = self._c.execute( 'SELECT child_service_tag_id, parent_service_tag_id FROM ' + deleted_tag_parents_table_name + ' WHERE parent_timestamp BETWEEN ? AND ?;', ( begin, end ) ).fetchall()
-        
-        for pair in pairs:
+            block_service_tag_id = None
+            block_of_service_hash_ids = []
+            
+            for page in self._RepositoryIterateRowPages( mappings_table_name, 'mapping_timestamp', begin, end, ( 'service_tag_id', 'service_hash_id' ) ):
+                
+                for ( service_tag_id, service_hash_id ) in page:
+                    
+                    if service_tag_id != block_service_tag_id or len( block_of_service_hash_ids ) == MAX_CONTENT_CHUNK:
+                        
+                        if len( block_of_service_hash_ids ) > 0:
+                            
+                            content_update_builder.AddRow( ( HC.CONTENT_TYPE_MAPPINGS, action, ( block_service_tag_id, block_of_service_hash_ids ) ), len( block_of_service_hash_ids ) )
+                            
+                        
+                        block_service_tag_id = service_tag_id
+                        block_of_service_hash_ids = []
+                        
+                    
+                    block_of_service_hash_ids.append( service_hash_id )
+                    
+                
+                for update in content_update_builder.PopUpdates():
+                    
+                    yield update
+                    
+                
+                yield None
+                
             
-            content_update_builder.AddRow( ( HC.CONTENT_TYPE_TAG_PARENTS, HC.CONTENT_UPDATE_DELETE, pair ) )
+            if len( block_of_service_hash_ids ) > 0:
+                
+                content_update_builder.AddRow( ( HC.CONTENT_TYPE_MAPPINGS, action, ( block_service_tag_id, block_of_service_hash_ids ) ), len( block_of_service_hash_ids ) )
+                
             
         
         #
         
+        ( current_tag_parents_table_name, deleted_tag_parents_table_name, pending_tag_parents_table_name, petitioned_tag_parents_table_name ) = GenerateRepositoryTagParentsTableNames( service_id )
         ( current_tag_siblings_table_name, deleted_tag_siblings_table_name, pending_tag_siblings_table_name, petitioned_tag_siblings_table_name ) = GenerateRepositoryTagSiblingsTableNames( service_id )
         
-        pairs = self._c.execute( 'SELECT bad_service_tag_id, good_service_tag_id FROM ' + current_tag_siblings_table_name + ' WHERE sibling_timestamp BETWEEN ? AND ?;', ( begin, end ) ).fetchall()
+        pair_sources = []
         
-        for pair in pairs:
-            
-            content_update_builder.AddRow( ( HC.CONTENT_TYPE_TAG_SIBLINGS, HC.CONTENT_UPDATE_ADD, pair ) )
-            
-        
-        pairs = self._c.execute( 'SELECT bad_service_tag_id, good_service_tag_id FROM ' + deleted_tag_siblings_table_name + ' WHERE sibling_timestamp BETWEEN ? AND ?;', ( begin, end ) ).fetchall()
+        pair_sources.append( ( HC.CONTENT_TYPE_TAG_PARENTS, HC.CONTENT_UPDATE_ADD, current_tag_parents_table_name, 'parent_timestamp', ( 'child_service_tag_id', 'parent_service_tag_id' ) ) )
+        pair_sources.append( ( HC.CONTENT_TYPE_TAG_PARENTS, HC.CONTENT_UPDATE_DELETE, deleted_tag_parents_table_name, 'parent_timestamp', ( 'child_service_tag_id', 'parent_service_tag_id' ) ) )
+        pair_sources.append( ( HC.CONTENT_TYPE_TAG_SIBLINGS, HC.CONTENT_UPDATE_ADD, current_tag_siblings_table_name, 'sibling_timestamp', ( 'bad_service_tag_id', 'good_service_tag_id' ) ) )
+        pair_sources.append( ( HC.CONTENT_TYPE_TAG_SIBLINGS, HC.CONTENT_UPDATE_DELETE, deleted_tag_siblings_table_name, 'sibling_timestamp', ( 'bad_service_tag_id', 'good_service_tag_id' ) ) )
         
-        for pair in pairs:
+        for ( content_type, action, table_name, timestamp_column_name, key_column_names ) in pair_sources:
             
-            content_update_builder.AddRow( ( HC.CONTENT_TYPE_TAG_SIBLINGS, HC.CONTENT_UPDATE_DELETE, pair ) )
+            for page in self._RepositoryIterateRowPages( table_name, timestamp_column_name, begin, end, key_column_names ):
+                
+                for pair in page:
+                    
+                    content_update_builder.AddRow( ( content_type, action, pair ) )
+                    
+                
+                for update in content_update_builder.PopUpdates():
+                    
+                    yield update
+                    
+                
+                yield None
+                
             
         
         #
         
         content_update_builder.Finish()
         
-        updates.extend( content_update_builder.GetUpdates() )
-        
-        return updates
+        for update in content_update_builder.PopUpdates():
+            
+            yield update
+            
         
     
     def _RepositoryGetAccountInfo( self, service_id, account_id ):
@@ -2498,6 +2605,79 @@ class DB( HydrusDB.HydrusDB ):
         return ( True, mime )
         
     
+    def _RepositoryIterateRowPages( self, table_name, timestamp_column_name, begin, end, key_column_names, select_statement = None, page_size = 10000 ):
+        
+        # asking for the period's rows in key order directly makes sqlite walk the whole primary key and skip the timestamp index
+        # so we first copy the period's keys out with the timestamp index and then page over that copy in key order
+        # select_statement is 'SELECT ... FROM %s ...', with %s the keys table and the key columns first in the results
+        # each page is fetched in full and then we pick up after its last key, so nothing is held open between pages
+        
+        if len( key_column_names ) == 1:
+            
+            ( first_key_column_name, ) = key_column_names
+            
+            keyset_predicate = first_key_column_name + ' > ?'
+            
+        else:
+            
+            ( first_key_column_name, second_key_column_name ) = key_column_names
+            
+            # the leading >= lets sqlite seek straight to the right place in the primary key
+            keyset_predicate = first_key_column_name + ' >= ? AND ( ' + first_key_column_name + ' > ? OR ' + second_key_column_name + ' > ? )'
+            
+        
+        temp_table_name = 'temp_update_keys_' + HydrusData.GenerateKey().encode( 'hex' )
+        
+        if select_statement is None:
+            
+            select_statement = 'SELECT * FROM %s'
+            
+        
+        query = ( select_statement % temp_table_name ) + ' WHERE ' + keyset_predicate + ' ORDER BY ' + ', '.join( key_column_names ) + ' LIMIT ?;'
+        
+        self._c.execute( 'CREATE TEMPORARY TABLE ' + temp_table_name + ' ( ' + ', '.join( key_column_name + ' INTEGER' for key_column_name in key_column_names ) + ', PRIMARY KEY ( ' + ', '.join( key_column_names ) + ' ) );' )
+        
+        try:
+            
+            self._c.execute( 'INSERT INTO ' + temp_table_name + ' SELECT ' + ', '.join( key_column_names ) + ' FROM ' + table_name + ' WHERE ' + timestamp_column_name + ' BETWEEN ? AND ?;', ( begin, end ) )
+            
+            last_key = ( -1, ) * len( key_column_names )
+            
+            while True:
+                
+                if len( key_column_names ) == 1:
+                    
+                    keyset_args = last_key
+                    
+                else:
+                    
+                    keyset_args = ( last_key[0], last_key[0], last_key[1] )
+                    
+                
+                page = self._c.execute( query, keyset_args + ( page_size, ) ).fetchall()
+                
+                if len( page ) == 0:
+                    
+                    break
+                    
+                
+                last_key = tuple( page[-1][ : len( key_column_names ) ] )
+                
+                yield page
+                
+                if len( page ) < page_size:
+                    
+                    break
+                    
+                
+            
+        finally:
+            
+            # if we are abandoned partway, this runs when the generator is closed, which _RepositoryAbandonUpdateGenerations does on the db thread
+            self._c.execute( 'DROP TABLE ' + temp_table_name + ';' )
+            
+        
+    
     def _RepositoryPendTagParent( self, service_id, account_id, child_master_tag_id, parent_master_tag_id, reason_id ):
         
         ( current_tag_parents_table_name, deleted_tag_parents_table_name, pending_tag_parents_table_name, petitioned_tag_parents_table_name ) = GenerateRepositoryTagParentsTableNames( service_id )
@@ -3833,6 +4013,24 @@ class DB( HydrusDB.HydrusDB ):
             HydrusPaths.DeletePath( updates_dir )
             
         
+        if version == 283:
+            
+            service_info = self._c.execute( 'SELECT service_id, service_type, dictionary_string FROM services;' ).fetchall()
+            
+            for ( service_id, service_type, dictionary_string ) in service_info:
+                
+                if service_type in HC.REPOSITORIES:
+                    
+                    dictionary = HydrusSerialisable.CreateFromString( dictionary_string )
+                    
+                    dictionary[ 'update_format' ] = HC.UPDATE_FORMAT_JSON
+                    
+                    dictionary_string = dictionary.DumpToString()
+                    
+                    self._c.execute( 'UPDATE services SET dictionary_string = ? WHERE service_id = ?;', ( dictionary_string, service_id ) )
+                    
+                
+            
         
         HydrusData.Print( 'The server has updated to version ' + str( version + 1 ) )
         
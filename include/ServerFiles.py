@@ -2,8 +2,18 @@ import HydrusConstants as HC
 import HydrusData
 import HydrusExceptions
 import HydrusGlobals as HG
+import collections
 import itertools
 import os
+import threading
+
+FILE_BLOB_CACHE_SIZE = 128 * 1024 * 1024
+MAX_CACHED_FILE_BLOB_SIZE = 8 * 1024 * 1024
+
+def GenerateETag( hash ):
+    
+    return '"' + hash.encode( 'hex' ) + '"'
+    
 
 def GetAllHashes( file_type ):
     
@@ -80,3 +90,90 @@ def IterateAllPaths( file_type ):
             
         
     
+    
+class FileBlobCache( object ):
+    
+    # update files and thumbnails never change once written, so we can hang on to hot ones without worrying about them going stale
+    
+    def __init__( self, cache_size = FILE_BLOB_CACHE_SIZE, max_blob_size = MAX_CACHED_FILE_BLOB_SIZE ):
+        
+        self._cache_size = cache_size
+        self._max_blob_size = max_blob_size
+        
+        self._paths_to_blobs = collections.OrderedDict()
+        self._total_size = 0
+        
+        self._num_hits = 0
+        self._num_misses = 0
+        
+        self._lock = threading.Lock()
+        
+    
+    def Clear( self ):
+        
+        with self._lock:
+            
+            self._paths_to_blobs = collections.OrderedDict()
+            self._total_size = 0
+            
+        
+    
+    def GetBlob( self, path ):
+        
+        # returns None if the file is too big to be worth caching, in which case serve it from disk
+        
+        with self._lock:
+            
+            if path in self._paths_to_blobs:
+                
+                self._num_hits += 1
+                
+                # pop and put back to move it to the recent end
+                blob = self._paths_to_blobs.pop( path )
+                
+                self._paths_to_blobs[ path ] = blob
+                
+                return blob
+                
+            
+            self._num_misses += 1
+            
+        
+        if os.path.getsize( path ) > self._max_blob_size:
+            
+            return None
+            
+        
+        with open( path, 'rb' ) as f:
+            
+            blob = f.read()
+            
+        
+        with self._lock:
+            
+            if path not in self._paths_to_blobs:
+                
+                self._paths_to_blobs[ path ] = blob
+                
+                self._total_size += len( blob )
+                
+                while self._total_size > self._cache_size:
+                    
+                    ( deletee_path, deletee_blob ) = self._paths_to_blobs.popitem( last = False )
+                    
+                    self._total_size -= len( deletee_blob )
+                    
+                
+            
+        
+        return blob
+        
+    
+    def GetStats( self ):
+        
+        with self._lock:
+            
+            return ( len( self._paths_to_blobs ), self._total_size, self._num_hits, self._num_misses )
+            
+        
+    
@@ -160,6 +160,27 @@ class HydrusResourceRestricted( HydrusServerResources.HydrusResource ):
         return request
         
     
+    def _generateCachedFileResponseContext( self, request, hash, path, mime ):
+        
+        etag = ServerFiles.GenerateETag( hash )
+        
+        if self._checkIfNoneMatch( request, etag ):
+            
+            return HydrusServerResources.ResponseContext( 304, etag = etag )
+            
+        
+        blob = HG.server_controller.GetFileBlobCache().GetBlob( path )
+        
+        if blob is None:
+            
+            return HydrusServerResources.ResponseContext( 200, mime = mime, path = path, etag = etag )
+            
+        else:
+            
+            return HydrusServerResources.ResponseContext( 200, mime = mime, body = blob, etag = etag )
+            
+        
+    
     def _reportDataUsed( self, request, num_bytes ):
         
         HydrusServerResources.HydrusResource._reportDataUsed( self, request, num_bytes )
@@ -419,7 +440,7 @@ class HydrusResourceRestrictedRepositoryThumbnail( HydrusResourceRestricted ):
         
         path = ServerFiles.GetThumbnailPath( hash )
         
-        response_context = HydrusServerResources.ResponseContext( 200, mime = HC.APPLICATION_OCTET_STREAM, path = path )
+        response_context = self._generateCachedFileResponseContext( request, hash, path, HC.APPLICATION_OCTET_STREAM )
         
         return response_context
         
@@ -472,7 +493,7 @@ class HydrusResourceRestrictedUpdate( HydrusResourceRestricted ):
         
         path = ServerFiles.GetFilePath( update_hash )
         
-        response_context = HydrusServerResources.ResponseContext( 200, mime = HC.APPLICATION_OCTET_STREAM, path = path )
+        response_context = self._generateCachedFileResponseContext( request, update_hash, path, HC.APPLICATION_OCTET_STREAM )
         
         return response_context
         
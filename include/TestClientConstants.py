@@ -3,9 +3,11 @@ import ClientData
 import ClientGUIManagement
 import ClientGUIDialogsManage
 import ClientCaches
+import ClientRendering
 import ClientServices
 import collections
 import HydrusConstants as HC
+import numpy
 import os
 import TestConstants
 import unittest
@@ -53,6 +55,55 @@ class TestFunctions( unittest.TestCase ):
     
 class TestManagers( unittest.TestCase ):
     
+    def test_data_cache( self ):
+        
+        class FakeData( object ):
+            
+            def __init__( self, size ):
+                
+                self._size = size
+                
+            
+            def GetEstimatedMemoryFootprint( self ):
+                
+                return self._size
+                
+            
+        
+        data_cache = ClientCaches.DataCache( HG.test_controller, 100 )
+        
+        data_cache.AddData( 'a', FakeData( 40 ) )
+        data_cache.AddData( 'b', FakeData( 40 ) )
+        
+        self.assertEqual( data_cache.GetStats(), ( 2, 80, 100, 0, 0, 0 ) )
+        
+        # touching 'a' makes 'b' the least recently used
+        
+        self.assertEqual( data_cache.GetIfHasData( 'a' ).GetEstimatedMemoryFootprint(), 40 )
+        
+        data_cache.AddData( 'c', FakeData( 40 ) )
+        
+        self.assertTrue( data_cache.HasData( 'a' ) )
+        self.assertFalse( data_cache.HasData( 'b' ) )
+        self.assertTrue( data_cache.HasData( 'c' ) )
+        
+        self.assertEqual( data_cache.GetIfHasData( 'b' ), None )
+        
+        self.assertEqual( data_cache.GetStats(), ( 2, 80, 100, 1, 1, 1 ) )
+        
+        # something bigger than the whole cache pushes everything else out, but is kept itself
+        
+        data_cache.AddData( 'd', FakeData( 150 ) )
+        
+        self.assertEqual( data_cache.GetStats(), ( 1, 150, 100, 1, 1, 3 ) )
+        
+        self.assertRaises( Exception, data_cache.GetData, 'a' )
+        
+        data_cache.Clear()
+        
+        self.assertEqual( data_cache.GetStats(), ( 0, 0, 100, 1, 2, 3 ) )
+        
+    
     def test_services( self ):
         
         def test_service( service, key, service_type, name ):
@@ -110,6 +161,80 @@ class TestManagers( unittest.TestCase ):
         self.assertRaises( Exception, services_manager.GetService, other_key )
         
     
+    def test_thumbnail_disk_cache( self ):
+        
+        path = os.path.join( TestConstants.DB_DIR, 'test_rendered_thumbnails.cache' )
+        
+        hash_1 = HydrusData.GenerateKey()
+        hash_2 = HydrusData.GenerateKey()
+        
+        hydrus_bitmap_1 = ClientRendering.GenerateHydrusBitmapFromNumPyImage( numpy.random.randint( 0, 256, ( 100, 150, 3 ) ).astype( numpy.uint8 ) )
+        hydrus_bitmap_2 = ClientRendering.GenerateHydrusBitmapFromNumPyImage( numpy.random.randint( 0, 256, ( 125, 80, 3 ) ).astype( numpy.uint8 ) )
+        
+        disk_cache = ClientCaches.ThumbnailDiskCache( path, ( 150, 125 ), 1048576 )
+        
+        disk_cache.AddHydrusBitmap( hash_1, 100.0, hydrus_bitmap_1 )
+        disk_cache.AddHydrusBitmap( hash_2, 200.0, hydrus_bitmap_2 )
+        
+        def check_bitmap( hydrus_bitmap, expected_hydrus_bitmap ):
+            
+            self.assertEqual( hydrus_bitmap.GetSize(), expected_hydrus_bitmap.GetSize() )
+            self.assertEqual( hydrus_bitmap.GetCompressedData(), expected_hydrus_bitmap.GetCompressedData() )
+            
+        
+        check_bitmap( disk_cache.GetHydrusBitmap( hash_1, 100.0 ), hydrus_bitmap_1 )
+        
+        # a regenerated thumbnail has a new timestamp, so we should miss
+        
+        self.assertEqual( disk_cache.GetHydrusBitmap( hash_1, 101.0 ), None )
+        self.assertEqual( disk_cache.GetHydrusBitmap( HydrusData.GenerateKey(), 100.0 ), None )
+        
+        disk_cache.Close()
+        
+        # reopening should find everything again, and clip any half-written record
+        
+        with open( path, 'ab' ) as f:
+            
+            f.write( 'half a record' )
+            
+        
+        disk_cache = ClientCaches.ThumbnailDiskCache( path, ( 150, 125 ), 1048576 )
+        
+        self.assertEqual( disk_cache.GetNumThumbnails(), 2 )
+        
+        check_bitmap( disk_cache.GetHydrusBitmap( hash_1, 100.0 ), hydrus_bitmap_1 )
+        check_bitmap( disk_cache.GetHydrusBitmap( hash_2, 200.0 ), hydrus_bitmap_2 )
+        
+        disk_cache.AddHydrusBitmap( hash_1, 101.0, hydrus_bitmap_2 )
+        
+        check_bitmap( disk_cache.GetHydrusBitmap( hash_1, 101.0 ), hydrus_bitmap_2 )
+        
+        disk_cache.Reset( ( 200, 200 ) )
+        
+        self.assertEqual( disk_cache.GetNumThumbnails(), 0 )
+        
+        disk_cache.Close()
+        
+        # different thumbnail dimensions mean nothing in the file is any good
+        
+        disk_cache = ClientCaches.ThumbnailDiskCache( path, ( 150, 125 ), 1048576 )
+        
+        self.assertEqual( disk_cache.GetNumThumbnails(), 0 )
+        
+        # and a full file starts again
+        
+        disk_cache.SetMaxSize( len( hydrus_bitmap_1.GetCompressedData() ) + 100 )
+        
+        disk_cache.AddHydrusBitmap( hash_1, 100.0, hydrus_bitmap_1 )
+        disk_cache.AddHydrusBitmap( hash_2, 200.0, hydrus_bitmap_2 )
+        
+        self.assertEqual( disk_cache.GetHydrusBitmap( hash_1, 100.0 ), None )
+        
+        check_bitmap( disk_cache.GetHydrusBitmap( hash_2, 200.0 ), hydrus_bitmap_2 )
+        
+        disk_cache.Close()
+        
+    
     def test_undo( self ):
         
         hash_1 = HydrusData.GenerateKey()
@@ -55,8 +55,13 @@ class TestDaemons( unittest.TestCase ):
             ClientDaemons.DAEMONCheckImportFolders( HG.test_controller )
             
             import_file = HG.test_controller.GetWrite( 'import_file' )
+            import_files = HG.test_controller.GetWrite( 'import_files' )
             
-            self.assertEqual( len( import_file ), 3 )
+            # the good files are committed in batches of whatever is ready, so count the jobs rather than the writes
+            
+            num_jobs_written = len( import_file ) + sum( ( len( file_import_jobs ) for ( ( file_import_jobs, ), kwargs ) in import_files ) )
+            
+            self.assertEqual( num_jobs_written, 3 )
             
             # I need to expand tests here with the new file system
             
@@ -1,3 +1,4 @@
+import BaseHTTPServer
 import ClientConstants as CC
 import ClientNetworking
 import ClientNetworkingDomain
@@ -8,7 +9,9 @@ import HydrusConstants as HC
 import HydrusData
 import HydrusExceptions
 import HydrusNetworking
+import HydrusSerialisable
 import os
+import SocketServer
 import TestConstants
 import threading
 import time
@@ -51,6 +54,11 @@ def catch_wew_ok( url, request ):
     
     return GOOD_RESPONSE
     
+@urlmatch( netloc = 'wew.lad' )
+def catch_wew_long_ok( url, request ):
+    
+    return LONG_GOOD_RESPONSE
+    
 @urlmatch( netloc = MOCK_HYDRUS_ADDRESS )
 def catch_hydrus_error( url, request ):
     
@@ -113,6 +121,23 @@ class TestBandwidthManager( unittest.TestCase ):
             self.assertTrue( bm.CanStartRequest( DOMAIN_NETWORK_CONTEXTS ) )
             self.assertTrue( bm.CanStartRequest( SUBDOMAIN_NETWORK_CONTEXTS ) )
             
+            # trackers are stored packed, and old dumps with json trackers still load
+            
+            old_serialisable_trackers = [ ( network_context.GetSerialisableTuple(), bm.GetTracker( network_context ).GetSerialisableTuple() ) for network_context in SUBDOMAIN_NETWORK_CONTEXTS ]
+            
+            old_bm = HydrusSerialisable.CreateFromSerialisableTuple( ( HydrusSerialisable.SERIALISABLE_TYPE_NETWORK_BANDWIDTH_MANAGER, 1, ( old_serialisable_trackers, [] ) ) )
+            
+            for dupe_bm in ( bm.Duplicate(), old_bm ):
+                
+                for network_context in SUBDOMAIN_NETWORK_CONTEXTS:
+                    
+                    for bandwidth_type in ( HC.BANDWIDTH_TYPE_DATA, HC.BANDWIDTH_TYPE_REQUESTS ):
+                        
+                        self.assertEqual( dupe_bm.GetTracker( network_context ).GetUsage( bandwidth_type, None ), bm.GetTracker( network_context ).GetUsage( bandwidth_type, None ) )
+                        
+                    
+                
+            
             #
             
             bm.SetRules( ClientNetworking.GLOBAL_NETWORK_CONTEXT, EMPTY_RULES )
@@ -312,7 +337,7 @@ class TestNetworkingEngine( unittest.TestCase ):
                 
                 self.assertEqual( len( engine._jobs_bandwidth_throttled ), 0 )
                 self.assertEqual( len( engine._jobs_login_throttled ), 0 )
-                self.assertEqual( len( engine._jobs_ready_to_start ), 0 )
+                self.assertEqual( len( engine._priorities_to_jobs_ready_to_start ), 0 )
                 self.assertEqual( len( engine._jobs_downloading ), 0 )
                 
             
@@ -322,6 +347,143 @@ class TestNetworkingEngine( unittest.TestCase ):
         engine.Shutdown()
         
     
+    def test_engine_bandwidth_wake( self ):
+        
+        mock_controller = TestConstants.MockController()
+        bandwidth_manager = ClientNetworking.NetworkBandwidthManager()
+        session_manager = ClientNetworking.NetworkSessionManager()
+        domain_manager = ClientNetworkingDomain.NetworkDomainManager()
+        login_manager = ClientNetworkingLogin.NetworkLoginManager()
+        
+        engine = ClientNetworking.NetworkEngine( mock_controller, bandwidth_manager, session_manager, domain_manager, login_manager )
+        
+        DOMAIN_NETWORK_CONTEXT = ClientNetworking.NetworkContext( CC.NETWORK_CONTEXT_DOMAIN, MOCK_DOMAIN )
+        
+        RESTRICTIVE_DATA_RULES = HydrusNetworking.BandwidthRules()
+        
+        RESTRICTIVE_DATA_RULES.AddRule( HC.BANDWIDTH_TYPE_DATA, 86400, 10 )
+        
+        bandwidth_manager.ReportDataUsed( [ DOMAIN_NETWORK_CONTEXT ], 50 )
+        
+        bandwidth_manager.SetRules( DOMAIN_NETWORK_CONTEXT, RESTRICTIVE_DATA_RULES )
+        
+        try:
+            
+            mock_controller.CallToThread( engine.MainLoop )
+            
+            with HTTMock( catch_all ):
+                
+                with HTTMock( catch_wew_ok ):
+                    
+                    job = ClientNetworking.NetworkJob( 'GET', MOCK_URL )
+                    
+                    engine.AddJob( job )
+                    
+                    time.sleep( 0.1 )
+                    
+                    # the wait is a day, so the job sleeps and is parked until its wake time
+                    
+                    self.assertFalse( job.IsDone() )
+                    self.assertTrue( job.IsAsleep() )
+                    
+                    self.assertEqual( len( engine._jobs_bandwidth_throttled ), 0 )
+                    self.assertEqual( len( engine._waiting_jobs_heap ), 1 )
+                    
+                    bandwidth_manager.SetRules( DOMAIN_NETWORK_CONTEXT, HydrusNetworking.BandwidthRules() )
+                    
+                    time.sleep( 0.1 )
+                    
+                    self.assertTrue( job.IsDone() )
+                    self.assertFalse( job.HasError() )
+                    
+                    self.assertEqual( len( engine._waiting_jobs_heap ), 0 )
+                    
+                
+            
+        finally:
+            
+            engine.Shutdown()
+            
+        
+    
+    def test_engine_scheduling( self ):
+        
+        mock_controller = TestConstants.MockController()
+        bandwidth_manager = ClientNetworking.NetworkBandwidthManager()
+        session_manager = ClientNetworking.NetworkSessionManager()
+        domain_manager = ClientNetworkingDomain.NetworkDomainManager()
+        login_manager = ClientNetworkingLogin.NetworkLoginManager()
+        
+        engine = ClientNetworking.NetworkEngine( mock_controller, bandwidth_manager, session_manager, domain_manager, login_manager )
+        
+        new_options = HG.client_controller.GetNewOptions()
+        
+        original_max_jobs_per_domain = new_options.GetInteger( 'max_network_jobs_per_domain' )
+        
+        new_options.SetInteger( 'max_network_jobs_per_domain', 1 )
+        
+        urls_requested = []
+        
+        @all_requests
+        def catch_slow_ok( url, request ):
+            
+            urls_requested.append( request.url )
+            
+            time.sleep( 0.25 )
+            
+            return GOOD_RESPONSE
+            
+        
+        try:
+            
+            mock_controller.CallToThread( engine.MainLoop )
+            
+            with HTTMock( catch_slow_ok ):
+                
+                first_job = ClientNetworking.NetworkJob( 'GET', MOCK_URL )
+                subscription_job = ClientNetworking.NetworkJobSubscriptionTemporary( HydrusData.GenerateKey(), 'GET', MOCK_SUBURL )
+                interactive_job = ClientNetworking.NetworkJob( 'GET', MOCK_URL + '&key3=value3' )
+                
+                self.assertEqual( first_job.GetSecondLevelDomain(), MOCK_DOMAIN )
+                self.assertEqual( subscription_job.GetSecondLevelDomain(), MOCK_DOMAIN )
+                
+                self.assertEqual( subscription_job.GetPriority(), CC.NETWORK_JOB_PRIORITY_SUBSCRIPTION )
+                self.assertEqual( interactive_job.GetPriority(), CC.NETWORK_JOB_PRIORITY_INTERACTIVE )
+                
+                engine.AddJob( first_job )
+                
+                time.sleep( 0.1 )
+                
+                engine.AddJob( subscription_job )
+                engine.AddJob( interactive_job )
+                
+                time.sleep( 0.1 )
+                
+                self.assertEqual( subscription_job.GetStatus()[0], u'waiting for download slot on this domain\u2026' )
+                
+                for job in ( first_job, subscription_job, interactive_job ):
+                    
+                    job.WaitUntilDone()
+                    
+                
+            
+            self.assertEqual( urls_requested, [ MOCK_URL, MOCK_URL + '&key3=value3', MOCK_SUBURL ] )
+            
+            queue_wait_stats = engine.GetQueueWaitStats()
+            
+            self.assertEqual( queue_wait_stats[ CC.NETWORK_JOB_PRIORITY_INTERACTIVE ][0], 2 )
+            self.assertEqual( queue_wait_stats[ CC.NETWORK_JOB_PRIORITY_SUBSCRIPTION ][0], 1 )
+            
+            self.assertGreater( queue_wait_stats[ CC.NETWORK_JOB_PRIORITY_SUBSCRIPTION ][2], queue_wait_stats[ CC.NETWORK_JOB_PRIORITY_INTERACTIVE ][2] )
+            
+        finally:
+            
+            new_options.SetInteger( 'max_network_jobs_per_domain', original_max_jobs_per_domain )
+            
+            engine.Shutdown()
+            
+        
+    
 class TestNetworkingJob( unittest.TestCase ):
     
     def _GetJob( self, for_login = False ):
@@ -475,6 +637,78 @@ class TestNetworkingJob( unittest.TestCase ):
             
         
     
+    def test_bandwidth_reported_in_batches( self ):
+        
+        with HTTMock( catch_all ):
+            
+            with HTTMock( catch_wew_long_ok ):
+                
+                job = self._GetJob()
+                
+                bm = job.engine.bandwidth_manager
+                
+                reported = []
+                
+                original_report_data_used = bm.ReportDataUsed
+                
+                def report_data_used( network_contexts, num_bytes ):
+                    
+                    reported.append( num_bytes )
+                    
+                    original_report_data_used( network_contexts, num_bytes )
+                    
+                
+                bm.ReportDataUsed = report_data_used
+                
+                job.BandwidthOK()
+                
+                job.Start()
+                
+                self.assertEqual( sum( reported ), len( LONG_GOOD_RESPONSE ) )
+                self.assertLess( len( reported ), len( LONG_GOOD_RESPONSE ) / 65536 )
+                
+                tracker = bm.GetTracker( ClientNetworking.GLOBAL_NETWORK_CONTEXT )
+                
+                self.assertEqual( tracker.GetUsage( HC.BANDWIDTH_TYPE_DATA, None ), len( LONG_GOOD_RESPONSE ) )
+                
+            
+        
+    
+    def test_bandwidth_wait_wakes_on_cancel( self ):
+        
+        RESTRICTIVE_DATA_RULES = HydrusNetworking.BandwidthRules()
+        
+        RESTRICTIVE_DATA_RULES.AddRule( HC.BANDWIDTH_TYPE_DATA, 10, 10 )
+        
+        job = self._GetJob()
+        
+        bm = job.engine.bandwidth_manager
+        
+        bm.ReportDataUsed( [ ClientNetworking.GLOBAL_NETWORK_CONTEXT ], 50 )
+        
+        bm.SetRules( ClientNetworking.GLOBAL_NETWORK_CONTEXT, RESTRICTIVE_DATA_RULES )
+        
+        job.engine._bandwidth_changed.clear()
+        
+        waiter = threading.Thread( target = job._WaitOnOngoingBandwidth )
+        
+        waiter.start()
+        
+        time.sleep( 0.1 )
+        
+        self.assertTrue( waiter.is_alive() )
+        
+        job.Cancel()
+        
+        waiter.join( 0.5 )
+        
+        self.assertFalse( waiter.is_alive() )
+        
+        # a cancel should not make the engine recheck every parked bandwidth job
+        
+        self.assertFalse( job.engine._bandwidth_changed.is_set() )
+        
+    
     def test_done_ok( self ):
         
         with HTTMock( catch_all ):
@@ -686,3 +920,75 @@ class TestNetworkingJobHydrus( unittest.TestCase ):
         pass
         
     
+class TestNetworkSessionManager( unittest.TestCase ):
+    
+    def test_connection_reuse( self ):
+        
+        class KeepAliveHandler( BaseHTTPServer.BaseHTTPRequestHandler ):
+            
+            protocol_version = 'HTTP/1.1'
+            
+            def do_GET( self ):
+                
+                self.send_response( 200 )
+                self.send_header( 'Content-Length', str( len( GOOD_RESPONSE ) ) )
+                self.end_headers()
+                
+                self.wfile.write( GOOD_RESPONSE )
+                
+            
+            def log_message( self, *args ):
+                
+                pass
+                
+            
+        
+        class ThreadedServer( SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer ):
+            
+            daemon_threads = True
+            
+        
+        server = ThreadedServer( ( '127.0.0.1', 0 ), KeepAliveHandler )
+        
+        port = server.server_address[1]
+        
+        threading.Thread( target = server.serve_forever ).start()
+        
+        try:
+            
+            session_manager = ClientNetworking.NetworkSessionManager()
+            
+            network_context = ClientNetworking.NetworkContext( CC.NETWORK_CONTEXT_DOMAIN, '127.0.0.1' )
+            
+            session = session_manager.GetSession( network_context )
+            
+            url = 'http://127.0.0.1:' + str( port ) + '/'
+            
+            for i in range( 5 ):
+                
+                response = session.get( url )
+                
+                self.assertEqual( response.content, GOOD_RESPONSE )
+                
+            
+            self.assertEqual( session_manager.GetConnectionPoolStats(), { ( 'http', '127.0.0.1', port ) : ( 1, 4, 1 ) } )
+            
+            adapter = session.get_adapter( url )
+            
+            new_options = HG.client_controller.GetNewOptions()
+            
+            self.assertEqual( adapter.max_retries.total, new_options.GetInteger( 'network_connection_retries' ) )
+            
+            # getting the session again does not throw away the pool
+            
+            self.assertIs( session_manager.GetSession( network_context ).get_adapter( url ), adapter )
+            
+            session.close()
+            
+        finally:
+            
+            server.shutdown()
+            server.server_close()
+            
+        
+    
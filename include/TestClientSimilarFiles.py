@@ -0,0 +1,166 @@
+import ClientSimilarFiles
+import HydrusData
+import os
+import random
+import struct
+import unittest
+
+class TestMIH( unittest.TestCase ):
+    
+    def test_search_substrings( self ):
+        
+        phash = os.urandom( 8 )
+        
+        substrings = ClientSimilarFiles.GetMIHSubstrings( phash )
+        
+        self.assertEqual( len( substrings ), ClientSimilarFiles.MIH_NUM_SUBSTRINGS )
+        
+        self.assertEqual( ClientSimilarFiles.GetMIHSearchSubstrings( phash, 3 ), [ ( substring_index, [ substring ] ) for ( substring_index, substring ) in enumerate( substrings ) ] )
+        
+        for max_hamming_distance in ( 0, 2, 4, 8, 10 ):
+            
+            search_substrings = ClientSimilarFiles.GetMIHSearchSubstrings( phash, max_hamming_distance )
+            
+            for i in range( 50 ):
+                
+                ( phash_int, ) = struct.unpack( '>Q', phash )
+                
+                for bit in random.sample( range( 64 ), max_hamming_distance ):
+                    
+                    phash_int ^= 1 << bit
+                    
+                
+                similar_phash = struct.pack( '>Q', phash_int )
+                
+                self.assertEqual( HydrusData.Get64BitHammingDistance( phash, similar_phash ), max_hamming_distance )
+                
+                similar_substrings = ClientSimilarFiles.GetMIHSubstrings( similar_phash )
+                
+                self.assertTrue( any( ( similar_substrings[ substring_index ] in candidates for ( substring_index, candidates ) in search_substrings ) ) )
+                
+            
+        
+    
+
+class TestPHashIndex( unittest.TestCase ):
+    
+    def test_search( self ):
+        
+        rows = [ ( phash_id, os.urandom( 8 ) ) for phash_id in range( 1, 1001 ) ]
+        
+        phash_index = ClientSimilarFiles.PHashIndex( rows )
+        
+        self.assertEqual( phash_index.GetNumPHashes(), 1000 )
+        
+        removed_phash_ids = set( random.sample( range( 1, 1001 ), 300 ) )
+        
+        phash_index.RemovePHashIds( removed_phash_ids )
+        
+        self.assertEqual( phash_index.GetNumPHashes(), 700 )
+        
+        alive_rows = [ ( phash_id, phash ) for ( phash_id, phash ) in rows if phash_id not in removed_phash_ids ]
+        
+        for ( search_phash_id, search_phash ) in random.sample( rows, 20 ):
+            
+            for max_hamming_distance in ( 0, 24, 28 ):
+                
+                expected_phash_ids = { phash_id for ( phash_id, phash ) in alive_rows if HydrusData.Get64BitHammingDistance( search_phash, phash ) <= max_hamming_distance }
+                
+                self.assertEqual( phash_index.Search( [ search_phash ], max_hamming_distance ), expected_phash_ids )
+                
+            
+        
+        #
+        
+        phash_index.AddPHashes( [ ( phash_id, phash ) for ( phash_id, phash ) in rows if phash_id in removed_phash_ids ] )
+        
+        self.assertEqual( phash_index.GetNumPHashes(), 1000 )
+        
+        ( phash_id, phash ) = rows[0]
+        
+        self.assertIn( phash_id, phash_index.Search( [ phash ], 0 ) )
+        
+        results = phash_index.SearchMany( [ ( 'a', [ phash ] ), ( 'b', [] ) ], 0 )
+        
+        self.assertIn( phash_id, results[ 'a' ] )
+        self.assertEqual( results[ 'b' ], set() )
+        
+    
+class TestVPTree( unittest.TestCase ):
+    
+    def test_generate( self ):
+        
+        nodes = [ ( phash_id, os.urandom( 8 ) ) for phash_id in range( 1, 2001 ) ]
+        
+        # some duplicates to make sure ties at the median split cleanly
+        
+        nodes.extend( [ ( phash_id, nodes[0][1] ) for phash_id in range( 2001, 2051 ) ] )
+        
+        phash_ids_to_phashes = dict( nodes )
+        
+        rows = ClientSimilarFiles.GenerateVPTreeRows( nodes, parent_id = 5000 )
+        
+        self.assertEqual( len( rows ), len( nodes ) )
+        self.assertEqual( { row[0] for row in rows }, set( phash_ids_to_phashes.keys() ) )
+        self.assertEqual( rows[0][1], 5000 )
+        
+        phash_ids_to_rows = { row[0] : row for row in rows }
+        
+        def get_branch_phash_ids( phash_id ):
+            
+            branch_phash_ids = [ phash_id ]
+            
+            ( phash_id, parent_id, radius, inner_id, inner_population, outer_id, outer_population ) = phash_ids_to_rows[ phash_id ]
+            
+            if inner_id is not None:
+                
+                branch_phash_ids.extend( get_branch_phash_ids( inner_id ) )
+                
+            
+            if outer_id is not None:
+                
+                branch_phash_ids.extend( get_branch_phash_ids( outer_id ) )
+                
+            
+            return branch_phash_ids
+            
+        
+        for ( phash_id, parent_id, radius, inner_id, inner_population, outer_id, outer_population ) in random.sample( rows, 50 ):
+            
+            phash = phash_ids_to_phashes[ phash_id ]
+            
+            inner_phash_ids = get_branch_phash_ids( inner_id ) if inner_id is not None else []
+            outer_phash_ids = get_branch_phash_ids( outer_id ) if outer_id is not None else []
+            
+            self.assertEqual( len( inner_phash_ids ), inner_population )
+            self.assertEqual( len( outer_phash_ids ), outer_population )
+            
+            branch_phashes = [ phash_ids_to_phashes[ child_id ] for child_id in inner_phash_ids + outer_phash_ids ]
+            
+            if len( set( branch_phashes ) ) == len( branch_phashes ):
+                
+                # identical phashes cannot be split, but anything else should be about half and half
+                
+                self.assertTrue( abs( inner_population - outer_population ) <= max( 2, ( inner_population + outer_population ) / 2 ) )
+                
+            
+            
+            for child_id in inner_phash_ids:
+                
+                self.assertTrue( HydrusData.Get64BitHammingDistance( phash, phash_ids_to_phashes[ child_id ] ) <= radius )
+                
+            
+            for child_id in outer_phash_ids:
+                
+                self.assertTrue( HydrusData.Get64BitHammingDistance( phash, phash_ids_to_phashes[ child_id ] ) > radius )
+                
+            
+            if inner_id is not None:
+                
+                self.assertEqual( phash_ids_to_rows[ inner_id ][1], phash_id )
+                
+            
+        
+        self.assertEqual( ClientSimilarFiles.GenerateVPTreeRows( [] ), [] )
+        
+    
@@ -11,6 +11,7 @@ import ClientImporting
 import ClientRatings
 import ClientSearch
 import ClientServices
+import ClientThreading
 import collections
 import HydrusConstants as HC
 import HydrusData
@@ -19,9 +20,11 @@ import HydrusVideoHandling
 import HydrusGlobals as HG
 import HydrusNetwork
 import HydrusSerialisable
+import HydrusTagArchive
 import itertools
 import os
 import ServerDB
+import ServerFiles
 import shutil
 import sqlite3
 import stat
@@ -252,6 +255,40 @@ class TestClientDB( unittest.TestCase ):
         
         TestClientDB._clear_db()
         
+        def check_query_ids( search_context, result ):
+            
+            file_query_ids = self._read( 'file_query_ids', search_context )
+            
+            self.assertEqual( len( file_query_ids ), result )
+            
+            # live searches only check the files that changed, which should give the same answer
+            
+            if search_context.GetSystemPredicates().GetLimit() is not None:
+                
+                return
+                
+            
+            everything_search_context = ClientSearch.FileSearchContext( file_service_key = CC.LOCAL_FILE_SERVICE_KEY, predicates = [ ClientSearch.Predicate( HC.PREDICATE_TYPE_SYSTEM_EVERYTHING ) ] )
+            
+            all_hash_ids = self._read( 'file_query_ids', everything_search_context )
+            
+            checked_file_query_ids = self._read( 'file_query_ids', search_context, hash_ids_to_check = all_hash_ids )
+            
+            self.assertEqual( set( checked_file_query_ids ), set( file_query_ids ) )
+            
+        
+        def run_multiple_predicate_tests( tests ):
+            
+            for ( predicates_info, result ) in tests:
+                
+                predicates = [ ClientSearch.Predicate( predicate_type, value, inclusive ) for ( predicate_type, value, inclusive ) in predicates_info ]
+                
+                search_context = ClientSearch.FileSearchContext( file_service_key = CC.LOCAL_FILE_SERVICE_KEY, predicates = predicates )
+                
+                check_query_ids( search_context, result )
+                
+            
+        
         def run_namespace_predicate_tests( tests ):
             
             for ( inclusive, namespace, result ) in tests:
@@ -260,9 +297,7 @@ class TestClientDB( unittest.TestCase ):
                 
                 search_context = ClientSearch.FileSearchContext( file_service_key = CC.LOCAL_FILE_SERVICE_KEY, predicates = predicates )
                 
-                file_query_ids = self._read( 'file_query_ids', search_context )
-                
-                self.assertEqual( len( file_query_ids ), result )
+                check_query_ids( search_context, result )
                 
             
         
@@ -274,9 +309,7 @@ class TestClientDB( unittest.TestCase ):
                 
                 search_context = ClientSearch.FileSearchContext( file_service_key = CC.LOCAL_FILE_SERVICE_KEY, predicates = predicates )
                 
-                file_query_ids = self._read( 'file_query_ids', search_context )
-                
-                self.assertEqual( len( file_query_ids ), result )
+                check_query_ids( search_context, result )
                 
             
         
@@ -288,9 +321,7 @@ class TestClientDB( unittest.TestCase ):
                 
                 search_context = ClientSearch.FileSearchContext( file_service_key = CC.LOCAL_FILE_SERVICE_KEY, predicates = predicates )
                 
-                file_query_ids = self._read( 'file_query_ids', search_context )
-                
-                self.assertEqual( len( file_query_ids ), result )
+                check_query_ids( search_context, result )
                 
             
         
@@ -519,6 +550,21 @@ class TestClientDB( unittest.TestCase ):
         
         #
         
+        tests = []
+        
+        tests.append( ( [ ( HC.PREDICATE_TYPE_TAG, 'maker:ford', True ), ( HC.PREDICATE_TYPE_TAG, 'series:cars', True ) ], 1 ) )
+        tests.append( ( [ ( HC.PREDICATE_TYPE_TAG, 'maker:ford', True ), ( HC.PREDICATE_TYPE_TAG, 'bus', True ) ], 0 ) )
+        tests.append( ( [ ( HC.PREDICATE_TYPE_TAG, 'maker:ford', True ), ( HC.PREDICATE_TYPE_NAMESPACE, 'series', True ) ], 1 ) )
+        tests.append( ( [ ( HC.PREDICATE_TYPE_TAG, 'ford', True ), ( HC.PREDICATE_TYPE_WILDCARD, 'series:c*', True ) ], 1 ) )
+        tests.append( ( [ ( HC.PREDICATE_TYPE_TAG, 'ford', True ), ( HC.PREDICATE_TYPE_WILDCARD, 'series:b*', True ) ], 0 ) )
+        tests.append( ( [ ( HC.PREDICATE_TYPE_TAG, 'ford', True ), ( HC.PREDICATE_TYPE_SYSTEM_MIME, ( HC.IMAGE_PNG, ), True ) ], 1 ) )
+        tests.append( ( [ ( HC.PREDICATE_TYPE_TAG, 'ford', True ), ( HC.PREDICATE_TYPE_SYSTEM_MIME, ( HC.IMAGE_JPEG, ), True ) ], 0 ) )
+        tests.append( ( [ ( HC.PREDICATE_TYPE_TAG, 'maker:ford', True ), ( HC.PREDICATE_TYPE_TAG, 'series:cars', False ) ], 0 ) )
+        
+        run_multiple_predicate_tests( tests )
+        
+        #
+        
         like_rating_service_key = HydrusData.GenerateKey()
         numerical_rating_service_key = HydrusData.GenerateKey()
         
@@ -868,6 +914,60 @@ class TestClientDB( unittest.TestCase ):
         self.assertEqual( item.GetName(), 'imp 1' )
         
     
+    def test_import_pipeline( self ):
+        
+        TestClientDB._clear_db()
+        
+        png_path = os.path.join( HC.STATIC_DIR, 'hydrus.png' )
+        mp3_path = os.path.join( HC.STATIC_DIR, 'error.mp3' )
+        missing_path = os.path.join( HC.STATIC_DIR, 'not_a_real_file.png' )
+        
+        file_import_options = ClientImporting.FileImportOptions( automatic_archive = False, exclude_deleted = False, min_size = None, min_resolution = None )
+        
+        png_statuses = []
+        results = {}
+        temp_paths = []
+        
+        for batch in ClientImporting.PrepareFileImportJobs( [ png_path, mp3_path, png_path, missing_path ], file_import_options, mimes = ( HC.IMAGE_PNG, ) ):
+            
+            file_import_jobs = []
+            
+            for ( path, file_import_job, exc_info ) in batch:
+                
+                if file_import_job is not None:
+                    
+                    ( temp_path, thumbnail ) = file_import_job.GetTempPathAndThumbnail()
+                    
+                    self.assertTrue( os.path.exists( temp_path ) )
+                    
+                    temp_paths.append( temp_path )
+                    
+                    file_import_jobs.append( file_import_job )
+                    
+                else:
+                    
+                    results[ path ] = exc_info
+                    
+                
+            
+            if len( file_import_jobs ) > 0:
+                
+                png_statuses.extend( self._write( 'import_files', file_import_jobs ) )
+                
+            
+        
+        # the second copy is either redundant within its batch or against the first commit
+        
+        self.assertEqual( png_statuses, [ CC.STATUS_SUCCESSFUL, CC.STATUS_REDUNDANT ] )
+        self.assertEqual( results[ mp3_path ], None )
+        self.assertEqual( results[ missing_path ][0], Exception )
+        
+        for temp_path in temp_paths:
+            
+            self.assertFalse( os.path.exists( temp_path ) )
+            
+        
+    
     def test_init( self ):
         
         self.assertTrue( os.path.exists( TestConstants.DB_DIR ) )
@@ -889,6 +989,118 @@ class TestClientDB( unittest.TestCase ):
             
         
     
+    def test_live_search( self ):
+        
+        TestClientDB._clear_db()
+        
+        pubs = []
+        
+        def pub( topic, *args, **kwargs ):
+            
+            if topic in ( 'add_media_results', 'remove_media' ):
+                
+                pubs.append( ( topic, args ) )
+                
+            
+        
+        HG.test_controller.pub = pub
+        HG.test_controller.new_options.SetBoolean( 'update_search_pages_live', True )
+        
+        try:
+            
+            path = os.path.join( HC.STATIC_DIR, 'hydrus.png' )
+            
+            file_import_job = ClientImporting.FileImportJob( path )
+            
+            file_import_job.GenerateHashAndStatus()
+            
+            file_import_job.GenerateInfo()
+            
+            self._write( 'import_file', file_import_job )
+            
+            hash = file_import_job.GetHash()
+            
+            page_key = HydrusData.GenerateKey()
+            
+            predicates = [ ClientSearch.Predicate( HC.PREDICATE_TYPE_TAG, 'series:live' ) ]
+            
+            search_context = ClientSearch.FileSearchContext( file_service_key = CC.LOCAL_FILE_SERVICE_KEY, predicates = predicates )
+            
+            job_key = ClientThreading.JobKey()
+            
+            self._write( 'register_live_search', page_key, job_key, search_context, [] )
+            
+            #
+            
+            content_update = HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( 'series:live', ( hash, ) ) )
+            
+            self._write( 'content_updates', { CC.LOCAL_TAG_SERVICE_KEY : [ content_update ] } )
+            
+            self.assertEqual( len( pubs ), 1 )
+            
+            ( topic, ( pub_page_key, media_results ) ) = pubs.pop()
+            
+            self.assertEqual( topic, 'add_media_results' )
+            self.assertEqual( pub_page_key, page_key )
+            self.assertEqual( [ media_result.GetHash() for media_result in media_results ], [ hash ] )
+            
+            #
+            
+            content_update = HydrusData.ContentUpdate( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_ARCHIVE, ( hash, ) )
+            
+            self._write( 'content_updates', { CC.COMBINED_LOCAL_FILE_SERVICE_KEY : [ content_update ] } )
+            
+            self.assertEqual( pubs, [] )
+            
+            #
+            
+            content_update = HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_DELETE, ( 'series:live', ( hash, ) ) )
+            
+            self._write( 'content_updates', { CC.LOCAL_TAG_SERVICE_KEY : [ content_update ] } )
+            
+            self.assertEqual( pubs, [ ( 'remove_media', ( page_key, [ hash ] ) ) ] )
+            
+            del pubs[:]
+            
+            # an old query's job key should not touch the page's current live search
+            
+            stale_job_key = ClientThreading.JobKey()
+            
+            stale_job_key.Cancel()
+            
+            self._write( 'unregister_live_search', page_key, stale_job_key )
+            
+            content_update = HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( 'series:live', ( hash, ) ) )
+            
+            self._write( 'content_updates', { CC.LOCAL_TAG_SERVICE_KEY : [ content_update ] } )
+            
+            self.assertEqual( [ topic for ( topic, args ) in pubs ], [ 'add_media_results' ] )
+            
+            del pubs[:]
+            
+            #
+            
+            self._write( 'unregister_live_search', page_key, job_key )
+            
+            self._write( 'register_live_search', page_key, stale_job_key, search_context, [] )
+            
+            content_update = HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_DELETE, ( 'series:live', ( hash, ) ) )
+            
+            self._write( 'content_updates', { CC.LOCAL_TAG_SERVICE_KEY : [ content_update ] } )
+            
+            content_update = HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( 'series:live', ( hash, ) ) )
+            
+            self._write( 'content_updates', { CC.LOCAL_TAG_SERVICE_KEY : [ content_update ] } )
+            
+            self.assertEqual( pubs, [] )
+            
+        finally:
+            
+            del HG.test_controller.pub
+            HG.test_controller.new_options.SetBoolean( 'update_search_pages_live', False )
+            
+        
+    
     def test_md5_status( self ):
         
         TestClientDB._clear_db()
@@ -1000,6 +1212,21 @@ class TestClientDB( unittest.TestCase ):
         self.assertEqual( mr_num_frames, None )
         self.assertEqual( mr_num_words, None )
         
+        # while something holds on to a media result, the db hands out that same object
+        
+        ( cached_media_result, ) = self._read( 'media_results', ( hash, ) )
+        
+        self.assertIs( cached_media_result, media_result )
+        
+        content_update = HydrusData.ContentUpdate( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_ARCHIVE, ( hash, ) )
+        
+        self._write( 'content_updates', { CC.COMBINED_LOCAL_FILE_SERVICE_KEY : [ content_update ] } )
+        
+        ( media_result, ) = self._read( 'media_results', ( hash, ) )
+        
+        self.assertIsNot( media_result, cached_media_result )
+        self.assertEqual( media_result.GetInbox(), False )
+        
     
     def test_tag_censorship( self ):
         
@@ -1031,6 +1258,79 @@ class TestClientDB( unittest.TestCase ):
         self.assertEqual( result, ( False, [ ':', 'series:' ] ) )
         
     
+    def test_tag_archive_sync( self ):
+        
+        TestClientDB._clear_db()
+        
+        md5 = 'fdadb2cae78f2dfeb629449cd005f2a2'.decode( 'hex' )
+        
+        path = os.path.join( HC.STATIC_DIR, 'hydrus.png' )
+        
+        file_import_job = ClientImporting.FileImportJob( path )
+        
+        file_import_job.GenerateHashAndStatus()
+        
+        file_import_job.GenerateInfo()
+        
+        self._write( 'import_file', file_import_job )
+        
+        hash = file_import_job.GetHash()
+        
+        #
+        
+        hta_path = os.path.join( TestConstants.DB_DIR, 'test_archive.db' )
+        
+        try:
+            
+            hta = HydrusTagArchive.HydrusTagArchive( hta_path )
+            
+            hta.SetHashType( HydrusTagArchive.HASH_TYPE_MD5 )
+            
+            hta.AddMappings( md5, [ 'character:samus aran', 'blue eyes' ] )
+            hta.AddMappings( os.urandom( 16 ), [ 'character:link' ] )
+            
+            hta.Close()
+            
+            read_only_hta = HydrusTagArchive.HydrusTagArchive( hta_path, read_only = True )
+            
+            self.assertEqual( read_only_hta.GetMappingsForHashes( [ md5, os.urandom( 16 ) ] ), { md5 : { 'character:samus aran', 'blue eyes' } } )
+            
+            with self.assertRaises( sqlite3.OperationalError ):
+                
+                read_only_hta.AddMappings( md5, [ 'red eyes' ] )
+                
+            
+            read_only_hta.Close()
+            
+            #
+            
+            self._write( 'sync_hashes_to_tag_archive', [ hash ], hta_path, CC.LOCAL_TAG_SERVICE_KEY, True, [ 'character' ] )
+            
+            ( media_result, ) = self._read( 'media_results', ( hash, ) )
+            
+            self.assertEqual( media_result.GetTagsManager().GetCurrent( CC.LOCAL_TAG_SERVICE_KEY ), { 'character:samus aran' } )
+            
+            #
+            
+            self._write( 'sync_hashes_to_tag_archive', [ hash ], hta_path, CC.LOCAL_TAG_SERVICE_KEY, True, [ '' ] )
+            
+            ( media_result, ) = self._read( 'media_results', ( hash, ) )
+            
+            self.assertEqual( media_result.GetTagsManager().GetCurrent( CC.LOCAL_TAG_SERVICE_KEY ), { 'character:samus aran', 'blue eyes' } )
+            
+        finally:
+            
+            # the db keeps the archive open, and shutting it down closes its cached handles
+            
+            TestClientDB._clear_db()
+            
+            if os.path.exists( hta_path ):
+                
+                os.remove( hta_path )
+                
+            
+        
+    
     def test_nums_pending( self ):
         
         result = self._read( 'nums_pending' )
@@ -1132,6 +1432,66 @@ class TestClientDB( unittest.TestCase ):
         self.assertEqual( result, set() )
         
     
+    def test_repository_update_loading( self ):
+        
+        test_dir = tempfile.mkdtemp()
+        
+        try:
+            
+            hash_ids_and_paths = []
+            
+            for i in range( 5 ):
+                
+                definitions_update = HydrusNetwork.DefinitionsUpdate()
+                
+                definitions_update.AddRow( ( HC.DEFINITIONS_TYPE_TAGS, i, 'tag ' + str( i ) ) )
+                
+                path = os.path.join( test_dir, str( i ) )
+                
+                with open( path, 'wb' ) as f:
+                    
+                    f.write( definitions_update.DumpToNetworkString() )
+                    
+                
+                hash_ids_and_paths.append( ( i, path ) )
+                
+            
+            results = [ ( hash_id, update.GetTagIdsToTags() ) for ( hash_id, update ) in ClientDB.IterateLoadedRepositoryUpdates( hash_ids_and_paths ) ]
+            
+            self.assertEqual( results, [ ( i, { i : 'tag ' + str( i ) } ) for i in range( 5 ) ] )
+            
+            #
+            
+            hash_ids_and_paths.insert( 2, ( 99, os.path.join( test_dir, 'missing' ) ) )
+            
+            loaded_hash_ids = []
+            
+            with self.assertRaises( IOError ):
+                
+                for ( hash_id, update ) in ClientDB.IterateLoadedRepositoryUpdates( hash_ids_and_paths ):
+                    
+                    loaded_hash_ids.append( hash_id )
+                    
+                
+            
+            self.assertEqual( loaded_hash_ids, [ 0, 1 ] )
+            
+            #
+            
+            loaded_updates = ClientDB.IterateLoadedRepositoryUpdates( hash_ids_and_paths )
+            
+            ( hash_id, update ) = loaded_updates.next()
+            
+            self.assertEqual( hash_id, 0 )
+            
+            loaded_updates.close()
+            
+        finally:
+            
+            shutil.rmtree( test_dir )
+            
+        
+    
     def test_services( self ):
         
         result = self._read( 'services', ( HC.LOCAL_FILE_DOMAIN, HC.LOCAL_FILE_TRASH_DOMAIN, HC.COMBINED_LOCAL_FILE, HC.LOCAL_TAG ) )
@@ -1241,6 +1601,9 @@ class TestServerDB( unittest.TestCase ):
         
         cls._db = ServerDB.DB( HG.test_controller, TestConstants.DB_DIR, 'server' )
         
+        # the init key only works once, so every test shares it
+        cls._admin_access_key = cls._db.Read( 'access_key', HC.HIGH_PRIORITY, HC.SERVER_ADMIN_KEY, 'init' )
+        
     
     @classmethod
     def tearDownClass( cls ):
@@ -1339,13 +1702,11 @@ class TestServerDB( unittest.TestCase ):
     
     def _test_init_server_admin( self ):
         
-        result = self._read( 'access_key', HC.SERVER_ADMIN_KEY, 'init' )
+        result = self._admin_access_key
         
         self.assertEqual( type( result ), str )
         self.assertEqual( len( result ), 32 )
         
-        self._admin_access_key = result
-        
         result = self._read( 'account_key_from_access_key', HC.SERVER_ADMIN_KEY, self._admin_access_key )
         
         self.assertEqual( type( result ), str )
@@ -1415,6 +1776,103 @@ class TestServerDB( unittest.TestCase ):
         self.assertEqual( services_info[ self._file_service_key ], ( HC.FILE_REPOSITORY, f_options_modified ) )
         
     
+    def test_repository_updates( self ):
+        
+        admin_account_key = self._read( 'account_key_from_access_key', HC.SERVER_ADMIN_KEY, self._admin_access_key )
+        admin_account = self._read( 'account', HC.SERVER_ADMIN_KEY, admin_account_key )
+        
+        tag_service_key = HydrusData.GenerateKey()
+        
+        tag_service = HydrusNetwork.GenerateService( tag_service_key, HC.TAG_REPOSITORY, 'update test tag repo', 10101 )
+        
+        service_keys_to_access_keys = self._write( 'services', admin_account, self._read( 'services' ) + [ tag_service ] )
+        
+        account_key = self._read( 'account_key_from_access_key', tag_service_key, service_keys_to_access_keys[ tag_service_key ] )
+        account = self._read( 'account', tag_service_key, account_key )
+        
+        # more than two pages of rows, and more than one chunk of hashes for the big tag
+        
+        big_hashes = [ HydrusData.GenerateKey() for i in range( 26000 ) ]
+        small_hashes = big_hashes[ : 10 ]
+        
+        client_to_server_update = HydrusNetwork.ClientToServerUpdate()
+        
+        client_to_server_update.AddContent( HC.CONTENT_UPDATE_PEND, HydrusNetwork.Content( HC.CONTENT_TYPE_MAPPINGS, ( 'big tag', big_hashes ) ) )
+        client_to_server_update.AddContent( HC.CONTENT_UPDATE_PEND, HydrusNetwork.Content( HC.CONTENT_TYPE_MAPPINGS, ( 'small tag', small_hashes ) ) )
+        
+        self._write( 'update', tag_service_key, account, client_to_server_update )
+        
+        end = HydrusData.GetNow() + 100
+        
+        # a stop_time in the past makes it stop after every page, so this tests picking the generation back up
+        
+        num_calls = 0
+        
+        update_hashes = None
+        
+        while update_hashes is None:
+            
+            update_hashes = self._write( 'create_update', tag_service_key, 0, end, stop_time = 0 )
+            
+            num_calls += 1
+            
+        
+        self.assertGreater( num_calls, 3 )
+        
+        updates = []
+        
+        for update_hash in update_hashes:
+            
+            with open( ServerFiles.GetExpectedFilePath( update_hash ), 'rb' ) as f:
+                
+                updates.append( HydrusSerialisable.CreateFromNetworkString( f.read() ) )
+                
+            
+        
+        hash_ids_to_hashes = {}
+        tag_ids_to_tags = {}
+        tags_to_chunk_lengths = collections.defaultdict( list )
+        tags_to_hashes = collections.defaultdict( set )
+        
+        for update in updates:
+            
+            if isinstance( update, HydrusNetwork.DefinitionsUpdate ):
+                
+                hash_ids_to_hashes.update( update.GetHashIdsToHashes() )
+                tag_ids_to_tags.update( update.GetTagIdsToTags() )
+                
+            
+        
+        for update in updates:
+            
+            if isinstance( update, HydrusNetwork.ContentUpdate ):
+                
+                for ( tag_id, hash_ids ) in update.GetNewMappings():
+                    
+                    tag = tag_ids_to_tags[ tag_id ]
+                    
+                    tags_to_chunk_lengths[ tag ].append( len( hash_ids ) )
+                    tags_to_hashes[ tag ].update( hash_ids_to_hashes[ hash_id ] for hash_id in hash_ids )
+                    
+                
+            
+        
+        self.assertEqual( set( hash_ids_to_hashes.values() ), set( big_hashes ) )
+        self.assertEqual( set( tag_ids_to_tags.values() ), { 'big tag', 'small tag' } )
+        
+        # each tag's hashes stay together across the page boundaries, split only at the chunk limit
+        
+        self.assertEqual( tags_to_chunk_lengths[ 'big tag' ], [ 25000, 1000 ] )
+        self.assertEqual( tags_to_chunk_lengths[ 'small tag' ], [ 10 ] )
+        
+        self.assertEqual( tags_to_hashes[ 'big tag' ], set( big_hashes ) )
+        self.assertEqual( tags_to_hashes[ 'small tag' ], set( small_hashes ) )
+        
+        # and making it all in one go gives the same files
+        
+        self.assertEqual( self._write( 'create_update', tag_service_key, 0, end ), update_hashes )
+        
+    
     def test_server( self ):
         
         self._test_init_server_admin()
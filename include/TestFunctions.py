@@ -3,12 +3,74 @@ import HydrusConstants as HC
 import ClientData
 import os
 import TestConstants
+import threading
 import unittest
 import HydrusData
+import HydrusFileHandling
+import HydrusPaths
 import ClientConstants as CC
+from mock import patch
 
 class TestFunctions( unittest.TestCase ):
     
+    def test_adaptive_chunks( self ):
+        
+        chunk_sizer = HydrusData.AdaptiveChunkSizer( 10, 1.0, min_chunk_size = 5, max_chunk_size = 100 )
+        
+        chunk_sizer.ReportChunk( 10, 0.1 )
+        
+        self.assertEqual( chunk_sizer.GetChunkSize(), 20 ) # wants 100, but only doubles
+        
+        chunk_sizer.ReportChunk( 20, 0.1 )
+        chunk_sizer.ReportChunk( 40, 0.1 )
+        chunk_sizer.ReportChunk( 80, 0.1 )
+        
+        self.assertEqual( chunk_sizer.GetChunkSize(), 100 )
+        
+        chunk_sizer.ReportChunk( 100, 10.0 )
+        
+        self.assertEqual( chunk_sizer.GetChunkSize(), 10 )
+        
+        chunk_sizer.ReportChunk( 10, 100.0 )
+        
+        self.assertEqual( chunk_sizer.GetChunkSize(), 5 )
+        
+        #
+        
+        xs = range( 100 )
+        
+        chunk_sizer = HydrusData.AdaptiveChunkSizer( 10, 1.0 )
+        
+        chunks = []
+        
+        for chunk in HydrusData.SplitListIntoAdaptiveChunks( xs, chunk_sizer ):
+            
+            chunks.append( chunk )
+            
+            chunk_sizer.ReportChunk( len( chunk ), 0.5 )
+            
+        
+        self.assertEqual( [ len( chunk ) for chunk in chunks ], [ 10, 20, 40, 30 ] )
+        self.assertEqual( sum( chunks, [] ), xs )
+        
+        #
+        
+        mappings = [ ( 'a', range( 25 ) ), ( 'b', range( 3 ) ), ( 'c', set( range( 40 ) ) ) ]
+        
+        chunk_sizer = HydrusData.AdaptiveChunkSizer( 10, 1.0 )
+        
+        rows = []
+        
+        for chunk in HydrusData.SplitMappingListIntoAdaptiveChunks( mappings, chunk_sizer ):
+            
+            rows.extend( ( ( tag, hash ) for ( tag, hashes ) in chunk for hash in hashes ) )
+            
+            chunk_sizer.ReportChunk( 10, 1.0 )
+            
+        
+        self.assertEqual( sorted( rows ), sorted( ( ( tag, hash ) for ( tag, hashes ) in mappings for hash in hashes ) ) )
+        
+    
     def test_dict_to_content_updates( self ):
         
         hash = HydrusData.GenerateKey()
@@ -41,6 +103,68 @@ class TestFunctions( unittest.TestCase ):
         self.assertEqual( ClientData.ConvertServiceKeysToTagsToServiceKeysToContentUpdates( { hash }, service_keys_to_tags ), content_updates )
         
     
+    def test_file_hashes( self ):
+        
+        # big enough that the extra hashes are done on the worker thread
+        
+        path = os.path.join( TestConstants.DB_DIR, 'hash_test_file' )
+        
+        with open( path, 'wb' ) as f:
+            
+            f.write( os.urandom( 5 * 1024 * 1024 + 123 ) )
+            
+        
+        try:
+            
+            ( sha256, extra_hashes_callable ) = HydrusFileHandling.GetHashAndExtraHashesFromPath( path )
+            
+            self.assertEqual( sha256, HydrusFileHandling.GetHashFromPath( path ) )
+            self.assertEqual( extra_hashes_callable(), HydrusFileHandling.GetExtraHashesFromPath( path ) )
+            
+            # a read that fails partway does not leave the worker behind
+            
+            def fail_partway( f, block_size = HC.READ_BLOCK_SIZE ):
+                
+                yield f.read( block_size )
+                yield f.read( block_size )
+                
+                raise IOError( 'read failed' )
+                
+            
+            with patch.object( HydrusPaths, 'ReadFileLikeAsBlocks', side_effect = fail_partway ):
+                
+                self.assertRaises( IOError, HydrusFileHandling.GetHashAndExtraHashesFromPath, path )
+                
+            
+            self.assertFalse( any( ( thread.name == 'extra hashes' for thread in threading.enumerate() ) ) )
+            
+        finally:
+            
+            os.remove( path )
+            
+        
+    
+    def test_hamming_distances( self ):
+        
+        phashes = [ os.urandom( 8 ) for i in range( 50 ) ]
+        
+        search_phash = phashes[0]
+        
+        distances = HydrusData.Get64BitHammingDistances( search_phash, phashes )
+        
+        self.assertEqual( distances.tolist(), [ HydrusData.Get64BitHammingDistance( search_phash, phash ) for phash in phashes ] )
+        self.assertEqual( distances[0], 0 )
+        
+        search_phashes = phashes[ : 5 ]
+        
+        distances = HydrusData.Get64BitHammingDistances( search_phashes, phashes )
+        
+        self.assertEqual( distances.shape, ( 5, 50 ) )
+        self.assertEqual( distances.tolist(), [ [ HydrusData.Get64BitHammingDistance( a, b ) for b in phashes ] for a in search_phashes ] )
+        
+        self.assertEqual( HydrusData.Get64BitHammingDistances( '\x00' * 8, [ '\xff' * 8 ] ).tolist(), [ 64 ] )
+        
+    
     def test_number_conversion( self ):
         
         i = 123456789
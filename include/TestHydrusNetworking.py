@@ -1,4 +1,6 @@
+import calendar
 import collections
+import datetime
 import HydrusConstants as HC
 import os
 import random
@@ -8,6 +10,7 @@ import unittest
 import HydrusData
 import HydrusGlobals as HG
 import HydrusNetworking
+import HydrusSerialisable
 from mock import patch
 
 now = HydrusData.GetNow()
@@ -522,3 +525,102 @@ class TestBandwidthTracker( unittest.TestCase ):
             
         
     
+    def test_bandwidth_tracker_serialisation( self ):
+        
+        bandwidth_tracker = HydrusNetworking.BandwidthTracker()
+        
+        now = HydrusData.GetNow()
+        
+        for ( seconds_ago, num_bytes ) in ( ( 5 * 86400, 4096 ), ( 7200, 2048 ), ( 90, 1024 ), ( 3, 512 ), ( 0, 256 ) ):
+            
+            with patch.object( HydrusData, 'GetNow', return_value = now - seconds_ago ):
+                
+                bandwidth_tracker.ReportDataUsed( num_bytes )
+                bandwidth_tracker.ReportRequestUsed()
+                
+            
+        
+        def test_usage( tracker ):
+            
+            with patch.object( HydrusData, 'GetNow', return_value = now ):
+                
+                for time_delta in ( 1, 2, 6, 120, 3600, 10800, 86400, 7 * 86400, None ):
+                    
+                    for bandwidth_type in ( HC.BANDWIDTH_TYPE_DATA, HC.BANDWIDTH_TYPE_REQUESTS ):
+                        
+                        self.assertEqual( tracker.GetUsage( bandwidth_type, time_delta ), bandwidth_tracker.GetUsage( bandwidth_type, time_delta ) )
+                        self.assertEqual( tracker.GetWaitingEstimate( bandwidth_type, time_delta, 1 ), bandwidth_tracker.GetWaitingEstimate( bandwidth_type, time_delta, 1 ) )
+                        
+                    
+                
+                self.assertEqual( tracker.GetUsage( HC.BANDWIDTH_TYPE_DATA, 6, for_user = True ), bandwidth_tracker.GetUsage( HC.BANDWIDTH_TYPE_DATA, 6, for_user = True ) )
+                
+            
+            self.assertEqual( tracker.GetMonthlyDataUsage(), bandwidth_tracker.GetMonthlyDataUsage() )
+            
+        
+        with patch.object( HydrusData, 'GetNow', return_value = now ):
+            
+            self.assertEqual( bandwidth_tracker.GetUsage( HC.BANDWIDTH_TYPE_DATA, 6 ), 768 )
+            self.assertEqual( bandwidth_tracker.GetUsage( HC.BANDWIDTH_TYPE_REQUESTS, 120 ), 3 )
+            self.assertEqual( bandwidth_tracker.GetUsage( HC.BANDWIDTH_TYPE_DATA, 86400 ), 3840 )
+            self.assertEqual( bandwidth_tracker.GetUsage( HC.BANDWIDTH_TYPE_REQUESTS, 7 * 86400 ), 5 )
+            
+        
+        test_usage( HydrusSerialisable.CreateFromString( bandwidth_tracker.DumpToString() ) )
+        test_usage( HydrusSerialisable.CreateFromString( bandwidth_tracker.DumpToBinaryString() ) )
+        
+        # the old format was ten timestamp->value counters
+        
+        def get_old_counters( bandwidth_type ):
+            
+            counters = [ collections.Counter() for i in range( 5 ) ]
+            
+            for ( seconds_ago, num_bytes ) in ( ( 5 * 86400, 4096 ), ( 7200, 2048 ), ( 90, 1024 ), ( 3, 512 ), ( 0, 256 ) ):
+                
+                timestamp = now - seconds_ago
+                
+                if bandwidth_type == HC.BANDWIDTH_TYPE_DATA:
+                    
+                    value = num_bytes
+                    
+                else:
+                    
+                    value = 1
+                    
+                
+                month_dt = datetime.datetime.utcfromtimestamp( timestamp )
+                
+                counters[ 0 ][ calendar.timegm( datetime.datetime( month_dt.year, month_dt.month, 1 ).timetuple() ) ] += value
+                
+                for ( i, width ) in enumerate( ( 86400, 3600, 60, 1 ) ):
+                    
+                    counters[ i + 1 ][ timestamp - timestamp % width ] += value
+                    
+                
+            
+            return [ counter.items() for counter in counters ]
+            
+        
+        old_serialisable_info = get_old_counters( HC.BANDWIDTH_TYPE_DATA ) + get_old_counters( HC.BANDWIDTH_TYPE_REQUESTS )
+        
+        old_tracker = HydrusSerialisable.CreateFromSerialisableTuple( ( HydrusSerialisable.SERIALISABLE_TYPE_BANDWIDTH_TRACKER, 1, old_serialisable_info ) )
+        
+        test_usage( old_tracker )
+        
+        # accounts send trackers to older clients, so the json format has to stay the old counters, less anything too old to matter
+        
+        ( serialisable_type, version, serialisable_info ) = bandwidth_tracker.GetSerialisableTuple()
+        
+        self.assertEqual( version, 1 )
+        self.assertEqual( len( serialisable_info ), len( old_serialisable_info ) )
+        
+        for ( flat_dict, old_flat_dict ) in zip( serialisable_info, old_serialisable_info ):
+            
+            self.assertTrue( set( flat_dict ).issubset( old_flat_dict ) )
+            
+        
+        self.assertEqual( serialisable_info[0], old_serialisable_info[0] )
+        self.assertEqual( sorted( serialisable_info[1] ), sorted( old_serialisable_info[1] ) )
+        
+    
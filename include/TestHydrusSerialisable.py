@@ -66,6 +66,21 @@ class TestSerialisables( unittest.TestCase ):
         
         test_func( obj, dupe_obj )
         
+        #
+        
+        if obj.BINARY_VERSION is not None:
+            
+            network_string = obj.DumpToNetworkString( binary = True )
+            
+            self.assertIsInstance( network_string, str )
+            
+            dupe_obj = HydrusSerialisable.CreateFromNetworkString( network_string )
+            
+            self.assertIsNot( obj, dupe_obj )
+            
+            test_func( obj, dupe_obj )
+            
+        
     
     def test_basics( self ):
         
@@ -146,6 +161,55 @@ class TestSerialisables( unittest.TestCase ):
             
         
     
+    def test_SERIALISABLE_TYPE_CONTENT_UPDATE( self ):
+        
+        def test( obj, dupe_obj ):
+            
+            self.assertEqual( [ tuple( row ) for row in obj.GetNewFiles() ], [ tuple( row ) for row in dupe_obj.GetNewFiles() ] )
+            self.assertEqual( list( obj.GetDeletedFiles() ), list( dupe_obj.GetDeletedFiles() ) )
+            self.assertEqual( [ ( tag_id, list( hash_ids ) ) for ( tag_id, hash_ids ) in obj.GetNewMappings() ], [ ( tag_id, list( hash_ids ) ) for ( tag_id, hash_ids ) in dupe_obj.GetNewMappings() ] )
+            self.assertEqual( [ tuple( pair ) for pair in obj.GetDeletedTagSiblings() ], [ tuple( pair ) for pair in dupe_obj.GetDeletedTagSiblings() ] )
+            self.assertEqual( obj.GetNumRows(), dupe_obj.GetNumRows() )
+            
+        
+        content_update = HydrusNetwork.ContentUpdate()
+        
+        content_update.AddRow( ( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_ADD, ( 1, 65536, HC.IMAGE_PNG, 1500000000, 640, 480, None, None, None ) ) )
+        content_update.AddRow( ( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_ADD, ( 2, 2 ** 40, HC.VIDEO_WEBM, 1500000001, 1920, 1080, 60000, 1800, None ) ) )
+        content_update.AddRow( ( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_DELETE, 3 ) )
+        content_update.AddRow( ( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( 4, [ 1, 2 ] ) ) )
+        content_update.AddRow( ( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( 5, [ 3 ] ) ) )
+        content_update.AddRow( ( HC.CONTENT_TYPE_TAG_SIBLINGS, HC.CONTENT_UPDATE_DELETE, ( 4, 5 ) ) )
+        
+        self._dump_and_load_and_test( content_update, test )
+        
+        binary_content_update = HydrusSerialisable.CreateFromNetworkString( content_update.DumpToNetworkString( binary = True ) )
+        
+        self.assertEqual( binary_content_update.GetNewFiles(), [ ( 1, 65536, HC.IMAGE_PNG, 1500000000, 640, 480, None, None, None ), ( 2, 2 ** 40, HC.VIDEO_WEBM, 1500000001, 1920, 1080, 60000, 1800, None ) ] )
+        self.assertEqual( binary_content_update.GetNewMappings(), [ ( 4, [ 1, 2 ] ), ( 5, [ 3 ] ) ] )
+        self.assertEqual( binary_content_update.GetNewTagParents(), [] )
+        
+    
+    def test_SERIALISABLE_TYPE_DEFINITIONS_UPDATE( self ):
+        
+        def test( obj, dupe_obj ):
+            
+            self.assertEqual( obj.GetHashIdsToHashes(), dupe_obj.GetHashIdsToHashes() )
+            self.assertEqual( obj.GetTagIdsToTags(), dupe_obj.GetTagIdsToTags() )
+            
+        
+        definitions_update = HydrusNetwork.DefinitionsUpdate()
+        
+        definitions_update.AddRow( ( HC.DEFINITIONS_TYPE_HASHES, 1, HydrusData.GenerateKey() ) )
+        definitions_update.AddRow( ( HC.DEFINITIONS_TYPE_HASHES, 2, HydrusData.GenerateKey() ) )
+        definitions_update.AddRow( ( HC.DEFINITIONS_TYPE_TAGS, 1, u'character:samus aran' ) )
+        definitions_update.AddRow( ( HC.DEFINITIONS_TYPE_TAGS, 2, u'\u30b5\u30e0\u30b9' ) )
+        
+        self._dump_and_load_and_test( definitions_update, test )
+        
+        self._dump_and_load_and_test( HydrusNetwork.DefinitionsUpdate(), test )
+        
+    
     def test_SERIALISABLE_TYPE_DUPLICATE_ACTION_OPTIONS( self ):
         
         def test( obj, dupe_obj ):
@@ -291,6 +291,46 @@ class TestServer( unittest.TestCase ):
         
         #
         
+        file_request = '/file?share_key=' + share_key.encode( 'hex' ) + '&hash=' + hashes[0].encode( 'hex' )
+        
+        connection.request( 'GET', file_request, headers = { 'Range' : 'bytes=10-19' } )
+        
+        response = connection.getresponse()
+        
+        data = response.read()
+        
+        self.assertEqual( response.status, 206 )
+        self.assertEqual( data, EXAMPLE_FILE[ 10 : 20 ] )
+        self.assertEqual( response.getheader( 'Content-Range' ), 'bytes 10-19/' + str( len( EXAMPLE_FILE ) ) )
+        
+        connection.request( 'GET', file_request, headers = { 'Range' : 'bytes=-5' } )
+        
+        response = connection.getresponse()
+        
+        data = response.read()
+        
+        self.assertEqual( response.status, 206 )
+        self.assertEqual( data, EXAMPLE_FILE[ -5 : ] )
+        
+        connection.request( 'GET', file_request, headers = { 'Range' : 'bytes=10-19', 'If-Range' : '"not the same file"' } )
+        
+        response = connection.getresponse()
+        
+        data = response.read()
+        
+        self.assertEqual( response.status, 200 )
+        self.assertEqual( data, EXAMPLE_FILE )
+        
+        connection.request( 'GET', file_request, headers = { 'Range' : 'bytes=' + str( len( EXAMPLE_FILE ) ) + '-' } )
+        
+        response = connection.getresponse()
+        
+        data = response.read()
+        
+        self.assertEqual( response.status, 416 )
+        
+        #
+        
         HG.test_controller.SetRead( 'local_booru_share_keys', [] )
         
         local_booru_manager.RefreshShares()
@@ -601,6 +641,69 @@ class TestServer( unittest.TestCase ):
         self._test_basics( host, port, https = False )
         self._test_local_booru( host, port )
         
+    
+    def test_file_blob_cache( self ):
+        
+        file_blob_cache = ServerFiles.FileBlobCache( cache_size = 250, max_blob_size = 200 )
+        
+        paths = []
+        
+        for ( i, size ) in enumerate( ( 100, 100, 100, 300 ) ):
+            
+            path = os.path.join( TestConstants.DB_DIR, 'blob_' + str( i ) )
+            
+            with open( path, 'wb' ) as f:
+                
+                f.write( os.urandom( size ) )
+                
+            
+            paths.append( path )
+            
+        
+        ( path_0, path_1, path_2, big_path ) = paths
+        
+        with open( path_0, 'rb' ) as f:
+            
+            self.assertEqual( file_blob_cache.GetBlob( path_0 ), f.read() )
+            
+        
+        file_blob_cache.GetBlob( path_1 )
+        file_blob_cache.GetBlob( path_0 )
+        
+        self.assertEqual( file_blob_cache.GetStats(), ( 2, 200, 1, 2 ) )
+        
+        # path_1 is now the least recently used, so it goes first
+        
+        file_blob_cache.GetBlob( path_2 )
+        
+        self.assertEqual( file_blob_cache.GetStats(), ( 2, 200, 1, 3 ) )
+        
+        file_blob_cache.GetBlob( path_0 )
+        file_blob_cache.GetBlob( path_1 )
+        
+        self.assertEqual( file_blob_cache.GetStats(), ( 2, 200, 2, 4 ) )
+        
+        self.assertEqual( file_blob_cache.GetBlob( big_path ), None )
+        
+        self.assertEqual( ServerFiles.GenerateETag( '\x00\xff' ), '"00ff"' )
+        
+    
+    def test_range_header( self ):
+        
+        self.assertEqual( HydrusServerResources.ParseRangeHeader( 'bytes=0-99', 1000 ), ( 0, 99 ) )
+        self.assertEqual( HydrusServerResources.ParseRangeHeader( 'bytes=500-', 1000 ), ( 500, 999 ) )
+        self.assertEqual( HydrusServerResources.ParseRangeHeader( 'bytes=-100', 1000 ), ( 900, 999 ) )
+        self.assertEqual( HydrusServerResources.ParseRangeHeader( 'bytes=900-5000', 1000 ), ( 900, 999 ) )
+        self.assertEqual( HydrusServerResources.ParseRangeHeader( 'bytes=-5000', 1000 ), ( 0, 999 ) )
+        
+        self.assertEqual( HydrusServerResources.ParseRangeHeader( 'bytes=1000-', 1000 ), ( 1000, 999 ) )
+        self.assertEqual( HydrusServerResources.ParseRangeHeader( 'bytes=2000-2999', 1000 ), ( 1000, 999 ) )
+        
+        self.assertEqual( HydrusServerResources.ParseRangeHeader( 'bytes=0-9,20-29', 1000 ), None )
+        self.assertEqual( HydrusServerResources.ParseRangeHeader( 'bytes=99-0', 1000 ), None )
+        self.assertEqual( HydrusServerResources.ParseRangeHeader( 'items=0-9', 1000 ), None )
+        self.assertEqual( HydrusServerResources.ParseRangeHeader( 'bytes=a-b', 1000 ), None )
+        
     '''
 class TestAMP( unittest.TestCase ):
     
@@ -20,6 +20,7 @@ from include import TestClientDaemons
 from include import TestClientData
 from include import TestClientListBoxes
 from include import TestClientNetworking
+from include import TestClientSimilarFiles
 from include import TestConstants
 from include import TestDialogs
 from include import TestDB
@@ -46,6 +47,7 @@ from include import ClientCaches
 from include import ClientData
 from include import HydrusData
 from include import HydrusPaths
+from include import ServerFiles
 
 only_run = None
 
@@ -139,6 +141,7 @@ class Controller( object ):
         self._managers[ 'tag_parents' ] = ClientCaches.TagParentsManager( self )
         self._managers[ 'undo' ] = ClientCaches.UndoManager( self )
         self._server_session_manager = HydrusSessions.HydrusSessionManagerServer()
+        self._file_blob_cache = ServerFiles.FileBlobCache()
         self._managers[ 'local_booru' ] = ClientCaches.LocalBooruCache( self )
         
         self._cookies = {}
@@ -206,6 +209,11 @@ class Controller( object ):
         return False
         
     
+    def GetFileBlobCache( self ):
+        
+        return self._file_blob_cache
+        
+    
     def GetFilesDir( self ):
         
         return self._server_files_dir
@@ -317,6 +325,7 @@ class Controller( object ):
         if run_all or only_run == 'db':
             
             suites.append( unittest.TestLoader().loadTestsFromModule( TestDB ) )
+            suites.append( unittest.TestLoader().loadTestsFromModule( TestClientSimilarFiles ) )
             
         if run_all or only_run == 'networking':
             
@@ -407,6 +416,19 @@ class Controller( object ):
                 return CC.STATUS_SUCCESSFUL
                 
             
+        elif name == 'import_files':
+            
+            ( file_import_jobs, ) = args
+            
+            if True in ( file_import_job.GetHash().encode( 'hex' ) == 'a593942cb7ea9ffcd8ccf2f0fa23c338e23bfecd9a3e508dfc0bcf07501ead08' for file_import_job in file_import_jobs ):
+                
+                raise Exception( 'File failed to import for some reason!' )
+                
+            else:
+                
+                return [ CC.STATUS_SUCCESSFUL for file_import_job in file_import_jobs ]
+                
+            
         
     
 if __name__ == '__main__':